@@ -0,0 +1,183 @@
+# Z-SOAR
+# Created by: Martin Offermann
+# This module is a benchmark that measures the memory used by a case file holding a large number of contexts.
+#
+# The high-volume context classes (ContextFlow, ContextProcess, ContextLog, ContextFile and ContextRegistry) use '__slots__'.
+# To measure the gain, the same case file is built once with the slotted classes and once with equivalent classes
+# that store their attributes in a per-instance '__dict__'.
+#
+# Usage: python -m benchmarks.bench_context_memory [--contexts 10000]
+
+import argparse
+import datetime
+import gc
+import tracemalloc
+import uuid
+
+import lib.class_helper as class_helper
+
+DEFAULT_CONTEXT_COUNT = 10000  # Total number of contexts added to the benchmarked case file
+TARGET_REDUCTION = 0.4  # The slotted classes should use at least 40% less memory than the dict based ones
+CONTEXT_CLASSES = (
+    class_helper.ContextFlow,
+    class_helper.ContextProcess,
+    class_helper.ContextLog,
+    class_helper.ContextFile,
+    class_helper.ContextRegistry,
+)
+TIMELINES = {
+    "ContextFlow": "context_flows",
+    "ContextProcess": "context_processes",
+    "ContextLog": "context_logs",
+    "ContextFile": "context_files",
+    "ContextRegistry": "context_registries",
+}  # The case file timeline of each context class
+
+
+def unslotted(cls):
+    """Returns a copy of a slotted class that stores its attributes in a per-instance '__dict__'.
+
+    Args:
+        cls (type): The slotted class
+
+    Returns:
+        type: The class without '__slots__'
+    """
+    namespace = {key: value for key, value in vars(cls).items() if key not in cls.__slots__ and key != "__slots__"}
+    return type(cls.__name__, (), namespace)
+
+
+def make_context(cls, detection_uuid, index):
+    """Creates a context of the given class with realistic attribute values.
+
+    Args:
+        cls (type): The context class (or its unslotted copy)
+        detection_uuid (uuid.UUID): The UUID of the related detection
+        index (int): The index of the context, used to create distinct values
+
+    Returns:
+        object: The created context
+    """
+    timestamp = datetime.datetime(2023, 1, 1) + datetime.timedelta(seconds=index)
+    process_uuid = str(uuid.uuid4())
+    name = cls.__name__
+
+    if name == "ContextFlow":
+        return cls(
+            detection_uuid,
+            timestamp,
+            "elastic_siem",
+            "10.0.0." + str(index % 254 + 1),
+            50000 + index % 10000,
+            "93.184.216." + str(index % 254 + 1),
+            443,
+            "TCP",
+            process_uuid=process_uuid,
+            process_name="chrome.exe",
+            process_id=index,
+        )
+    if name == "ContextProcess":
+        return cls(
+            process_uuid,
+            timestamp,
+            detection_uuid,
+            "svchost.exe",
+            index,
+            "services.exe",
+            612,
+            process_path="C:\\Windows\\svchost.exe",
+        )
+    if name == "ContextLog":
+        return cls(detection_uuid, timestamp, "Log message " + str(index), "Sysmon", "10.0.0.1", uuid=uuid.uuid4())
+    if name == "ContextFile":
+        return cls(
+            detection_uuid,
+            timestamp,
+            "create",
+            "file_" + str(index) + ".tmp",
+            file_path="C:\\Tmp\\file_" + str(index) + ".tmp",
+            process_uuid=process_uuid,
+            uuid=uuid.uuid4(),
+        )
+    return cls(detection_uuid, timestamp, "set", "HKLM\\Software\\Key" + str(index), "Value", process_uuid=process_uuid)
+
+
+def build_case(classes, count):
+    """Builds a case file holding 'count' contexts spread evenly over the given context classes.
+
+    Args:
+        classes (list): The context classes to use
+        count (int): The total number of contexts
+
+    Returns:
+        CaseFile: The case file
+    """
+    detection = class_helper.Detection(
+        "456", "Benchmark Detection", [class_helper.Rule("123", "Benchmark Rule", 0)], datetime.datetime.now()
+    )
+    case_file = class_helper.CaseFile(detection)
+    per_class = count // len(classes)
+
+    for timeline in TIMELINES.values():
+        getattr(case_file, timeline).max_size = max(getattr(case_file, timeline).max_size, per_class)
+
+    for i in range(per_class):
+        for cls in classes:
+            context = make_context(cls, detection.uuid, i)
+            if cls in CONTEXT_CLASSES:
+                case_file.add_context(context)
+            else:
+                # The unslotted copies are not recognized by CaseFile.add_context(), so they are stored directly
+                getattr(case_file, TIMELINES[cls.__name__]).add(context, context.timestamp)
+    return case_file
+
+
+def measure(classes, count):
+    """Measures the memory allocated while building a case file.
+
+    Args:
+        classes (list): The context classes to use
+        count (int): The total number of contexts
+
+    Returns:
+        int: The allocated memory in bytes
+    """
+    gc.collect()
+    tracemalloc.start()
+    case_file = build_case(classes, count)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del case_file
+    return size
+
+
+def run(count=DEFAULT_CONTEXT_COUNT):
+    """Runs the benchmark.
+
+    Args:
+        count (int): The total number of contexts
+
+    Returns:
+        dict: The memory used with and without '__slots__' and the relative reduction
+    """
+    slotted_size = measure(CONTEXT_CLASSES, count)
+    dict_size = measure([unslotted(cls) for cls in CONTEXT_CLASSES], count)
+    return {
+        "contexts": count,
+        "slotted_bytes": slotted_size,
+        "dict_bytes": dict_size,
+        "reduction": 1 - slotted_size / dict_size,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measures the memory used by a case file with many contexts.")
+    parser.add_argument("--contexts", type=int, default=DEFAULT_CONTEXT_COUNT, help="Total number of contexts")
+    args = parser.parse_args()
+
+    result = run(args.contexts)
+    print("Contexts:           " + str(result["contexts"]))
+    print("With __slots__:     " + str(round(result["slotted_bytes"] / 1024 / 1024, 2)) + " MiB")
+    print("With __dict__:      " + str(round(result["dict_bytes"] / 1024 / 1024, 2)) + " MiB")
+    print("Reduction:          " + str(round(result["reduction"] * 100, 1)) + " %")
+    print("Target:             " + str(int(TARGET_REDUCTION * 100)) + " %")
@@ -0,0 +1,175 @@
+# Z-SOAR
+# Created by: Martin Offermann
+# This module is a benchmark that measures how fast search results of Elastic-SIEM and IBM QRadar are converted to contexts.
+#
+# For Elastic-SIEM it compares the per-document path (filtering and converting every search hit on its own, like the context
+# provider did before) with the batch converter elastic_siem.create_contexts_from_docs(). For IBM QRadar it measures the
+# create_*_from_events() converters, which always work on a whole result page.
+#
+# Usage: python -m benchmarks.bench_event_conversion [--events 10000] [--rounds 3]
+
+import argparse
+import random
+import time
+
+import lib.logging_helper as logging_helper
+from lib.class_helper import ContextFlow, ContextProcess
+import integrations.elastic_siem as elastic_siem
+import integrations.ibm_qradar as ibm_qradar
+
+DEFAULT_EVENT_COUNT = 10000  # Number of synthetic events per converter
+DEFAULT_ROUNDS = 3  # Number of conversions per variant (the fastest one is reported)
+OTHER_CATEGORY_SHARE = 0.1  # Share of Elastic documents with a category that is filtered out
+
+
+def make_elastic_docs(count, category):
+    """Creates synthetic Elastic-SIEM search hits in the Elastic Common Schema.
+
+    Args:
+        count (int): The number of documents
+        category (str): The event category, either 'network' or 'process'
+
+    Returns:
+        list: The search hits (with the document in '_source')
+    """
+    docs = []
+    for i in range(count):
+        doc = {
+            "@timestamp": "2023-06-01T12:00:00.000Z",
+            "event": {"category": [category if random.random() > OTHER_CATEGORY_SHARE else "library"], "action": "start"},
+            "host": {"name": "host-" + str(i % 50), "ip": ["10.0.0." + str(i % 250 + 1)], "mac": ["00-50-56-00-00-01"]},
+            "user": {"name": "user" + str(i % 20)},
+            "process": {
+                "name": "process" + str(i % 100) + ".exe",
+                "pid": i,
+                "entity_id": "%064x" % i,
+                "executable": "C:\\Windows\\process" + str(i % 100) + ".exe",
+                "args": ["process" + str(i % 100) + ".exe", "--flag"],
+                "start": "2023-06-01T11:59:00.000Z",
+                "hash": {"md5": "%032x" % i, "sha1": "%040x" % i, "sha256": "%064x" % i},
+                "parent": {"entity_id": "%064x" % (i // 10), "name": "explorer.exe", "pid": i // 10},
+            },
+        }
+        if category == "network":
+            source_ip = "10.0.0." + str(i % 250 + 1)
+            doc["source"] = {"address": source_ip, "ip": source_ip, "port": 50000 + i % 1000}
+            doc["destination"] = {
+                "address": "203.0.113." + str(i % 250 + 1),
+                "ip": "203.0.113." + str(i % 250 + 1),
+                "port": 443,
+                "bytes": 1024,
+                "geo": {"country_name": "Germany", "city_name": "Berlin", "location": {"lat": 52.5, "lon": 13.4}},
+                "as": {"number": 3320, "organization": {"name": "Example AS"}},
+            }
+            doc["network"] = {"protocol": "tls", "transport": "tcp"}
+            del doc["event"]["action"]  # The action of a network event is used as firewall action, which is unknown here
+        docs.append({"_id": str(i), "_source": doc})
+    return docs
+
+
+def make_qradar_events(count):
+    """Creates synthetic IBM QRadar events, like they are returned by the AQL queries of the integration.
+
+    Args:
+        count (int): The number of events
+
+    Returns:
+        list: The events
+    """
+    events = []
+    for i in range(count):
+        events.append(
+            {
+                "Log Source Time": "2023-06-01T12:00:00.000Z",
+                "Log Source": random.choice(["Firewall", "Suricata Traffic"]),
+                "Source IP": "10.0.0." + str(i % 250 + 1),
+                "Destination IP": "203.0.113." + str(i % 250 + 1),
+                "Source Port": 50000 + i % 1000,
+                "Destination Port": random.choice([53, 80, 443, 8080]),
+                "Source Asset Name": "host-" + str(i % 50) if i % 2 else None,
+                "Destination Asset Name": None,
+                "Event Name": random.choice(["Firewall Permit", "Firewall Deny", "Suricata Alert - WARNING"]),
+                "Low Level Category": "Firewall Permit",
+                "Severity": "UNKNOWN",
+                "Firewall - Rule ID": str(i % 30),
+                "Message": "Connection from 10.0.0." + str(i % 250 + 1),
+            }
+        )
+    return events
+
+
+def convert_per_doc(mlog, docs, context_type, categories):
+    """Converts the search hits one by one, like the Elastic-SIEM context provider did before the batch converter."""
+    create_context = elastic_siem.CONTEXT_FROM_DOC[context_type]
+    contexts = []
+    for doc in docs:
+        category = doc["_source"]["event"]["category"][0]
+        if category not in categories:
+            mlog.info("Skipping adding event with category: " + category)
+            continue
+        contexts.append(create_context(mlog, doc["_source"], "detection"))
+    return contexts
+
+
+def time_variant(function, rounds):
+    """Measures the fastest of multiple conversions.
+
+    Args:
+        function (function): The conversion, called without arguments
+        rounds (int): The number of conversions
+
+    Returns:
+        float: The fastest time in seconds
+    """
+    best = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def run(count=DEFAULT_EVENT_COUNT, rounds=DEFAULT_ROUNDS):
+    """Runs the benchmark.
+
+    Args:
+        count (int): The number of synthetic events per converter
+        rounds (int): The number of conversions per variant
+
+    Returns:
+        dict: The throughput (in events per second) of each variant
+    """
+    mlog = logging_helper.Log(
+        "benchmarks.bench_event_conversion", log_level="WARNING", log_level_file="none", log_level_stdout="WARNING"
+    )
+    result = {"events": count}
+
+    for name, context_type, category in (("flow", ContextFlow, "network"), ("process", ContextProcess, "process")):
+        docs = make_elastic_docs(count, category)
+        seconds = time_variant(lambda: convert_per_doc(mlog, docs, context_type, (category,)), rounds)
+        result["elastic_" + name + "_per_doc"] = count / seconds
+        seconds = time_variant(
+            lambda: elastic_siem.create_contexts_from_docs(mlog, docs, context_type, "detection", categories=(category,)),
+            rounds,
+        )
+        result["elastic_" + name + "_batch"] = count / seconds
+
+    events = make_qradar_events(count)
+    result["qradar_flow_batch"] = count / time_variant(lambda: ibm_qradar.create_flow_from_events(mlog, 1, events), rounds)
+    result["qradar_log_batch"] = count / time_variant(lambda: ibm_qradar.create_logs_from_events(mlog, 1, events), rounds)
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measures the conversion of search results to contexts.")
+    parser.add_argument("--events", type=int, default=DEFAULT_EVENT_COUNT, help="Number of synthetic events per converter")
+    parser.add_argument("--rounds", type=int, default=DEFAULT_ROUNDS, help="Conversions per variant")
+    args = parser.parse_args()
+
+    result = run(args.events, args.rounds)
+    print("Events:             " + str(result["events"]))
+    for variant in ("elastic_flow_per_doc", "elastic_flow_batch", "elastic_process_per_doc", "elastic_process_batch"):
+        print(variant.ljust(28) + str(round(result[variant])).rjust(10) + " events/s")
+    for variant in ("qradar_flow_batch", "qradar_log_batch"):
+        print(variant.ljust(28) + str(round(result[variant])).rjust(10) + " events/s")
@@ -0,0 +1,83 @@
+# Z-SOAR
+# Created by: Martin Offermann
+# This module is a benchmark that measures how long it takes to render the context tables of a ticket note.
+#
+# Usage: python -m benchmarks.bench_format_results [--rows 1000] [--rounds 5]
+
+import argparse
+import datetime
+import time
+
+from lib.class_helper import ContextFlow, DNSQuery, Location
+from lib.generic_helper import format_results
+
+DEFAULT_ROW_COUNT = 1000  # Number of flows in the rendered table
+DEFAULT_ROUNDS = 5  # Number of renderings per variant (the fastest one is reported)
+
+
+def make_flows(count):
+    """Creates flows with a destination location and (for every 4th flow) a DNS query, like they are found in a case.
+
+    Args:
+        count (int): The number of flows
+
+    Returns:
+        List[ContextFlow]: The flows
+    """
+    flows = []
+    for i in range(count):
+        dns = None
+        if i % 4 == 0:
+            dns = DNSQuery("detection", "A", query="host" + str(i) + ".example.com", query_response="203.0.113.1", has_response=True)
+        flows.append(
+            ContextFlow(
+                "detection",
+                datetime.datetime(2023, 6, 1, 12, 0, 0) + datetime.timedelta(seconds=i),
+                "Elastic-SIEM",
+                "10.0.0." + str(i % 250 + 1),
+                50000 + i % 1000,
+                "203.0.113." + str(i % 250 + 1),
+                53 if dns else 443,
+                "DNS" if dns else "HTTPS",
+                process_id=i % 20,
+                destination_location=Location("Germany", "Berlin", org="Example AS"),
+                dns_query=dns,
+            )
+        )
+    return flows
+
+
+def run(count=DEFAULT_ROW_COUNT, rounds=DEFAULT_ROUNDS):
+    """Runs the benchmark.
+
+    Args:
+        count (int): The number of flows in the table
+        rounds (int): The number of renderings per variant
+
+    Returns:
+        dict: The fastest time in milliseconds for each variant
+    """
+    flows = make_flows(count)
+    result = {"rows": count}
+
+    for variant, format, group_by in (("html", "html", ""), ("markdown", "markdown", ""), ("html_grouped", "html", "process_id")):
+        best = None
+        for _ in range(rounds):
+            start = time.perf_counter()
+            format_results(flows, format, group_by=group_by)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        result[variant + "_ms"] = best * 1000
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measures the rendering of context tables for ticket notes.")
+    parser.add_argument("--rows", type=int, default=DEFAULT_ROW_COUNT, help="Number of flows in the table")
+    parser.add_argument("--rounds", type=int, default=DEFAULT_ROUNDS, help="Renderings per variant")
+    args = parser.parse_args()
+
+    result = run(args.rows, args.rounds)
+    print("Rows:               " + str(result["rows"]))
+    for variant in ("html", "markdown", "html_grouped"):
+        print(variant.ljust(20) + str(round(result[variant + "_ms"], 1)).rjust(10) + " ms")
@@ -0,0 +1,83 @@
+# Z-SOAR
+# Created by: Martin Offermann
+# This module is a micro-benchmark for parsing and classifying the IP addresses of a batch of Elastic flow documents.
+#
+# It compares parsing every address with ipaddress.ip_address() and checking its flags with the memoized
+# generic_helper.get_ip_info(). The synthetic batch mimics a real one: most endpoints are a few thousand internal hosts.
+#
+# Usage: python -m benchmarks.bench_ip_parsing [--events 10000] [--hosts 2000]
+
+import argparse
+import ipaddress
+import random
+import time
+
+from lib.generic_helper import get_ip_info
+
+DEFAULT_EVENT_COUNT = 10000  # Number of flow documents in the batch
+DEFAULT_HOST_COUNT = 2000  # Number of distinct internal hosts
+EXTERNAL_SHARE = 0.2  # Share of flows with an external destination
+
+
+def make_flow_batch(events, hosts):
+    """Creates a batch of (source IP, destination IP) pairs like they are found in Elastic flow documents.
+
+    Args:
+        events (int): The number of flow documents
+        hosts (int): The number of distinct internal hosts
+
+    Returns:
+        list: The (source IP, destination IP) pairs as strings
+    """
+    internal = ["10." + str(i // 65536 % 256) + "." + str(i // 256 % 256) + "." + str(i % 256) for i in range(1, hosts + 1)]
+    external = [str(ipaddress.ip_address(random.getrandbits(32))) for _ in range(hosts // 10)]
+
+    batch = []
+    for _ in range(events):
+        destination = random.choice(external) if random.random() < EXTERNAL_SHARE else random.choice(internal)
+        batch.append((random.choice(internal), destination))
+    return batch
+
+
+def classify_uncached(ip):
+    address = ipaddress.ip_address(ip)
+    return address, address.is_private, address.is_global, address.is_loopback, address.is_multicast
+
+
+def classify_cached(ip):
+    return get_ip_info(ip)
+
+
+def run(events=DEFAULT_EVENT_COUNT, hosts=DEFAULT_HOST_COUNT):
+    """Runs the benchmark.
+
+    Args:
+        events (int): The number of flow documents
+        hosts (int): The number of distinct internal hosts
+
+    Returns:
+        dict: The time in milliseconds for the batch with each variant
+    """
+    batch = make_flow_batch(events, hosts)
+    result = {"events": events, "hosts": hosts}
+
+    for variant, function in (("uncached", classify_uncached), ("cached", classify_cached)):
+        start = time.perf_counter()
+        for source_ip, destination_ip in batch:
+            function(source_ip)
+            function(destination_ip)
+        result[variant + "_ms"] = (time.perf_counter() - start) * 1000
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measures the parsing and classification of IP addresses.")
+    parser.add_argument("--events", type=int, default=DEFAULT_EVENT_COUNT, help="Number of flow documents")
+    parser.add_argument("--hosts", type=int, default=DEFAULT_HOST_COUNT, help="Number of distinct internal hosts")
+    args = parser.parse_args()
+
+    result = run(args.events, args.hosts)
+    print("Flow documents:     " + str(result["events"]) + " (" + str(result["hosts"]) + " internal hosts)")
+    print("ipaddress:          " + str(round(result["uncached_ms"], 1)) + " ms")
+    print("get_ip_info():      " + str(round(result["cached_ms"], 1)) + " ms")
+    print("Speedup:            " + str(round(result["uncached_ms"] / result["cached_ms"], 1)) + "x")
@@ -0,0 +1,359 @@
+# Z-SOAR
+# Created by: Martin Offermann
+# This module is a collection of micro-benchmarks for the hot helpers of lib/generic_helper.py and the data model.
+#
+# Every benchmark reports the fastest time per call in microseconds. The results can be saved as baseline (see
+# BASELINE_FILE) and every later run is compared to it, so the effect of a change in lib/ can be quantified. As the
+# absolute numbers depend on the machine, a new baseline should be saved before changing lib/ on another machine.
+#
+# The cache benchmarks run against a temporary config and cache file of the given sizes, so the cache of the
+# repository is not touched. Spans are not recorded during the benchmarks (metrics_helper.METRICS_ENABLED).
+#
+# Usage: python -m benchmarks.bench_lib_helpers [--rounds 5] [--cache-sizes 1 10 100] [--save-baseline]
+
+import argparse
+import contextlib
+import datetime
+import json
+import logging
+import os
+import platform
+import random
+import tempfile
+import timeit
+import uuid
+
+import yaml
+
+import lib.config_helper as config_helper
+import lib.metrics_helper as metrics_helper
+from benchmarks.bench_format_results import make_flows
+from benchmarks.stand_ins import load_fixture
+from lib.class_helper import CaseFile, ContextProcess, Detection, Rule
+from lib.generic_helper import (
+    Timeline,
+    add_to_cache,
+    add_to_timeline,
+    cast_to_ipaddress,
+    del_none_from_dict,
+    dict_get,
+    format_results,
+    get_from_cache,
+    remove_duplicates_from_dict,
+)
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_FILE = os.path.join(REPO_ROOT, "benchmarks", "baselines", "bench_lib_helpers.json")  # The saved baseline results
+DEFAULT_ROUNDS = 5  # Number of timed repetitions per benchmark (the fastest one is reported)
+DEFAULT_CACHE_SIZES_MB = (1, 10, 100)  # Sizes of the cache file for the cache benchmarks
+BATCH_SIZE = 1000  # Number of prepared inputs for benchmarks of functions that change their input
+IP_POOL_SIZE = 1000  # Number of distinct IPs cast by the cast_to_ipaddress benchmark (the IPs repeat like in production)
+TABLE_ROW_COUNT = 100  # Number of flows in the table of the format_results benchmark
+WHITELIST_ENTRY_COUNT = 1000  # Number of whitelist entries per indicator type for the whitelist benchmark
+REGRESSION_THRESHOLD = 1.2  # Results slower than the baseline by this factor are marked as regression
+
+
+def time_call(function, rounds):
+    """Gets the fastest time of a call of a function without arguments.
+
+    Args:
+        function (function): The function
+        rounds (int): The number of timed repetitions
+
+    Returns:
+        float: The time per call in microseconds
+    """
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    return min(timer.repeat(rounds, number)) / number * 1e6
+
+
+def time_each(function, make_inputs, rounds):
+    """Gets the fastest time of a call of a function that changes its input, with freshly prepared inputs per round.
+
+    Args:
+        function (function): The function
+        make_inputs (function): Returns the list of argument tuples of one round (preparing them is not timed)
+        rounds (int): The number of timed repetitions
+
+    Returns:
+        float: The time per call in microseconds
+    """
+    best = None
+    for _ in range(rounds):
+        inputs = make_inputs()
+        start = timeit.default_timer()
+        for args in inputs:
+            function(*args)
+        elapsed = (timeit.default_timer() - start) / len(inputs)
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1e6
+
+
+def make_process(index, timestamp=None):
+    """Creates a process context like it is created from an EDR event."""
+    return ContextProcess(
+        uuid.uuid4(),
+        timestamp or datetime.datetime(2023, 6, 1, 12, 0, 0) + datetime.timedelta(seconds=index),
+        uuid.uuid4(),
+        "powershell.exe",
+        1000 + index,
+        process_start_time=datetime.datetime(2023, 6, 1, 12, 0, 0),
+    )
+
+
+def make_detection():
+    """Creates a detection with a process and a flow, like it is provided by a SIEM integration."""
+    flow = make_flows(1)[0]
+    return Detection(
+        "4d8a3b1e6f0c2a97",
+        "Suspicious PowerShell Encoded Command",
+        [Rule("9a1f6c2e", "Suspicious PowerShell Encoded Command", 73)],
+        "2023-06-12T09:14:32.517Z",
+        description="Identifies the use of PowerShell with an encoded command.",
+        tags=["Elastic", "Host", "Windows"],
+        host_name="WS-0001",
+        host_ip=cast_to_ipaddress("10.20.1.101"),
+        severity=73,
+        process=make_process(0),
+        flow=flow,
+    )
+
+
+@contextlib.contextmanager
+def temporary_cache(cache):
+    """Lets the cache helpers use a temporary config and cache file with the given content.
+
+    Args:
+        cache (dict): The content of the cache file
+
+    Yields:
+        str: The path of the cache file
+    """
+    with open(os.path.join(REPO_ROOT, config_helper.FILE_PATH), "r") as f:
+        cfg = yaml.safe_load(f)
+
+    with tempfile.TemporaryDirectory(prefix="zsoar_benchmark_") as directory:
+        cfg["cache"]["file"]["enabled"] = True
+        cfg["cache"]["file"]["path"] = os.path.join(directory, "cache.json")
+        with open(cfg["cache"]["file"]["path"], "w") as f:
+            json.dump(cache, f)
+        with open(os.path.join(directory, "zsoar_config.yml"), "w") as f:
+            yaml.safe_dump(cfg, f)
+
+        file_path = config_helper.FILE_PATH
+        config_helper.FILE_PATH = os.path.join(directory, "zsoar_config.yml")
+        try:
+            yield cfg["cache"]["file"]["path"]
+        finally:
+            config_helper.FILE_PATH = file_path
+
+
+@contextlib.contextmanager
+def muted_stdout_logging():
+    """Lets the loggers write their console output to os.devnull. The messages are still formatted and written to the
+    log files, so the time of logging is part of the results.
+    """
+    with open(os.devnull, "w") as devnull:
+        streams = {}
+        for logger in list(logging.Logger.manager.loggerDict.values()):
+            for handler in getattr(logger, "handlers", []):
+                if type(handler) is logging.StreamHandler:
+                    streams[handler] = handler.setStream(devnull)
+        try:
+            yield
+        finally:
+            for handler, stream in streams.items():
+                handler.setStream(stream)
+
+
+def bench_helpers(rounds):
+    """Runs the benchmarks of the generic helpers.
+
+    Args:
+        rounds (int): The number of timed repetitions
+
+    Returns:
+        dict: The time per call in microseconds by benchmark name
+    """
+    results = {}
+    doc = load_fixture("elastic_alert")["_source"]
+    doc_json = json.dumps(doc)
+    results["dict_get"] = time_call(lambda: dict_get(doc, "process.parent.entity_id"), rounds)
+    results["dict_get (missing key)"] = time_call(lambda: dict_get(doc, "process.parent.hash.sha256"), rounds)
+
+    def make_docs():
+        docs = [json.loads(doc_json) for _ in range(BATCH_SIZE)]
+        for copy in docs:
+            # remove_duplicates_from_dict() only supports lists of hashable values
+            del copy["kibana.alert.rule.parameters"]["threat"], copy["process"]["Ext"]["code_signature"]
+            copy["process"]["parent"]["hash"] = None
+            copy["host"]["os"]["Ext"] = {"variant": None}
+            copy["process"]["args"] = copy["process"]["args"] * 2
+        return [(copy,) for copy in docs]
+
+    results["del_none_from_dict"] = time_each(del_none_from_dict, make_docs, rounds)
+    results["remove_duplicates_from_dict"] = time_each(remove_duplicates_from_dict, make_docs, rounds)
+
+    processes = [make_process(i) for i in range(BATCH_SIZE)]
+
+    def make_timeline_inputs():
+        timeline = Timeline(processes[: BATCH_SIZE // 2], max_size=BATCH_SIZE * 2)
+        added = [make_process(i, processes[random.randrange(BATCH_SIZE)].timestamp) for i in range(BATCH_SIZE // 2)]
+        return [(timeline, process, process.timestamp) for process in added]
+
+    results["add_to_timeline"] = time_each(add_to_timeline, make_timeline_inputs, rounds)
+
+    ips = ["10.20.{:d}.{:d}".format(i // 250, i % 250 + 1) for i in range(IP_POOL_SIZE)]
+    results["cast_to_ipaddress"] = time_each(
+        cast_to_ipaddress, lambda: [(random.choice(ips),) for _ in range(BATCH_SIZE)], rounds
+    )
+
+    flows = make_flows(TABLE_ROW_COUNT)
+    results["format_results (" + str(TABLE_ROW_COUNT) + " rows, html)"] = time_call(  # Ungrouped, like the ticket notes
+        lambda: format_results(flows, "html", group_by=""), rounds
+    )
+    return results
+
+
+def bench_data_model(rounds):
+    """Runs the benchmarks of the data model (detections and case files).
+
+    Args:
+        rounds (int): The number of timed repetitions
+
+    Returns:
+        dict: The time per call in microseconds by benchmark name
+    """
+    results = {"Detection.__init__": time_call(make_detection, rounds)}
+
+    def make_case_inputs():
+        case_file = CaseFile(make_detection())
+        return [(case_file, flow) for flow in make_flows(BATCH_SIZE)]
+
+    results["CaseFile.add_context"] = time_each(
+        lambda case_file, context: case_file.add_context(context), make_case_inputs, rounds
+    )
+
+    cache = {
+        "global_whitelist_ips": {"LIST": ["192.0.2.{:d}".format(i % 250) for i in range(WHITELIST_ENTRY_COUNT)]},
+        "global_whitelist_domains": {"LIST": ["host{:d}.example.com".format(i) for i in range(WHITELIST_ENTRY_COUNT)]},
+        "global_whitelist_hashes": {"LIST": ["{:032x}".format(i) for i in range(WHITELIST_ENTRY_COUNT)]},
+    }
+    detection = make_detection()
+    with temporary_cache(cache):
+        detection.check_against_whitelist()  # Compiles the whitelist
+        results["Detection.check_against_whitelist"] = time_call(detection.check_against_whitelist, rounds)
+    return results
+
+
+def bench_cache(rounds, sizes_mb=DEFAULT_CACHE_SIZES_MB):
+    """Runs the benchmarks of the file cache with cache files of different sizes.
+
+    Args:
+        rounds (int): The number of timed repetitions
+        sizes_mb (iterable): The sizes of the cache file in megabytes
+
+    Returns:
+        dict: The time per call in microseconds by benchmark name
+    """
+    results = {}
+    entity = load_fixture("elastic_alert")["_source"]
+    entity_size = len(json.dumps(entity))
+    for size in sizes_mb:
+        entities = {"entity" + str(i): entity for i in range(size * 1024 * 1024 // entity_size + 1)}
+        with temporary_cache({"benchmark": {"entities": entities}}):
+            results["get_from_cache (" + str(size) + " MB)"] = time_call(
+                lambda: get_from_cache("benchmark", "entities", "entity0"), rounds
+            )
+            results["add_to_cache (" + str(size) + " MB)"] = time_call(
+                lambda: add_to_cache("benchmark", "entities", "entity0", entity), rounds
+            )
+    return results
+
+
+def run(rounds=DEFAULT_ROUNDS, cache_sizes_mb=DEFAULT_CACHE_SIZES_MB):
+    """Runs all benchmarks.
+
+    Args:
+        rounds (int): The number of timed repetitions per benchmark
+        cache_sizes_mb (iterable): The sizes of the cache file for the cache benchmarks
+
+    Returns:
+        dict: The time per call in microseconds by benchmark name
+    """
+    metrics_enabled = metrics_helper.METRICS_ENABLED
+    metrics_helper.METRICS_ENABLED = False
+    try:
+        with muted_stdout_logging():
+            results = bench_helpers(rounds)
+            results.update(bench_data_model(rounds))
+            results.update(bench_cache(rounds, cache_sizes_mb))
+    finally:
+        metrics_helper.METRICS_ENABLED = metrics_enabled
+    return results
+
+
+def load_baseline(path=BASELINE_FILE):
+    """Loads the saved baseline results.
+
+    Args:
+        path (str, optional): The path of the baseline file. Defaults to BASELINE_FILE.
+
+    Returns:
+        dict: The baseline (with the results by benchmark name in 'results') or None if there is none
+    """
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def save_baseline(results, path=BASELINE_FILE):
+    """Saves results as baseline, together with the Python version and machine they were measured on.
+
+    Args:
+        results (dict): The time per call in microseconds by benchmark name
+        path (str, optional): The path of the baseline file. Defaults to BASELINE_FILE.
+
+    Returns:
+        None
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    baseline = {
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "machine": platform.platform() + " (" + (platform.processor() or platform.machine()) + ")",
+        "results": {name: round(value, 3) for name, value in results.items()},
+    }
+    with open(path, "w") as f:
+        json.dump(baseline, f, indent=2)
+        f.write("\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for the lib helpers and the data model.")
+    parser.add_argument("--rounds", type=int, default=DEFAULT_ROUNDS, help="Timed repetitions per benchmark")
+    parser.add_argument("--cache-sizes", type=int, nargs="*", default=DEFAULT_CACHE_SIZES_MB, help="Cache sizes in MB")
+    parser.add_argument("--save-baseline", action="store_true", help="Save the results as new baseline")
+    args = parser.parse_args()
+
+    results = run(args.rounds, args.cache_sizes)
+    baseline = load_baseline()
+
+    print("{:<44s}{:>14s}{:>14s}{:>10s}".format("Benchmark", "us/call", "Baseline", "Ratio"))
+    for name, value in results.items():
+        line = "{:<44s}{:>14.3f}".format(name, value)
+        if baseline and name in baseline["results"]:
+            ratio = value / baseline["results"][name]
+            line += "{:>14.3f}{:>9.2f}x".format(baseline["results"][name], ratio)
+            if ratio > REGRESSION_THRESHOLD:
+                line += "  SLOWER"
+        print(line)
+
+    if baseline:
+        print("Baseline from " + baseline["created"] + " (Python " + baseline["python"] + ", " + baseline["machine"] + ")")
+    if args.save_baseline:
+        save_baseline(results)
+        print("Saved results as baseline to " + os.path.relpath(BASELINE_FILE, REPO_ROOT))
@@ -0,0 +1,92 @@
+# Z-SOAR
+# Created by: Martin Offermann
+# This module is a benchmark that measures how long it takes to serialize a large case file to JSON.
+#
+# It compares the single-pass serializer (generic_helper.to_json()) with the legacy approach of dumping the
+# __dict__() of every object, which embeds the nested objects as escaped JSON strings.
+#
+# Usage: python -m benchmarks.bench_serialization [--contexts 1000] [--rounds 5]
+
+import argparse
+import json
+import time
+
+import lib.generic_helper as generic_helper
+from lib.generic_helper import del_none_from_dict, to_json
+from benchmarks.bench_context_memory import build_case, CONTEXT_CLASSES, TIMELINES
+
+DEFAULT_CONTEXT_COUNT = 1000  # Total number of contexts in the serialized case file
+DEFAULT_ROUNDS = 5  # Number of serializations per variant (the fastest one is reported)
+
+
+def legacy_json(case_file):
+    """Serializes the detections and contexts of a case file the way __str__() did before to_json() was introduced.
+
+    Args:
+        case_file (CaseFile): The case file to serialize
+
+    Returns:
+        str: The JSON strings of all objects, joined by newlines
+    """
+    objects = list(case_file.detections)
+    for timeline in TIMELINES.values():
+        objects.extend(getattr(case_file, timeline))
+    return "\n".join(json.dumps(del_none_from_dict(obj.__dict__()), indent=4, sort_keys=False, default=str) for obj in objects)
+
+
+def time_variant(function, obj, rounds):
+    """Measures the fastest of multiple serializations.
+
+    Args:
+        function (function): The serialization function
+        obj (object): The object to serialize
+        rounds (int): The number of serializations
+
+    Returns:
+        tuple: The fastest time in seconds and the size of the output in bytes
+    """
+    best = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        output = function(obj)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, len(output.encode())
+
+
+def run(count=DEFAULT_CONTEXT_COUNT, rounds=DEFAULT_ROUNDS):
+    """Runs the benchmark.
+
+    Args:
+        count (int): The total number of contexts
+        rounds (int): The number of serializations per variant
+
+    Returns:
+        dict: The time (in seconds) and output size (in bytes) of each variant
+    """
+    case_file = build_case(CONTEXT_CLASSES, count)
+    result = {"contexts": count, "encoder": "orjson" if generic_helper.orjson else "json"}
+    result["legacy_seconds"], result["legacy_bytes"] = time_variant(legacy_json, case_file, rounds)
+    result["to_json_seconds"], result["to_json_bytes"] = time_variant(to_json, case_file, rounds)
+    result["to_json_indent_seconds"], result["to_json_indent_bytes"] = time_variant(
+        lambda obj: to_json(obj, indent=True), case_file, rounds
+    )
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measures the serialization of a case file with many contexts.")
+    parser.add_argument("--contexts", type=int, default=DEFAULT_CONTEXT_COUNT, help="Total number of contexts")
+    parser.add_argument("--rounds", type=int, default=DEFAULT_ROUNDS, help="Serializations per variant")
+    args = parser.parse_args()
+
+    result = run(args.contexts, args.rounds)
+    print("Contexts:           " + str(result["contexts"]) + " (encoder: " + result["encoder"] + ")")
+    for variant in ("legacy", "to_json", "to_json_indent"):
+        print(
+            variant.ljust(20)
+            + str(round(result[variant + "_seconds"] * 1000, 1)).rjust(10)
+            + " ms"
+            + str(round(result[variant + "_bytes"] / 1024, 1)).rjust(12)
+            + " KiB"
+        )
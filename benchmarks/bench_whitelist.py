@@ -0,0 +1,75 @@
+# Z-SOAR
+# Created by: Martin Offermann
+# This module is a benchmark that measures how long it takes to check a detection against a large compiled whitelist.
+#
+# Usage: python -m benchmarks.bench_whitelist [--entries 100000] [--rounds 10000]
+
+import argparse
+import ipaddress
+import random
+import time
+
+from lib.generic_helper import Whitelist, create_indicators
+
+DEFAULT_ENTRY_COUNT = 100000  # Number of whitelist entries per indicator type
+DEFAULT_ROUNDS = 10000  # Number of matched detections
+
+
+def build_whitelist(count):
+    """Builds a whitelist with 'count' entries per indicator type (IPs as mix of single addresses and CIDR ranges).
+
+    Args:
+        count (int): The number of entries per indicator type
+
+    Returns:
+        Whitelist: The compiled whitelist
+    """
+    whitelist = Whitelist()
+    for i in range(count):
+        whitelist.add("ip", str(ipaddress.ip_address(random.getrandbits(32))) + random.choice(["", "/16", "/24", "/28"]))
+        whitelist.add("domain", "host" + str(i) + ".example" + str(i % 100) + ".com")
+        whitelist.add("hash", "%032x" % random.getrandbits(128))
+        whitelist.add("url", "https://example" + str(i) + ".com/path")
+        whitelist.add("email", "user" + str(i) + "@example.com")
+    return whitelist
+
+
+def run(count=DEFAULT_ENTRY_COUNT, rounds=DEFAULT_ROUNDS):
+    """Runs the benchmark.
+
+    Args:
+        count (int): The number of entries per indicator type
+        rounds (int): The number of matched detections
+
+    Returns:
+        dict: The build time in seconds and the average match time per detection in microseconds
+    """
+    start = time.perf_counter()
+    whitelist = build_whitelist(count)
+    build_seconds = time.perf_counter() - start
+
+    indicators = create_indicators()  # A detection with a few indicators that are not whitelisted (worst case)
+    indicators["ip"].extend([ipaddress.ip_address("8.8.8.8"), ipaddress.ip_address("2001:db8::1")])
+    indicators["domain"].extend(["www.not-whitelisted.org", "cdn.example5.net"])
+    indicators["hash"].add("0" * 32)
+    indicators["url"].add("https://not-whitelisted.org/")
+    indicators["email"].add("someone@not-whitelisted.org")
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        whitelist.match_indicators(indicators)
+    match_microseconds = (time.perf_counter() - start) / rounds * 1000000
+
+    return {"entries": whitelist.size, "build_seconds": build_seconds, "match_microseconds": match_microseconds}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measures the matching of detections against a large whitelist.")
+    parser.add_argument("--entries", type=int, default=DEFAULT_ENTRY_COUNT, help="Whitelist entries per indicator type")
+    parser.add_argument("--rounds", type=int, default=DEFAULT_ROUNDS, help="Number of matched detections")
+    args = parser.parse_args()
+
+    result = run(args.entries, args.rounds)
+    print("Whitelist entries:  " + str(result["entries"]))
+    print("Build time:         " + str(round(result["build_seconds"], 2)) + " s")
+    print("Match time:         " + str(round(result["match_microseconds"], 1)) + " us per detection")
@@ -0,0 +1,235 @@
+# Z-SOAR
+# Created by: Martin Offermann
+# This module is a benchmark that runs the whole worker pipeline (zsoar_worker.main) offline against synthetic loads.
+#
+# The SIEMs, Znuny and VirusTotal are replaced by the local stand-ins of benchmarks/stand_ins.py, which replay recorded
+# API responses. For every detection type (Elastic-SIEM alerts and QRadar offenses) and load, the worker runs in a fresh
+# process with its own config, cache and log directory until all detections are handled. Reported are the throughput,
+# the latency per stage (from the spans of lib/metrics_helper.py) and the peak memory (RSS) of the worker process.
+#
+# The VirusTotal rate limit is raised for the benchmark, as the public API tier (4 requests per minute) would dominate
+# every run. All other settings are taken from configs/zsoar_config.yml.
+#
+# The stand-ins can simulate slow and unreliable APIs (latency, error rate, the VirusTotal quota and Ariel searches that
+# need to be polled). The simulated faults are drawn with a fixed seed, so runs with the same options are comparable.
+#
+# Usage: python -m benchmarks.bench_worker_pipeline [--detections 10 100 1000] [--types elastic_siem ibm_qradar]
+#            [--latency-ms 20 80] [--error-rate 0.01] [--vt-quota 4 60] [--search-polls 2] [--seed 0]
+
+import argparse
+import concurrent.futures
+import contextlib
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+
+import yaml
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_LOADS = (10, 100, 1000)  # Number of synthetic detections per run
+DETECTION_TYPES = ("elastic_siem", "ibm_qradar")  # The integrations that provide the synthetic detections
+MAX_CYCLES = 100  # The maximum number of worker cycles per run (QRadar only fetches a limited number of offenses per cycle)
+VT_REQUESTS_PER_MINUTE = 600000  # The VirusTotal rate limit used for the benchmark
+VT_BURST_SIZE = 1000  # The VirusTotal burst size used for the benchmark
+SECRET = "benchmark"  # Used for every password and API key of the benchmark config
+STAGE_ORDER = (
+    "worker.provide_new_detections",
+    "playbook.can_handle_detection",
+    "playbook.handle_detection",
+    "integration.provide_context",
+    "znuny.add_note",
+    "cache.get",
+    "cache.put",
+)  # The stages that are printed (in this order)
+
+
+def write_config(workdir, detection_type, urls):
+    """Writes the config of a benchmark run, based on the config of the repository.
+
+    Args:
+        workdir (str): The working directory of the run
+        detection_type (str): The integration that provides the detections (the other SIEM is disabled)
+        urls (dict): The URLs of the stand-ins by integration
+
+    Returns:
+        None
+    """
+    with open(os.path.join(REPO_ROOT, "configs", "zsoar_config.yml"), "r") as f:
+        cfg = yaml.safe_load(f)
+
+    cfg["setup"]["load_enviroment_variables"] = False
+    cfg["cache"]["file"]["path"] = "lib/cache.json"
+    integrations = cfg["integrations"]
+
+    integrations["elastic_siem"].update(
+        enabled=detection_type == "elastic_siem", elastic_url=urls["elastic_siem"], elastic_password=SECRET
+    )
+    integrations["ibm_qradar"].update(
+        enabled=detection_type == "ibm_qradar", qradar_url=urls["ibm_qradar"], qradar_api_key=SECRET
+    )
+    integrations["virus_total"].update(enabled=True, api_key=SECRET)
+    integrations["znuny_otrs"].update(enabled=True, url=urls["znuny_otrs"], password=SECRET)
+    integrations["matrix_notify"].update(enabled=False, matrix_enabled=False, matrix_access_token=SECRET)
+    integrations["matrix_notify"].update(matrix_server="http://127.0.0.1:9", matrix_room_id=SECRET)
+
+    for directory in ("configs", "lib", "logs"):
+        os.makedirs(os.path.join(workdir, directory), exist_ok=True)
+    with open(os.path.join(workdir, "configs", "zsoar_config.yml"), "w") as f:
+        yaml.safe_dump(cfg, f)
+    with open(os.path.join(workdir, "lib", "cache.json"), "w") as f:
+        f.write("{}")
+
+
+def run_single(detection_type, detections, faults=None):
+    """Runs the worker pipeline for one detection type and load. Must be called in a fresh process, as the integrations
+    and playbooks read the config when they are imported.
+
+    Args:
+        detection_type (str): The integration that provides the detections
+        detections (int): The number of synthetic detections
+        faults (dict, optional): The simulated faults of the stand-ins ('latency', 'error_rate' and 'seed' for all
+            stand-ins, 'vt_quota' and 'search_polls' for VirusTotal and QRadar). Defaults to None (no faults).
+
+    Returns:
+        dict: The results of the run
+    """
+    from benchmarks.stand_ins import ElasticStandIn, QRadarStandIn, VirusTotalStandIn, ZnunyStandIn
+
+    faults = dict(faults or {})
+    vt_quota = faults.pop("vt_quota", None)
+    search_polls = faults.pop("search_polls", 0)
+
+    elastic = ElasticStandIn(detections if detection_type == "elastic_siem" else 0, **faults)
+    qradar = QRadarStandIn(detections if detection_type == "ibm_qradar" else 0, search_polls=search_polls, **faults)
+    stand_ins = {
+        "elastic_siem": elastic,
+        "ibm_qradar": qradar,
+        "znuny_otrs": ZnunyStandIn(**faults),
+        "virus_total": VirusTotalStandIn(quota=vt_quota, **faults),
+    }
+
+    # The log messages of the worker are still formatted and written to the log files, but not printed
+    with tempfile.TemporaryDirectory(prefix="zsoar_benchmark_") as workdir, open(os.devnull, "w") as devnull:
+        for stand_in in stand_ins.values():
+            stand_in.start()
+        write_config(workdir, detection_type, {name: stand_in.url for name, stand_in in stand_ins.items()})
+
+        os.chdir(workdir)
+        sys.path.insert(0, REPO_ROOT)
+        try:
+            with contextlib.redirect_stdout(devnull), contextlib.redirect_stderr(devnull):
+                import integrations.ibm_qradar as ibm_qradar
+                import integrations.virus_total as virus_total
+                import lib.config_helper as config_helper
+                import lib.metrics_helper as metrics_helper
+                import zsoar_worker
+
+                # The AQL queries are configured per QRadar URL, so the stand-in gets the ones of the default instance
+                ibm_qradar.QUERIES[qradar.url] = next(iter(ibm_qradar.QUERIES.values()))
+                virus_total.VT_API_URL = stand_ins["virus_total"].url
+                virus_total._lookup_engine = virus_total.LookupEngine(VT_REQUESTS_PER_MINUTE, VT_BURST_SIZE)
+
+                config = config_helper.Config().cfg
+                setup_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+                cycles = 0
+                start = time.perf_counter()
+                while cycles < MAX_CYCLES:
+                    zsoar_worker.main(config)
+                    cycles += 1
+                    open_alerts = sum(
+                        doc["_source"]["kibana.alert.workflow_status"] == "open" for doc in elastic.stores["alerts"]
+                    )
+                    open_offenses = sum(not offense["follow_up"] for offense in qradar.offenses.values())
+                    if open_alerts + open_offenses == 0:
+                        break
+                duration = time.perf_counter() - start
+
+                metrics_helper.flush()
+                stage_stats = metrics_helper.get_stage_stats(metrics_helper.load_spans(max_spans=sys.maxsize))
+        finally:
+            os.chdir(REPO_ROOT)
+            for stand_in in stand_ins.values():
+                stand_in.stop()
+
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {
+        "type": detection_type,
+        "detections": detections,
+        "cycles": cycles,
+        "seconds": duration,
+        "detections_per_second": detections / duration,
+        "tickets": len(stand_ins["znuny_otrs"].tickets),
+        "peak_rss_mb": peak_rss / 1024,
+        "peak_rss_increase_mb": (peak_rss - setup_rss) / 1024,
+        "stages": stage_stats,
+        "unhandled_requests": {name: stand_in.unhandled_requests() for name, stand_in in stand_ins.items()},
+        "faults": {name: dict(stand_in.fault_counts) for name, stand_in in stand_ins.items()},
+    }
+
+
+def run(loads=DEFAULT_LOADS, detection_types=DETECTION_TYPES, faults=None):
+    """Runs the benchmark. Every run is done in a fresh process.
+
+    Args:
+        loads (iterable): The numbers of synthetic detections
+        detection_types (iterable): The integrations that provide the detections
+        faults (dict, optional): The simulated faults of the stand-ins (see run_single()). Defaults to None.
+
+    Returns:
+        list: The results of all runs (see run_single())
+    """
+    results = []
+    context = multiprocessing.get_context("spawn")
+    for detection_type in detection_types:
+        for detections in loads:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                results.append(executor.submit(run_single, detection_type, detections, faults).result())
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs the worker pipeline offline against synthetic loads.")
+    parser.add_argument("--detections", type=int, nargs="+", default=DEFAULT_LOADS, help="Numbers of detections")
+    parser.add_argument("--types", nargs="+", default=DETECTION_TYPES, choices=DETECTION_TYPES, help="Detection types")
+    parser.add_argument("--latency-ms", type=float, nargs="+", default=[0], help="Latency of the APIs (or min and max)")
+    parser.add_argument("--error-rate", type=float, default=0, help="Share of API requests that fail with a server error")
+    parser.add_argument("--vt-quota", type=int, nargs=2, metavar=("REQUESTS", "SECONDS"), help="VirusTotal API quota")
+    parser.add_argument("--search-polls", type=int, default=0, help="Status polls until a QRadar Ariel search completes")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the simulated latencies and errors")
+    args = parser.parse_args()
+
+    latency = tuple(ms / 1000 for ms in args.latency_ms[:2])
+    faults = {
+        "latency": latency if len(latency) == 2 else latency[0],
+        "error_rate": args.error_rate,
+        "seed": args.seed,
+        "vt_quota": tuple(args.vt_quota) if args.vt_quota else None,
+        "search_polls": args.search_polls,
+    }
+
+    for result in run(args.detections, args.types, faults):
+        print(result["type"] + " - " + str(result["detections"]) + " detections")
+        print("  Duration:           " + str(round(result["seconds"], 2)) + " s (" + str(result["cycles"]) + " cycles)")
+        print("  Throughput:         " + str(round(result["detections_per_second"], 2)) + " detections/s")
+        print("  Tickets created:    " + str(result["tickets"]))
+        print("  Peak memory (RSS):  " + str(round(result["peak_rss_mb"], 1)) + " MiB", end="")
+        print(" (+" + str(round(result["peak_rss_increase_mb"], 1)) + " MiB during the run)")
+        print("  {:<34s}{:>8s}{:>10s}{:>10s}{:>10s}".format("Stage", "Count", "p50 ms", "p95 ms", "Max ms"))
+        for stage in STAGE_ORDER:
+            if stage in result["stages"]:
+                stats = result["stages"][stage]
+                print(
+                    "  {:<34s}{:>8d}{:>10.2f}{:>10.2f}{:>10.2f}".format(
+                        stage, stats["count"], stats["p50_ms"], stats["p95_ms"], stats["max_ms"]
+                    )
+                )
+        unhandled = {name: count for name, count in result["unhandled_requests"].items() if count}
+        if unhandled:
+            print("  Unhandled stand-in requests: " + str(unhandled))
+        simulated = {name: counts for name, counts in result["faults"].items() if counts}
+        if simulated:
+            print("  Simulated faults:   " + str(simulated))
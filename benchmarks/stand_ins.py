@@ -0,0 +1,678 @@
+# Z-SOAR
+# Created by: Martin Offermann
+# This module provides local stand-ins for the HTTP APIs of Elastic-SIEM, IBM QRadar, Znuny and VirusTotal for the benchmarks.
+#
+# Every stand-in is a small threaded HTTP server on a free port of 127.0.0.1 that replays the recorded (and sanitized) API
+# responses in benchmarks/fixtures. The SIEM stand-ins generate any number of detections from the recorded ones by varying
+# their IDs, hosts and process entity IDs, so the whole worker pipeline can be run against synthetic loads without network.
+#
+# To measure how the integrations cope with slow or unreliable APIs, every stand-in can delay its responses (latency),
+# answer a share of the requests with a server error (error_rate) and reject requests above a quota with the response
+# the real API sends in that case (quota). Delays and errors are drawn from a seeded random generator, so runs with the
+# same options are reproducible.
+#
+# Usage:
+#   with ElasticStandIn(detections=100, latency=(0.01, 0.05), error_rate=0.01) as elastic:
+#       config["integrations"]["elastic_siem"]["elastic_url"] = elastic.url
+
+import collections
+import copy
+import hashlib
+import http.server
+import itertools
+import json
+import os
+import random
+import re
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+import urllib.parse
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+STAND_IN_HOST = "127.0.0.1"  # The stand-ins only listen locally
+EXTERNAL_IP_POOL = 50  # The number of distinct remote IPs and domains of the synthetic detections (so lookups repeat)
+FILE_HASH_POOL = 200  # The number of distinct file hashes used by the synthetic detections
+ELASTIC_DEFAULT_SIZE = 10  # The number of hits Elasticsearch returns if the search does not set a size
+
+
+def load_fixture(name):
+    """Loads a recorded API response from the fixtures directory.
+
+    Args:
+        name (str): The name of the fixture (file name without '.json')
+
+    Returns:
+        dict: The recorded response
+    """
+    with open(os.path.join(FIXTURES_DIR, name + ".json"), "r") as f:
+        return json.load(f)
+
+
+def vary(fixture, replacements):
+    """Creates a variant of a recorded response by replacing values in it.
+
+    Args:
+        fixture (dict): The recorded response
+        replacements (dict): The values to replace (old -> new), applied in order
+
+    Returns:
+        dict: A deep copy of the response with all replacements applied
+    """
+    text = json.dumps(fixture)
+    for old, new in replacements.items():
+        text = text.replace(old, new)
+    return json.loads(text)
+
+
+def create_certificate(directory):
+    """Creates a self-signed certificate for STAND_IN_HOST with the openssl command line tool.
+
+    Args:
+        directory (str): The directory the certificate and its key are written to
+
+    Returns:
+        tuple: The paths of the certificate and of the key
+    """
+    cert_file = os.path.join(directory, "stand_in.crt")
+    key_file = os.path.join(directory, "stand_in.key")
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1", "-subj", "/CN=" + STAND_IN_HOST]
+        + ["-keyout", key_file, "-out", cert_file],
+        check=True,
+        capture_output=True,
+    )
+    return cert_file, key_file
+
+
+def internal_ip(network, index):
+    """Returns the IP of the 'index'-th synthetic internal host in a /16 network (e.g. '10.30')."""
+    return "{:s}.{:d}.{:d}".format(network, index // 250 % 250, index % 250 + 1)
+
+
+def external_ip(index):
+    """Returns one of the EXTERNAL_IP_POOL public remote IPs of the synthetic detections. The stand-ins never connect to them."""
+    return "45.80.{:d}.{:d}".format(index % EXTERNAL_IP_POOL // 250 + 1, index % EXTERNAL_IP_POOL % 250 + 1)
+
+
+def external_domain(name, index):
+    """Returns one of the EXTERNAL_IP_POOL remote domains of the synthetic detections, based on a recorded domain."""
+    label, _, parent = name.partition(".")
+    return "{:s}{:d}.{:s}".format(label, index % EXTERNAL_IP_POOL, parent)
+
+
+def file_hash(value, index):
+    """Returns one of the FILE_HASH_POOL synthetic file hashes with the same length as the recorded hash 'value'."""
+    return hashlib.sha256((value + str(index % FILE_HASH_POOL)).encode()).hexdigest()[: len(value)]
+
+
+class _RequestHandler(http.server.BaseHTTPRequestHandler):
+    """Passes every request to the routes of the stand-in that owns the server."""
+
+    protocol_version = "HTTP/1.1"
+
+    def _handle(self):
+        parsed = urllib.parse.urlsplit(self.path)
+        query = {key: values[-1] for key, values in urllib.parse.parse_qs(parsed.query, keep_blank_values=True).items()}
+
+        length = int(self.headers.get("Content-Length") or 0)
+        raw_body = self.rfile.read(length) if length else b""
+        try:
+            body = json.loads(raw_body) if raw_body else {}
+        except ValueError:
+            body = {key: values[-1] for key, values in urllib.parse.parse_qs(raw_body.decode()).items()}
+
+        status, payload = self.server.stand_in.dispatch(self.command, parsed.path, query, body, self.headers)
+        data = json.dumps(payload).encode() if payload is not None else b""
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for header, value in self.server.stand_in.response_headers.items():
+            self.send_header(header, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = _handle
+
+    def log_message(self, format, *args):
+        pass  # The stand-ins count requests instead of logging them
+
+
+class StandInServer:
+    """Base class of the stand-ins. Runs a threaded HTTP server on a free local port and dispatches requests to routes.
+
+    Subclasses register their routes with add_route(). A handler is called with the regex match of the path, the query
+    parameters, the parsed body and the request headers and returns a tuple of status code and JSON payload (None for an
+    empty body).
+
+    Args:
+        tls (bool, optional): Whether the stand-in uses HTTPS (with a self-signed certificate). Defaults to False.
+        latency (float or tuple, optional): The delay of every response in seconds, or the (min, max) range of a random
+            delay. Defaults to 0.
+        error_rate (float, optional): The share of requests that are answered with error_response. Defaults to 0.
+        quota (tuple, optional): The (requests, seconds) quota of the API. Requests above it are answered with
+            quota_response until the period is over. Defaults to None (no quota).
+        seed (int, optional): The seed of the random generator for delays and errors. Defaults to 0.
+
+    Attributes:
+        request_counts (collections.Counter): The number of requests per route (unhandled requests are counted as well)
+        fault_counts (collections.Counter): The number of simulated errors ('error') and quota rejections ('quota')
+    """
+
+    response_headers = {}  # Additional headers sent with every response
+    error_response = (503, {"error": "Service unavailable (simulated by the stand-in)"})  # The response of a simulated error
+    quota_response = (429, {"error": "Too many requests (simulated by the stand-in)"})  # The response if the quota is exceeded
+
+    def __init__(self, tls=False, latency=0, error_rate=0, quota=None, seed=0):
+        if not 0 <= error_rate <= 1:
+            raise ValueError("error_rate must be between 0 and 1, got " + str(error_rate))
+        self.tls = tls
+        self.latency = latency
+        self.error_rate = error_rate
+        self.quota = quota
+        self.request_counts = collections.Counter()
+        self.fault_counts = collections.Counter()
+        self.lock = threading.RLock()
+        self._random = random.Random(seed)
+        self._quota_period_start = None
+        self._quota_used = 0
+        self._routes = []
+        self._httpd = None
+        self._thread = None
+
+    def add_route(self, method, pattern, handler):
+        """Registers a handler for all requests with the given method whose path matches the regex 'pattern'."""
+        self._routes.append((method, re.compile(pattern + "$"), handler, method + " " + pattern))
+
+    @property
+    def url(self):
+        """The base URL of the running stand-in."""
+        return "{:s}://{:s}:{:d}".format("https" if self.tls else "http", *self._httpd.server_address[:2])
+
+    def unhandled_requests(self):
+        """Returns the number of requests no route was registered for (these point to a stand-in that needs a new route)."""
+        return sum(count for route, count in self.request_counts.items() if route.startswith("UNHANDLED "))
+
+    def get_quota_response(self, method, path):
+        """Returns the response to a request above the quota (subclasses can answer differently per endpoint)."""
+        return self.quota_response
+
+    def _draw_fault(self, method, path):
+        """Draws the delay of a request and whether it is answered with a simulated error or a quota rejection.
+
+        Returns:
+            tuple: The delay in seconds and the response of the fault (None if the request is handled by its route)
+        """
+        delay = self._random.uniform(*self.latency) if type(self.latency) is tuple else self.latency
+        if self.quota is not None:
+            requests, seconds = self.quota
+            now = time.monotonic()
+            if self._quota_period_start is None or now - self._quota_period_start >= seconds:
+                self._quota_period_start, self._quota_used = now, 0
+            self._quota_used += 1
+            if self._quota_used > requests:
+                self.fault_counts["quota"] += 1
+                return delay, self.get_quota_response(method, path)
+        if self.error_rate and self._random.random() < self.error_rate:
+            self.fault_counts["error"] += 1
+            return delay, self.error_response
+        return delay, None
+
+    def dispatch(self, method, path, query, body, headers):
+        for route_method, pattern, handler, route in self._routes:
+            if route_method != method:
+                continue
+            match = pattern.match(path)
+            if match:
+                with self.lock:
+                    self.request_counts[route] += 1
+                    delay, fault = self._draw_fault(method, path)
+                if delay:
+                    time.sleep(delay)  # Outside of the lock, so that concurrent requests are delayed in parallel
+                if fault is not None:
+                    return fault
+                with self.lock:
+                    return handler(match, query, body, headers)
+
+        with self.lock:
+            self.request_counts["UNHANDLED " + method + " " + path] += 1
+        return 404, {"error": "No stand-in route for " + method + " " + path}
+
+    def start(self):
+        self._httpd = http.server.ThreadingHTTPServer((STAND_IN_HOST, 0), _RequestHandler)
+        self._httpd.daemon_threads = True
+        self._httpd.stand_in = self
+        if self.tls:
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            with tempfile.TemporaryDirectory() as directory:
+                context.load_cert_chain(*create_certificate(directory))
+            self._httpd.socket = context.wrap_socket(self._httpd.socket, server_side=True)
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name=type(self).__name__, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._httpd is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+class ElasticStandIn(StandInServer):
+    """Stand-in for Elasticsearch with the Elastic Security alert index and the endpoint event indices.
+
+    Every synthetic detection is an open alert with its own host, process tree (parent, alert and child process) and the
+    network, file and registry events of the alert process. Searches support the 'match' and 'term' clauses used by the
+    integration, time ranges are ignored. The stand-in uses HTTPS, as the Elasticsearch client of the integration is
+    always created with TLS options.
+    """
+
+    response_headers = {"X-Elastic-Product": "Elasticsearch"}
+    error_response = (
+        503,
+        {"error": {"type": "no_shard_available_action_exception", "reason": "No shard available (simulated)"}, "status": 503},
+    )
+    quota_response = (
+        429,
+        {"error": {"type": "es_rejected_execution_exception", "reason": "Search queue is full (simulated)"}, "status": 429},
+    )
+
+    def __init__(self, detections=10, **options):
+        super().__init__(tls=True, **options)
+        alert = load_fixture("elastic_alert")
+        events = load_fixture("elastic_events")
+        process = alert["_source"]["process"]
+
+        self.stores = {"alerts": [], "events": []}
+        self._field_index = {"alerts": {}, "events": {}}  # store -> field -> value -> list of docs
+        self._alerts_by_id = {}
+        for n in range(detections):
+            replacements = {
+                alert["_id"]: hashlib.sha256(("elastic-alert-" + str(n)).encode()).hexdigest(),
+                "10.20.1.101": internal_ip("10.30", n),
+                "WS-0001": "WS-{:04d}".format(n),
+                "ws-0001": "ws-{:04d}".format(n),
+                "203.0.113.45": external_ip(n),
+                "updates.example-cdn.net": external_domain("updates.example-cdn.net", n),
+                process["hash"]["sha256"]: file_hash(process["hash"]["sha256"], n),
+            }
+            entity_ids = [process["entity_id"], process["parent"]["entity_id"]] + process["Ext"]["ancestry"]
+            entity_ids.append(events["child_process"]["_source"]["process"]["entity_id"])
+            for entity_id in entity_ids:
+                replacements[entity_id] = entity_id.rstrip("=") + "-" + str(n)
+
+            doc = vary(alert, replacements)
+            self.stores["alerts"].append(doc)
+            self._alerts_by_id[doc["_id"]] = doc
+            for name, event in events.items():
+                self.stores["events"].extend(vary(event if type(event) is list else [event], replacements))
+
+        self.add_route("GET", r"/_cat/indices", self.cat_indices)
+        self.add_route("GET", r"/(?P<index>[^/_][^/]*)/_search", self.search)
+        self.add_route("POST", r"/(?P<index>[^/_][^/]*)/_search", self.search)
+        self.add_route("POST", r"/(?P<index>[^/_][^/]*)/_update/(?P<doc_id>[^/]+)", self.update)
+
+    @staticmethod
+    def get_field(doc, field):
+        """Returns the value of a (flat or nested) field of a document's source or None."""
+        source = doc["_source"]
+        if field in source:
+            return source[field]
+        value = source
+        for key in field.split("."):
+            if type(value) is not dict or key not in value:
+                return None
+            value = value[key]
+        return value
+
+    def _lookup(self, store, field, value):
+        """Returns the documents of a store whose field equals (or, for lists, contains) the value."""
+        index = self._field_index[store].get(field)
+        if index is None:
+            index = collections.defaultdict(list)
+            for doc in self.stores[store]:
+                values = self.get_field(doc, field)
+                for item in values if type(values) is list else [values]:
+                    if item is not None:
+                        index[str(item)].append(doc)
+            self._field_index[store][field] = index
+        return index.get(str(value), [])
+
+    @staticmethod
+    def _clauses(query):
+        """Yields the (field, value) pairs of all 'match' and 'term' clauses of a query."""
+        if type(query) is dict:
+            for key, value in query.items():
+                if key in ("match", "term") and type(value) is dict:
+                    for field, condition in value.items():
+                        yield field, condition.get("query", condition.get("value")) if type(condition) is dict else condition
+                else:
+                    yield from ElasticStandIn._clauses(value)
+        elif type(query) is list:
+            for item in query:
+                yield from ElasticStandIn._clauses(item)
+
+    def cat_indices(self, match, query, body, headers):
+        indices = {doc["_index"] for store in self.stores.values() for doc in store}
+        return 200, [{"health": "green", "status": "open", "index": index} for index in sorted(indices)]
+
+    def search(self, match, query, body, headers):
+        store = "alerts" if ".alerts" in match.group("index") else "events"
+        clauses = list(self._clauses(body.get("query", {})))
+        if clauses:
+            field, value = clauses[0]
+            hits = self._lookup(store, field, value)
+            for field, value in clauses[1:]:
+                matching = {id(doc) for doc in self._lookup(store, field, value)}
+                hits = [doc for doc in hits if id(doc) in matching]
+        else:
+            hits = self.stores[store]
+
+        size = int(query.get("size", body.get("size", ELASTIC_DEFAULT_SIZE)))
+        return 200, {
+            "took": 1,
+            "timed_out": False,
+            "_shards": {"total": 1, "successful": 1, "skipped": 0, "failed": 0},
+            "hits": {"total": {"value": len(hits), "relation": "eq"}, "max_score": 1.0, "hits": hits[:size]},
+        }
+
+    def update(self, match, query, body, headers):
+        doc = self._alerts_by_id.get(match.group("doc_id"))
+        if doc is None:
+            return 404, {"_index": match.group("index"), "_id": match.group("doc_id"), "result": "not_found"}
+
+        doc["_source"].update(body.get("doc", {}))
+        for field in body.get("doc", {}):
+            self._field_index["alerts"].pop(field, None)
+        return 200, {
+            "_index": doc["_index"],
+            "_id": doc["_id"],
+            "result": "updated",
+            "_shards": {"total": 1, "successful": 1, "failed": 0},
+        }
+
+
+class QRadarStandIn(StandInServer):
+    """Stand-in for the QRadar REST API (offenses, rules, Ariel searches and DNS lookups).
+
+    Every synthetic detection is an open offense of its own source host with the recorded firewall and Suricata events.
+    Ariel searches return the events of the offense and log sources of the AQL query, projected on the columns of its
+    SELECT clause. They complete immediately or, with 'search_polls', after their status was polled that many times.
+    """
+
+    error_response = (
+        503,
+        {"http_response": {"code": 503, "message": "Service Unavailable"}, "code": 1010, "message": "Simulated error"},
+    )
+    quota_response = (
+        429,
+        {"http_response": {"code": 429, "message": "Too Many Requests"}, "code": 1004, "message": "Simulated rate limit"},
+    )
+
+    def __init__(self, detections=10, search_polls=0, **options):
+        super().__init__(**options)
+        self.search_polls = search_polls
+        fixture = load_fixture("qradar_offense")
+        self._events = load_fixture("qradar_events")
+        self._first_id = fixture["offense"]["id"]
+
+        self.offenses = {}
+        for n in range(detections):
+            offense = copy.deepcopy(fixture["offense"])
+            offense["id"] = self._first_id + n
+            offense["offense_source"] = internal_ip("10.40", n)
+            offense["start_time"] += n * 1000
+            offense["last_updated_time"] += n * 1000
+            self.offenses[offense["id"]] = offense
+
+        self.rules = {rule["id"]: rule for rule in fixture["rules"]}
+        self.notes = collections.defaultdict(list)
+        self._dns_lookup = fixture["dns_lookup"]
+        self._searches = {}
+        self._search_polls = {}  # search ID -> number of status polls
+        self._ids = itertools.count(1)
+
+        self.add_route("GET", r"/api/siem/offenses", self.get_offenses)
+        self.add_route("GET", r"/api/siem/offenses/(?P<offense_id>\d+)", self.get_offense)
+        self.add_route("POST", r"/api/siem/offenses/(?P<offense_id>\d+)", self.update_offense)
+        self.add_route("POST", r"/api/siem/offenses/(?P<offense_id>\d+)/notes", self.create_note)
+        self.add_route("GET", r"/api/analytics/rules", self.get_rules)
+        self.add_route("GET", r"/api/analytics/rules/(?P<rule_id>\d+)", self.get_rule)
+        self.add_route("POST", r"/api/ariel/searches", self.create_search)
+        self.add_route("GET", r"/api/ariel/searches/(?P<search_id>[^/]+)", self.get_search)
+        self.add_route("GET", r"/api/ariel/searches/(?P<search_id>[^/]+)/results", self.get_search_results)
+        self.add_route("POST", r"/api/services/dns_lookups", self.create_dns_lookup)
+        self.add_route("GET", r"/api/services/dns_lookups/(?P<lookup_id>\d+)", self.get_dns_lookup)
+
+    def offense_events(self, offense_id):
+        """Returns the events of an offense by log source name."""
+        n = offense_id - self._first_id
+        return vary(
+            self._events,
+            {
+                "10.20.2.17": self.offenses[offense_id]["offense_source"],
+                "ws-0217": "ws-{:04d}".format(n),
+                "198.51.100.23": external_ip(n),
+                "beacon.example-c2.net": external_domain("beacon.example-c2.net", n),
+                "44d88612fea8a8f36de82e1278abb02f": file_hash("44d88612fea8a8f36de82e1278abb02f", n),
+            },
+        )
+
+    def get_offenses(self, match, query, body, headers):
+        offense_filter = query.get("filter", "")
+        min_id = re.search(r"id > (\d+)", offense_filter)
+        min_time = re.search(r"last_updated_time > (\d+)", offense_filter)
+
+        offenses = []
+        for offense in sorted(self.offenses.values(), key=lambda offense: offense["id"]):
+            if offense["status"] != "OPEN" or offense["follow_up"]:
+                continue
+            newer = [
+                bound is None or offense[field] > int(bound.group(1))
+                for field, bound in (("id", min_id), ("last_updated_time", min_time))
+            ]
+            if (min_id and min_time and any(newer)) or all(newer):
+                offenses.append(offense)
+
+        first, last = re.match(r"items=(\d+)-(\d+)", headers.get("Range", "items=0-49")).groups()
+        page = offenses[int(first) : int(last) + 1]
+        return 206 if len(page) < len(offenses) else 200, page
+
+    def get_offense(self, match, query, body, headers):
+        offense = self.offenses.get(int(match.group("offense_id")))
+        if offense is None:
+            return 404, {"http_response": {"code": 404, "message": "Not Found"}, "message": "Offense not found"}
+        return 200, offense
+
+    def update_offense(self, match, query, body, headers):
+        status, offense = self.get_offense(match, query, body, headers)
+        if status == 200 and "follow_up" in query:
+            offense["follow_up"] = query["follow_up"] == "true"
+        return status, offense
+
+    def create_note(self, match, query, body, headers):
+        note = {"id": next(self._ids), "note_text": query.get("note_text", "")}
+        self.notes[int(match.group("offense_id"))].append(note)
+        return 201, note
+
+    def get_rules(self, match, query, body, headers):
+        rule_ids = [int(rule_id) for rule_id in re.findall(r"\d+", query.get("filter", ""))]
+        return 200, [self.rules[rule_id] for rule_id in rule_ids if rule_id in self.rules]
+
+    def get_rule(self, match, query, body, headers):
+        rule = self.rules.get(int(match.group("rule_id")))
+        if rule is None:
+            return 404, {"http_response": {"code": 404, "message": "Not Found"}, "message": "Rule not found"}
+        return 200, rule
+
+    def create_search(self, match, query, body, headers):
+        aql = query.get("query_expression", "")
+        offense_id = re.search(r"INOFFENSE\((\d+)\)", aql)
+        log_source = re.search(r"LOGSOURCENAME\(logsourceid\) MATCHES '([^']*)'", aql)
+        select = aql.split("\n", 1)[0]
+        columns = [alias or field for alias, field in re.findall(r"""[Aa][Ss] '([^']+)'|"([^"]+)\"""", select)]
+
+        events = []
+        if offense_id is not None and int(offense_id.group(1)) in self.offenses:
+            for name, source_events in self.offense_events(int(offense_id.group(1))).items():
+                if log_source is not None and not re.match(log_source.group(1), name):
+                    continue
+                for event in source_events:
+                    event = dict(event, **{"Log Source": name})
+                    events.append({column: event.get(column) for column in columns} if columns else event)
+
+        search_id = "benchmark-search-{:d}".format(next(self._ids))
+        self._searches[search_id] = events
+        self._search_polls[search_id] = 0
+        return 201, self._search_status(search_id)
+
+    def _search_status(self, search_id):
+        """Returns the status of an Ariel search, which completes after it was polled 'search_polls' times."""
+        polls = self._search_polls[search_id]
+        if polls >= self.search_polls:
+            return {"search_id": search_id, "status": "COMPLETED", "progress": 100}
+        return {"search_id": search_id, "status": "EXECUTE" if polls else "WAIT", "progress": 100 * polls // self.search_polls}
+
+    def get_search(self, match, query, body, headers):
+        search_id = match.group("search_id")
+        if search_id not in self._searches:
+            return 404, {"message": "Search not found"}
+        self._search_polls[search_id] += 1
+        return 200, self._search_status(search_id)
+
+    def get_search_results(self, match, query, body, headers):
+        events = self._searches.pop(match.group("search_id"), None)
+        if events is None:
+            return 404, {"message": "Search not found"}
+        del self._search_polls[match.group("search_id")]
+        return 200, {"events": events}
+
+    def create_dns_lookup(self, match, query, body, headers):
+        return 201, dict(self._dns_lookup, id=next(self._ids))
+
+    def get_dns_lookup(self, match, query, body, headers):
+        return 200, dict(self._dns_lookup, id=int(match.group("lookup_id")))
+
+
+class ZnunyStandIn(StandInServer):
+    """Stand-in for the generic ticket connector web service of Znuny/OTRS (as used by pyotrs).
+
+    Tickets and their articles are kept in memory. Searches only support the ticket number, other searches find nothing.
+    """
+
+    WEBSERVICE_PATH = r"/(?:znuny|otrs)/nph-genericinterface\.pl/Webservice/[^/]+"
+
+    def __init__(self, **options):
+        super().__init__(**options)
+        fixture = load_fixture("znuny")
+        self._session = fixture["session"]
+        self._ticket = fixture["ticket"]
+        self._article = fixture["article"]
+        self.tickets = {}
+        self._ticket_ids_by_number = {}
+        self._ids = itertools.count(1)
+
+        self.add_route("POST", self.WEBSERVICE_PATH + r"/Session", self.create_session)
+        self.add_route("POST", self.WEBSERVICE_PATH + r"/Ticket", self.create_ticket)
+        self.add_route("GET", self.WEBSERVICE_PATH + r"/Ticket", self.search_tickets)
+        self.add_route("GET", self.WEBSERVICE_PATH + r"/Ticket/(?P<ticket_id>\d+)", self.get_ticket)
+        self.add_route("PATCH", self.WEBSERVICE_PATH + r"/Ticket/(?P<ticket_id>\d+)", self.update_ticket)
+        self.add_route("GET", self.WEBSERVICE_PATH + r"/TicketList", self.get_ticket_list)
+
+    def _add_article(self, ticket, article):
+        article_id = str(next(self._ids))
+        ticket["Article"].append(
+            dict(self._article, ArticleID=article_id, ArticleNumber=len(ticket["Article"]) + 1, **article.get("Article", {}))
+        )
+        return article_id
+
+    def create_session(self, match, query, body, headers):
+        return 200, self._session
+
+    def create_ticket(self, match, query, body, headers):
+        ticket_id = str(next(self._ids))
+        ticket = dict(self._ticket, TicketID=ticket_id, TicketNumber="2023061210{:06d}".format(int(ticket_id)), Article=[])
+        ticket.update({key: value for key, value in body.get("Ticket", {}).items() if type(value) is str})
+        article_id = self._add_article(ticket, body)
+
+        self.tickets[ticket_id] = ticket
+        self._ticket_ids_by_number[ticket["TicketNumber"]] = ticket_id
+        return 200, {"TicketID": ticket_id, "TicketNumber": ticket["TicketNumber"], "ArticleID": article_id}
+
+    def search_tickets(self, match, query, body, headers):
+        ticket_id = self._ticket_ids_by_number.get(query.get("TicketNumber"))
+        return 200, {"TicketID": [ticket_id]} if ticket_id else {}
+
+    def get_ticket(self, match, query, body, headers):
+        ticket = self.tickets.get(match.group("ticket_id"))
+        if ticket is None:
+            return 200, {"Error": {"ErrorCode": "TicketGet.AccessDenied", "ErrorMessage": "TicketGet: Ticket not found"}}
+        if query.get("AllArticles") not in ("1", "true", "True"):
+            ticket = {key: value for key, value in ticket.items() if key != "Article"}
+        return 200, {"Ticket": [ticket]}
+
+    def update_ticket(self, match, query, body, headers):
+        ticket = self.tickets.get(match.group("ticket_id"))
+        if ticket is None:
+            return 200, {"Error": {"ErrorCode": "TicketUpdate.AccessDenied", "ErrorMessage": "TicketUpdate: Ticket not found"}}
+        ticket.update({key: value for key, value in body.get("Ticket", {}).items() if type(value) is str})
+        response = {"TicketID": ticket["TicketID"], "TicketNumber": ticket["TicketNumber"]}
+        if "Article" in body:
+            response["ArticleID"] = self._add_article(ticket, body)
+        return 200, response
+
+    def get_ticket_list(self, match, query, body, headers):
+        ticket_ids = query.get("TicketID", "").split(",")
+        return 200, {"Ticket": [self.tickets[ticket_id] for ticket_id in ticket_ids if ticket_id in self.tickets]}
+
+
+class VirusTotalStandIn(StandInServer):
+    """Stand-in for the VirusTotal API (IP addresses, domains, file reports and URL analyses).
+
+    Requests above the quota are answered like by the real API: HTTP 429 with a QuotaExceededError for the v3 API and
+    HTTP 204 without a body for the v2 API. The public API tier allows 4 requests per minute, i.e. quota=(4, 60).
+    """
+
+    def __init__(self, **options):
+        super().__init__(**options)
+        self._fixture = load_fixture("virustotal")
+        self.error_response = (503, {"error": {"code": "TransientError", "message": "Simulated error"}})
+        self.quota_response = (429, self._fixture["quota_exceeded"])
+
+        self.add_route("GET", r"/api/v3/ip_addresses/(?P<value>[^/]+)", self.get_report("ip_address"))
+        self.add_route("GET", r"/api/v3/ip_addresses/(?P<value>[^/]+)/resolutions", self.get_report("resolutions"))
+        self.add_route("GET", r"/api/v3/domains/(?P<value>[^/]+)", self.get_report("domain"))
+        self.add_route("GET", r"/vtapi/v2/file/report", self.get_file_report)
+        self.add_route("POST", r"/api/v3/urls", self.submit_url)
+        self.add_route("GET", r"/api/v3/analyses/(?P<value>[^/]+)", self.get_report("url_analysis"))
+
+    def get_report(self, name):
+        """Returns a handler that replays the recorded report 'name' for the requested indicator."""
+
+        def handler(match, query, body, headers):
+            report = copy.deepcopy(self._fixture[name])
+            if type(report["data"]) is dict:
+                report["data"]["id"] = match.group("value")
+            return 200, report
+
+        return handler
+
+    def get_quota_response(self, method, path):
+        if path.startswith("/vtapi/v2/"):
+            return 204, None
+        return self.quota_response
+
+    def get_file_report(self, match, query, body, headers):
+        return 200, dict(self._fixture["file_report"], resource=query.get("resource"), sha256=query.get("resource"))
+
+    def submit_url(self, match, query, body, headers):
+        return 200, self._fixture["url_submission"]
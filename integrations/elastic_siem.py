@@ -26,6 +26,7 @@ import string
 import time
 
 import lib.logging_helper as logging_helper
+import lib.metrics_helper as metrics_helper
 
 # For new detections:
 from lib.class_helper import Rule, Detection, ContextProcess, ContextFlow, ContextDevice
@@ -43,7 +44,7 @@ from lib.class_helper import (
     Certificate,
     ContextRegistry,
 )
-from lib.generic_helper import dict_get, get_from_cache, add_to_cache
+from lib.generic_helper import dict_get, get_from_cache, add_to_cache, get_ip_info, compile_path, compile_mapping
 
 
 ELASTIC_MAX_RESULTS = 50  # Maximum number of results to return from Elastic-SIEM for a Context in one query
@@ -158,112 +159,195 @@ def get_host_ip_from_doc(doc_dict):
             doc_dict["host"]["ip"] = [doc_dict["host"]["ip"]]
 
         for ip in doc_dict["host"]["ip"]:
-            ip_casted = cast_to_ipaddress(ip, False)
-            if ip_casted is not None and ip_casted.is_private:
+            ip_info = get_ip_info(ip)
+            if ip_info is not None and ip_info.is_private:
                 if ip.startswith("10."):
-                    host_ip = ip_casted
+                    host_ip = ip_info.address
                     break  # This is prefered, therefore break here
                 elif ip.startswith("192.168."):
-                    host_ip = ip_casted  # Continue loop to maybe find a 10.* IP
-            elif ip_casted and ip_casted.is_global:
-                global_ip = ip_casted
+                    host_ip = ip_info.address  # Continue loop to maybe find a 10.* IP
+            elif ip_info and ip_info.is_global:
+                global_ip = ip_info.address
     return host_ip, global_ip
 
 
-def create_flow_from_doc(mlog, doc_dict, detection_id):
-    """Creates a ContextFlow object from an Elastic-SIEM document.
-       Will also add DNS or HTTP objects to flow if available.
+# Field mappings of the Elastic Common Schema (ECS), compiled once into accessor functions (see generic_helper.compile_mapping)
+FLOW_FIELDS = compile_mapping(
+    {
+        "timestamp": "@timestamp",
+        "source_port": "source.port",
+        "destination_port": "destination.port",
+        "protocol": "network.protocol",
+        "application": "network.application",
+        "process_name": "process.name",
+        "process_id": "process.pid",
+        "destination_bytes": "destination.bytes",
+        "source_bytes": "source.bytes",
+        "bytes_toclient": "suricata.eve.flow.bytes_toclient",
+        "bytes_toserver": "suricata.eve.flow.bytes_toserver",
+        "host_mac": "host.mac",
+        "host_name": "host.name",
+        "action": "event.action",
+        "transport": "network.transport",
+        "ruleset": "rule.ruleset",
+        "dns_query": "dns.question.name",
+    }
+)
+FLOW_ENDPOINT_FIELDS = {
+    endpoint: compile_mapping(
+        {
+            "address": endpoint + ".address",
+            "ip": endpoint + ".ip",
+            "location": endpoint + ".geo.location",
+            "country": endpoint + ".geo.country_name",
+            "city": endpoint + ".geo.city_name",
+            "asn": endpoint + ".as.number",
+            "org": endpoint + ".as.organization.name",
+        }
+    )
+    for endpoint in ("source", "destination")
+}
+PROCESS_FIELDS = compile_mapping(
+    {
+        "timestamp": "@timestamp",
+        "alert_uuid": "kibana.alert.uuid",
+        "name": "process.name",
+        "pid": "process.pid",
+        "entity_id": "process.entity_id",
+        "parent_entity_id": "process.parent.entity_id",
+        "ancestry": "process.Ext.ancestry",
+        "parent_name": "process.parent.name",
+        "parent_pid": "process.parent.pid",
+        "parent_args": "process.parent.args",
+        "parent_start": "process.parent.start",
+        "start": "process.start",
+        "executable": "process.executable",
+        "md5": "process.hash.md5",
+        "sha1": "process.hash.sha1",
+        "sha256": "process.hash.sha256",
+        "args": "process.args",
+        "user": "user.name",
+        "working_directory": "process.working_directory",
+        "code_signature": "process.Ext.code_signature",
+        "io_bytes": "process.io.total_bytes_captured",
+        "io_text": "process.io.text",
+    }
+)
+FILE_FIELDS = compile_mapping(
+    {
+        "timestamp": "@timestamp",
+        "action": "event.action",
+        "file_name": "file.name",
+        "file_original_name": "file.original.name",
+        "file_path": "file.path",
+        "file_original_path": "file.original.path",
+        "file_extension": "file.extension",
+        "file_size": "file.size",
+        "file_header_bytes": "file.header",
+        "entropy": "file.Ext.entropy",
+    }
+)
+REGISTRY_FIELDS = compile_mapping(
+    {
+        "timestamp": "@timestamp",
+        "action": "event.action",
+        "registry_key": "registry.key",
+        "registry_value": "registry.value",
+        "registry_data": "registry.data.bytes",
+        "registry_data_type": "registry.data.type",
+        "registry_hive": "registry.hive",
+        "registry_path": "registry.path",
+    }
+)
+get_event_category = compile_path("event.category")
+
+# Regex patterns to find the resolved IP address in the message of a DNS event
+RE_DNS_IPV4 = re.compile(
+    r"(25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)\.(25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)\.(25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)\.(25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)"
+)
+RE_DNS_IPV6 = re.compile("([0-9a-fA-F]{1,4}(?::[0-9a-fA-F]{1,4}){7})")
+
+
+def get_flow_endpoint_from_doc(mlog, doc_dict, endpoint):
+    """Gets the IP address and location of the source or destination of a flow from an Elastic-SIEM document.
+       Falls back to the host's IP if the document has no IP for the endpoint.
 
     Args:
         mlog (logging_helper.Log): The logging object
-        doc_id (str): The Elastic-SIEM document ID
         doc_dict (dict): The Elastic-SIEM document as a dictionary
-        detection_id (str): The detection ID
+        endpoint (str): Either 'source' or 'destination'
 
     Returns:
-        ContextFlow: The ContextFlow object
+        tuple: The IP address (or None if it could not be casted) and the Location object (or None)
     """
-    src_location = None
-    dst_location = None
+    fields = FLOW_ENDPOINT_FIELDS[endpoint](doc_dict)
+    location = None
 
-    # Create flow object if applicable
-    if "source" in doc_dict and "address" in doc_dict["source"] or dict_get(doc_dict, "source.ip"):
-        src_ip = cast_to_ipaddress(dict_get(doc_dict, "source.address"), False)
-        if not src_ip:
-            src_ip = cast_to_ipaddress(dict_get(doc_dict, "source.ip"), False)
+    if "address" in doc_dict.get(endpoint, {}) or fields["ip"]:
+        ip = cast_to_ipaddress(fields["address"], False)
+        if not ip:
+            ip = cast_to_ipaddress(fields["ip"], endpoint == "destination")  # Destination IP has to be valid
 
-        if not src_ip:
+        if not ip:
             mlog.error(
-                "create_flow_from_doc - No source IP casted in Elastic-SIEM document, even though the field source.ip or source.address have a value. Skipping flow."
+                f"create_flow_from_doc - No {endpoint} IP casted in Elastic-SIEM document, even though the field {endpoint}.ip or {endpoint}.address have a value. Skipping flow."
             )
-            return None
+            return None, None
 
-        # Get source location if possible
-        if "geo" in doc_dict["source"]:
+        # Get location if possible
+        if "geo" in doc_dict[endpoint]:
             try:
-                long_lat = dict_get(doc_dict, "source.geo.location")
+                long_lat = fields["location"]
 
-                src_location = Location(
-                    dict_get(doc_dict, "source.geo.country_name"),
-                    dict_get(doc_dict, "source.geo.city_name"),
+                location = Location(
+                    fields["country"],
+                    fields["city"],
                     long_lat["lat"] if long_lat else None,
                     long_lat["lon"] if long_lat else None,
-                    asn=dict_get(doc_dict, "source.as.number"),
-                    org=dict_get(doc_dict, "source.as.organization.name"),
+                    asn=fields["asn"],
+                    org=fields["org"],
                     certainty=80,
                 )
             except Exception as e:
-                mlog.warning("create_flow_from_doc - Could not parse source flow location from Elastic-SIEM document: " + str(e))
+                mlog.warning(
+                    f"create_flow_from_doc - Could not parse {endpoint} flow location from Elastic-SIEM document: " + str(e)
+                )
     else:
         host_ip, _ = get_host_ip_from_doc(doc_dict)
+        mlog.warning(f"create_flow_from_doc - No {endpoint} IP found in Elastic-SIEM document. Using host's IP: " + str(host_ip))
 
-        mlog.warning("create_flow_from_doc - No source IP found in Elastic-SIEM document. Using host's IP: " + str(src_ip))
-        src_ip = cast_to_ipaddress(host_ip, False)
-        if not src_ip:
+        ip = cast_to_ipaddress(host_ip, False)
+        if not ip:
             mlog.error(
-                "create_flow_from_doc - No source IP casted in Elastic-SIEM document, even though the field host.ip has a value. Skipping flow."
+                f"create_flow_from_doc - No {endpoint} IP casted in Elastic-SIEM document, even though the field host.ip has a value. Skipping flow."
             )
-            return None
+            return None, None
 
-    if "destination" in doc_dict and "address" in doc_dict["destination"] or dict_get(doc_dict, "destination.ip"):
-        dst_ip = cast_to_ipaddress(dict_get(doc_dict, "destination.address"), False)
-        if not dst_ip:
-            dst_ip = cast_to_ipaddress(dict_get(doc_dict, "destination.ip"))
+    return ip, location
 
-        if not dst_ip:
-            mlog.error(
-                "create_flow_from_doc - No destination IP casted in Elastic-SIEM document, even though the field destination.ip or destination.address have a value. Skipping flow."
-            )
-            return None
 
-        # Get destination location if possible
-        if "geo" in doc_dict["destination"]:
-            try:
-                long_lat = dict_get(doc_dict, "destination.geo.location")
+def create_flow_from_doc(mlog, doc_dict, detection_id):
+    """Creates a ContextFlow object from an Elastic-SIEM document.
+       Will also add DNS or HTTP objects to flow if available.
 
-                dst_location = Location(
-                    dict_get(doc_dict, "destination.geo.country_name"),
-                    dict_get(doc_dict, "destination.geo.city_name"),
-                    long_lat["lat"] if long_lat else None,
-                    long_lat["lon"] if long_lat else None,
-                    asn=dict_get(doc_dict, "destination.as.number"),
-                    org=dict_get(doc_dict, "destination.as.organization.name"),
-                    certainty=80,
-                )
-            except Exception as e:
-                mlog.warning(
-                    "create_flow_from_doc - Could not parse destination flow location from Elastic-SIEM document: " + str(e)
-                )
-    else:
-        host_ip, _ = get_host_ip_from_doc(doc_dict)
-        mlog.warning("create_flow_from_doc - No destination IP found in Elastic-SIEM document. Using host's IP: " + str(src_ip))
+    Args:
+        mlog (logging_helper.Log): The logging object
+        doc_dict (dict): The Elastic-SIEM document as a dictionary
+        detection_id (str): The detection ID
 
-        dst_ip = cast_to_ipaddress(host_ip, False)
-        if not dst_ip:
-            mlog.error(
-                "create_flow_from_doc - No destination IP casted in Elastic-SIEM document, even though the field host.ip has a value. Skipping flow."
-            )
-            return None
+    Returns:
+        ContextFlow: The ContextFlow object
+    """
+    # Create flow object if applicable
+    src_ip, src_location = get_flow_endpoint_from_doc(mlog, doc_dict, "source")
+    if not src_ip:
+        return None
+
+    dst_ip, dst_location = get_flow_endpoint_from_doc(mlog, doc_dict, "destination")
+    if not dst_ip:
+        return None
+
+    fields = FLOW_FIELDS(doc_dict)
 
     # Get http object if applicable
     http = None
@@ -280,15 +364,11 @@ def create_flow_from_doc(mlog, doc_dict, detection_id):
             dns_type = "A"  # Default type if unknown is A
 
             # Get the resolved IP Address from the message string using regex:
-            resolved_ips = re.findall(
-                r"(25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)\.(25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)\.(25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)\.(25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)",
-                msg,
-            )
-            resolved_ip = resolved_ips[0] if len(resolved_ips) > 0 else None
-            resolved_ip = ".".join(resolved_ip) if resolved_ip is not None else None
+            resolved_ips = RE_DNS_IPV4.findall(msg)
+            resolved_ip = ".".join(resolved_ips[0]) if len(resolved_ips) > 0 else None
             if resolved_ip is None:
                 # Try find an ipv6 address
-                resolved_ips = re.findall("([0-9a-fA-F]{1,4}(?::[0-9a-fA-F]{1,4}){7})", msg)
+                resolved_ips = RE_DNS_IPV6.findall(msg)
                 resolved_ip = resolved_ips[0] if len(resolved_ips) > 0 else None
 
             if resolved_ip is not None:
@@ -298,19 +378,15 @@ def create_flow_from_doc(mlog, doc_dict, detection_id):
                 except Exception as e:
                     mlog.warning("create_flow_from_doc - DNS: Could not parse resolved IP from Elastic-SIEM document: " + str(e))
                     resolved_ip = None
-            else:
-                resolved_ip = None
 
             # Get type of DNS query
-            if has_resp and type(resolved_ip) == ipaddress.IPv4Address:
-                dns_type = "A"
-            elif has_resp and dns_type(resolved_ip) is ipaddress.IPv6Address:
+            if has_resp and type(resolved_ip) is ipaddress.IPv6Address:
                 dns_type = "AAAA"
 
             dns = DNSQuery(
                 detection_id,
                 type=dns_type,
-                query=dict_get(doc_dict, "dns.question.name"),
+                query=fields["dns_query"],
                 has_response=has_resp,
                 query_response=resolved_ip,
             )
@@ -318,42 +394,30 @@ def create_flow_from_doc(mlog, doc_dict, detection_id):
         except Exception as e:
             mlog.warning("create_flow_from_doc - Could not parse flow's DNS from Elastic-SIEM document: " + str(e))
 
-    source_bytes = int(dict_get(doc_dict, "destination.bytes")) if dict_get(doc_dict, "destination.bytes") else None
-    destination_bytes = int(dict_get(doc_dict, "source.bytes")) if dict_get(doc_dict, "source.bytes") else None
-    if source_bytes is None:
-        source_bytes = (
-            int(dict_get(doc_dict, "suricata.eve.flow.bytes_toclient"))
-            if dict_get(doc_dict, "suricata.eve.flow.bytes_toclient")
-            else None
-        )
-    if destination_bytes is None:
-        destination_bytes = (
-            int(dict_get(doc_dict, "suricata.eve.flow.bytes_toserver"))
-            if dict_get(doc_dict, "suricata.eve.flow.bytes_toserver")
-            else None
-        )
+    source_bytes = fields["destination_bytes"] or fields["bytes_toclient"]
+    destination_bytes = fields["source_bytes"] or fields["bytes_toserver"]
 
     flow = ContextFlow(
         detection_id,
-        dict_get(doc_dict, "@timestamp"),
+        fields["timestamp"],
         "Elastic-SIEM",
         src_ip,
-        dict_get(doc_dict, "source.port"),
+        fields["source_port"],
         dst_ip,
-        dict_get(doc_dict, "destination.port"),
-        dict_get(doc_dict, "network.protocol"),
-        dict_get(doc_dict, "network.application"),
-        dict_get(doc_dict, "process.name"),
-        dict_get(doc_dict, "process.pid"),
+        fields["destination_port"],
+        fields["protocol"],
+        fields["application"],
+        fields["process_name"],
+        fields["process_id"],
         None,
-        source_bytes,
-        destination_bytes,
-        dict_get(doc_dict, "host.mac")[0] if dict_get(doc_dict, "host.mac") else None,
+        int(source_bytes) if source_bytes else None,
+        int(destination_bytes) if destination_bytes else None,
+        fields["host_mac"][0] if fields["host_mac"] else None,
         None,
-        dict_get(doc_dict, "host.name"),
+        fields["host_name"],
         None,
-        dict_get(doc_dict, "event.action"),
-        dict_get(doc_dict, "network.transport"),
+        fields["action"],
+        fields["transport"],
         None,
         flow_source="Elastic Endpoint Security",
         source_location=src_location,
@@ -361,93 +425,84 @@ def create_flow_from_doc(mlog, doc_dict, detection_id):
         http=http,
         dns_query=dns,
         detection_relevance=50,
-        firewall_action=dict_get(doc_dict, "event.action") if dict_get(doc_dict, "event.action") else "Unknown",
-        firewall_rule_id=dict_get(doc_dict, "rule.ruleset"),
+        firewall_action=fields["action"] if fields["action"] else "Unknown",
+        firewall_rule_id=fields["ruleset"],
     )
 
-    flow_str = str(flow)
-    mlog.debug("Created flow: " + flow_str)
+    if mlog.is_debug_enabled():  # Avoid serializing the flow if it is not logged anyway
+        mlog.debug("Created flow: " + str(flow))
     return flow
 
 
 def create_process_from_doc(mlog, doc_dict, detectionOnly=True):
     """Creates a ContextProcess object from a Elastic-SIEM document."""
-    mlog.debug("Creating ContextProcess object from Elastic-SIEM document.")
+    fields = PROCESS_FIELDS(doc_dict)
 
     dns_requests = None  # TODO: Implement create_dns_from_doc
     files = None  # TODO: Implement create_file_from_doc
     flows = None  # TODO: Implement create_flow_from_doc
     http_requests = None  # TODO: Implement create_http_from_doc
 
-    created_files = []
-    deleted_files = []
-    modified_files = []
-
     # Get parent process entity to create a minimal process to link the current process to it
-    parent = dict_get(doc_dict, "process.parent.entity_id")
+    parent = fields["parent_entity_id"]
     if not parent:
-        parent = dict_get(doc_dict, "process.Ext.ancestry")
-        if parent:
-            parent = parent[0]
-        else:
-            parent = None
+        parent = fields["ancestry"][0] if fields["ancestry"] else None
 
-    children = []
-    start_time = dict_get(doc_dict, "process.start")
+    start_time = fields["start"]
     if not start_time:
         mlog.warning("No explicit start time found for process. Using @timestamp of event.")
-        start_time = dict_get(doc_dict, "@timestamp")
+        start_time = fields["timestamp"]
 
     # Try to create certificate object from process signature
     signature = None
-    sign_raw = dict_get(doc_dict, "process.Ext.code_signature")
+    sign_raw = fields["code_signature"]
     if sign_raw:
         if type(sign_raw) == list:
             sign_raw = sign_raw[0]
 
         signer = dict_get(sign_raw, "subject_name")
         signature = Certificate(
-            dict_get(doc_dict, "kibana.alert.uuid"), is_trusted=bool(dict_get(sign_raw, "trusted")), issuer=signer, subject=signer
+            fields["alert_uuid"], is_trusted=bool(dict_get(sign_raw, "trusted")), issuer=signer, subject=signer
         )
 
-    sha256 = dict_get(doc_dict, "process.hash.sha256")
+    sha256 = fields["sha256"]
     if sha256 is None:
-        mlog.warning(f"No SHA256 hash found for process '{dict_get(doc_dict, 'process.name')}'. Using random hash instead.")
+        mlog.warning(f"No SHA256 hash found for process '{fields['name']}'. Using random hash instead.")
         # Create 64 random hex characters
         sha256 = "".join(random.choice(string.hexdigits) for _ in range(64))
 
     # Create the process object
     process = ContextProcess(
-        timestamp=dict_get(doc_dict, "@timestamp"),
-        related_detection_uuid=dict_get(doc_dict, "kibana.alert.uuid"),
-        process_name=dict_get(doc_dict, "process.name"),
-        process_id=dict_get(doc_dict, "process.pid"),
-        parent_process_name=dict_get(doc_dict, "process.parent.name"),
-        parent_process_id=dict_get(doc_dict, "process.parent.pid"),
-        parent_process_arguments=dict_get(doc_dict, "process.parent.args"),
-        process_path=dict_get(doc_dict, "process.executable"),
-        process_md5=dict_get(doc_dict, "process.hash.md5"),
-        process_sha1=dict_get(doc_dict, "process.hash.sha1"),
+        timestamp=fields["timestamp"],
+        related_detection_uuid=fields["alert_uuid"],
+        process_name=fields["name"],
+        process_id=fields["pid"],
+        parent_process_name=fields["parent_name"],
+        parent_process_id=fields["parent_pid"],
+        parent_process_arguments=fields["parent_args"],
+        process_path=fields["executable"],
+        process_md5=fields["md5"],
+        process_sha1=fields["sha1"],
         process_sha256=sha256,
-        process_command_line=dict_get(doc_dict, "process.args"),
-        process_username=dict_get(doc_dict, "user.name"),
-        process_owner=dict_get(doc_dict, "user.name"),
+        process_command_line=fields["args"],
+        process_username=fields["user"],
+        process_owner=fields["user"],
         process_start_time=start_time,
-        process_parent_start_time=dict_get(doc_dict, "process.parent.start"),
-        process_current_directory=dict_get(doc_dict, "process.working_directory"),
+        process_parent_start_time=fields["parent_start"],
+        process_current_directory=fields["working_directory"],
         process_dns=dns_requests,
         process_http=http_requests,
         process_flow=flows,
         process_parent=parent,
-        process_children=children,
-        process_arguments=dict_get(doc_dict, "process.args"),
+        process_children=[],
+        process_arguments=fields["args"],
         process_signature=signature,
-        created_files=created_files,
-        deleted_files=deleted_files,
-        modified_files=modified_files,
-        process_uuid=dict_get(doc_dict, "process.entity_id"),
-        process_io_bytes=dict_get(doc_dict, "process.io.total_bytes_captured"),
-        process_io_text=dict_get(doc_dict, "process.io.text"),
+        created_files=[],
+        deleted_files=[],
+        modified_files=[],
+        process_uuid=fields["entity_id"],
+        process_io_bytes=fields["io_bytes"],
+        process_io_text=fields["io_text"],
         is_complete=True,
     )
 
@@ -457,32 +512,18 @@ def create_process_from_doc(mlog, doc_dict, detectionOnly=True):
 
 def create_file_from_doc(mlog, doc_dict, detection_id):
     """Creates a ContextFile object from a Elastic-SIEM document."""
-    mlog.debug("Creating ContextFile object from Elastic-SIEM document.")
+    fields = FILE_FIELDS(doc_dict)
 
     # Parse entropy as float if possible
-    entropy = None
+    entropy = fields.pop("entropy")
     try:
-        entropy = dict_get(doc_dict, "file.Ext.entropy")
         if entropy:
             entropy = float(entropy)
     except Exception as e:
-        pass
+        entropy = None
 
     # Create the file object
-    file = ContextFile(
-        detection_id,
-        timestamp=dict_get(doc_dict, "@timestamp"),
-        action=dict_get(doc_dict, "event.action"),
-        file_name=dict_get(doc_dict, "file.name"),
-        file_original_name=dict_get(doc_dict, "file.original.name"),
-        file_path=dict_get(doc_dict, "file.path"),
-        file_original_path=dict_get(doc_dict, "file.original.path"),
-        file_extension=dict_get(doc_dict, "file.extension"),
-        file_size=dict_get(doc_dict, "file.size"),
-        file_header_bytes=dict_get(doc_dict, "file.header"),
-        file_entropy=entropy
-        # TODO: Add more fields if found
-    )
+    file = ContextFile(detection_id, file_entropy=entropy, **fields)  # TODO: Add more fields if found
 
     mlog.debug("Created file: " + str(file.file_name))
     return file
@@ -490,25 +531,62 @@ def create_file_from_doc(mlog, doc_dict, detection_id):
 
 def create_registry_from_doc(mlog, doc_dict, detection_id):
     """Creates a ContextRegistry object from a Elastic-SIEM document."""
-    mlog.debug("Creating ContextRegistry object from Elastic-SIEM document.")
-
-    # Create the registry object
-    registry = ContextRegistry(
-        detection_id,
-        timestamp=dict_get(doc_dict, "@timestamp"),
-        action=dict_get(doc_dict, "event.action"),
-        registry_key=dict_get(doc_dict, "registry.key"),
-        registry_value=dict_get(doc_dict, "registry.value"),
-        registry_data=dict_get(doc_dict, "registry.data.bytes"),
-        registry_data_type=dict_get(doc_dict, "registry.data.type"),
-        registry_hive=dict_get(doc_dict, "registry.hive"),
-        registry_path=dict_get(doc_dict, "registry.path"),
-    )
+    registry = ContextRegistry(detection_id, **REGISTRY_FIELDS(doc_dict))
 
     mlog.debug("Created registry: " + str(registry.registry_key))
     return registry
 
 
+# The functions that create a context object from an Elastic-SIEM document, by context type
+CONTEXT_FROM_DOC = {
+    ContextFlow: create_flow_from_doc,
+    ContextProcess: lambda mlog, doc_dict, detection_id: create_process_from_doc(mlog, doc_dict),
+    ContextFile: create_file_from_doc,
+    ContextRegistry: create_registry_from_doc,
+}
+
+
+def create_contexts_from_docs(mlog, docs, context_type, detection_id=None, categories=None, max_contexts=-1):
+    """Creates the context objects for a whole page of Elastic-SIEM search results in one pass.
+
+    Args:
+        mlog (logging_helper.Log): The logging object
+        docs (list): The Elastic-SIEM search hits (with the document in '_source')
+        context_type (type): The context class to create (ContextFlow, ContextProcess, ContextFile or ContextRegistry)
+        detection_id (str): The detection ID
+        categories (tuple, optional): Only create contexts from documents with one of these event categories. Defaults to all.
+        max_contexts (int, optional): The maximum number of contexts to create. Defaults to -1 (no limit).
+
+    Returns:
+        list: The created context objects
+    """
+    create_context = CONTEXT_FROM_DOC[context_type]
+    contexts = []
+    skipped = {}
+
+    for doc in docs:
+        doc_dict = doc["_source"]
+        if categories is not None:
+            category = get_event_category(doc_dict)
+            category = category[0] if category else None
+            if category not in categories:
+                skipped[category] = skipped.get(category, 0) + 1
+                continue
+
+        if max_contexts != -1 and len(contexts) >= max_contexts:
+            mlog.info("Reached given maxContext limit (" + str(max_contexts) + "). Will not return more context.")
+            break
+
+        context = create_context(mlog, doc_dict, detection_id)
+        if context is not None:
+            contexts.append(context)
+
+    if skipped:
+        mlog.info("Skipped adding events with categories: " + ", ".join(str(k) + " (" + str(v) + ")" for k, v in skipped.items()))
+    mlog.debug(f"create_contexts_from_docs - Created {len(contexts)} {context_type.__name__} objects from {len(docs)} documents.")
+    return contexts
+
+
 def get_all_indices(mlog, config, security_only=False):
     """Gets all indices from Elasticsearch.
 
@@ -1242,6 +1320,7 @@ def zs_provide_new_detections(config, TEST="") -> List[Detection]:
 ############################################
 
 
+@metrics_helper.timed("integration.provide_context", with_module=True)
 def zs_provide_context_for_detections(
     config,
     case_file: CaseFile,
@@ -1346,20 +1425,11 @@ def zs_provide_context_for_detections(
                             )
                             return None
                         else:
-                            counter = 0
-                            for doc in docs:
-                                event_category = doc["_source"]["event"]["category"][0]
-                                if event_category != "process":
-                                    mlog.info("Skipping adding event with category: " + event_category)
-                                    continue
-                                if maxContext != -1 and counter >= maxContext:
-                                    mlog.info(
-                                        "Reached given maxContext limit (" + str(maxContext) + "). Will not return more context."
-                                    )
-                                    break
-                                process = create_process_from_doc(mlog, doc["_source"])
-                                return_objects.append(process)
-                                counter += 1
+                            return_objects.extend(
+                                create_contexts_from_docs(
+                                    mlog, docs, ContextProcess, categories=("process",), max_contexts=maxContext
+                                )
+                            )
                     else:
                         mlog.info("UUID provided. Will return the single process with UUID: " + str(search_value))
                         doc = search_entity_by_id(mlog, config, search_value, entity_type="process")
@@ -1380,8 +1450,7 @@ def zs_provide_context_for_detections(
                         mlog.info("No flows found for process with Entity ID: " + str(search_value))
                         return None
 
-                    for doc in flow_docs:
-                        return_objects.append(create_flow_from_doc(mlog, doc["_source"], detection_id))
+                    return_objects.extend(create_contexts_from_docs(mlog, flow_docs, ContextFlow, detection_id))
                 else:
                     mlog.error("UUID does not match either a valid Elastic Entity ID")
                     return None
@@ -1399,9 +1468,7 @@ def zs_provide_context_for_detections(
                             mlog.info("No files found with Entity ID: " + str(search_value))
                             return None
 
-                        for doc in file_docs:
-                            file_obj = create_file_from_doc(mlog, doc["_source"], detection_id)
-                            return_objects.append(file_obj)
+                        return_objects.extend(create_contexts_from_docs(mlog, file_docs, ContextFile, detection_id))
                     else:
                         mlog.error("UUID does not match either a valid Elastic Entity ID")
                         return None
@@ -1421,9 +1488,7 @@ def zs_provide_context_for_detections(
                             mlog.info("No registry entries found with Entity ID: " + str(search_value))
                             return None
 
-                        for doc in registry_docs:
-                            registry_obj = create_registry_from_doc(mlog, doc["_source"], detection_id)
-                            return_objects.append(registry_obj)
+                        return_objects.extend(create_contexts_from_docs(mlog, registry_docs, ContextRegistry, detection_id))
 
         if search_type == "dest_ip":
             if required_type == ContextProcess:
@@ -1442,13 +1507,9 @@ def zs_provide_context_for_detections(
                         mlog.info("No processes found which have destination IP Address: " + str(search_value))
                         return None
 
-                    for doc in docs:
-                        event_category = doc["_source"]["event"]["category"][0]
-                        if event_category not in ["process", "network"]:
-                            mlog.info("Skipping adding event with category: " + event_category)
-                            continue
-                        process = create_process_from_doc(mlog, doc["_source"])
-                        return_objects.append(process)
+                    return_objects.extend(
+                        create_contexts_from_docs(mlog, docs, ContextProcess, categories=("process", "network"))
+                    )
 
         if search_type == "host_ip":
             if required_type == ContextProcess:
@@ -1467,13 +1528,7 @@ def zs_provide_context_for_detections(
                         mlog.info("No processes found which have host IP Address: " + str(search_value))
                         return None
 
-                    for doc in docs:
-                        event_category = doc["_source"]["event"]["category"][0]  # TODO: Fix Bug here: KeyError: 'event'
-                        if event_category not in ["process"]:
-                            mlog.info("Skipping adding event with category: " + event_category)
-                            continue
-                        process = create_process_from_doc(mlog, doc["_source"])
-                        return_objects.append(process)
+                    return_objects.extend(create_contexts_from_docs(mlog, docs, ContextProcess, categories=("process",)))
                 else:
                     mlog.error("IP Address provided is not valid.")
                     return None
@@ -1489,13 +1544,7 @@ def zs_provide_context_for_detections(
                         mlog.info("No files found which have host IP Address: " + str(search_value))
                         return None
 
-                    for doc in docs:
-                        event_category = doc["_source"]["event"]["category"][0]
-                        if event_category not in ["file"]:
-                            mlog.info("Skipping adding event with category: " + event_category)
-                            continue
-                        file_obj = create_file_from_doc(mlog, doc["_source"], detection_id)
-                        return_objects.append(file_obj)
+                    return_objects.extend(create_contexts_from_docs(mlog, docs, ContextFile, detection_id, categories=("file",)))
                 else:
                     mlog.error("IP Address provided is not valid.")
                     return None
@@ -1516,13 +1565,9 @@ def zs_provide_context_for_detections(
                         mlog.info("No registry entries found which have host IP Address: " + str(search_value))
                         return None
 
-                    for doc in docs:
-                        event_category = doc["_source"]["event"]["category"][0]
-                        if event_category not in ["registry"]:
-                            mlog.info("Skipping adding event with category: " + event_category)
-                            continue
-                        registry_obj = create_registry_from_doc(mlog, doc["_source"], detection_id)
-                        return_objects.append(registry_obj)
+                    return_objects.extend(
+                        create_contexts_from_docs(mlog, docs, ContextRegistry, detection_id, categories=("registry",))
+                    )
                 else:
                     mlog.error("IP Address provided is not valid.")
                     return None
@@ -1538,13 +1583,9 @@ def zs_provide_context_for_detections(
                         mlog.info("No flows found which have host IP Address: " + str(search_value))
                         return None
 
-                    for doc in docs:
-                        event_category = doc["_source"]["event"]["category"][0]
-                        if event_category not in ["network"]:
-                            mlog.info("Skipping adding event with category: " + event_category)
-                            continue
-                        flow_obj = create_flow_from_doc(mlog, doc["_source"], detection_id)
-                        return_objects.append(flow_obj)
+                    return_objects.extend(
+                        create_contexts_from_docs(mlog, docs, ContextFlow, detection_id, categories=("network",))
+                    )
                 else:
                     mlog.error("IP Address provided is not valid.")
                     return None
@@ -30,11 +30,12 @@ import collections
 import ipaddress
 
 import lib.logging_helper as logging_helper
+import lib.metrics_helper as metrics_helper
 
 # For new detections:
 from lib.class_helper import Rule, Detection, ContextFlow, ContextDevice, ContextLog, HTTP, ContextFile, ContextDevice, DNSQuery
 from lib.config_helper import Config
-from lib.generic_helper import cast_to_ipaddress
+from lib.generic_helper import cast_to_ipaddress, get_ip_info
 
 # For context for detections:
 from lib.class_helper import (
@@ -48,6 +49,8 @@ SEARCH_POLLING_INTERVAL = 1  # The interval in seconds to poll for the results o
 MAX_RESULTS_QRADAR_SEARCH = 5000  # The maximum number of results that can be returned by a QRadar search
 MAX_TRIES_QRADAR_SEARCH = 360  # The maximum number of tries to get the results of a QRadar search before giving up (time in seconds = MAX_TRIES_QRADAR_SEARCH * SEARCH_POLLING_INTERVAL)
 CONNECTION_TIMEOUT = 10  # The timeout in seconds for the connection to QRadar (set higher if you have a slow connection)
+MAX_OFFENSES_PER_POLL = 100  # The maximum number of new offenses fetched in one poll. The rest will be fetched in the next poll(s)
+RULE_CACHE_TTL = 24 * 60 * 60  # The time in seconds a cached rule (name, type, origin, notes) is used before it is fetched again
 
 # This is a query used to gather an AQL query for custom fields for a specified log source.
 # Feel free to edit this log sources or custom fields to match your environment.
@@ -202,6 +205,46 @@ FLOW_LOG_SOURCES = ["Firewall", "Suricata Traffic"]
 LOG_LOG_SOURCES = ["Suricata Alerts", "FALLBACK"]
 FILE_LOG_SOURCES = ["Suricata Traffic"]
 
+# Well-known ports and their protocols, used to guess the protocol of a flow. If both ports are known, the first one listed wins.
+PORT_PROTOCOLS = {
+    port: (priority, protocol)
+    for priority, (port, protocol) in enumerate(
+        [
+            (53, "DNS"),
+            (80, "HTTP"),
+            (443, "HTTPS"),
+            (22, "SSH"),
+            (23, "Telnet"),
+            (25, "SMTP"),
+            (110, "POP3"),
+            (143, "IMAP"),
+            (389, "LDAP"),
+            (636, "LDAPS"),
+            (1433, "MSSQL"),
+            (3306, "MySQL"),
+            (3389, "RDP"),
+            (5432, "PostgreSQL"),
+            (5985, "WinRM"),
+        ]
+    )
+}
+FIREWALL_DENY_WORDS = ("Blocked", "Denied", "Drop", "Deny")  # Event names containing one of these words are denied flows
+LOG_SEVERITY_LEVELS = ("DEBUG", "CRITICAL", "ERROR", "WARNING", "INFO")  # Severities found in event names, by precedence
+LOG_STANDARD_FIELDS = frozenset(  # Event fields that are mapped to ContextLog attributes (all others become custom fields)
+    [
+        "Log Source Time",
+        "Log Source",
+        "Source IP",
+        "Source Asset Name",
+        "Destination Asset Name",
+        "Event Name",
+        "Low Level Category",
+        "Destination IP",
+        "Destination Port",
+        "Source Port",
+    ]
+)
+
 
 if __name__ == "__main__":
     sys.exit()  # TODO: Add interactive setup
@@ -222,7 +265,9 @@ class Client(metaclass=abc.ABCMeta):
         self.session.verify = verify
         self.mlog = mlog
 
-    def request(self, method: str, params: dict = None, path: str = None, url=None, timeout=CONNECTION_TIMEOUT):
+    def request(
+        self, method: str, params: dict = None, path: str = None, url=None, timeout=CONNECTION_TIMEOUT, headers: dict = None
+    ):
         if path is not None and url is not None:
             raise ValueError("At least one of path or url must be None")
 
@@ -231,6 +276,7 @@ class Client(metaclass=abc.ABCMeta):
             method=method,
             url=self.host + path if url is None else url,
             params=params,
+            headers=headers,
             timeout=timeout,
         )
         return response
@@ -312,16 +358,168 @@ def init_logging(config):
     return mlog
 
 
+def get_offense_high_water_mark(qradar_url: str) -> dict:
+    """Returns the persisted offense high-water mark for a QRadar instance.
+
+    Args:
+        qradar_url (str): The URL of the QRadar instance
+
+    Returns:
+        dict: The high-water mark with the keys 'id' and 'last_updated_time' or None if there is none yet
+    """
+    high_water_mark = get_from_cache("ibm_qradar", "offense_high_water_mark", qradar_url)
+    if type(high_water_mark) is not dict or "id" not in high_water_mark:
+        return None
+    return high_water_mark
+
+
+def set_offense_high_water_mark(qradar_url: str, offense_id: int, last_updated_time: int):
+    """Persists the offense high-water mark for a QRadar instance.
+
+    Args:
+        qradar_url (str): The URL of the QRadar instance
+        offense_id (int): The highest offense ID that was handled completely
+        last_updated_time (int): The newest 'last_updated_time' (epoch ms) of all handled offenses
+    """
+    add_to_cache(
+        "ibm_qradar",
+        "offense_high_water_mark",
+        qradar_url,
+        {"id": offense_id, "last_updated_time": last_updated_time},
+    )
+
+
+class RuleCache:
+    """Cache for the metadata of QRadar rules, keyed by rule ID.
+
+    The cache lives in memory for the lifetime of the process (e.g. across daemon cycles) and is backed by the Z-SOAR
+    file cache, so it also survives restarts. Entries expire after RULE_CACHE_TTL seconds.
+
+    Attributes:
+        qradar_url (str): The URL of the QRadar instance the rules belong to
+        ttl (int): The time in seconds an entry is valid
+    """
+
+    def __init__(self, qradar_url: str, ttl: int = RULE_CACHE_TTL):
+        self.qradar_url = qradar_url
+        self.ttl = ttl
+        self._rules = {}  # rule_id -> {"cached_at": epoch seconds, "rule": rule dict}
+        self._loaded = False
+
+    def _load(self):
+        """Loads the persisted entries from the file cache (only once)."""
+        if self._loaded:
+            return
+        self._loaded = True
+        persisted = get_from_cache("ibm_qradar", "rule_metadata", self.qradar_url)
+        if type(persisted) is not dict:
+            return
+        for rule_id, entry in persisted.items():
+            try:
+                self._rules[int(rule_id)] = {"cached_at": float(entry["cached_at"]), "rule": entry["rule"]}
+            except (KeyError, TypeError, ValueError):
+                continue
+
+    def _save(self):
+        """Persists all entries to the file cache with a single write."""
+        add_to_cache("ibm_qradar", "rule_metadata", self.qradar_url, {str(k): v for k, v in self._rules.items()})
+
+    def get(self, rule_id: int) -> dict:
+        """Returns the cached rule or None if it is not cached or expired.
+
+        Args:
+            rule_id (int): The ID of the rule
+
+        Returns:
+            dict: The rule details or None
+        """
+        self._load()
+        entry = self._rules.get(int(rule_id))
+        if entry is None or time.time() - entry["cached_at"] > self.ttl:
+            return None
+        return entry["rule"]
+
+    def put(self, rules: dict, persist: bool = True):
+        """Adds rules to the cache.
+
+        Args:
+            rules (dict): The rule details by rule ID
+            persist (bool, optional): If the cache should be written to the file cache. Defaults to True.
+        """
+        self._load()
+        now = time.time()
+        for rule_id, rule in rules.items():
+            self._rules[int(rule_id)] = {"cached_at": now, "rule": rule}
+        if persist and len(rules) > 0:
+            self._save()
+
+    def warm(self, qradar, rule_ids) -> dict:
+        """Makes sure all given rules are cached, fetching the missing or expired ones with a single request.
+
+        Args:
+            qradar (QRadar): The QRadar API object used for fetching
+            rule_ids (iterable): The IDs of the rules
+
+        Returns:
+            dict: The rule details by rule ID (rules that could not be fetched are missing)
+        """
+        rules = {}
+        missing = set()
+        for rule_id in rule_ids:
+            rule = self.get(rule_id)
+            if rule is None:
+                missing.add(int(rule_id))
+            else:
+                rules[int(rule_id)] = rule
+
+        if len(missing) > 0:
+            qradar.client.mlog.debug("RuleCache: Fetching {:d} uncached rule(s) from QRadar".format(len(missing)))
+            fetched = qradar.get_rules(missing)
+            self.put(fetched)
+            rules.update(fetched)
+
+        return rules
+
+
+_rule_caches = {}  # qradar_url -> RuleCache
+
+
+def get_rule_cache(qradar_url: str) -> RuleCache:
+    """Returns the (process wide) rule cache for a QRadar instance.
+
+    Args:
+        qradar_url (str): The URL of the QRadar instance
+
+    Returns:
+        RuleCache: The rule cache
+    """
+    if qradar_url not in _rule_caches:
+        _rule_caches[qradar_url] = RuleCache(qradar_url)
+    return _rule_caches[qradar_url]
+
+
 class QRadar:
     def __init__(self, config_url, config_api_key, verify, mlog):
         self.client = TokenClient(config_url, config_api_key, mlog, verify)
 
-    def get_offenses(self):
+    def get_offenses(self, min_id: int = None, min_last_updated_time: int = None):
+        """Gets open and not yet acknowledged offenses.
+
+        If a high-water mark is given, only offenses with a higher ID or a newer 'last_updated_time' are requested.
+
+        Args:
+            min_id (int, optional): Only return offenses with an ID above this value. Defaults to None.
+            min_last_updated_time (int, optional): Also return offenses updated after this time (epoch ms). Defaults to None.
+
+        Returns:
+            requests.Response: The response of the offense API or None if the request failed
+        """
         fields = [
             "id",
             "description",
             "start_time",
-            "rules",
+            "last_updated_time",
+            "rules(id)",
             "categories",
             "credibility",
             "device_count",
@@ -332,9 +530,15 @@ class QRadar:
             "severity",
             "follow_up",
         ]
+        offense_filter = "status = OPEN and follow_up = False"
+        if min_id is not None and min_last_updated_time is not None:
+            offense_filter += " and (id > {:d} or last_updated_time > {:d})".format(min_id, min_last_updated_time)
+        elif min_id is not None:
+            offense_filter += " and id > {:d}".format(min_id)
+
         params = {
             "fields": ",".join(fields),
-            "filter": "status = OPEN and follow_up = False",
+            "filter": offense_filter,
             "sort": "+id",
         }
         try:
@@ -342,6 +546,7 @@ class QRadar:
                 method="GET",
                 path="/api/siem/offenses",
                 params=params,
+                headers={"Range": "items=0-{:d}".format(MAX_OFFENSES_PER_POLL - 1)},
             )
         except requests.exceptions.RequestException as e:
             print(str(e))
@@ -350,7 +555,7 @@ class QRadar:
         return offenses
 
     def get_rule(self, rule):
-        fields = ["name", "type", "origin"]
+        fields = ["name", "type", "origin", "notes"]
         params = {
             "fields": ",".join(fields),
         }
@@ -365,6 +570,40 @@ class QRadar:
 
         return rule
 
+    def get_rules(self, rule_ids) -> dict:
+        """Gets the details of multiple rules with a single filtered request.
+
+        Args:
+            rule_ids (iterable): The IDs of the rules
+
+        Returns:
+            dict: The rule details by rule ID (rules that could not be fetched are missing)
+        """
+        rule_ids = sorted(set(int(rule_id) for rule_id in rule_ids))
+        if len(rule_ids) == 0:
+            return {}
+
+        fields = ["id", "name", "type", "origin", "notes"]
+        params = {
+            "fields": ",".join(fields),
+            "filter": "id in ({:s})".format(", ".join(str(rule_id) for rule_id in rule_ids)),
+        }
+        try:
+            response = self.client.request(
+                method="GET",
+                path="/api/analytics/rules",
+                params=params,
+            )
+        except requests.exceptions.RequestException as e:
+            self.client.mlog.error("Error in get_rules(): " + str(e))
+            return {}
+
+        if response.status_code != 200:
+            self.client.mlog.error(f"Got response code {str(response.status_code)} in get_rules(): " + response.text)
+            return {}
+
+        return {rule["id"]: rule for rule in response.json()}
+
     def set_tag(self, offense, TEST=False):
         if TEST:
             self.client.mlog.warning(
@@ -509,6 +748,45 @@ class QRadar:
         return message[0]
 
 
+def get_protocol_by_port(destination_port, source_port):
+    """Gets the (likely) application protocol of a flow by its ports, see PORT_PROTOCOLS.
+
+    Args:
+        destination_port (int): The destination port
+        source_port (int): The source port
+
+    Returns:
+        str: The protocol or 'Undefined' if none of the ports is known
+    """
+    destination = PORT_PROTOCOLS.get(destination_port)
+    source = PORT_PROTOCOLS.get(source_port)
+    if destination and source:
+        return min(destination, source)[1]
+    return (destination or source or (None, "Undefined"))[1]
+
+
+def get_device_from_event(event, asset_name_field, ip_field):
+    """Creates a ContextDevice object from the asset name and IP of an event.
+
+    Args:
+        event (dict): The event
+        asset_name_field (str): The field of the asset name (e.g. 'Source Asset Name')
+        ip_field (str): The field of the IP (e.g. 'Source IP')
+
+    Returns:
+        ContextDevice: The device object
+    """
+    ip = cast_to_ipaddress(event[ip_field], False)
+    ip_private = get_ip_info(ip).is_private if ip != None else False
+
+    return ContextDevice(
+        event[asset_name_field],
+        ip if ip_private else None,
+        ip if not ip_private else None,
+        [ip] if ip != None else None,
+    )
+
+
 def create_flow_from_events(mlog, offense_id, all_events):
     """Creates flows from a list of events.
 
@@ -522,10 +800,12 @@ def create_flow_from_events(mlog, offense_id, all_events):
     """
 
     mlog.debug("Creating flows from events...")
+    debug = mlog.is_debug_enabled()  # Avoid building the debug messages for every event if they are not logged anyway
     flow_list = []
 
     for event in all_events:
-        mlog.debug("Creating flow from event: " + str(event))
+        if debug:
+            mlog.debug("Creating flow from event: " + str(event))
 
         try:
             if event["Source IP"] == None or event["Source IP"] == "NoneNone":
@@ -540,8 +820,9 @@ def create_flow_from_events(mlog, offense_id, all_events):
             dns = None
             device = None
 
-            if dict_get(event, "HTTP - Method") != None:
-                mlog.debug("Creating HTTP context for event: " + repr(event))
+            if event.get("HTTP - Method") != None:
+                if debug:
+                    mlog.debug("Creating HTTP context for event: " + repr(event))
                 http = HTTP(
                     offense_id,
                     event["HTTP - Method"],
@@ -559,17 +840,19 @@ def create_flow_from_events(mlog, offense_id, all_events):
                     file=file,
                     timestamp=event["Log Source Time"],
                 )
-            elif dict_get(event, "Server Name Indication") != None:
-                mlog.debug("Creating HTTPS context for event: " + repr(event))
+            elif event.get("Server Name Indication") != None:
+                if debug:
+                    mlog.debug("Creating HTTPS context for event: " + repr(event))
                 http = HTTP(offense_id, "Unknown (Encrypted)", "HTTPS", event["Server Name Indication"], None)
 
-            if dict_get(event, "DNS - Query") != None:
+            if event.get("DNS - Query") != None:
                 query_response_ip = cast_to_ipaddress(event["DNS - Query Response"], None)
                 dns_type = "A"
                 if type(query_response_ip) == ipaddress.IPv6Address:
                     dns_type = "AAAA"
 
-                mlog.debug("Creating DNS context for event: " + repr(event))
+                if debug:
+                    mlog.debug("Creating DNS context for event: " + repr(event))
                 dns = DNSQuery(
                     offense_id,
                     type=dns_type,
@@ -579,72 +862,26 @@ def create_flow_from_events(mlog, offense_id, all_events):
                     has_response=event["DNS - Query Response"] != None,
                 )
 
-            protocol = "Undefined"
             if http != None:
                 protocol = http.type
-            elif event["Destination Port"] == 53 or event["Source Port"] == 53:
-                protocol = "DNS"
-            elif event["Destination Port"] == 80 or event["Source Port"] == 80:
-                protocol = "HTTP"
-            elif event["Destination Port"] == 443 or event["Source Port"] == 443:
-                protocol = "HTTPS"
-            elif event["Destination Port"] == 22 or event["Source Port"] == 22:
-                protocol = "SSH"
-            elif event["Destination Port"] == 23 or event["Source Port"] == 23:
-                protocol = "Telnet"
-            elif event["Destination Port"] == 25 or event["Source Port"] == 25:
-                protocol = "SMTP"
-            elif event["Destination Port"] == 110 or event["Source Port"] == 110:
-                protocol = "POP3"
-            elif event["Destination Port"] == 143 or event["Source Port"] == 143:
-                protocol = "IMAP"
-            elif event["Destination Port"] == 389 or event["Source Port"] == 389:
-                protocol = "LDAP"
-            elif event["Destination Port"] == 636 or event["Source Port"] == 636:
-                protocol = "LDAPS"
-            elif event["Destination Port"] == 1433 or event["Source Port"] == 1433:
-                protocol = "MSSQL"
-            elif event["Destination Port"] == 3306 or event["Source Port"] == 3306:
-                protocol = "MySQL"
-            elif event["Destination Port"] == 3389 or event["Source Port"] == 3389:
-                protocol = "RDP"
-            elif event["Destination Port"] == 5432 or event["Source Port"] == 5432:
-                protocol = "PostgreSQL"
-            elif event["Destination Port"] == 5985 or event["Source Port"] == 5985:
-                protocol = "WinRM"
+            else:
+                protocol = get_protocol_by_port(event["Destination Port"], event["Source Port"])
 
+            event_name = event["Event Name"]
             firewall_action = "Permit"
-            if any(word in event["Event Name"] for word in ["Blocked", "Denied", "Drop", "Deny"]):
+            if any(word in event_name for word in FIREWALL_DENY_WORDS):
                 firewall_action = "Deny"
-            elif "Reject" in event["Event Name"]:
+            elif "Reject" in event_name:
                 firewall_action = "Reject"
 
-            rule_id = dict_get(event, "Firewall - Rule ID")
+            rule_id = event.get("Firewall - Rule ID")
             rule_id = int(rule_id) if rule_id else None
 
-            if event["Source Asset Name"] != None:
-                src_ip = cast_to_ipaddress(event["Source IP"], False)
-                src_ip_private = src_ip.is_private if src_ip != None else False
-
-                device = ContextDevice(
-                    event["Source Asset Name"],
-                    src_ip if src_ip_private else None,
-                    src_ip if not src_ip_private else None,
-                    [src_ip] if src_ip != None else None,
-                )
-
             if event["Destination Asset Name"] != None:
-                dst_ip = cast_to_ipaddress(event["Destination IP"], False)
-                dst_ip_private = dst_ip.is_private if dst_ip != None else False
-
-                device = ContextDevice(
-                    event["Destination Asset Name"],
-                    dst_ip if dst_ip_private else None,
-                    dst_ip if not dst_ip_private else None,
-                    [dst_ip] if dst_ip != None else None,
-                )
+                device = get_device_from_event(event, "Destination Asset Name", "Destination IP")
+            elif event["Source Asset Name"] != None:
+                device = get_device_from_event(event, "Source Asset Name", "Source IP")
 
-            mlog.debug("Creating flow context for event: " + repr(event))
             flow = ContextFlow(
                 offense_id,
                 event["Log Source Time"],
@@ -658,7 +895,7 @@ def create_flow_from_events(mlog, offense_id, all_events):
                 device=device,
                 source_hostname=event["Source Asset Name"],
                 destination_hostname=event["Destination Asset Name"],
-                category=event["Event Name"],
+                category=event_name,
                 sub_category=event["Low Level Category"],
                 firewall_action=firewall_action,
                 firewall_rule_id=rule_id,
@@ -666,7 +903,8 @@ def create_flow_from_events(mlog, offense_id, all_events):
                 dns_query=dns,
             )
 
-            mlog.debug("Flow context created: " + str(flow))
+            if debug:
+                mlog.debug("Flow context created: " + str(flow))
             flow_list.append(flow)
 
             # TODO: Add support for QRadar flows instead of just events
@@ -675,6 +913,7 @@ def create_flow_from_events(mlog, offense_id, all_events):
             mlog.warning("Missing key in event: " + str(event) + " - " + str(e) + ". Skipping event.")
             continue
 
+    mlog.debug("Created " + str(len(flow_list)) + " flows from " + str(len(all_events)) + " events.")
     return flow_list
 
 
@@ -691,64 +930,31 @@ def create_logs_from_events(mlog, offense_id, all_events):
     """
 
     mlog.debug("Creating logs from events...")
+    debug = mlog.is_debug_enabled()  # Avoid building the debug messages for every event if they are not logged anyway
     log_list = []
 
     for event in all_events:
-        mlog.debug("Creating log from event: " + str(event))
+        if debug:
+            mlog.debug("Creating log from event: " + str(event))
 
         try:
             device = None
-            custom_fields = {}
 
             if event["Source Asset Name"] != None:
-                src_ip = cast_to_ipaddress(event["Source IP"], False)
-                src_ip_private = src_ip.is_private if src_ip != None else False
-
-                device = ContextDevice(
-                    event["Source Asset Name"],
-                    src_ip if src_ip_private else None,
-                    src_ip if not src_ip_private else None,
-                    [src_ip] if src_ip != None else None,
-                )
-
+                device = get_device_from_event(event, "Source Asset Name", "Source IP")
             elif event["Destination Asset Name"] != None:
-                dst_ip = cast_to_ipaddress(event["Destination IP"], False)
-                dst_ip_private = dst_ip.is_private if dst_ip != None else False
-
-                device = ContextDevice(
-                    event["Destination Asset Name"],
-                    dst_ip if dst_ip_private else None,
-                    dst_ip if not dst_ip_private else None,
-                    [dst_ip] if dst_ip != None else None,
-                )
+                device = get_device_from_event(event, "Destination Asset Name", "Destination IP")
 
-            severity = dict_get(event, "Severity", "UNKNOWN")
+            severity = event.get("Severity", "UNKNOWN")
             if severity == "UNKNOWN":
-                severity = "INFO" if "INFO" in dict_get(event, "Event Name", "UNKNOWN").upper() else severity
-                severity = "WARNING" if "WARNING" in dict_get(event, "Event Name", "UNKNOWN").upper() else severity
-                severity = "ERROR" if "ERROR" in dict_get(event, "Event Name", "UNKNOWN").upper() else severity
-                severity = "CRITICAL" if "CRITICAL" in dict_get(event, "Event Name", "UNKNOWN").upper() else severity
-                severity = "DEBUG" if "DEBUG" in dict_get(event, "Event Name", "UNKNOWN").upper() else severity
-
-            custom_fields = {
-                k: event[k]
-                for k in event
-                if k
-                not in [
-                    "Log Source Time",
-                    "Log Source",
-                    "Source IP",
-                    "Source Asset Name",
-                    "Destination Asset Name",
-                    "Event Name",
-                    "Low Level Category",
-                    "Destination IP",
-                    "Destination Port",
-                    "Source Port",
-                ]
-            }
-
-            mlog.debug("Creating log context for event: " + repr(event))
+                event_name = str(event.get("Event Name", "UNKNOWN")).upper()
+                for level in LOG_SEVERITY_LEVELS:
+                    if level in event_name:
+                        severity = level
+                        break
+
+            custom_fields = {k: v for k, v in event.items() if k not in LOG_STANDARD_FIELDS}
+
             log = ContextLog(
                 offense_id,
                 event["Log Source Time"],
@@ -760,13 +966,15 @@ def create_logs_from_events(mlog, offense_id, all_events):
                 log_severity=severity,
                 log_custom_fields=custom_fields,
             )
-            mlog.debug("Log context created: " + str(log))
+            if debug:
+                mlog.debug("Log context created: " + str(log))
             log_list.append(log)
 
         except KeyError as e:
             mlog.warning("Missing key in event: " + str(event) + " - " + str(e) + ". Skipping event.")
             continue
 
+    mlog.debug("Created " + str(len(log_list)) + " logs from " + str(len(all_events)) + " events.")
     return log_list
 
 
@@ -783,34 +991,35 @@ def create_files_from_events(mlog, offense_id, all_events):
     """
 
     mlog.debug("Creating files from events...")
+    debug = mlog.is_debug_enabled()  # Avoid building the debug messages for every event if they are not logged anyway
     file_list = []
 
     for event in all_events:
-        mlog.debug("Creating file from event: " + str(event))
+        if event.get("File Hash") == None:
+            continue
 
         try:
-            file = None
-
-            if dict_get(event, "File Hash") != None:
-                # Get filename from end of the filename path
-                file_name = dict_get(event, "Filename")
-                if file_name and "/" in file_name and len(file_name.split("/")) > 1:
-                    file_name = file_name.split("/")[-1]
+            # Get filename from end of the filename path
+            file_name = event.get("Filename")
+            if file_name and "/" in file_name:
+                file_name = file_name.rsplit("/", 1)[-1]
 
-                file = ContextFile(
-                    offense_id,
-                    event["Log Source Time"],
-                    "File Transfer",
-                    file_name,
-                    event["File Hash"],
-                    file_path=event["Filename"],
-                )
+            file = ContextFile(
+                offense_id,
+                event["Log Source Time"],
+                "File Transfer",
+                file_name,
+                event["File Hash"],
+                file_path=event["Filename"],
+            )
+            if debug:
                 mlog.debug("File context created: " + str(file))
-                file_list.append(file)
+            file_list.append(file)
         except KeyError as e:
             mlog.warning("Missing key in event: " + str(event) + " - " + str(e) + ". Skipping event.")
             continue
 
+    mlog.debug("Created " + str(len(file_list)) + " files from " + str(len(all_events)) + " events.")
     return file_list
 
 
@@ -840,28 +1049,38 @@ def zs_provide_new_detections(config, TEST=False) -> List[Detection]:
 
     # QRadar Offenses
     mlog.debug("QRadar: Connecting to {:s} ...".format(qradar_url))
-    offenses = qradar.get_offenses()
+    high_water_mark = get_offense_high_water_mark(qradar_url)
+    if high_water_mark:
+        mlog.debug("QRadar: Only fetching offenses newer than high-water mark " + str(high_water_mark))
+        offenses = qradar.get_offenses(high_water_mark["id"], high_water_mark.get("last_updated_time"))
+    else:
+        offenses = qradar.get_offenses()
+    if offenses is None or offenses.status_code not in (200, 206):
+        mlog.error("QRadar: Could not fetch offenses.")
+        return []
     offenses = offenses.json()
     if not offenses:
         mlog.info("QRadar: Done Quering QRadar SIEM (0 Hits)")
         return []
     mlog.info("Found {:d} new offenses".format(len(offenses)))
 
+    # Get rule details for all rules of all offenses from the rule cache (uncached rules are fetched with a single request)
+    rule_cache = get_rule_cache(qradar_url)
+    rule_ids = set()
     for offense in offenses:
-        try:
-            # QRadar Rules
-            rule_list = []
-            rules = {}
-
-            # Get rules associated with offenses
-            for rule in offense["rules"]:
-                rules[rule["id"]] = {}
+        for rule in offense["rules"]:
+            rule_ids.add(rule["id"])
+    rules = rule_cache.warm(qradar, rule_ids)
 
-            # Get rule details for each rule
-            for rule_id in rules.keys():
-                rules[rule_id] = qradar.get_rule(rule_id).json()
-                rules[rule_id]["id"] = rule_id
+    # The ID part of the high-water mark is only moved forward until the first offense that could not be handled,
+    # so that it will be fetched again in the next poll.
+    new_mark_id = high_water_mark["id"] if high_water_mark else None
+    new_mark_time = high_water_mark.get("last_updated_time") if high_water_mark else None
+    mark_blocked = False
 
+    for offense in offenses:
+        handled = False
+        try:
             # Link to offense
             offense["url"] = "{:s}/console/do/sem/offensesummary?appName=Sem&pageId=OffenseSummary&summaryId={:d}".format(
                 qradar_url,
@@ -871,11 +1090,17 @@ def zs_provide_new_detections(config, TEST=False) -> List[Detection]:
             # Create rule objects for each offense and rule
             rule_list = []
             for i in range(len(offense["rules"])):
-                offense["rules"][i] = rules[offense["rules"][i]["id"]]
+                rule_id = offense["rules"][i]["id"]
+                if rule_id not in rules:  # Fallback if the rule was missing in the bulk response
+                    rules[rule_id] = qradar.get_rule(rule_id).json()
+                    rules[rule_id]["id"] = rule_id
+                    rule_cache.put({rule_id: rules[rule_id]})
+                offense["rules"][i] = rules[rule_id]
                 rule_list.append(
                     Rule(
                         offense["rules"][i]["id"],
                         offense["rules"][i]["name"],
+                        description=offense["rules"][i].get("notes"),
                         tags=[offense["rules"][i]["origin"], offense["rules"][i]["type"]],
                     )
                 )
@@ -906,6 +1131,7 @@ def zs_provide_new_detections(config, TEST=False) -> List[Detection]:
                 qradar.set_tag(offense["id"], TEST)  # acknowledge offense
                 qradar.create_note(offense["id"], detection.uuid)
                 detections.append(detection)
+                handled = True
             except Exception:
                 mlog.error(
                     "[ANTI-LOOP] Failed to acknowledge offense with offense ID "
@@ -916,10 +1142,25 @@ def zs_provide_new_detections(config, TEST=False) -> List[Detection]:
         except Exception as e:
             mlog.error("Uncatched exception in zs_provide_new_detections(): " + (traceback.format_exc()))
 
+        if handled and not mark_blocked:
+            if new_mark_id is None or offense["id"] > new_mark_id:
+                new_mark_id = offense["id"]
+            last_updated_time = offense.get("last_updated_time")
+            if last_updated_time is not None and (new_mark_time is None or last_updated_time > new_mark_time):
+                new_mark_time = last_updated_time
+        elif not handled:
+            mark_blocked = True
+
+    if TEST:
+        mlog.warning("TEST: High-water mark will not be persisted, so the same offenses will be fetched again.")
+    elif new_mark_id is not None:
+        set_offense_high_water_mark(qradar_url, new_mark_id, new_mark_time)
+
     mlog.info("Done Quering QRadar SIEM (with Hit(s))")
     return detections
 
 
+@metrics_helper.timed("integration.provide_context", with_module=True)
 def zs_provide_context_for_detections(
     case_file: CaseFile, required_type: type, TEST="", search_type=None, search_value=None
 ) -> list:
@@ -19,8 +19,12 @@ import re
 import random
 import string
 import time
+import copy
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 
 import lib.logging_helper as logging_helper
+import lib.metrics_helper as metrics_helper
 
 # For context for detections:
 from lib.class_helper import (
@@ -40,6 +44,35 @@ THRESHOLD_MAX_TRIES_API_QUOTA_EXCEEDED = 15  # The maximum number of times the A
 TIME_INTERVAL_API_QUOTA_EXCEEDED = 60  # The time interval in seconds after which the API call will be retried
 THRESHOLD_MAX_TRIES_QUEUED_SEARCH = 5  # The maximum number of times the API call will be retried if the search is queued
 TIME_INTERVAL_QUEUED_SEARCH = 10  # The time interval in seconds after which the API call will be retried
+TIMEOUT_LOOKUP = (
+    THRESHOLD_MAX_TRIES_API_QUOTA_EXCEEDED * TIME_INTERVAL_API_QUOTA_EXCEEDED
+    + THRESHOLD_MAX_TRIES_QUEUED_SEARCH * TIME_INTERVAL_QUEUED_SEARCH
+    + 60
+)  # The maximum time in seconds zs_provide_context_for_detections() waits for a lookup (all retries plus a margin)
+VT_API_URL = "https://www.virustotal.com"  # The base URL of the VirusTotal API
+VT_REQUESTS_PER_MINUTE = 4  # The number of API requests per minute allowed by your API tier (public API: 4)
+VT_BURST_SIZE = 4  # The maximum number of API requests that can be sent at once after being idle (size of the token bucket)
+VT_MAX_IN_FLIGHT_REQUESTS = 4  # The maximum number of concurrent API lookups (worker threads)
+VT_VERDICT_TTL_MALICIOUS = 7 * 24 * 60 * 60  # The time in seconds a malicious/suspicious verdict is cached
+VT_VERDICT_TTL_CLEAN = 24 * 60 * 60  # The time in seconds a clean verdict (no hits) is cached
+VT_VERDICT_TTL_UNKNOWN = 6 * 60 * 60  # The time in seconds an unknown verdict (indicator not found in VirusTotal) is cached
+
+CERT_FIELDS = (
+    "subject",
+    "issuer",
+    "issuer_common_name",
+    "issuer_organization",
+    "issuer_organizational_unit",
+    "serial_number",
+    "subject_common_name",
+    "subject_organization",
+    "subject_organizational_unit",
+    "subject_alternative_names",
+    "valid_from",
+    "valid_to",
+    "is_trusted",
+    "is_self_signed",
+)  # The certificate fields that are stored in the verdict cache
 
 
 def handle_response(
@@ -70,7 +103,6 @@ def handle_response(
         if "scans" in response_json:
             if not cache:
                 mlog.info(f"VirusTotal API call for {str(search_type)} '{search_value}' returned data.")
-                add_to_cache("virus_total", str(search_type), str(search_value), response_json)
 
             scans = response_json["scans"]
 
@@ -107,7 +139,6 @@ def handle_response(
         if "data" in response_json:
             if not cache:
                 mlog.info(f"VirusTotal API call for {str(search_type)} '{search_value}' returned data.")
-                add_to_cache("virus_total", str(search_type), str(search_value), response_json)
             try:
                 scans = response_json["data"]["attributes"]["last_analysis_results"]
             except KeyError:
@@ -141,7 +172,14 @@ def handle_response(
         if len(intel) > 0:
             mlog.info(f"VirusTotal API for {str(search_type)} '{search_value}' returned {len(intel)} context entries.")
             context = ContextThreatIntel(
-                search_type, search_value, "Virus Total API", datetime.datetime.now(), intel, related_detection_uuid=detection_id
+                search_type,
+                search_value,
+                "Virus Total API",
+                datetime.datetime.now(),
+                intel,
+                related_detection_uuid=detection_id,
+                related_domains=[],
+                links=[],
             )
 
             # Add certificate information if available
@@ -295,7 +333,6 @@ def handle_response(
             return context
         else:
             mlog.error(f"VirusTotal API call for {str(search_type)} '{search_value}' did not return any data.")
-            add_to_cache("virus_total", str(search_type), str(search_value), response_json)
             return None
 
     else:
@@ -305,7 +342,462 @@ def handle_response(
         return None
 
 
-def zs_provide_context_for_detections(
+def _verdict_key(search_type: type, search_value) -> str:
+    if search_type == HTTP:  # URLs are looked up without surrounding '=' (see VirusTotalLookup)
+        search_value = str(search_value).strip("=")
+    return search_type.__name__ + ":" + str(search_value)
+
+
+def get_verdict(search_type: type, search_value):
+    """Gets a cached verdict for an indicator, if it is not expired yet.
+
+    Args:
+        search_type (type): The type of the indicator
+        search_value (str): The indicator
+
+    Returns:
+        dict: The cached verdict or None if there is no (valid) verdict
+    """
+    entry = get_from_cache("virus_total", "verdicts", _verdict_key(search_type, search_value))
+    if type(entry) is not dict or "verdict" not in entry:
+        return None
+
+    if entry["verdict"] == "malicious":
+        ttl = VT_VERDICT_TTL_MALICIOUS
+    elif entry["verdict"] == "clean":
+        ttl = VT_VERDICT_TTL_CLEAN
+    else:
+        ttl = VT_VERDICT_TTL_UNKNOWN
+    if time.time() - entry.get("cached_at", 0) > ttl:
+        return None
+    return entry
+
+
+def save_verdict(search_type: type, search_value, context: ContextThreatIntel):
+    """Saves the verdict for an indicator to the cache.
+
+    Only the parsed fields of the context that are used by Z-SOAR are stored: the scores, the engines with hits,
+    categories, links, related domains and the certificate.
+
+    Args:
+        search_type (type): The type of the indicator
+        search_value (str): The indicator
+        context (ContextThreatIntel): The context of the lookup or None if the indicator is unknown to VirusTotal
+    """
+    entry = {"cached_at": time.time()}
+    if context is None:
+        entry["verdict"] = "unknown"
+    else:
+        entry["verdict"] = "malicious" if context.score_hit_sus > 0 or context.score_hit_mal > 0 else "clean"
+        entry["timestamp"] = context.timestamp.isoformat()
+        entry["scores"] = [
+            context.score_hit,
+            context.score_total,
+            context.score_hit_sus,
+            context.score_hit_mal,
+            context.score_known,
+            context.score_unknown,
+        ]
+        entry["hits"] = [
+            [intel.engine, intel.hit_type, intel.threat_name, intel.confidence]
+            for intel in context.threat_intel_detections
+            if intel.is_hit
+        ]
+        if len(context.categories) > 0:
+            entry["categories"] = context.categories
+        if len(context.links) > 0:
+            entry["links"] = context.links
+        if len(context.related_domains) > 0:
+            entry["related_domains"] = context.related_domains
+        if context.related_cert is not None:
+            entry["cert"] = {field: getattr(context.related_cert, field, None) for field in CERT_FIELDS}
+
+    add_to_cache("virus_total", "verdicts", _verdict_key(search_type, search_value), entry)
+
+
+def context_from_verdict(verdict: dict, search_type: type, search_value, detection_id) -> ContextThreatIntel:
+    """Builds the context from a cached verdict (without parsing an API response).
+
+    Args:
+        verdict (dict): The cached verdict
+        search_type (type): The type of the indicator
+        search_value (str): The indicator
+        detection_id (uuid.UUID): The ID of the related detection
+
+    Returns:
+        ContextThreatIntel: The context or None if the indicator is unknown to VirusTotal
+    """
+    if verdict["verdict"] == "unknown":
+        return None
+
+    timestamp = datetime.datetime.fromisoformat(verdict["timestamp"])
+    score_hit, score_total, score_hit_sus, score_hit_mal, score_known, score_unknown = verdict["scores"]
+    intel = [
+        ThreatIntel(
+            time_requested=timestamp,
+            engine=engine,
+            is_known=True,
+            is_hit=True,
+            hit_type=hit_type,
+            threat_name=threat_name,
+            confidence=confidence,
+        )
+        for engine, hit_type, threat_name, confidence in verdict["hits"]
+    ]
+    context = ContextThreatIntel(
+        search_type,
+        search_value,
+        "Virus Total API",
+        timestamp,
+        intel,
+        score_hit=score_hit,
+        score_total=score_total,
+        score_hit_sus=score_hit_sus,
+        score_hit_mal=score_hit_mal,
+        score_known=score_known,
+        score_unknown=score_unknown,
+        related_detection_uuid=detection_id,
+        related_domains=list(verdict.get("related_domains", [])),
+        links=list(verdict.get("links", [])),
+    )
+    context.categories = list(verdict.get("categories", []))
+    if "cert" in verdict:
+        context.related_cert = Certificate(related_detection_uuid=detection_id, **verdict["cert"])
+    return context
+
+
+class TokenBucket:
+    """Thread-safe token bucket that is used to stay within the VirusTotal API quota.
+
+    Tokens are refilled continuously with 'rate_per_minute' tokens per minute up to 'capacity' tokens.
+
+    Attributes:
+        rate (float): The refill rate in tokens per second
+        capacity (int): The maximum number of tokens
+    """
+
+    def __init__(self, rate_per_minute: float = VT_REQUESTS_PER_MINUTE, capacity: int = VT_BURST_SIZE):
+        if capacity < 1:
+            raise ValueError("The capacity of the token bucket (VT_BURST_SIZE) must be at least 1, got " + str(capacity))
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    def try_acquire(self, tokens: int = 1) -> float:
+        """Takes tokens from the bucket if enough are available.
+
+        Requests for more tokens than the bucket can hold take all of its tokens, as they could never be served otherwise
+        (e.g. an IP lookup needs two API requests, but VT_BURST_SIZE may be 1).
+
+        Args:
+            tokens (int, optional): The number of tokens to take. Defaults to 1.
+
+        Returns:
+            float: 0 if the tokens were taken, else the time in seconds until enough tokens will be available
+        """
+        tokens = min(tokens, self.capacity)
+        with self._lock:
+            self._refill()
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return 0.0
+            return (tokens - self._tokens) / self.rate
+
+    def drain(self, seconds: float):
+        """Empties the bucket so that no tokens are available for the given time (e.g. if the API reported an exceeded quota).
+
+        Args:
+            seconds (float): The time in seconds until the next token will be available
+        """
+        with self._lock:
+            self._refill()
+            self._tokens = min(self._tokens, 1 - seconds * self.rate)
+
+
+class LookupEngine:
+    """Runs VirusTotal lookups concurrently while sharing one token bucket for the API quota.
+
+    Lookups are submitted with submit() and return a Future. Lookups that have to wait for the API quota (or for a queued
+    URL analysis) are re-scheduled with a timer instead of blocking a worker thread.
+
+    Lookups for the same (search_type, search_value) are coalesced: while a lookup is in flight, every further submit for
+    the same indicator gets the same Future. After start_cycle() was called, completed lookups are shared as well until
+    the next cycle starts.
+
+    Attributes:
+        bucket (TokenBucket): The token bucket shared by all lookups
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: float = VT_REQUESTS_PER_MINUTE,
+        burst_size: int = VT_BURST_SIZE,
+        max_in_flight: int = VT_MAX_IN_FLIGHT_REQUESTS,
+    ):
+        self.bucket = TokenBucket(requests_per_minute, burst_size)
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="zsoar_virus_total")
+        self._lookups = {}  # (search_type, search_value) -> Future of in-flight lookups (and of completed ones in a cycle)
+        self._lookups_lock = threading.Lock()
+        self._keep_results = False
+
+    def start_cycle(self):
+        """Starts a new worker cycle. Results of completed lookups of the previous cycle are dropped and results of this
+        cycle will be shared until the next cycle starts."""
+        with self._lookups_lock:
+            self._lookups = {key: future for key, future in self._lookups.items() if not future.done()}
+            self._keep_results = True
+
+    def submit(self, lookup: "Lookup") -> Future:
+        """Submits a lookup or joins an already submitted lookup for the same indicator.
+
+        Args:
+            lookup (Lookup): The lookup to run
+
+        Returns:
+            Future: A (possibly shared) future that resolves to a ContextThreatIntel object or None
+        """
+        key = (lookup.search_type, str(lookup.search_value))
+        with self._lookups_lock:
+            future = self._lookups.get(key)
+            if future is not None:
+                lookup.mlog.debug(f"Joining already submitted lookup for {str(lookup.search_type)} '{lookup.search_value}'.")
+                return future
+            self._lookups[key] = lookup.future
+
+        lookup.future.add_done_callback(lambda future, key=key: self._done(key, future))
+        self._schedule(lookup, 0)
+        return lookup.future
+
+    def _done(self, key, future: Future):
+        with self._lookups_lock:
+            if not self._keep_results and self._lookups.get(key) is future:
+                del self._lookups[key]
+
+    def _schedule(self, lookup: "Lookup", delay: float):
+        if delay <= 0:
+            self._executor.submit(self._run, lookup)
+        else:
+            timer = threading.Timer(delay, self._executor.submit, args=(self._run, lookup))
+            timer.daemon = True
+            timer.start()
+
+    def _run(self, lookup: "Lookup"):
+        try:
+            wait = self.bucket.try_acquire(lookup.tokens_needed())
+            if wait > 0:
+                self._schedule(lookup, wait)
+                return
+
+            delay = lookup.step(self.bucket)
+            if delay is not None:
+                self._schedule(lookup, delay)
+        except Exception as e:
+            lookup.mlog.error(f"VirusTotal lookup for {str(lookup.search_type)} '{lookup.search_value}' failed: {str(e)}")
+            lookup.future.set_exception(e)
+
+
+class Lookup:
+    """A single VirusTotal lookup (one indicator). Used by LookupEngine.
+
+    Attributes:
+        search_type (type): The type of the searched indicator
+        search_value (str): The searched indicator
+        future (Future): The future that resolves to the resulting ContextThreatIntel object or None
+    """
+
+    def __init__(self, config, search_type, search_value, detection_id, mlog, wait_if_api_quota_exceeded):
+        self.search_type = search_type
+        self.search_value = search_value
+        self.detection_id = detection_id
+        self.mlog = mlog
+        self.wait_if_api_quota_exceeded = wait_if_api_quota_exceeded
+        self.future = Future()
+
+        self.verify_certs = config["verify_certs"]
+        self.api_key = config["api_key"]
+        self.headers = {
+            "x-apikey": self.api_key,
+            "Accept": "application/json",
+        }
+        self.params = None
+        self.url = None
+        self.url2 = None
+        self.needs_url_submission = False
+        self.tries_quota = 0
+        self.tries_queued = 0
+
+        if search_type == ipaddress.IPv4Address or search_type == ipaddress.IPv6Address:
+            self.url = f"{VT_API_URL}/api/v3/ip_addresses/{search_value}"
+            self.url2 = f"{VT_API_URL}/api/v3/ip_addresses/{search_value}/resolutions"
+
+        elif search_type == DNSQuery:
+            self.url = f"{VT_API_URL}/api/v3/domains/{search_value}"
+
+        elif search_type == HTTP:
+            self.search_value = (search_value.encode()).decode().strip("=")
+            self.needs_url_submission = True
+
+        elif search_type == ContextProcess or search_type == ContextFile:
+            self.url = VT_API_URL + "/vtapi/v2/file/report"
+            self.params = {"apikey": self.api_key, "resource": search_value}
+
+        else:
+            mlog.critical(f"Search type '{search_type}' is not supported for this integration.")
+            raise TypeError(f"Search type '{search_type}' is not supported for this integration.")
+
+    def tokens_needed(self) -> int:
+        """Returns the number of API requests the next step will need."""
+        if self.needs_url_submission:
+            return 1
+        return 2 if self.url2 else 1
+
+    def _quota_exceeded(self, bucket: TokenBucket):
+        """Handles an exceeded API quota. Returns the delay for a retry or None if the lookup was cancelled."""
+        self.tries_quota += 1
+        if not self.wait_if_api_quota_exceeded:
+            self.mlog.error(
+                f"VirusTotal API call for {str(self.search_type)} '{self.search_value}' failed as the API quota is exceeded. Cancelling, as flag 'wait_if_api_quota_exceeded' is set to False."
+            )
+            self.future.set_result(None)
+            return None
+        if self.tries_quota >= THRESHOLD_MAX_TRIES_API_QUOTA_EXCEEDED:
+            self.mlog.error(
+                f"VirusTotal API call for {str(self.search_type)} '{self.search_value}' exceeded the API quota {str(self.tries_quota)} times in a row (above threshold). Aborting."
+            )
+            self.future.set_result(None)
+            return None
+
+        self.mlog.warning(
+            f"VirusTotal API call for {str(self.search_type)} '{self.search_value}' failed as the API quota is exceeded. Queued for retry in {TIME_INTERVAL_API_QUOTA_EXCEEDED} seconds."
+        )
+        bucket.drain(TIME_INTERVAL_API_QUOTA_EXCEEDED)
+        return 0  # Will wait for the (drained) token bucket without blocking a worker
+
+    def step(self, bucket: TokenBucket):
+        """Runs the next API request(s) of the lookup.
+
+        Args:
+            bucket (TokenBucket): The token bucket of the engine (used to signal an exceeded API quota)
+
+        Returns:
+            float: The delay in seconds after which the lookup has to be run again or None if the lookup is done
+        """
+        if self.needs_url_submission:
+            headers = dict(self.headers)
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+            response = requests.request(
+                "POST",
+                VT_API_URL + "/api/v3/urls",
+                data="url=" + self.search_value,
+                headers=headers,
+                verify=self.verify_certs,
+                timeout=10,
+            )
+            if response.status_code in (204, 429):
+                return self._quota_exceeded(bucket)
+
+            id_url_analysis = response.json()["data"]["id"]
+            self.mlog.info(f"VirusTotal API call for URL '{self.search_value}' returned analysis ID '{id_url_analysis}'.")
+            self.url = VT_API_URL + "/api/v3/analyses/" + id_url_analysis
+            self.needs_url_submission = False
+            return 0
+
+        response = requests.request("GET", self.url, headers=self.headers, verify=self.verify_certs, params=self.params, timeout=10)
+        if response.status_code in (204, 429):
+            return self._quota_exceeded(bucket)
+
+        if response.status_code == 200 and dict_get(response.json(), "data.attributes.status") == "queued":
+            self.tries_queued += 1
+            if self.tries_queued > THRESHOLD_MAX_TRIES_QUEUED_SEARCH:
+                self.mlog.error(
+                    f"VirusTotal API call for '{self.search_value}' queued search exceeded maximum number of tries ({THRESHOLD_MAX_TRIES_QUEUED_SEARCH})."
+                )
+                self.future.set_result(None)
+                return None
+            self.mlog.info(
+                f"VirusTotal API call for '{self.search_value}' is queued. Checking again in {TIME_INTERVAL_QUEUED_SEARCH} seconds."
+            )
+            return TIME_INTERVAL_QUEUED_SEARCH
+
+        if response.status_code == 404:
+            self.mlog.info(f"VirusTotal does not know {str(self.search_type)} '{self.search_value}'.")
+            save_verdict(self.search_type, self.search_value, None)
+            self.future.set_result(None)
+            return None
+
+        response2 = None
+        if self.url2:
+            response2 = requests.request(
+                "GET", self.url2, headers=self.headers, verify=self.verify_certs, params=self.params, timeout=10
+            )
+            if response2.status_code in (204, 429):
+                return self._quota_exceeded(bucket)
+            if response2.status_code != 200:
+                self.mlog.warning(
+                    f"Second VirusTotal API call for {str(self.search_type)} '{self.search_value}' returned status code "
+                    + f"{response2.status_code}. Skipping the additional relationship data."
+                )
+                response2 = None
+
+        context = handle_response(
+            response,
+            None,
+            self.search_value,
+            self.search_type,
+            self.detection_id,
+            self.mlog,
+            self.wait_if_api_quota_exceeded,
+            response2=response2,
+        )
+        if response.status_code == 200:
+            save_verdict(self.search_type, self.search_value, context)
+        self.future.set_result(context)
+        return None
+
+
+_lookup_engine = None
+_lookup_engine_lock = threading.Lock()
+
+
+def _for_detection(shared_future: Future, detection_id) -> Future:
+    """Returns a future that resolves to a copy of the (shared) lookup result which is related to the given detection."""
+    future = Future()
+
+    def _resolve(done: Future):
+        if done.exception() is not None:
+            future.set_exception(done.exception())
+            return
+        context = done.result()
+        if context is not None and context.related_detection_uuid != detection_id:
+            context = copy.copy(context)
+            context.related_detection_uuid = detection_id
+        future.set_result(context)
+
+    shared_future.add_done_callback(_resolve)
+    return future
+
+
+def get_lookup_engine() -> LookupEngine:
+    """Returns the (process wide) lookup engine, so that all lookups share the same API quota.
+
+    Returns:
+        LookupEngine: The lookup engine
+    """
+    global _lookup_engine
+    with _lookup_engine_lock:
+        if _lookup_engine is None:
+            _lookup_engine = LookupEngine()
+        return _lookup_engine
+
+
+def zs_provide_context_for_detections_async(
     config,
     case_file: CaseFile,
     required_type: type,
@@ -314,26 +806,20 @@ def zs_provide_context_for_detections(
     search_value=None,
     maxContext=50,
     wait_if_api_quota_exceeded=False,
-) -> ContextThreatIntel:
-    """Returns a CaseFile object with context for the detections from the Virus Total integration.
+) -> Future:
+    """Submits a lookup for context from the Virus Total integration without waiting for it.
 
-    Args:
-        config (dict): The configuration dictionary for this integration
-        detection (CaseFile): The CaseFile object to add context to
-        required_type (type): The type of context to return. Can be one of the following:
-            [ContextThreatIntel]
-        TEST (bool, optional): If set to True, the function will return a test object. Defaults to False.
-        search_type (str, optional): The type of the search. Can be one of the following:
-            [IP, DOMAIN, URL, HASH]. Defaults to "IP".
-        search_value (str, optional): The value (indicator) to search for. Defaults to None.
-        maxContext (int, optional): The maximum number of context entries to return. Defaults to 50.
+    Takes the same arguments as zs_provide_context_for_detections(). Use this to submit many indicators at once and
+    await the results afterwards, so that the lookups can run concurrently within the API quota.
 
     Returns:
-        ContextThreatIntel: A ContextThreatIntel object with context for the detections
+        Future: A future that resolves to a ContextThreatIntel object (or None if there is no context)
     """
     # Check if integration is enabled
     if config["enabled"] == False:
-        return None
+        future = Future()
+        future.set_result(None)
+        return future
 
     # Initialize the logger
     log_level_file = config["logging"][
@@ -345,17 +831,17 @@ def zs_provide_context_for_detections(
 
     # Check if the required type is supported
     if required_type not in [ContextThreatIntel]:
-        mlog.log_critical(f"Required context type '{required_type}' is not supported for this integration.")
+        mlog.critical(f"Required context type '{required_type}' is not supported for this integration.")
         raise ValueError(f"Required context type '{required_type}' is not supported for this integration.")
 
     # Check if the search type is supported
     if search_type not in (ipaddress.IPv4Address, ipaddress.IPv6Address, HTTP, DNSQuery, ContextFile, ContextProcess):
-        mlog.log_critical(f"Search type '{search_type}' is not supported for this integration.")
+        mlog.critical(f"Search type '{search_type}' is not supported for this integration.")
         raise ValueError(f"Search type '{search_type}' is not supported for this integration.")
 
     # Check if the search value is set
     if search_value is None or search_value == "":
-        mlog.log_critical(f"Search value is not set.")
+        mlog.critical(f"Search value is not set.")
         raise ValueError(f"Search value is not set.")
 
     detection_name = case_file.detections[0].name
@@ -364,96 +850,70 @@ def zs_provide_context_for_detections(
     mlog.info(
         f"Providing context for detection '{detection_name}' with ID '{detection_id}'. Search indicator type is '{search_type}' and searched value is '{search_value}'."
     )
+    # Get the context from the verdict cache
+    verdict = get_verdict(search_type, search_value)
+    if verdict:
+        mlog.info(f"{str(search_type)} -'{search_value}' is in the cache ({verdict['verdict']}). Returning cached context.")
+        future = Future()
+        future.set_result(context_from_verdict(verdict, search_type, search_value, detection_id))
+        return future
+
     # Get the context from VirusTotal
-    cache = get_from_cache("virus_total", str(search_type), str(search_value))
-    if cache:
-        mlog.info(f"{str(search_type)} -'{search_value}' is in the cache. Returning cached context.")
-        response = cache
-
-    api_key = config["api_key"]
-    verify_certs = config["verify_certs"]
-    params = None
-    url2 = None
-    response2 = None
-
-    if search_type == ipaddress.IPv4Address or search_type == ipaddress.IPv6Address:
-        url = f"https://www.virustotal.com/api/v3/ip_addresses/{search_value}"
-        url2 = f"https://www.virustotal.com/api/v3/ip_addresses/{search_value}/resolutions"
-
-    elif search_type == DNSQuery:
-        url = f"https://www.virustotal.com/api/v3/domains/{search_value}"
-
-    elif search_type == HTTP:
-        search_value = (search_value.encode()).decode().strip("=")
-        vt_url = "https://www.virustotal.com/api/v3/urls"
-        payload = "url=" + search_value
-
-        headers = {
-            "Accept": "application/json",
-            "x-apikey": api_key,
-            "Content-Type": "application/x-www-form-urlencoded",
-        }
-        if not cache:
-            response_url_req = requests.request("POST", vt_url, data=payload, headers=headers, verify=verify_certs, timeout=10)
-            response_url_req_json = response_url_req.json()
+    lookup = Lookup(config, search_type, search_value, detection_id, mlog, wait_if_api_quota_exceeded)
+    return _for_detection(get_lookup_engine().submit(lookup), detection_id)
 
-            id_url_analysis = response_url_req_json["data"]["id"]
-            mlog.info(f"VirusTotal API call for URL '{search_value}' returned analysis ID '{id_url_analysis}'.")
-            url = "https://www.virustotal.com/api/v3/analyses/" + id_url_analysis
 
-    elif search_type == ContextProcess or search_type == ContextFile:
-        url = "https://www.virustotal.com/vtapi/v2/file/report"
-        params = {"apikey": api_key, "resource": search_value}
+def zs_start_cycle():
+    """Tells the integration that a new worker cycle starts. Lookups of the same indicator are shared within one cycle."""
+    get_lookup_engine().start_cycle()
 
-    else:
-        mlog.critical(f"Search type '{search_type}' is not supported for this integration.")
-        raise TypeError(f"Search type '{search_type}' is not supported for this integration.")
-
-    headers = {
-        "x-apikey": api_key,
-        "Accept": "application/json",
-    }
-
-    if not cache:
-        tries = 0
-        while True:
-            response = requests.request("GET", url, headers=headers, verify=verify_certs, params=params, timeout=10)
-            tries += 1
-
-            if response.status_code == 204:
-                if wait_if_api_quota_exceeded:
-                    mlog.warning(
-                        f"VirusTotal API call for {str(search_type)} '{search_value}' returned status code 204. This means that the API quota is exceeded. Will retry in {TIME_INTERVAL_API_QUOTA_EXCEEDED} seconds."
-                    )
-                    if tries >= THRESHOLD_MAX_TRIES_API_QUOTA_EXCEEDED:
-                        mlog.error(
-                            f"VirusTotal API call for {str(search_type)} '{search_value}' returned status code 204 {str(tries)} times in a row (above threshold). Aborting."
-                        )
-                        return None
-                    time.sleep(TIME_INTERVAL_API_QUOTA_EXCEEDED)
-                else:
-                    mlog.error(
-                        f"VirusTotal API call for {str(search_type)} '{search_value}' returned status code 204. This means that the API quota is exceeded. Cancelling, as flag 'wait_if_api_quota_exceeded' is set to False."
-                    )
-                    return None
-
-            elif dict_get(response, "data.attributes.status") == "queued":
-                if tries > THRESHOLD_MAX_TRIES_QUEUED_SEARCH:
-                    mlog.error(
-                        f"VirusTotal API call for '{search_value}' queued search exceeded maximum number of tries ({THRESHOLD_MAX_TRIES_QUEUED_SEARCH})."
-                    )
-                    return None
-                mlog.info(
-                    f"VirusTotal API call for '{search_value}' is queued. Waiting for {TIME_INTERVAL_QUEUED_SEARCH} seconds."
-                )
-                time.sleep(TIME_INTERVAL_QUEUED_SEARCH)
 
-            else:
-                break
+@metrics_helper.timed("integration.provide_context", with_module=True)
+def zs_provide_context_for_detections(
+    config,
+    case_file: CaseFile,
+    required_type: type,
+    TEST=False,
+    search_type=ipaddress.IPv4Address,
+    search_value=None,
+    maxContext=50,
+    wait_if_api_quota_exceeded=False,
+) -> ContextThreatIntel:
+    """Returns a CaseFile object with context for the detections from the Virus Total integration.
 
-        if url2:
-            response2 = requests.request("GET", url2, headers=headers, verify=verify_certs, params=params, timeout=10)
+    Args:
+        config (dict): The configuration dictionary for this integration
+        detection (CaseFile): The CaseFile object to add context to
+        required_type (type): The type of context to return. Can be one of the following:
+            [ContextThreatIntel]
+        TEST (bool, optional): If set to True, the function will return a test object. Defaults to False.
+        search_type (str, optional): The type of the search. Can be one of the following:
+            [IP, DOMAIN, URL, HASH]. Defaults to "IP".
+        search_value (str, optional): The value (indicator) to search for. Defaults to None.
+        maxContext (int, optional): The maximum number of context entries to return. Defaults to 50.
 
-    return handle_response(
-        response, cache, search_value, search_type, detection_id, mlog, wait_if_api_quota_exceeded, response2=response2
+    Returns:
+        ContextThreatIntel: A ContextThreatIntel object with context for the detections (None if the lookup timed out)
+    """
+    future = zs_provide_context_for_detections_async(
+        config,
+        case_file,
+        required_type,
+        TEST=TEST,
+        search_type=search_type,
+        search_value=search_value,
+        maxContext=maxContext,
+        wait_if_api_quota_exceeded=wait_if_api_quota_exceeded,
     )
+    try:
+        return future.result(timeout=TIMEOUT_LOOKUP)
+    except FutureTimeoutError:
+        logging_config = config["logging"]
+        mlog = logging_helper.Log(
+            __name__, log_level_stdout=logging_config["log_level_stdout"], log_level_file=logging_config["log_level_file"]
+        )
+        mlog.error(
+            f"VirusTotal lookup for {str(search_type)} '{search_value}' did not finish within {TIMEOUT_LOOKUP} seconds. "
+            + "Returning no context."
+        )
+        return None
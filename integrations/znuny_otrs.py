@@ -27,7 +27,10 @@ import sys
 from typing import Union, List
 from lib.config_helper import Config
 from lib.logging_helper import Log
-import pandas as pd
+import lib.metrics_helper as metrics_helper
+import base64
+import gzip
+import io
 import json
 import traceback
 
@@ -36,9 +39,28 @@ from lib.class_helper import Rule, Detection, ContextProcess, ContextFlow
 
 # For context for detections (remove unused types):
 from lib.class_helper import CaseFile, ContextFlow, ContextLog, ContextProcess, AuditLog
-from lib.generic_helper import get_unique, format_results, del_none_from_dict
+from lib.generic_helper import (
+    get_unique,
+    format_results,
+    del_none_from_dict,
+    get_table_rows,
+    summarize_results,
+    export_results,
+    render_table,
+)
 
 PRE_TAG = "[ZSOAR]"  # Tag before the title of the ticket (without spaces)
+NOTE_MAX_TABLE_ROWS = 200  # Maximum number of rows of a table in a note. Longer timelines are summarized and attached in full
+NOTE_MAX_BODY_SIZE = 1024 * 1024  # Maximum size (in bytes) of the body of a note, the rest is cut off
+NOTE_SUMMARY_TOP_N = 10  # Number of most common values shown per column in the summary of a long timeline
+NOTE_ATTACHMENT_FORMAT = "csv"  # Format of the attached timeline: 'csv' (table columns) or 'json' (JSON Lines with all fields)
+NOTE_SUMMARY_COLUMNS = {  # Columns that are summarized for long timelines, by context type
+    "flows": ["destination_ip", "destination_port", "protocol", "process_name", "source_ip"],
+    "processes": ["process_name", "parent_process_name", "process_username", "process_path"],
+    "file_events": ["file_name", "action", "process_name"],
+    "registry_events": ["registry_key", "action", "process_name"],
+    "log_events": ["log_source_name", "log_type", "log_severity"],
+}
 
 TICKET_CONNECTOR_CONFIG_DEFAULT = {
     "Name": "GenericTicketConnectorREST",
@@ -170,6 +192,7 @@ def zs_provide_new_detections(config, TEST="") -> List[Detection]:
     return NotImplementedError  # TODO: Implement
 
 
+@metrics_helper.timed("integration.provide_context", with_module=True)
 def zs_provide_context_for_detections(
     config, case_file: CaseFile, required_type: type, TEST=False, UUID=None, UUID_is_parent=False, maxContext=50
 ) -> Union[ContextFlow, ContextLog, ContextProcess]:
@@ -476,6 +499,94 @@ def zs_create_ticket(
             return SystemError
 
 
+def cap_note_body(body: str, max_size: int = NOTE_MAX_BODY_SIZE) -> str:
+    """Cuts off the HTML body of a note if it is larger than max_size bytes (at the last line break before the limit).
+
+    Arguments:
+        body {str} -- The HTML body of the note.
+        max_size {int} -- The maximum size of the body in bytes. (default: {NOTE_MAX_BODY_SIZE})
+
+    Returns:
+        str -- The (cut off) body.
+    """
+    size = len(body.encode("utf-8"))
+    if size <= max_size:
+        return body
+
+    mlog.warning(f"Note body has {size} bytes, which is more than the limit of {max_size} bytes. Cutting it off.")
+    body = body.encode("utf-8")[:max_size].decode("utf-8", errors="ignore")
+    line_break = body.rfind("<br>")
+    table_end = body.rfind("</table>")
+    if table_end > line_break:
+        body = body[: table_end + len("</table>")]  # Keep the closing tag, so that the table is complete
+    elif line_break > 0:
+        body = body[:line_break]
+    if body.rfind("<table") > body.rfind("</table>"):  # Cut inside a table (e.g. at a <br> in a cell)
+        body = body[: body.rfind("<table")]
+    return body + f"<br><br><i>The note was cut off, as it exceeded {max_size // 1024} KiB.</i>"
+
+
+def create_timeline_attachment(contexts: list, name: str, rows: list = None) -> pyotrs.Attachment:
+    """Creates a gzip compressed attachment with all given contexts, written one after another (see NOTE_ATTACHMENT_FORMAT).
+
+    Arguments:
+        contexts {list} -- The context objects.
+        name {str} -- The name of the attachment (without file extension).
+        rows {list} -- The table rows of the contexts, if already created by get_table_rows(). (default: {None})
+
+    Returns:
+        pyotrs.Attachment -- The attachment.
+    """
+    buffer = io.BytesIO()
+    with gzip.GzipFile(filename=name + "." + NOTE_ATTACHMENT_FORMAT, mode="wb", fileobj=buffer) as gzip_file:
+        with io.TextIOWrapper(gzip_file, encoding="utf-8", newline="") as file:
+            count = export_results(contexts, file, NOTE_ATTACHMENT_FORMAT, rows)
+
+    mlog.debug(f"Created attachment '{name}' with {count} contexts ({buffer.tell()} bytes compressed).")
+    return pyotrs.Attachment.create_basic(
+        Content=base64.b64encode(buffer.getvalue()).decode("utf-8"),
+        ContentType="application/gzip",
+        Filename=name + "." + NOTE_ATTACHMENT_FORMAT + ".gz",
+    )
+
+
+def render_timeline(contexts: list, name: str):
+    """Renders the complete timeline of a context type for a note. Timelines with more than NOTE_MAX_TABLE_ROWS entries are
+    summarized (counts, time range and the most common values of the NOTE_SUMMARY_COLUMNS) and only their first rows are shown,
+    while all entries are attached to the note.
+
+    Arguments:
+        contexts {list} -- The context objects of the timeline.
+        name {str} -- The name of the context type (a key of NOTE_SUMMARY_COLUMNS).
+
+    Returns:
+        tuple -- The HTML of the timeline and the attachment with all contexts (or None if the timeline is short enough).
+    """
+    if not contexts or len(contexts) <= NOTE_MAX_TABLE_ROWS:
+        return format_results(contexts, "html", group_by=""), None
+
+    rows = [{"field": "entries", "distinct": str(len(contexts)), "most common": ""}]
+    timestamps = [context.timestamp for context in contexts if getattr(context, "timestamp", None) is not None]
+    try:
+        if timestamps:
+            rows.append({"field": "time range", "distinct": "", "most common": f"{min(timestamps)} - {max(timestamps)}"})
+    except TypeError:  # Timestamps with and without timezone can not be compared
+        pass
+
+    table_rows = list(get_table_rows(contexts))
+    for column, (distinct, most_common) in summarize_results(table_rows, NOTE_SUMMARY_COLUMNS[name], NOTE_SUMMARY_TOP_N).items():
+        if distinct > 0:
+            values = ", ".join(f"{value} ({count})" for value, count in most_common)
+            rows.append({"field": column, "distinct": str(distinct), "most common": values})
+
+    attachment = create_timeline_attachment(contexts, "timeline_" + name, table_rows)
+    body = f"<h4>Summary (top {NOTE_SUMMARY_TOP_N}):</h4>"
+    body += render_table(["field", "distinct", "most common"], rows, "html")
+    body += f"<br><br>All {len(contexts)} entries are attached as '{attachment.Filename}'.<br><br>"
+    body += format_results(contexts, "html", group_by="", max_rows=NOTE_MAX_TABLE_ROWS)
+    return body, attachment
+
+
 def zs_add_note_to_ticket(
     ticket_number: str,
     mode: str,
@@ -495,6 +606,7 @@ def zs_add_note_to_ticket(
     file_names=None,
     visible_for_customer=True,
     gather_type=None,
+    attachments=None,
 ):
     """Adds a note to an existing ticket in Znuny.
 
@@ -505,6 +617,7 @@ def zs_add_note_to_ticket(
         raw_title {str} -- The title of the note if mode is set to "raw". (default: {None})
         raw_body {str} -- The body of the note if mode is set to "raw". (default: {None})
         raw_body_type {str} -- The body type of the note if mode is set to "raw". (default: {"text/plain"})
+        attachments {list} -- The pyotrs.Attachment objects to add to the note if mode is set to "raw". (default: {None})
 
     Keyword Arguments:
         include_context {bool} -- If set to True, the context of the detection will be added to the note. (default: {False})
@@ -543,6 +656,7 @@ def zs_add_note_to_ticket(
     if raw_body_type == "text/html":
         raw_body = str(raw_body)
         raw_body = raw_body.replace("\n", "")
+        raw_body = cap_note_body(raw_body)
 
     # Create client and session
     client = create_client_session()
@@ -595,8 +709,8 @@ def zs_add_note_to_ticket(
                     current_action.set_warning(warning_message=f"Detection has no process. Skipping note creation."), logger=mlog
                 )
             else:
-                # Replace "\n" by "<br" in process_tree
-                if process_tree:
+                # Replace "\n" by "<br" in process_tree (if it is a text tree and not already HTML)
+                if process_tree and not process_tree.startswith("<ul>"):
                     process_tree = process_tree.replace("\n", "<br>")
                     process_tree = process_tree.replace("    ", "&emsp;")
 
@@ -618,15 +732,18 @@ def zs_add_note_to_ticket(
                     body += f"{get_unique(process_names)}"
 
                     body += f"<br><br><h3>Parent Processes:<br><br><h3>"
-                    body += format_results(parents, "html", group_by="process_id")
+                    body += format_results(parents, "html", group_by="process_id", max_rows=NOTE_MAX_TABLE_ROWS)
 
                     body += f"<br><br><h3>Child Processes:</h3><br>"
-                    body += "<br>" + format_results(children, "html", group_by="process_id")
+                    body += "<br>" + format_results(children, "html", group_by="process_id", max_rows=NOTE_MAX_TABLE_ROWS)
 
+                timeline, attachment = render_timeline(case_file.context_processes, "processes")
                 body += "<br><br><h3>Complete Process Timeline:</h3><br>"
-                body += "<br>" + format_results(case_file.context_processes, "html", group_by="")
+                body += "<br>" + timeline
 
-                note_id = zs_add_note_to_ticket(ticket_number, "raw", DRY_RUN, title, body, "text/html")
+                note_id = zs_add_note_to_ticket(
+                    ticket_number, "raw", DRY_RUN, title, body, "text/html", attachments=[attachment] if attachment else None
+                )
                 if type(note_id) is not int:
                     mlog.warning(f"Failed to create note for processes in detection.")
                     case_file.update_audit(
@@ -698,19 +815,22 @@ def zs_add_note_to_ticket(
                     body += f"<h3>Network Flows of detected Process '{detection.process.process_name}' ({detection.process.process_id}):</h3><br><br>"
                 else:
                     body += f"<h3>Network Flows of Detection:</h3><br><br>"
-                body += format_results(detected_process_flows, "html", group_by="")
+                body += format_results(detected_process_flows, "html", group_by="", max_rows=NOTE_MAX_TABLE_ROWS)
 
                 body += f"<br><br><h3>List of all caseed IPs and domains: </h3><br><br>"
                 body += str(case_file.indicators["ip"]) + "<br>" + str(case_file.indicators["domain"]) + "<br><br>"
 
                 if context_process_flows and len(context_process_flows) > 0:
                     body += f"<br><br><h3>Network Flows of other Processes (grouped by process):</h3><br><br>"
-                    body += format_results(context_process_flows, "html", group_by="process_id")
+                    body += format_results(context_process_flows, "html", group_by="process_id", max_rows=NOTE_MAX_TABLE_ROWS)
 
+            timeline, attachment = render_timeline(case_file.context_flows, "flows")
             body += "<br><br><h3>Complete Network Timeline:</h3><br>"
-            body += "<br>" + format_results(case_file.context_flows, "html", group_by="")
+            body += "<br>" + timeline
 
-            note_id = zs_add_note_to_ticket(ticket_number, "raw", DRY_RUN, note_title, body, "text/html")
+            note_id = zs_add_note_to_ticket(
+                ticket_number, "raw", DRY_RUN, note_title, body, "text/html", attachments=[attachment] if attachment else None
+            )
             if type(note_id) is not int:
                 mlog.warning(f"Failed to create note for network in detection.")
                 case_file.update_audit(
@@ -785,18 +905,23 @@ def zs_add_note_to_ticket(
                     body += f"<h3>File Events of detected Process '{detection.process.process_name}' ({detection.process.process_id}):</h3><br><br>"
                 else:
                     body += f"<h3>File Events of Detection:</h3><br><br>"
-                body += format_results(detected_process_file_events, "html", group_by="")
+                body += format_results(detected_process_file_events, "html", group_by="", max_rows=NOTE_MAX_TABLE_ROWS)
 
                 if context_processes_file_events and len(context_processes_file_events) > 0:
                     body += f"<br><br><h3>List of all caseed files: </h3><br><br>"
                     body += f"{get_unique(file_names)}"
                     body += f"<br><br><h3>File Events of other Processes (grouped by process):</h3><br><br>"
-                    body += format_results(context_processes_file_events, "html", group_by="process_id")
+                    body += format_results(
+                        context_processes_file_events, "html", group_by="process_id", max_rows=NOTE_MAX_TABLE_ROWS
+                    )
 
+            timeline, attachment = render_timeline(case_file.context_files, "file_events")
             body += "<br><br><h3>Complete File Event Timeline:</h3><br>"
-            body += "<br>" + format_results(case_file.context_files, "html", group_by="")
+            body += "<br>" + timeline
 
-            note_id = zs_add_note_to_ticket(ticket_number, "raw", DRY_RUN, note_title, body, "text/html")
+            note_id = zs_add_note_to_ticket(
+                ticket_number, "raw", DRY_RUN, note_title, body, "text/html", attachments=[attachment] if attachment else None
+            )
             if type(note_id) is not int:
                 mlog.warning(f"Failed to create note for file events in detection.")
                 case_file.update_audit(
@@ -873,13 +998,18 @@ def zs_add_note_to_ticket(
                     body += f"<h3>Registry Events of detected Process '{detection.process.process_name}' ({detection.process.process_id}):</h3><br><br>"
                 else:
                     body += f"<h3>Registry Events of detected Process <N/A>:</h3><br><br>"
-                body += format_results(detected_process_registry_events, "html", group_by="")
+                body += format_results(detected_process_registry_events, "html", group_by="", max_rows=NOTE_MAX_TABLE_ROWS)
                 body += f"<br><br><h3>Registry Events of other Processes (grouped by process):</h3><br><br>"
-                body += format_results(context_processes_registry_events, "html", group_by="process_id")
+                body += format_results(
+                    context_processes_registry_events, "html", group_by="process_id", max_rows=NOTE_MAX_TABLE_ROWS
+                )
+            timeline, attachment = render_timeline(case_file.context_registries, "registry_events")
             body += f"<br><br><h3>Complete Registry Event Timeline:</h3><br>"
-            body += "<br>" + format_results(case_file.context_registries, "html", group_by="")
+            body += "<br>" + timeline
 
-            note_id = zs_add_note_to_ticket(ticket_number, "raw", DRY_RUN, note_title, body, "text/html")
+            note_id = zs_add_note_to_ticket(
+                ticket_number, "raw", DRY_RUN, note_title, body, "text/html", attachments=[attachment] if attachment else None
+            )
             if type(note_id) is not int:
                 mlog.warning(f"Failed to create note for registry events in detection.")
                 case_file.update_audit(
@@ -954,16 +1084,21 @@ def zs_add_note_to_ticket(
                     body += f"<h3>Log Events of detected Process '{detection.process.process_name}' ({detection.process.process_id}):</h3><br><br>"
                 else:
                     body += f"<h3>Log Events of Detection:</h3><br><br>"
-                body += format_results(detected_process_log_events, "html", group_by="")
+                body += format_results(detected_process_log_events, "html", group_by="", max_rows=NOTE_MAX_TABLE_ROWS)
 
                 if context_processes_log_events and len(context_processes_log_events) > 0:
                     body += f"<br><br><h3>Log Events of other Processes (grouped by process):</h3><br><br>"
-                    body += format_results(context_processes_log_events, "html", group_by="process_id")
+                    body += format_results(
+                        context_processes_log_events, "html", group_by="process_id", max_rows=NOTE_MAX_TABLE_ROWS
+                    )
 
+            timeline, attachment = render_timeline(case_file.context_logs, "log_events")
             body += f"<br><br><h3>Complete Log Event Timeline:</h3><br>"
-            body += "<br>" + format_results(case_file.context_logs, "html", group_by="")
+            body += "<br>" + timeline
 
-            note_id = zs_add_note_to_ticket(ticket_number, "raw", DRY_RUN, note_title, body, "text/html")
+            note_id = zs_add_note_to_ticket(
+                ticket_number, "raw", DRY_RUN, note_title, body, "text/html", attachments=[attachment] if attachment else None
+            )
             if type(note_id) is not int:
                 mlog.warning(f"Failed to create note for log events in detection.")
                 case_file.update_audit(
@@ -1016,6 +1151,8 @@ def zs_add_note_to_ticket(
     mlog.debug("Adding note to ticket...")
     if DRY_RUN:
         mlog.warning("Dry run mode is enabled. Not adding actual note to ticket.")
+        if attachments:
+            mlog.debug("Attachments: " + ", ".join(attachment.Filename for attachment in attachments))
         if note_body != None:
             mlog.debug("Note: '" + note_title + "'\n\n" + note_body)
         else:
@@ -1023,7 +1160,8 @@ def zs_add_note_to_ticket(
         return 123
     else:
         # Adding note to ticket
-        result = client.ticket_update(ticket.tid, article)
+        with metrics_helper.span("znuny.add_note", module="znuny_otrs"):
+            result = client.ticket_update(ticket.tid, article, attachments=attachments)
 
         # Check if note was added successfully
         try:
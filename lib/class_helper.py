@@ -1,31 +1,38 @@
 # Z-SOAR
 # Created by: Martin Offermann
 # This module is a helper module that privides important classes and functions for the Z-SOAR project.
+#
+# The __dict__() methods convert nested Z-SOAR objects (and lists of them) with their 'nested' argument (str() by default).
+# generic_helper.to_dict() passes a function that keeps them as they are, so that they are serialized as nested objects.
 
 from typing import DefaultDict, Union, List
 import random
 import datetime
 import ipaddress
 import datetime
-import json
 import uuid
-import pandas as pd
+import uuid as uuid_module
 import pyotrs
 
 import lib.config_helper as config_helper
 import lib.logging_helper as logging_helper
 from lib.generic_helper import (
-    del_none_from_dict,
     handle_percentage,
     cast_to_ipaddress,
+    get_ip_info,
     add_to_timeline,
-    remove_duplicates_from_dict,
+    Timeline,
+    create_indicators,
     dict_get,
+    to_json,
+    get_whitelist,
 )
 
 DEFAULT_IP = ipaddress.ip_address("127.0.0.1")  # When no IP address is provided, this is used
 THRESHOLD_PROCESS_IO_BYTES = 100000  # Threshold for the process IO bytes (100 KB)
 
+mlog = logging_helper.Log("lib.class_helper")  # Created once, as creating a logger (and loading the config) is expensive
+
 # TODO: Implement all functions used by zsoar_worker.py and its modules
 
 
@@ -96,7 +103,7 @@ class Location:
 
         self.uuid = uuid
 
-    def __dict__(self):
+    def __dict__(self, nested=str):
         """Returns the dictionary representation of the Location object."""
         dict_ = {
             "country": self.country,
@@ -115,7 +122,7 @@ class Location:
 
     def __str__(self):
         """Returns the string representation of the Vulnerability object."""
-        return json.dumps(del_none_from_dict(self.__dict__()), indent=4, sort_keys=False, default=str)
+        return to_json(self, indent=True)
 
     def is_valid(self):
         """Returns whether the Location object is valid or not."""
@@ -270,7 +277,7 @@ class Vulnerability:
         self.version = version
         self.uuid = uuid
 
-    def __dict__(self):
+    def __dict__(self, nested=str):
         dict_ = {
             "cve": self.cve,
             "description": self.description,
@@ -296,8 +303,8 @@ class Vulnerability:
             "solution_url": self.solution_url,
             "solution_advisory": self.solution_advisory,
             "solution_advisory_url": self.solution_advisory_url,
-            "services_affected": [str(service) for service in self.services_affected],
-            "services_vulnerable": [str(service) for service in self.services_vulnerable],
+            "services_affected": [nested(service) for service in self.services_affected],
+            "services_vulnerable": [nested(service) for service in self.services_vulnerable],
             "attack_vector": self.attack_vector,
             "attack_complexity": self.attack_complexity,
             "privileges_required": self.privileges_required,
@@ -314,7 +321,7 @@ class Vulnerability:
 
     def __str__(self):
         """Returns the string representation of the Vulnerability object."""
-        return json.dumps(del_none_from_dict(self.__dict__()), indent=4, sort_keys=False, default=str)
+        return to_json(self, indent=True)
 
 
 class Service:
@@ -420,7 +427,7 @@ class Service:
 
         self.uuid = uuid
 
-    def __dict__(self):
+    def __dict__(self, nested=str):
         """Converts the Service class to a dictionary."""
 
         dict_ = {
@@ -430,8 +437,8 @@ class Service:
             "tags": self.tags,
             "created_at": str(self.created_at),
             "updated_at": str(self.updated_at),
-            "current_vulnerabilities": [str(vuln) for vuln in self.current_vulnerabilities],
-            "fixed_vulnerabilities": [str(vuln) for vuln in self.fixed_vulnerabilities],
+            "current_vulnerabilities": [nested(vuln) for vuln in self.current_vulnerabilities],
+            "fixed_vulnerabilities": [nested(vuln) for vuln in self.fixed_vulnerabilities],
             "installed_version": self.installed_version,
             "latest_version": self.latest_version,
             "outdated": self.outdated,
@@ -444,8 +451,8 @@ class Service:
             "impact_score": str(self.impact_score),
             "risk_score": str(self.risk_score),
             "risk_score_vector": self.risk_score_vector,
-            "child_services": [str(service) for service in self.child_services],
-            "parent_services": [str(service) for service in self.parent_services],
+            "child_services": [nested(service) for service in self.child_services],
+            "parent_services": [nested(service) for service in self.parent_services],
             "uuid": str(self.uuid),
         }
 
@@ -453,7 +460,7 @@ class Service:
 
     def __str__(self) -> str:
         """Returns the Person class as a string."""
-        return json.dumps(del_none_from_dict(self.__dict__()), indent=4, sort_keys=False, default=str)
+        return to_json(self, indent=True)
 
 
 class Person:
@@ -510,7 +517,7 @@ class Person:
 
         self.uuid = uuid
 
-    def __dict__(self):
+    def __dict__(self, nested=str):
         """Converts the Person class to a dictionary.
 
         Returns:
@@ -523,15 +530,15 @@ class Person:
             "tags": self.tags,
             "created_at": str(self.created_at),
             "updated_at": str(self.updated_at),
-            "primary_location": str(self.primary_location),
-            "locations": [str(location) for location in self.locations],
+            "primary_location": nested(self.primary_location),
+            "locations": [nested(location) for location in self.locations],
             "roles": self.roles,
-            "access_to": [str(device) for device in self.access_to],
+            "access_to": [nested(device) for device in self.access_to],
         }
 
     def __str__(self) -> str:
         """Returns the Person class as a string."""
-        return json.dumps(del_none_from_dict(self.__dict__()), indent=4, sort_keys=False, default=str)
+        return to_json(self, indent=True)
 
 
 class ContextDevice:
@@ -638,8 +645,6 @@ class ContextDevice:
         ports: List[int] = [],
         protocols: List[str] = [],
     ):
-        mlog = logging_helper.Log("lib.class_helper")
-
         self.name = name
         self.local_ip = cast_to_ipaddress(local_ip, strict=False)
         self.global_ip = cast_to_ipaddress(global_ip, strict=False)
@@ -725,7 +730,7 @@ class ContextDevice:
         else:
             self.timestamp = last_update
 
-    def __dict__(self):
+    def __dict__(self, nested=str):
         """Returns the object as a dict."""
 
         dict_ = {
@@ -746,17 +751,17 @@ class ContextDevice:
             "updated_at": str(self.updated_at),
             "in_use": self.in_use,
             "type": self.type,
-            "owner": str(self.owner),
+            "owner": nested(self.owner),
             "uuid": self.uuid,
             "aliases": self.aliases,
             "description": self.description,
-            "location": str(self.location),
+            "location": nested(self.location),
             "notes": self.notes,
             "last_seen": str(self.last_seen),
             "first_seen": str(self.first_seen),
             "last_scan": str(self.last_scan),
             "last_update": str(self.last_update),
-            "user": [str(user) for user in self.user],
+            "user": [nested(user) for user in self.user],
             "group": self.group,
             "auth_types": self.auth_types,
             "auth_stored_in": self.auth_stored_in,
@@ -767,8 +772,8 @@ class ContextDevice:
             "hypervisor": self.hypervisor,
             "virtualization_type": self.virtualization_type,
             "virtual_locations": self.virtual_locations,
-            "services": [str(service) for service in self.services],
-            "vulnerabilities": [str(vulnerability) for vulnerability in self.vulnerabilities],
+            "services": [nested(service) for service in self.services],
+            "vulnerabilities": [nested(vulnerability) for vulnerability in self.vulnerabilities],
             "domains": self.domains,
             "network": str(self.network),
             "interfaces": self.interfaces,
@@ -780,7 +785,7 @@ class ContextDevice:
 
     def __str__(self):
         """Returns the object as a string."""
-        return json.dumps(del_none_from_dict(self.__dict__()), indent=4, sort_keys=False, default=str)
+        return to_json(self, indent=True)
 
 
 class Rule:
@@ -820,8 +825,6 @@ class Rule:
         mitre_references: List[str] = None,
         known_false_positives: str = None,
     ):
-        mlog = logging_helper.Log("lib.class_helper")
-
         if type(id) is not str:
             # mlog.warning("The ID of the rule is not a string: " + str(id) + ". Converting to string.")
             id = str(id)
@@ -841,7 +844,7 @@ class Rule:
         self.mitre_references = mitre_references
         self.known_false_positives = known_false_positives
 
-    def __dict__(self):
+    def __dict__(self, nested=str):
         """Returns the dictionary representation of the object."""
         dict_ = {
             "id": self.id,
@@ -862,7 +865,7 @@ class Rule:
 
     def __str__(self):
         """Returns the string representation of the object."""
-        return json.dumps(del_none_from_dict(self.__dict__()), indent=4, sort_keys=False, default=str)
+        return to_json(self, indent=True)
 
     # Getter and setter;
 
@@ -954,7 +957,7 @@ class Certificate:
         self.is_trusted = is_trusted
         self.is_self_signed = is_self_signed
 
-    def __dict__(self):
+    def __dict__(self, nested=str):
         dict_ = {
             "timestamp": self.timestamp,
             "related_detection_uuid": self.related_detection_uuid,
@@ -981,7 +984,7 @@ class Certificate:
 
     def __str__(self):
         """Returns the string representation of the object."""
-        return json.dumps(del_none_from_dict(self.__dict__()), indent=4, sort_keys=False, default=str)
+        return to_json(self, indent=True)
 
 
 class ContextFile:
@@ -1032,6 +1035,44 @@ class ContextFile:
         __str__(self): The string representation of the ContextFile class
     """
 
+    __slots__ = (
+        "related_detection_uuid",
+        "timestamp",
+        "action",
+        "file_name",
+        "file_original_name",
+        "file_path",
+        "file_original_path",
+        "file_size",
+        "file_md5",
+        "file_sha1",
+        "file_sha256",
+        "file_type",
+        "file_extension",
+        "file_signature",
+        "process_name",
+        "process_id",
+        "process_uuid",
+        "file_header_bytes",
+        "file_entropy",
+        "is_encrypted",
+        "is_compressed",
+        "is_archive",
+        "is_executable",
+        "is_readable",
+        "is_writable",
+        "is_hidden",
+        "is_system",
+        "is_temporary",
+        "is_virtual",
+        "is_directory",
+        "is_symlink",
+        "is_special",
+        "is_unknown",
+        "last_modified",
+        "uuid",
+    )
+
     def __init__(
         self,
         related_detection_uuid: uuid.UUID,
@@ -1126,7 +1167,7 @@ class ContextFile:
         self.timestamp = last_modified  # For cross-context compatibility
         self.uuid = uuid
 
-    def __dict__(self):
+    def __dict__(self, nested=str):
         dict_ = {
             "related_detection_uuid": self.related_detection_uuid,
             "timestamp": self.timestamp,
@@ -1141,7 +1182,7 @@ class ContextFile:
             "file_sha256": self.file_sha256,
             "file_type": self.file_type,
             "file_extension": self.file_extension,
-            "file_signature": str(self.file_signature),
+            "file_signature": nested(self.file_signature),
             "file_header_bytes": self.file_header_bytes,
             "file_entropy": str(self.file_entropy),
             "process_name": self.process_name,
@@ -1169,7 +1210,7 @@ class ContextFile:
 
     def __str__(self):
         """Returns the string representation of the object."""
-        return json.dumps(del_none_from_dict(self.__dict__()), indent=4, sort_keys=False, default=str)
+        return to_json(self, indent=True)
 
 
 class DNSQuery:
@@ -1208,14 +1249,13 @@ class DNSQuery:
         self.has_response = has_response
 
         if has_response and query_response == None:
-            mlog = logging_helper.Log("lib.class_helper")
             mlog.warning("DNSQuery __init__: query_response is still DEFAULT_IP while has_response is True.", str(self))
         self.query_response = query_response
 
         self.rcode = rcode
         self.timestamp = timestamp
 
-    def __dict__(self):
+    def __dict__(self, nested=str):
         dict_ = {
             "related_detection_uuid": self.related_detection_uuid,
             "type": self.type,
@@ -1229,7 +1269,7 @@ class DNSQuery:
 
     def __str__(self):
         """Returns the string representation of the object."""
-        return json.dumps(del_none_from_dict(self.__dict__()), indent=4, sort_keys=False, default=str)
+        return to_json(self, indent=True)
 
 
 class HTTP:
@@ -1296,7 +1336,6 @@ class HTTP:
         self.timestamp = None
 
         self.timestamp = timestamp
-        mlog = logging_helper.Log("lib.class_helper")
 
         if method not in ["GET", "POST", "PUT", "DELETE", "HEAD", "OPTIONS", "PATCH", "Unknown (Encrypted)"]:
             raise ValueError("method must be one of GET, POST, PUT, DELETE, HEAD, OPTIONS, PATCH")
@@ -1352,14 +1391,13 @@ class HTTP:
             if type != "HTTPS":
                 raise ValueError("certificate must be None if type is not HTTPS")
             if host not in certificate.subject and host not in certificate.subject_alternative_names:
-                mlog = logging_helper.Log("lib.class_helper")
                 mlog.warning(
                     "HTTP __init__: Certificate: HTTP.host does not match certificate subject nor subject_alternative_names"
                 )
         self.certificate = certificate
         self.file = file
 
-    def __dict__(self):
+    def __dict__(self, nested=str):
         try:
             dict_ = {
                 "timestamp": self.timestamp,
@@ -1378,8 +1416,8 @@ class HTTP:
                 "request_headers": self.request_headers,
                 "response_headers": self.response_headers,
                 "http_version": self.http_version,
-                "certificate": str(self.certificate),
-                "file": str(self.file),
+                "certificate": nested(self.certificate),
+                "file": nested(self.file),
             }
         except AttributeError:
             dict_ = {
@@ -1393,7 +1431,7 @@ class HTTP:
 
     def __str__(self):
         """Returns the string representation of the object."""
-        return json.dumps(del_none_from_dict(self.__dict__()), indent=4, sort_keys=False, default=str)
+        return to_json(self, indent=True)
 
 
 class ContextFlow:
@@ -1442,6 +1480,45 @@ class ContextFlow:
         __str__(self)
     """
 
+    __slots__ = (
+        "related_detection_uuid",
+        "timestamp",
+        "data",
+        "bytes_send",
+        "bytes_received",
+        "integration",
+        "source_ip",
+        "source_port",
+        "destination_ip",
+        "destination_port",
+        "protocol",
+        "process_uuid",
+        "process_name",
+        "process_id",
+        "source_mac",
+        "destination_mac",
+        "source_hostname",
+        "destination_hostname",
+        "category",
+        "sub_category",
+        "application",
+        "flow_id",
+        "interface",
+        "network",
+        "network_type",
+        "flow_source",
+        "source_location",
+        "destination_location",
+        "http",
+        "dns_query",
+        "device",
+        "firewall_action",
+        "firewall_rule_id",
+        "uuid",
+        "detection_relevance",
+        "flow_direction",
+    )
+
     def __init__(
         self,
         related_detection_uuid: uuid.UUID,
@@ -1527,13 +1604,15 @@ class ContextFlow:
         if flow_direction not in ["L2R", "R2L", "L2L", "R2R", None]:
             raise ValueError("flow_direction must be either L2R, L2L, R2L, R2R or None")
         if flow_direction == None:
-            if source_ip.is_private and destination_ip.is_private:
+            source_is_private = get_ip_info(source_ip).is_private
+            destination_is_private = get_ip_info(destination_ip).is_private
+            if source_is_private and destination_is_private:
                 self.flow_direction = "L2L"
-            elif source_ip.is_private and not destination_ip.is_private:
+            elif source_is_private and not destination_is_private:
                 self.flow_direction = "L2R"
-            elif not source_ip.is_private and destination_ip.is_private:
+            elif not source_is_private and destination_is_private:
                 self.flow_direction = "R2L"
-            elif not source_ip.is_private and not destination_ip.is_private:
+            elif not source_is_private and not destination_is_private:
                 self.flow_direction = "R2R"
         else:
             self.flow_direction = flow_direction
@@ -1593,7 +1672,7 @@ class ContextFlow:
         self.uuid = uuid
         self.detection_relevance = handle_percentage(detection_relevance)
 
-    def __dict__(self):
+    def __dict__(self, nested=str):
         # Have to overwrite the __dict__ method because of the ipaddress objects
 
         dict_ = {
@@ -1604,10 +1683,10 @@ class ContextFlow:
             "integration": self.integration,
             "firewall_action": self.firewall_action,
             "source_ip": str(self.source_ip),
-            "source_location": str(self.source_location),
+            "source_location": nested(self.source_location),
             "source_port": self.source_port,
             "destination_ip": str(self.destination_ip),
-            "destination_location": str(self.destination_location),
+            "destination_location": nested(self.destination_location),
             "destination_port": self.destination_port,
             "protocol": self.protocol,
             "process_uuid": str(self.process_uuid),
@@ -1628,9 +1707,9 @@ class ContextFlow:
             "network_type": self.network_type,
             "flow_source": self.flow_source,
             "application": self.application,
-            "http": str(self.http),
-            "dns_query": str(self.dns_query),
-            "device": str(self.device),
+            "http": nested(self.http),
+            "dns_query": nested(self.dns_query),
+            "device": nested(self.device),
             "firewall_rule_id": self.firewall_rule_id,
             "uuid": str(self.uuid),
         }
@@ -1639,7 +1718,7 @@ class ContextFlow:
 
     def __str__(self):
         """Returns the string representation of the object."""
-        return json.dumps(del_none_from_dict(self.__dict__()), indent=4, sort_keys=False, default=str)
+        return to_json(self, indent=True)
 
     # Getter and setter;
 
@@ -1706,6 +1785,65 @@ class ContextProcess:
         __str__(self)
     """
 
+    __slots__ = (
+        "process_uuid",
+        "timestamp",
+        "related_detection_uuid",
+        "process_name",
+        "process_id",
+        "parent_process_name",
+        "parent_process_id",
+        "process_path",
+        "process_md5",
+        "process_sha1",
+        "process_sha256",
+        "process_command_line",
+        "process_username",
+        "process_integrity_level",
+        "process_is_elevated_token",
+        "process_token_elevation_type",
+        "process_token_elevation_type_full",
+        "process_token_integrity_level",
+        "process_token_integrity_level_full",
+        "process_privileges",
+        "process_owner",
+        "process_group_id",
+        "process_group_name",
+        "process_logon_guid",
+        "process_logon_id",
+        "process_logon_type",
+        "process_logon_type_full",
+        "process_logon_time",
+        "process_start_time",
+        "process_parent_start_time",
+        "process_current_directory",
+        "process_image_file_device",
+        "process_image_file_directory",
+        "process_image_file_name",
+        "process_image_file_path",
+        "process_dns",
+        "process_signature",
+        "process_http",
+        "process_flow",
+        "process_parent",
+        "process_children",
+        "process_environment_variables",
+        "process_arguments",
+        "parent_process_arguments",
+        "process_modules",
+        "process_thread",
+        "created_files",
+        "deleted_files",
+        "modified_files",
+        "created_registry_keys",
+        "deleted_registry_keys",
+        "modified_registry_keys",
+        "is_complete",
+        "detection_relevance",
+        "process_io_bytes",
+        "process_io_text",
+    )
+
     # TODO: 1) Change that DNSQuery, HTTP and Certificate are directly inside a ContextFlow object, as they depend on each other [DONE]
     #        1b) Remove them as explicit contexts in Detection and CaseFile [DONE]
     #       2) Make that contexts only refere to itself by UUID [DONE]
@@ -1773,13 +1911,10 @@ class ContextProcess:
         is_complete: bool = False,
         detection_relevance: int = 50,
     ):
-        mlog = logging_helper.Log("lib.class_helper")
-
         self.process_uuid = str(process_uuid)
         if process_uuid == None or process_uuid == "":
             raise ValueError("uuid cannot be empty")
         if len(str(process_uuid)) < 36:
-            mlog = logging_helper.Log("lib.class_helper")
             mlog.warning("Process Object __init__: given uuid seems too short")
 
         self.timestamp = timestamp
@@ -1859,7 +1994,7 @@ class ContextProcess:
                     + "for "
                     + str(child)
                 )
-        self.process_children = process_children
+        self.process_children = list(process_children)  # A copy, as the process tree builders append to it
 
         self.process_environment_variables = process_environment_variables
         self.process_arguments = process_arguments
@@ -1907,7 +2042,7 @@ class ContextProcess:
         self.process_io_bytes = process_io_bytes
         self.process_io_text = process_io_text
 
-    def __dict__(self):
+    def __dict__(self, nested=str):
         _dict = {
             "timestamp": self.timestamp,
             "related_detection_uuid": self.related_detection_uuid,
@@ -1945,19 +2080,19 @@ class ContextProcess:
             "process_image_file_name": self.process_image_file_name,
             "process_image_file_path": self.process_image_file_path,
             "process_dns": self.process_dns,
-            "process_signature": str(self.process_signature),
-            "process_http": str(self.process_http),
-            "process_flow": str(self.process_flow),
-            "process_parent": str(self.process_parent),
-            "process_children": str(self.process_children),
+            "process_signature": nested(self.process_signature),
+            "process_http": nested(self.process_http),
+            "process_flow": nested(self.process_flow),
+            "process_parent": nested(self.process_parent),
+            "process_children": nested(self.process_children),
             "process_environment_variables": self.process_environment_variables,
             "process_arguments": self.process_arguments,
             "parent_process_arguments": self.parent_process_arguments,
             "process_modules": self.process_modules,
             "process_thread": self.process_thread,
-            "created_files": str(self.created_files),
-            "deleted_files": str(self.deleted_files),
-            "modified_files": str(self.modified_files),
+            "created_files": nested(self.created_files),
+            "deleted_files": nested(self.deleted_files),
+            "modified_files": nested(self.modified_files),
             "created_registry_keys": self.created_registry_keys,
             "deleted_registry_keys": self.deleted_registry_keys,
             "modified_registry_keys": self.modified_registry_keys,
@@ -1968,7 +2103,7 @@ class ContextProcess:
 
     def __str__(self):
         """Returns the string representation of the object."""
-        return json.dumps(del_none_from_dict(del_none_from_dict(self.__dict__())), indent=4, sort_keys=False, default=str)
+        return to_json(self, indent=True)
 
 
 class ContextLog:
@@ -1998,6 +2133,24 @@ class ContextLog:
 
     """
 
+    __slots__ = (
+        "related_detection_uuid",
+        "timestamp",
+        "log_message",
+        "log_source_name",
+        "log_source_device",
+        "log_flow",
+        "log_protocol",
+        "log_type",
+        "log_severity",
+        "log_facility",
+        "log_tags",
+        "log_custom_fields",
+        "uuid",
+        "detection_relevance",
+        "log_source_ip",
+    )
+
     def __init__(
         self,
         related_detection_uuid: uuid.UUID,
@@ -2045,7 +2198,7 @@ class ContextLog:
         self.uuid = uuid
         self.detection_relevance = handle_percentage(detection_relevance)
 
-    def __dict__(self):
+    def __dict__(self, nested=str):
         dict_ = {
             "related_detection_uuid": str(self.related_detection_uuid),
             "detection_relevance": self.detection_relevance,
@@ -2053,7 +2206,7 @@ class ContextLog:
             "log_message": self.log_message,
             "log_source_name": self.log_source_name,
             "log_source_ip": str(self.log_source_ip),
-            "log_source_device": str(self.log_source_device),
+            "log_source_device": nested(self.log_source_device),
             "log_flow": self.log_flow,
             "log_protocol": self.log_protocol,
             "log_type": self.log_type,
@@ -2067,7 +2220,7 @@ class ContextLog:
 
     def __str__(self):
         """Returns the string representation of the object."""
-        return json.dumps(del_none_from_dict(self.__dict__()), indent=4, sort_keys=False, default=str)
+        return to_json(self, indent=True)
 
 
 class ContextRegistry:
@@ -2083,6 +2236,21 @@ class ContextRegistry:
         registry_path (str): The registry path
     """
 
+    __slots__ = (
+        "related_detection_uuid",
+        "timestamp",
+        "action",
+        "registry_key",
+        "registry_value",
+        "registry_data",
+        "registry_data_type",
+        "registry_hive",
+        "registry_path",
+        "process_name",
+        "process_id",
+        "process_uuid",
+    )
+
     def __init__(
         self,
         related_detection_uuid: uuid.UUID,
@@ -2111,7 +2279,7 @@ class ContextRegistry:
         self.process_id = process_id
         self.process_uuid = process_uuid
 
-    def __dict__(self):
+    def __dict__(self, nested=str):
         dict_ = {
             "related_detection_uuid": str(self.related_detection_uuid),
             "timestamp": str(self.timestamp),
@@ -2130,7 +2298,7 @@ class ContextRegistry:
 
     def __str__(self):
         """Returns the string representation of the object."""
-        return json.dumps(del_none_from_dict(self.__dict__()), indent=4, sort_keys=False, default=str)
+        return to_json(self, indent=True)
 
 
 class ThreatIntel:
@@ -2198,7 +2366,7 @@ class ThreatIntel:
         self.is_related_indicator = is_related_indicator
         self.related_indicator_name = related_indicator_name
 
-    def __dict__(self):
+    def __dict__(self, nested=str):
         _dict = {
             "time_requested": str(self.time_requested),
             "engine": self.engine,
@@ -2219,7 +2387,7 @@ class ThreatIntel:
 
     def __str__(self):
         """Returns the string representation of the object."""
-        return json.dumps(del_none_from_dict(self.__dict__()), indent=4, sort_keys=False, default=str)
+        return to_json(self, indent=True)
 
 
 class Whois:
@@ -2397,7 +2565,7 @@ class Whois:
         self.name_server2 = name_server2
         self.dnssec = dnssec
 
-    def __dict__(self):
+    def __dict__(self, nested=str):
         """Returns the object as a dictionary."""
         return {
             "domain_name": self.domain_name,
@@ -2455,10 +2623,9 @@ class Whois:
             "dnssec": self.dnssec,
         }
 
-
-def __str__(self):
-    """Returns the string representation of the object."""
-    return json.dumps(del_none_from_dict(self.__dict__()), indent=4, sort_keys=False, default=str)
+    def __str__(self):
+        """Returns the string representation of the object."""
+        return to_json(self, indent=True)
 
 
 class ContextThreatIntel:
@@ -2605,7 +2772,6 @@ class ContextThreatIntel:
             self.score_unknown = score_unknown
         else:
             if self.score_known == None or self.score_total == None:  # Should not happen, as set above
-                mlog = logging_helper.Log("lib.class_helper")
                 mlog.error(
                     "Class ThreatIntel __init__: implicit calculation of score_unknown: score_unknown is not set and score_known or score_total is None. score_unknown cannot be calculated. You shouldn't see this message. Please case this issue."
                 )
@@ -2639,7 +2805,7 @@ class ContextThreatIntel:
 
         self.links = links
 
-    def __dict__(self):
+    def __dict__(self, nested=str):
         """Returns the object as a dictionary."""
         dict_ = {
             "type": self.type,
@@ -2660,20 +2826,19 @@ class ContextThreatIntel:
             "AS_owner": self.AS_owner,
             "AS_number": self.AS_number,
             "AS_IP_Range": self.AS_IP_Range,
-            "related_cert": str(self.related_cert),
-            "related_ips": str(self.related_ips),
-            "related_domains": str(self.related_domains),
-            "related_files": str(self.related_files),
-            "related_urls": str(self.related_urls),
-            "whois": str(self.whois),
+            "related_cert": nested(self.related_cert),
+            "related_ips": nested(self.related_ips),
+            "related_domains": nested(self.related_domains),
+            "related_files": nested(self.related_files),
+            "related_urls": nested(self.related_urls),
+            "whois": nested(self.whois),
             "uuid": self.uuid,
         }
         return dict_
 
     def __str__(self):
         """Returns the string representation of the object."""
-        clean_dict = del_none_from_dict(self.__dict__())
-        return json.dumps(clean_dict, indent=4, sort_keys=False, default=str)
+        return to_json(self, indent=True)
 
 
 class Detection:
@@ -2753,16 +2918,7 @@ class Detection:
         self.tags = tags
         self.raw = raw
         self.rules = rules
-        self.indicators = {
-            "ip": [],
-            "domain": [],
-            "url": [],
-            "hash": [],
-            "email": [],
-            "countries": [],
-            "registry": [],
-            "other": [],
-        }
+        self.indicators = create_indicators()
 
         if host_ip != None:
             host_ip = cast_to_ipaddress(host_ip)
@@ -2894,18 +3050,7 @@ class Detection:
         self.uuid = uuid
         self.ticket: pyotrs.Ticket = None
 
-        # Remove '*.' from domain indicators and replace with empty
-        for domain in self.indicators["domain"]:
-            if domain.startswith("*."):
-                mlog = logging_helper.Log("lib.class_helper")
-                mlog.debug(f"Removing '*.' from domain indicator: {domain}")
-                self.indicators["domain"].remove(domain)
-                self.indicators["domain"].append(domain[2:])
-
-        # Remove duplicates
-        remove_duplicates_from_dict(self.indicators)
-
-    def __dict__(self):
+    def __dict__(self, nested=str):
         """Returns the dictionary representation of the object."""
         dict_ = {
             "id": self.vendor_id,
@@ -2918,15 +3063,15 @@ class Detection:
             "tags": self.tags,
             "raw": self.raw,
             "rules": self.rules,
-            "log": str(self.log),
-            "process": str(self.process),
-            "flow": str(self.flow),
-            "threat_intel": str(self.threat_intel),
-            "location": str(self.location),
-            "device": str(self.device),
-            "user": str(self.user),
-            "file": str(self.file),
-            "registry": str(self.registry),
+            "log": nested(self.log),
+            "process": nested(self.process),
+            "flow": nested(self.flow),
+            "threat_intel": nested(self.threat_intel),
+            "location": nested(self.location),
+            "device": nested(self.device),
+            "user": nested(self.user),
+            "file": nested(self.file),
+            "registry": nested(self.registry),
             "log_source": self.log_source,
             "url": self.url,
             "uuid": self.uuid,
@@ -2936,7 +3081,7 @@ class Detection:
 
     def __str__(self):
         """Returns the string representation of the object."""
-        return json.dumps(del_none_from_dict(self.__dict__()), indent=4, sort_keys=False, default=str)
+        return to_json(self, indent=True)
 
     def get_context_by_uuid(self, uuid):
         """Returns the context object by uuid.
@@ -2947,103 +3092,43 @@ class Detection:
         Returns:
             Any: The context object
         """
-        if self.log.uuid == uuid:
-            return self.log
-
-        if self.process.uuid == uuid:
-            return self.process
-
-        if self.flow.uuid == uuid:
-            return self.flow
-
-        if self.threat_intel.uuid == uuid:
-            return self.threat_intel
-
-        if self.location.uuid == uuid:
-            return self.location
-
-        if self.device.uuid == uuid:
-            return self.device
-
-        if self.user.uuid == uuid:
-            return self.user
-
-        if self.file.uuid == uuid:
-            return self.file
+        if uuid is None:
+            return None
+
+        for context in (
+            self.log,
+            self.process,
+            self.flow,
+            self.threat_intel,
+            self.location,
+            self.device,
+            self.user,
+            self.file,
+            self.registry,
+        ):
+            if context is None:
+                continue
+            context_uuid = context.process_uuid if isinstance(context, ContextProcess) else getattr(context, "uuid", None)
+            if context_uuid is not None and str(context_uuid) == str(uuid):
+                return context
 
         return None
 
     def check_against_whitelist(self) -> bool:
-        """Checks the case against the whitelist.
+        """Checks the detection against the global whitelist (see generic_helper.get_whitelist()).
 
-        Args:
-            cache_integration_name (str): The name of the cache integration
+        IPs are also matched against whitelisted CIDR ranges and domains against whitelisted parent domains.
 
         Returns:
-            bool: True if the case is whitelisted, False otherwise
+            bool: True if the detection is whitelisted, False otherwise
         """
-        from lib.generic_helper import get_from_cache
-
-        mlog = logging_helper.Log("lib.class_helper")
-        detection = self
-
-        wl_ips = get_from_cache("global_whitelist_ips", "LIST")
-        wl_ips = wl_ips if wl_ips is not None else []
-        wl_ips = list(set(wl_ips))  # Remove duplicates
-        wl_ips = [ip for ip in wl_ips if ip != ""]  # Remove empty entries
-        mlog.debug(f"Found {len(wl_ips)} IPs in global whitelist.")
-
-        for ip in detection.indicators["ip"]:
-            if ip in wl_ips:
-                mlog.info(f"IP '{ip}' is whitelisted.")
-                return True
-
-        wl_domains = get_from_cache("global_whitelist_domains", "LIST")
-        wl_domains = wl_domains if wl_domains is not None else []
-        wl_domains = list(set(wl_domains))  # Remove duplicates
-        wl_domains = [domain for domain in wl_domains if domain != ""]  # Remove empty entries
-        mlog.debug(f"Found {len(wl_domains)} domains in global whitelist.")
-
-        for domain in detection.indicators["domain"]:
-            if domain in wl_domains:
-                mlog.info(f"Domain '{domain}' is whitelisted.")
-                return True
-
-        wl_hashes = get_from_cache("global_whitelist_hashes", "LIST")
-        wl_hashes = wl_hashes if wl_hashes is not None else []
-        wl_hashes = list(set(wl_hashes))  # Remove duplicates
-        wl_hashes = [hash_ for hash_ in wl_hashes if hash_ != ""]  # Remove empty entries
-        mlog.debug(f"Found {len(wl_hashes)} hashes in global whitelist.")
-
-        for hash_ in detection.indicators["hash"]:
-            if hash_ in wl_hashes:
-                mlog.info(f"Hash '{hash_}' is whitelisted.")
-                return True
-
-        wl_urls = get_from_cache("global_whitelist_urls", "LIST")
-        wl_urls = wl_urls if wl_urls is not None else []
-        wl_urls = list(set(wl_urls))  # Remove duplicates
-        wl_urls = [url for url in wl_urls if url != ""]  # Remove empty entries
-        mlog.debug(f"Found {len(wl_urls)} URLs in global whitelist.")
-
-        for url in detection.indicators["url"]:
-            if url in wl_urls:
-                mlog.info(f"URL '{url}' is whitelisted.")
-                return True
-
-        wl_emails = get_from_cache("global_whitelist_emails", "LIST")
-        wl_emails = wl_emails if wl_emails is not None else []
-        wl_emails = list(set(wl_emails))  # Remove duplicates
-        wl_emails = [email for email in wl_emails if email != ""]  # Remove empty entries
-        mlog.debug(f"Found {len(wl_emails)} emails in global whitelist.")
-
-        for email in detection.indicators["email"]:
-            if email in wl_emails:
-                mlog.info(f"Email '{email}' is whitelisted.")
-                return True
-
-        mlog.debug("Detection is not whitelisted in the global whitelist.")
-        return False
+        match = get_whitelist().match_indicators(self.indicators)
+        if match is None:
+            return False
+
+        indicator_type, indicator, entry = match
+        mlog.info(f"{indicator_type.upper()} '{indicator}' is whitelisted (whitelist entry: '{entry}').")
+        return True
 
 
 class AuditLog:
@@ -3153,7 +3238,7 @@ class AuditLog:
         self.stage_done = True
         return self
 
-    def __dict__(self):
+    def __dict__(self, nested=str):
         """Returns the dictionary representation of the object.
         It will only return the result_* attributes if the stage is done to enhance readability.
         """
@@ -3194,7 +3279,7 @@ class AuditLog:
 
     def __str__(self):
         """Returns the string representation of the object."""
-        return json.dumps(del_none_from_dict(self.__dict__()), indent=4, sort_keys=False, default=str)
+        return to_json(self, indent=True)
 
 
 class CaseFile:
@@ -3222,13 +3307,14 @@ class CaseFile:
 
 
     Methods:
-        __init__(self, detections: List[Detection], uuid: uuid.UUID = uuid.uuid4()): Initializes the CaseFile object.
+        __init__(self, detections: List[Detection], uuid: uuid.UUID = None): Initializes the CaseFile object.
         __str__(self): Returns the string representation of the object.
         add_context_log(self, context: Union[ContextLog, ContextProcess, ContextFlow, ContextThreatIntel, Location, Device, Person, ContextFile]): Adds a context to the case.
+        add_contexts(self, contexts: list): Adds multiple contexts to the case (processes with one sort of the timeline).
         get_context_by_uuid(self, uuid: str, filterType: type (optional)): Returns the context by the given uuid.
     """
 
-    def __init__(self, detections: list, uuid: uuid.UUID = uuid.uuid4()):
+    def __init__(self, detections: list, uuid: uuid.UUID = None):
         self.detections = detections
         if type(detections) != list:
             self.detections = [detections]
@@ -3257,27 +3343,20 @@ class CaseFile:
         self.ticket: pyotrs.Ticket = None
 
         # Context for every type of context
-        self.context_logs: List[ContextLog] = []
-        self.context_processes: List[ContextProcess] = []
-        self.context_flows: List[ContextFlow] = []
-        self.context_threat_intel: List[ContextThreatIntel] = []
-        self.context_locations: List[Location] = []
-        self.context_devices: List[ContextDevice] = []
-        self.context_persons: List[Person] = []
-        self.context_files: List[ContextFile] = []
-        self.context_registries: List[ContextRegistry] = []
-
-        self.uuid = uuid
-        self.indicators = {
-            "ip": [],
-            "domain": [],
-            "url": [],
-            "hash": [],
-            "email": [],
-            "countries": [],
-            "registry": [],
-            "other": [],
-        }
+        self.context_logs: Timeline = Timeline()
+        self.context_processes: Timeline = Timeline()
+        self.context_flows: Timeline = Timeline()
+        self.context_threat_intel: Timeline = Timeline()
+        self.context_locations: Timeline = Timeline()
+        self.context_devices: Timeline = Timeline()
+        self.context_persons: Timeline = Timeline()
+        self.context_files: Timeline = Timeline()
+        self.context_registries: Timeline = Timeline()
+        self._context_index = {}  # context type -> {str(uuid) -> context}, maintained by add_context()
+        self._process_index = {}  # str(process_uuid) -> [contexts of any type related to the process]
+
+        self.uuid = uuid if uuid is not None else uuid_module.uuid4()  # Every case needs its own UUID (e.g. for snapshots)
+        self.indicators = create_indicators()
 
         self.audit_trail[0].result_had_warnings = False
         self.audit_trail[0].result_had_errors = False
@@ -3286,25 +3365,26 @@ class CaseFile:
         self.audit_trail[0].result_message = "Initializing CaseFile was successful."
         self.audit_trail[0].result_data = "CaseFile was initialized successfully."
 
-    def __dict__(self):
+    def __dict__(self, nested=str):
         """Returns the object as a dictionary."""
         dict_ = {
             "detections": self.detections,
             "handled_by_playbooks": self.handled_by_playbooks,
-            "action": self.action,
             "ticket_number": self.get_ticket_number() if self.ticket else None,
-            "action_result": self.action_result,
-            "action_result_message": self.action_result_message,
-            "action_result_data": self.action_result_data,
-            "context_logs": str(self.context_logs),
-            "context_processes": str(self.context_processes),
-            "context_flows": str(self.context_flows),
-            "context_threat_intel": str(self.context_threat_intel),
-            "context_locations": str(self.context_locations),
-            "context_devices": str(self.context_devices),
-            "context_persons": str(self.context_persons),
-            "context_files": str(self.context_files),
-            "context_registries": str(self.context_registries),
+            "status": self.status,
+            "threat_type": self.threat_type,
+            "threat_level": self.threat_level,
+            "result": self.result,
+            "result_confidence": self.result_confidence,
+            "context_logs": nested(self.context_logs),
+            "context_processes": nested(self.context_processes),
+            "context_flows": nested(self.context_flows),
+            "context_threat_intel": nested(self.context_threat_intel),
+            "context_locations": nested(self.context_locations),
+            "context_devices": nested(self.context_devices),
+            "context_persons": nested(self.context_persons),
+            "context_files": nested(self.context_files),
+            "context_registries": nested(self.context_registries),
             "uuid": self.uuid,
             "indicators": self.indicators,
             "audit_trail": self.audit_trail,
@@ -3313,7 +3393,7 @@ class CaseFile:
 
     def __str__(self):
         """Returns the string representation of the object."""
-        return json.dumps(del_none_from_dict(self.__dict__()), indent=4, sort_keys=False, default=str)
+        return to_json(self, indent=True)
 
     # Getter and setter;
 
@@ -3360,25 +3440,17 @@ class CaseFile:
             timestamp = context.field_get("Created")
 
         if isinstance(context, ContextLog):
-            add_to_timeline(self.context_logs, context, timestamp)
+            added = add_to_timeline(self.context_logs, context, timestamp)
             if context.log_flow:
                 self.indicators["ip"].append(context.log_flow.source_ip)
                 self.indicators["ip"].append(context.log_flow.destination_ip)
 
         elif isinstance(context, ContextProcess):
-            add_to_timeline(self.context_processes, context, timestamp)
-            if context.process_flow:
-                self.indicators["ip"].append(context.process_flow.source_ip)
-                self.indicators["ip"].append(context.process_flow.destination_ip)
-            if context.process_md5:
-                self.indicators["hash"].append(context.process_md5)
-            if context.process_sha1:
-                self.indicators["hash"].append(context.process_sha1)
-            if context.process_sha256:
-                self.indicators["hash"].append(context.process_sha256)
+            added = add_to_timeline(self.context_processes, context, timestamp)
+            self._add_process_indicators(context)
 
         elif isinstance(context, ContextFlow):
-            add_to_timeline(self.context_flows, context, timestamp)
+            added = add_to_timeline(self.context_flows, context, timestamp)
             self.indicators["ip"].append(context.source_ip)
             self.indicators["ip"].append(context.destination_ip)
 
@@ -3411,30 +3483,30 @@ class CaseFile:
                         self.indicators["domain"].append(san)
 
         elif isinstance(context, ContextThreatIntel):
-            add_to_timeline(self.context_threat_intel, context, timestamp)
+            added = add_to_timeline(self.context_threat_intel, context, timestamp)
 
         elif isinstance(context, Location):
-            add_to_timeline(self.context_locations, context, timestamp)
+            added = add_to_timeline(self.context_locations, context, timestamp)
             if context.country:
                 self.indicators["countries"].append(context.country)
 
         elif isinstance(context, ContextDevice):
-            add_to_timeline(self.context_devices, context, timestamp)
+            added = add_to_timeline(self.context_devices, context, timestamp)
             if context.local_ip:
                 self.indicators["ip"].append(context.local_ip)
             if context.global_ip:
                 self.indicators["ip"].append(context.global_ip)
 
         elif isinstance(context, Person):
-            add_to_timeline(self.context_persons, context, timestamp)
+            added = add_to_timeline(self.context_persons, context, timestamp)
 
         elif isinstance(context, ContextRegistry):
-            add_to_timeline(self.context_registries, context, timestamp)
+            added = add_to_timeline(self.context_registries, context, timestamp)
             registry_indicator = context.registry_key.lower() + "->" + context.registry_value.lower()
             self.indicators["registry"].append(registry_indicator)
 
         elif isinstance(context, ContextFile):
-            add_to_timeline(self.context_files, context, timestamp)
+            added = add_to_timeline(self.context_files, context, timestamp)
             self.indicators["other"].append(context.file_name)
             if context.file_md5:
                 self.indicators["hash"].append(context.file_md5)
@@ -3444,6 +3516,7 @@ class CaseFile:
                 self.indicators["hash"].append(context.file_sha256)
 
         elif isinstance(context, dict) or isinstance(context, pyotrs.Ticket):
+            added = False
             if isinstance(context, pyotrs.Ticket) or context["Ticket"]:
                 self.ticket = context
             else:
@@ -3452,23 +3525,84 @@ class CaseFile:
         else:
             raise TypeError("Unknown context type.")
 
-        # Remove '*.' from domain indicators and replace with empty
-        for domain in self.indicators["domain"]:
-            if domain.startswith("*"):
-                mlog = logging_helper.Log("lib.class_helper")
-                mlog.debug("Removing '*.' from domain indicator: " + domain)
-                self.indicators["domain"].remove(domain)
-                self.indicators["domain"].append(domain[2:])
-
-        # Remove duplicates
-        remove_duplicates_from_dict(self.indicators)
+        if added:
+            self._index_context(context, timestamp)
         return
 
+    def add_contexts(self, contexts: list):
+        """Adds multiple contexts to the detection case. Processes are added to the timeline at once, so it is only sorted
+        once (e.g. for the processes of a big process tree). Other contexts are added one by one with add_context().
+
+        Args:
+            contexts (list): The contexts to add
+
+        Returns:
+            int: The number of processes that were dropped, as the process timeline is full
+
+        Raises:
+            ValueError: If a context object has no timestamp
+            TypeError: If a context object is not of a valid type
+        """
+        processes = []
+        for context in contexts:
+            if isinstance(context, ContextProcess):
+                if not hasattr(context, "timestamp"):
+                    raise ValueError("Context object has no timestamp.")
+                processes.append(context)
+            else:
+                self.add_context(context)
+
+        if len(processes) == 0:
+            return 0
+        free = max(self.context_processes.max_size - len(self.context_processes), 0)
+        self.context_processes.extend(processes)  # Drops the processes that do not fit anymore
+        for process in processes[:free]:
+            self._add_process_indicators(process)
+            self._index_context(process, process.timestamp)
+        return max(len(processes) - free, 0)
+
+    def _add_process_indicators(self, process):
+        """Adds the indicators (IPs and hashes) of a process to the case.
+
+        Args:
+            process (ContextProcess): The process
+        """
+        if process.process_flow:
+            self.indicators["ip"].append(process.process_flow.source_ip)
+            self.indicators["ip"].append(process.process_flow.destination_ip)
+        if process.process_md5:
+            self.indicators["hash"].append(process.process_md5)
+        if process.process_sha1:
+            self.indicators["hash"].append(process.process_sha1)
+        if process.process_sha256:
+            self.indicators["hash"].append(process.process_sha256)
+
+    def _index_context(self, context, timestamp):
+        """Adds a context to the UUID index and to the process index of the case.
+
+        Args:
+            context (Any): The context
+            timestamp (datetime): The timestamp of the context
+        """
+        context_uuid = context.process_uuid if isinstance(context, ContextProcess) else getattr(context, "uuid", None)
+        if context_uuid is not None:
+            index = self._context_index.setdefault(type(context), {})
+            existing = index.get(str(context_uuid))
+            # Like a search through the timeline, the index returns the earliest context with the UUID
+            if existing is None or timestamp < existing.timestamp:
+                index[str(context_uuid)] = context
+
+        process_uuid = getattr(context, "process_uuid", None)
+        if process_uuid is not None:
+            self._process_index.setdefault(str(process_uuid), []).append(context)
+
     def get_context_by_uuid(
         self, uuid: str, filterType: type = None
     ) -> Union[ContextLog, ContextProcess, ContextFlow, ContextThreatIntel, Location, ContextDevice, Person, ContextFile]:
         """Returns the context with the given UUID
 
+        For processes the process UUID is used. If multiple contexts have the same UUID, the earliest is returned.
+
         Args:
             uuid (str): The UUID of the context
             filterType (type, optional): The type of the context. Defaults to None.
@@ -3476,53 +3610,49 @@ class CaseFile:
         Returns:
             Union[ContextLog, ContextProcess, ContextFlow, ContextThreatIntel, Location, Device, Person, ContextFile]: The context
         """
-        if filterType == ContextLog or filterType is None:
-            for context in self.context_logs:
-                if context.uuid == uuid:
-                    return context
-
-        if filterType == ContextProcess or filterType is None:
-            for context in self.context_processes:
-                if context.uuid == uuid:
-                    return context
-
-        if filterType == ContextFlow or filterType is None:
-            for context in self.context_flows:
-                if context.uuid == uuid:
-                    return context
-
-        if filterType == ContextThreatIntel or filterType is None:
-            for context in self.context_threat_intel:
-                if context.uuid == uuid:
-                    return context
-
-        if filterType == Location or filterType is None:
-            for context in self.context_locations:
-                if context.uuid == uuid:
-                    return context
-
-        if filterType == ContextDevice or filterType is None:
-            for context in self.context_devices:
-                if context.uuid == uuid:
-                    return context
-
-        if filterType == Person or filterType is None:
-            for context in self.context_persons:
-                if context.uuid == uuid:
-                    return context
-
-        if filterType == ContextFile or filterType is None:
-            for context in self.context_files:
-                if context.uuid == uuid:
-                    return context
+        if uuid is None:
+            return None
 
         if filterType == pyotrs.Ticket or filterType is None:
-            for context in self.context_tickets:
-                if context.tid == uuid:
-                    return context
+            if isinstance(self.ticket, pyotrs.Ticket) and self.ticket.tid == uuid:
+                return self.ticket
+            if filterType == pyotrs.Ticket:
+                return None
+
+        for context_type in (
+            ContextLog,
+            ContextProcess,
+            ContextFlow,
+            ContextThreatIntel,
+            Location,
+            ContextDevice,
+            Person,
+            ContextFile,
+            ContextRegistry,
+        ):
+            if filterType is not None and filterType != context_type:
+                continue
+            context = self._context_index.get(context_type, {}).get(str(uuid))
+            if context is not None:
+                return context
 
         return None
 
+    def get_contexts_by_process_uuid(self, process_uuid: str, filterType: type = None) -> list:
+        """Returns all contexts related to the process with the given process UUID (entity ID).
+
+        Args:
+            process_uuid (str): The process UUID
+            filterType (type, optional): The type of the contexts. Defaults to None.
+
+        Returns:
+            list: The contexts in the order they were added (empty if there are none)
+        """
+        contexts = self._process_index.get(str(process_uuid), [])
+        if filterType is not None:
+            return [context for context in contexts if isinstance(context, filterType)]
+        return list(contexts)
+
     def get_audit_by_playbook(self, playbook: str) -> List[AuditLog]:
         """Returns the audit of the given playbook
 
@@ -5,19 +5,35 @@
 
 import lib.logging_helper as logging_helper
 import lib.config_helper as config_helper
+import lib.metrics_helper as metrics_helper
 
 import json
-from functools import reduce
-import pandas as pd
+import os
+from functools import lru_cache
 import base64
+import csv
+import html
 import datetime
 import ipaddress
-from typing import Union, List
+import threading
+import bisect
+import uuid
+from collections import Counter
+from typing import Union, List, NamedTuple
+
+try:
+    import orjson  # Optional: Faster JSON encoder used by to_json()
+except ImportError:
+    orjson = None
 
 THRESHOLD_MAX_CONTEXTS = 1000  # The maximum number of contexts for each type that can be added to a detection case
+IP_CACHE_SIZE = 65536  # The maximum number of parsed IP addresses that are memoized by get_ip_info()
+COMPILED_PATH_CACHE_SIZE = 4096  # The maximum number of dotted paths whose accessors are memoized by compile_path()
 
 mlog = logging_helper.Log("lib.generic_helper")
 
+_cache_lock = threading.RLock()  # Serializes access to the cache file, as integrations may use it from multiple threads
+
 
 def dict_get(dictionary, keys, default=None):
     """Gets a value from a nested dictionary.
@@ -30,13 +46,66 @@ def dict_get(dictionary, keys, default=None):
     Returns:
         any: The value of the key or the default value
     """
-    return reduce(
-        lambda d, key: d.get(key, default) if isinstance(d, dict) else default,
-        keys.split("."),
-        dictionary,
-    )
+    return compile_path(keys)(dictionary, default)
+
+
+@lru_cache(maxsize=COMPILED_PATH_CACHE_SIZE)
+def compile_path(path: str):
+    """Compiles a dotted path (like used by dict_get()) once into an accessor function.
 
+    The returned function behaves like dict_get(dictionary, path, default), but does not split the path on every call.
+    Compiled accessors are memoized, so calling compile_path() again with the same path is cheap.
+
+    Args:
+        path (str): The dotted path (e.g. 'source.geo.location')
+
+    Returns:
+        function: The accessor function, called as accessor(dictionary, default=None)
+    """
+    keys = tuple(path.split("."))
+
+    if len(keys) == 1:
+        key = keys[0]
+
+        def accessor(dictionary, default=None):
+            return dictionary.get(key, default) if isinstance(dictionary, dict) else default
+
+    elif len(keys) == 2:
+        first, second = keys
+
+        def accessor(dictionary, default=None):
+            value = dictionary.get(first, default) if isinstance(dictionary, dict) else default
+            return value.get(second, default) if isinstance(value, dict) else default
+
+    else:
 
+        def accessor(dictionary, default=None):
+            value = dictionary
+            for key in keys:
+                value = value.get(key, default) if isinstance(value, dict) else default
+            return value
+
+    return accessor
+
+
+def compile_mapping(mapping: dict):
+    """Compiles a field mapping (name -> dotted path) once into a function that extracts all fields from a dictionary.
+
+    Args:
+        mapping (dict): The mapping of field names to dotted paths
+
+    Returns:
+        function: The extractor function, called as extractor(dictionary) and returning a dict of field name -> value
+    """
+    accessors = tuple((name, compile_path(path)) for name, path in mapping.items())
+
+    def extractor(dictionary):
+        return {name: accessor(dictionary) for name, accessor in accessors}
+
+    return extractor
+
+
+@metrics_helper.timed("cache.put")
 def add_to_cache(integration, category, key, value):
     """
     Adds a value to the cache of a specific integration
@@ -62,39 +131,40 @@ def add_to_cache(integration, category, key, value):
                 + integration
             )
             cache_file = config_all["cache"]["file"]["path"]
-            with open(cache_file, "r") as f:
-                cache = json.load(f)
-
-            if key == "LIST":
-                mlog.debug("add_to_cache() - Key is 'LIST' literal, appending value to list")
-                try:
-                    if value in cache[integration][category]:
-                        mlog.debug("add_to_cache() - Value '" + str(value) + "' already exists in cache, skipping")
-                        return
-                    cache[integration][category].append(value)
-                except KeyError:
-                    if integration not in cache:
-                        cache[integration] = {}
-                    if category not in cache[integration]:
-                        cache[integration][category] = []
-
-                    cache[integration][category].append(value)
-            else:
-                try:
-                    cache[integration][category][key] = value
-                except KeyError:
-                    if integration not in cache:
-                        cache[integration] = {}
-                    if category not in cache[integration]:
-                        cache[integration][category] = {}
-
-                    cache[integration][category][key] = value
-
-            with open(cache_file, "w") as f:
-                try:
-                    json.dump(cache, f)
-                except TypeError:
-                    json.dump(cache, f, default=str)
+            with _cache_lock:
+                with open(cache_file, "r") as f:
+                    cache = json.load(f)
+
+                if key == "LIST":
+                    mlog.debug("add_to_cache() - Key is 'LIST' literal, appending value to list")
+                    try:
+                        if value in cache[integration][category]:
+                            mlog.debug("add_to_cache() - Value '" + str(value) + "' already exists in cache, skipping")
+                            return
+                        cache[integration][category].append(value)
+                    except KeyError:
+                        if integration not in cache:
+                            cache[integration] = {}
+                        if category not in cache[integration]:
+                            cache[integration][category] = []
+
+                        cache[integration][category].append(value)
+                else:
+                    try:
+                        cache[integration][category][key] = value
+                    except KeyError:
+                        if integration not in cache:
+                            cache[integration] = {}
+                        if category not in cache[integration]:
+                            cache[integration][category] = {}
+
+                        cache[integration][category][key] = value
+
+                with open(cache_file, "w") as f:
+                    try:
+                        json.dump(cache, f)
+                    except TypeError:
+                        json.dump(cache, f, default=str)
             mlog.info(
                 "add_to_cache() - Value '"
                 + str(value)
@@ -109,6 +179,7 @@ def add_to_cache(integration, category, key, value):
         mlog.warning("add_to_cache() - Error adding value to cache: " + str(e))
 
 
+@metrics_helper.timed("cache.get", result_labels=lambda value: {"hit": value is not None})
 def get_from_cache(integration, category, key="LIST"):
     """
     Gets a value from the cache of a specific integration
@@ -134,8 +205,9 @@ def get_from_cache(integration, category, key="LIST"):
             # Load cahceh file to variable
             cache_file = config_all["cache"]["file"]["path"]
             mlog.debug("get_from_cache() - Loading cache file: " + cache_file)
-            with open(cache_file, "r") as f:
-                cache = json.load(f)
+            with _cache_lock:
+                with open(cache_file, "r") as f:
+                    cache = json.load(f)
 
             # Check if category just stores a list
             if key == "LIST":
@@ -198,6 +270,155 @@ def del_none_from_dict(d):
     return d  # For convenience
 
 
+TRIVIAL_VALUES = ("", "Unknown", "N/A")  # Values that are skipped when serializing objects (like in del_none_from_dict())
+JSON_TYPES = (str, int, float, bool)  # Types that are serialized as they are
+
+
+def _is_trivial(value):
+    """Checks if a serialized value is empty or trivial and can be skipped.
+
+    Args:
+        value (object): The serialized value
+
+    Returns:
+        bool: True if the value can be skipped
+    """
+    if type(value) is str:
+        return value in TRIVIAL_VALUES
+    return (type(value) is list or type(value) is dict) and len(value) == 0
+
+
+def get_object_state(obj):
+    """Returns the attributes of a Z-SOAR object (one that provides a __dict__() method) as a dictionary.
+
+    Args:
+        obj (object): The object
+
+    Returns:
+        dict: The attributes of the object
+    """
+    try:
+        state = obj.__getstate__()
+    except AttributeError:  # Python < 3.11, fall back to the (stringified) __dict__() of the object
+        return obj.__dict__()
+
+    if type(state) is tuple:  # Slotted objects return (instance dict, slots dict)
+        merged = {}
+        for part in state:
+            if part:
+                merged.update(part)
+        return merged
+    return state or {}
+
+
+def _keep_nested(value):
+    """Returns a nested object as it is (passed as 'nested' to the __dict__() methods by get_object_fields())."""
+    return value
+
+
+def get_object_fields(obj):
+    """Returns the fields of a Z-SOAR object as defined by its __dict__() method (same keys, same hidden fields).
+
+    The __dict__() methods convert nested Z-SOAR objects (and lists of them) with their 'nested' argument, which is str()
+    by default. Here, they are kept as they are, so that to_dict() can serialize them as nested objects.
+    Fields that are only "None" because the attribute of the same name is None are returned as None.
+
+    Args:
+        obj (object): The object
+
+    Returns:
+        dict: The fields of the object
+    """
+    fields = obj.__dict__(nested=_keep_nested)
+    for key, value in fields.items():
+        if type(value) is str and value == "None" and getattr(obj, key, value) is None:
+            fields[key] = None
+    return fields
+
+
+def to_dict(obj, _path=None):
+    """Converts a Z-SOAR object (or a list or dictionary of them) to a JSON compatible dictionary in a single pass.
+
+    The fields of an object are the ones of its __dict__() method (see get_object_fields()), but unlike __dict__(), nested
+    objects are converted to nested dictionaries instead of JSON strings.
+    Values that are None, empty or trivial (see TRIVIAL_VALUES) are skipped during the traversal, as well as private attributes.
+    Objects that are already part of the current path (e.g. a parent process referencing its child) are replaced by their UUID.
+
+    Args:
+        obj (object): The object to convert
+        _path (set): The IDs of the objects in the current path (used internally)
+
+    Returns:
+        object: The converted object (dict, list, str, int, float or bool)
+    """
+    if obj is None or type(obj) in JSON_TYPES:
+        return obj
+    if isinstance(obj, (datetime.datetime, datetime.date)):
+        return obj.isoformat()
+    if isinstance(obj, (uuid.UUID, ipaddress.IPv4Address, ipaddress.IPv6Address)):
+        return str(obj)
+    if isinstance(obj, type):
+        return obj.__name__
+
+    if _path is None:
+        _path = set()
+
+    if isinstance(obj, dict):
+        items = obj.items()
+    elif isinstance(obj, (list, tuple, set)):
+        result = []
+        for item in obj:
+            if type(item) not in JSON_TYPES:
+                item = to_dict(item, _path)
+            if item is not None and not _is_trivial(item):
+                result.append(item)
+        return result
+    elif callable(getattr(obj, "__dict__", None)):
+        if id(obj) in _path:
+            return str(getattr(obj, "uuid", None) or getattr(obj, "process_uuid", None) or type(obj).__name__)
+        items = get_object_fields(obj).items()
+    elif isinstance(obj, (str, int, float)):  # Subclasses like IntEnum
+        return obj
+    else:
+        return str(obj)
+
+    _path.add(id(obj))
+    result = {}
+    for key, value in items:
+        if type(key) is not str:
+            key = str(key)
+        elif key[0] == "_":
+            continue
+        if value is None:
+            continue
+        if type(value) not in JSON_TYPES:
+            value = to_dict(value, _path)
+        if value is not None and not _is_trivial(value):
+            result[key] = value
+    _path.discard(id(obj))
+    return result
+
+
+def to_json(obj, indent=False):
+    """Serializes a Z-SOAR object (or a list or dictionary of them) to JSON using to_dict().
+
+    If the optional 'orjson' package is installed, it is used for encoding.
+
+    Args:
+        obj (object): The object to serialize
+        indent (bool): Whether to pretty print the JSON (indented by two spaces)
+
+    Returns:
+        str: The JSON string
+    """
+    data = to_dict(obj)
+    if orjson is not None:
+        return orjson.dumps(data, default=str, option=orjson.OPT_INDENT_2 if indent else 0).decode()
+    if indent:
+        return json.dumps(data, indent=2, ensure_ascii=False, default=str)
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False, default=str)
+
+
 def color_cell(cell):
     try:
         return "color: " + ("red" if int(cell) > 0 else "green")
@@ -205,227 +426,287 @@ def color_cell(cell):
         return "color: black"
 
 
-def format_results(events, format, group_by="uuid", transform=False):
-    if events is None or (type(events) == list and len(events) == 0):
-        return "~ No results found ~"
-    if type(events) is list and len(events) == 1:
-        events = events[0]
-    if type(events) is not list:
-        events = [events]
+# Fields of the context objects that are not shown in the tables of format_results()
+FORMAT_HIDDEN_FIELDS = frozenset(
+    [
+        "uuid",
+        "process_parent",
+        "process_flow",
+        "process_http",
+        "process_parent_start_time",
+        "process_sha256",
+        "process_sha1",
+        "parent_process_arguments",
+        "process_modules",
+        "process_arguments",
+        "process_children",
+        "related_detection_uuids",
+        "process_uuid",
+        "related_detection_uuid",
+    ]
+)
+FORMAT_DEVICE_COLUMNS = {"device_name": "name", "device_type": "type", "device_os": "os"}
+# Nested objects that format_results() expands into table columns: field -> {column: attribute of the nested object}
+FORMAT_EXPANDED_FIELDS = {
+    "source_location": {"source_location_country": "country", "source_location_city": "city", "source_location_org": "org"},
+    "destination_location": {
+        "destination_location_country": "country",
+        "destination_location_city": "city",
+        "destination_location_org": "org",
+    },
+    "dns_query": {"dns_query": "query", "dns_response": "query_response"},
+    "http": {
+        "full_url": "full_url",
+        "http_method": "method",
+        "http_status_code": "status_code",
+        "http_user_agent": "user_agent",
+        "host": "host",
+        "request_headers": "request_headers",
+        "request_body": "request_body",
+        "response_headers": "response_headers",
+        "response_body": "response_body",
+        "certificate": "certificate",
+    },
+    "device": FORMAT_DEVICE_COLUMNS,
+    "log_source_device": FORMAT_DEVICE_COLUMNS,
+    "process_signature": {"process_signature_issuer": "issuer", "process_signature_trusted": "is_trusted"},
+}
+
+
+def _format_cell(value):
+    """Formats a value of a context object as the text of a table cell.
 
-    dict_events = []
+    Args:
+        value (object): The value
 
-    # Removing fields that are unnecessary for the table view
-    for event in events:
-        if event is None or type(event) is int:
-            continue
-        if type(event) is list:
-            event = event[0]
-            mlog.warning("format_results() - 'Event' is a list, taking first item")
+    Returns:
+        str: The text, or None if the value is empty and the cell is left blank
+    """
+    if value is None:
+        return None
+    if type(value) is int:
+        return str(value)
+    if type(value) is str:
+        return None if value in TRIVIAL_VALUES or value == "None" else value
+    if isinstance(value, (list, tuple, set)):
+        return ", ".join(cell for cell in (_format_cell(item) for item in value) if cell is not None) or None
+    if callable(getattr(value, "__dict__", None)):  # Nested Z-SOAR objects that are not expanded
+        return to_json(value)
+    return str(value)
 
-        event = event.__dict__()
-        if "uuid" in event:
-            del event["uuid"]
-        if "process_parent" in event:
-            del event["process_parent"]
-        if "process_flow" in event:
-            del event["process_flow"]
-        if "process_http" in event:
-            del event["process_http"]
-        if "process_parent_start_time" in event:
-            del event["process_parent_start_time"]
-        if "process_sha256" in event:
-            del event["process_sha256"]
-        if "process_sha1" in event:
-            del event["process_sha1"]
-        if "parent_process_arguments" in event:
-            del event["parent_process_arguments"]
-        if "process_modules" in event:
-            del event["process_modules"]
-        if "process_arguments" in event:
-            del event["process_arguments"]
-        if "process_children" in event:
-            del event["process_children"]
-        if "related_detection_uuids" in event:
-            del event["related_detection_uuids"]
-        if "process_uuid" in event:
-            del event["process_uuid"]
-        if "related_detection_uuid" in event:
-            del event["related_detection_uuid"]
-
-        if "process_id" in event and event["process_id"] is not None:
-            if type(event["process_id"]) is not int:  # If a UUID == process_id, limit it to not be too long in the table
-                event["process_id"] = event["process_id"][:5]
-
-        # Try to expand some fields
-        try:
-            if "destination_location" in event:
-                loc = event["destination_location"]
-                del event["destination_location"]
-
-                if loc is not None and loc != "None":
-                    loc = json.loads(loc)
-                    country = dict_get(loc, "country")
-                    if country is not None:
-                        event["destination_location_country"] = country
 
-                    city = dict_get(loc, "city")
-                    if city is not None:
-                        event["destination_location_city"] = city
+def _get_table_row(obj):
+    """Gets the cells of a context object for the tables of format_results(), with nested objects expanded.
 
-                    org = dict_get(loc, "org")
-                    if org is not None:
-                        event["destination_location_org"] = org
+    Args:
+        obj (object): The context object
 
-            if "dns_query" in event:
-                dns_query = event["dns_query"]
-                del event["dns_query"]
+    Returns:
+        dict: The cells by column name (empty cells are left out)
+    """
+    row = {}
+    for key, value in get_object_state(obj).items():
+        if key[0] == "_" or key in FORMAT_HIDDEN_FIELDS or value is None:
+            continue
 
-                if dns_query is not None and dns_query != "None":
-                    dns_query = json.loads(dns_query)
+        if key in FORMAT_EXPANDED_FIELDS:
+            for column, attribute in FORMAT_EXPANDED_FIELDS[key].items():
+                cell = _format_cell(getattr(value, attribute, None))
+                if cell is not None:
+                    row[column] = cell
+            continue
 
-                    dns_query = dict_get(dns_query, "query")
-                    if dns_query is not None:
-                        event["dns_query"] = dns_query
+        if key == "threat_intel_detections":  # Only show the engines that hit, as all engines are too many to be readable
+            value = ["[ '" + str(hit.engine) + "': " + str(hit.threat_name) + " ]" for hit in value if hit.is_hit == True]
+        elif key == "process_id" and type(value) is not int:  # If a UUID == process_id, limit it to not be too long in the table
+            value = str(value)[:5]
 
-                    dns_query_response = dict_get(dns_query, "query_response")
-                    if dns_query_response is not None:
-                        event["dns_response"] = dns_query_response
+        cell = _format_cell(value)
+        if cell is not None:
+            row[key] = cell
+    return row
 
-            if "http" in event:
-                http = event["http"]
-                del event["http"]
 
-                if http is not None and http != "None":
-                    http = json.loads(http)
+def _escape_html(text):
+    """Escapes the special characters of HTML in a text (faster than html.escape() for the common case of nothing to escape)."""
+    if "&" in text or "<" in text or ">" in text:
+        return html.escape(text, quote=False)
+    return text
 
-                    http_url = dict_get(http, "full_url")
-                    if http_url is not None:
-                        event["full_url"] = http_url
 
-                    http_method = dict_get(http, "method")
-                    if http_method is not None:
-                        event["http_method"] = http_method
+def render_table(columns, rows, format):
+    """Renders rows of cells as an HTML or Markdown table.
 
-                    http_status_code = dict_get(http, "status_code")
-                    if http_status_code is not None:
-                        event["http_status_code"] = http_status_code
+    Args:
+        columns (list): The column names
+        rows (list): The rows, each a dict of column name -> cell text (missing cells are left blank)
+        format (str): The format of the table, either 'html' or 'markdown'
 
-                    http_user_agent = dict_get(http, "user_agent")
-                    if http_user_agent is not None:
-                        event["http_user_agent"] = http_user_agent
+    Returns:
+        str: The table
+    """
+    if format == "html":
+        parts = ['<table border="1">\n  <thead>\n    <tr style="text-align: right;">\n']
+        parts.extend("      <th>" + _escape_html(column) + "</th>\n" for column in columns)
+        parts.append("    </tr>\n  </thead>\n  <tbody>\n")
+        for row in rows:
+            cells = "</td>\n      <td>".join(_escape_html(row.get(column, "")) for column in columns)
+            parts.append("    <tr>\n      <td>" + cells + "</td>\n    </tr>\n")
+        parts.append("  </tbody>\n</table>")
+        return "".join(parts)
 
-                    http_referer = dict_get(http, "host")
-                    if http_referer is not None:
-                        event["host"] = http_referer
+    def escape(text):
+        return text.replace("|", "\\|").replace("\n", " ")
 
-                    http_body = dict_get(http, "request_headers")
-                    if http_body is not None and http_body != "None":
-                        event["request_headers"] = http_body
+    lines = ["| " + " | ".join(escape(column) for column in columns) + " |", "|" + "---|" * len(columns)]
+    lines.extend("| " + " | ".join(escape(row.get(column, "")) for column in columns) + " |" for row in rows)
+    return "\n".join(lines)
 
-                    http_body = dict_get(http, "request_body")
-                    if http_body is not None and http_body != "None":
-                        event["request_body"] = http_body
 
-                    http_body = dict_get(http, "response_headers")
-                    if http_body is not None and http_body != "None":
-                        event["response_headers"] = http_body
+def format_results(events, format, group_by="uuid", transform=False, max_rows=None):
+    """Formats context objects as a table (for ticket notes) or as JSON.
 
-                    http_body = dict_get(http, "response_body")
-                    if http_body is not None and http_body != "None":
-                        event["response_body"] = http_body
+    Args:
+        events (list): The context objects (or a single one)
+        format (str): The format, either 'html', 'markdown' or 'json'
+        group_by (str, optional): Combine the rows with the same value in this column into one row. Defaults to "uuid".
+                                  Use "" to not group the rows. The rows are not grouped if no row has the column (like
+                                  "uuid", which is hidden in the tables, see FORMAT_HIDDEN_FIELDS).
+        transform (bool, optional): Transpose the table (one row per column). Defaults to False.
+        max_rows (int, optional): The maximum number of rows in the table, the rest is left out. Defaults to None (no limit).
 
-                    http_body = dict_get(http, "certificate")
-                    if http_body is not None and http_body != "None":
-                        event["response_body"] = http_body
+    Returns:
+        str: The formatted events
+    """
+    if events is None or (isinstance(events, list) and len(events) == 0):
+        return "~ No results found ~"
+    if not isinstance(events, list):  # Also accepts Timelines (the context lists of a CaseFile)
+        events = [events]
 
-            if "device" in event or "log_source_device" in event:
-                if "device" in event:
-                    device = event["device"]
-                    del event["device"]
-                if "log_source_device" in event:
-                    device = event["log_source_device"]
-                    del event["log_source_device"]
+    if format == "json":
+        return to_json(events)
 
-                if device is not None and device != "None":
-                    device = json.loads(device)
+    if group_by in FORMAT_HIDDEN_FIELDS:  # Hidden columns are never part of the rows
+        group_by = ""
 
-                    device_name = dict_get(device, "name")
-                    if device_name is not None:
-                        event["device_name"] = device_name
+    omitted = 0
+    if max_rows is not None and group_by == "" and len(events) > max_rows:  # Only the shown rows have to be created
+        omitted = len(events) - max_rows
+        events = events[:max_rows]
 
-                    device_type = dict_get(device, "type")
-                    if device_type is not None and device_type != "None":
-                        event["device_type"] = device_type
+    rows = []
+    columns = {}  # Used as ordered set, columns appear in the order they are first found
+    for row in get_table_rows(events):
+        columns.update(dict.fromkeys(row))
+        rows.append(row)
+    if len(rows) == 0:
+        return "~ No results found ~"
 
-                    device_os = dict_get(device, "os")
-                    if device_os is not None:
-                        event["device_os"] = device_os
+    if group_by != "" and group_by in columns and len(rows) > 1:
+        groups = {}
+        for row in rows:
+            groups.setdefault(row.get(group_by, ""), []).append(row)
+
+        rows = []
+        for key in sorted(groups, key=lambda key: (key == "", key)):  # Rows without the column are grouped last
+            group = groups[key]
+            row = {group_by: key} if key != "" else {}
+            for column in columns:
+                if column != group_by:
+                    cells = [cell for cell in (grouped_row.get(column) for grouped_row in group) if cell is not None]
+                    if cells:
+                        row[column] = ", ".join(cells)
+            rows.append(row)
+        columns = {group_by: None, **columns}
+
+    if max_rows is not None and len(rows) > max_rows:
+        omitted = len(rows) - max_rows
+        rows = rows[:max_rows]
+
+    columns = list(columns)
+    if transform:
+        count = len(rows)
+        rows = [{"field": column, **{str(i): row.get(column, "") for i, row in enumerate(rows)}} for column in columns]
+        columns = ["field"] + [str(i) for i in range(count)]
+
+    # TODO: Add color support
+
+    table = render_table(columns, rows, format)
+    if omitted:
+        note = "Showing the first " + str(len(rows)) + " of " + str(len(rows) + omitted) + " rows."
+        table += "<br><i>" + note + "</i><br>" if format == "html" else "\n\n_" + note + "_"
+    return table
+
+
+def get_table_rows(events):
+    """Gets the table rows of context objects (like shown by format_results()), one after another.
 
-            if "process_signature" in event:
-                signature = event["process_signature"]
-                del event["process_signature"]
+    Args:
+        events (list): The context objects
 
-                if signature is not None and signature != "None":
-                    signature = json.loads(signature)
+    Yields:
+        dict: The cells of a context object by column name
+    """
+    for event in events:
+        if event is None or type(event) is int:
+            continue
+        if isinstance(event, list):
+            event = event[0]
+            mlog.warning("format_results() - 'Event' is a list, taking first item")
+        yield _get_table_row(event)
 
-                    issuer = dict_get(signature, "issuer")
-                    if issuer is not None:
-                        event["process_signature_issuer"] = issuer
 
-                    event["process_signature_trusted"] = dict_get(signature, "is_trusted")
+def summarize_results(rows, columns, top_n=10):
+    """Summarizes table rows of context objects (see get_table_rows()) by the most common values of some columns.
 
-        except Exception as e:
-            mlog.warning("format_results() - Error expanding fields: " + str(e))
+    Args:
+        rows (list): The table rows
+        columns (list): The columns to summarize
+        top_n (int, optional): The number of most common values per column. Defaults to 10.
 
-        # Try to remove undetected / clean ThreatIntel Engine hits, as they are too many to be readable
-        try:
-            if "threat_intel_detections" in event:
-                detections_hit = ""
-                detections = event["threat_intel_detections"]
-                del event["threat_intel_detections"]
-
-                if detections is not None and detections != "None":
-                    for detection in detections:
-                        if detection.is_hit == True:
-                            detections_hit += "[ '" + detection.engine + "': " + detection.threat_name + " ]  "
-
-                event["threat_intel_detections"] = detections_hit
-        except Exception as e:
-            mlog.warning("format_results() - Error removing clean ThreatIntel Engine hits: " + str(e))
-
-        event = del_none_from_dict(event)
-        dict_events.append(event)
-
-    # If only one event, return it as a dict
-    if len(dict_events) == 1:
-        dict_events = dict_events[0]
-
-    # events = [del_none_from_dict(event.__dict__()) for event in events]
-
-    if format in ("html", "markdown"):
-        if type(dict_events) is list and len(dict_events) > 0:
-            data = pd.DataFrame(data=dict_events)
-            if group_by != "":
-                data = data.groupby([group_by]).agg(lambda x: x.tolist())
-            data.dropna(axis=1, how="all", inplace=True)
-        else:
-            data = pd.DataFrame.from_dict(dict_events, orient="index")
-            data = data.T
+    Returns:
+        dict: Per column a tuple of the number of distinct values and the list of (value, count) of the most common values
+    """
+    counters = {column: Counter() for column in columns}
+    for row in rows:
+        for column, counter in counters.items():
+            cell = row.get(column)
+            if cell is not None:
+                counter[cell] += 1
+    return {column: (len(counter), counter.most_common(top_n)) for column, counter in counters.items()}
 
-        # TODO: Add color support
 
-        if transform:
-            data = data.T
+def export_results(events, file, format="csv", rows=None):
+    """Writes context objects to a (text) file, one after another, so that large results do not have to fit in a string.
 
-        if format == "html":
-            tmp = data.to_html(index=False, classes=None, bold_rows=True)
-            return tmp.replace(' class="dataframe"', "")
+    Args:
+        events (list): The context objects
+        file (io.TextIOBase): The file to write to
+        format (str, optional): Either 'csv' (the table rows of format_results()) or 'json' (JSON Lines with all fields).
+                                Defaults to "csv".
+        rows (list, optional): The table rows of the context objects, if they were already created by get_table_rows().
 
-        elif format == "markdown":
-            return data.to_markdown(index="false")
-    elif format == "json":
-        return json.dumps(events, ensure_ascii=False, sort_keys=False)
+    Returns:
+        int: The number of written objects
+    """
+    count = 0
+    if format == "json":
+        for event in events:
+            if event is not None and type(event) is not int:
+                file.write(to_json(event) + "\n")
+                count += 1
+        return count
+
+    columns = {}  # First pass to find the columns, as the header of a CSV file has to be written first
+    for row in rows if rows is not None else get_table_rows(events):
+        columns.update(dict.fromkeys(row))
+
+    writer = csv.DictWriter(file, fieldnames=list(columns))
+    writer.writeheader()
+    for row in rows if rows is not None else get_table_rows(events):
+        writer.writerow(row)
+        count += 1
+    return count
 
 
 def get_unique(data):
@@ -436,6 +717,45 @@ def get_unique(data):
 # [internal note] Copied the following from class_helper to this file, to better separate classes and generic functions
 
 
+class IPInfo(NamedTuple):
+    """A parsed IP address and its classification, as returned by get_ip_info().
+
+    Attributes:
+        address (ipaddress.IPv4Address or ipaddress.IPv6Address): The IP address object
+        is_private (bool): Whether the address is private
+        is_global (bool): Whether the address is globally reachable
+        is_loopback (bool): Whether the address is a loopback address
+        is_multicast (bool): Whether the address is a multicast address
+    """
+
+    address: Union[ipaddress.IPv4Address, ipaddress.IPv6Address]
+    is_private: bool
+    is_global: bool
+    is_loopback: bool
+    is_multicast: bool
+
+
+@lru_cache(maxsize=IP_CACHE_SIZE)
+def _parse_ip(ip) -> IPInfo:
+    address = ip if type(ip) in (ipaddress.IPv4Address, ipaddress.IPv6Address) else ipaddress.ip_address(ip)
+    return IPInfo(address, address.is_private, address.is_global, address.is_loopback, address.is_multicast)
+
+
+def get_ip_info(ip) -> IPInfo:
+    """Parses and classifies an IP address. Results are memoized, as the same addresses are seen over and over again.
+
+    Args:
+        ip (str, int, ipaddress.IPv4Address or ipaddress.IPv6Address): The IP address
+
+    Returns:
+        IPInfo: The address object and its classification (None if the IP address is invalid)
+    """
+    try:
+        return _parse_ip(ip)
+    except (ValueError, TypeError):
+        return None
+
+
 def cast_to_ipaddress(ip, strict=True) -> Union[ipaddress.IPv4Address, ipaddress.IPv6Address]:
     """Tries to cast a string to an IP address.
 
@@ -451,13 +771,13 @@ def cast_to_ipaddress(ip, strict=True) -> Union[ipaddress.IPv4Address, ipaddress
     if not ip and not strict:
         return None
     if type(ip) != ipaddress.IPv4Address and type(ip) != ipaddress.IPv6Address and type(ip) != None:
-        try:
-            ip = ipaddress.ip_address(ip)
-        except ValueError:
+        ip_info = get_ip_info(ip)
+        if ip_info is None:
             if strict:
                 raise ValueError("invalid ip address: " + str(ip))
             else:
                 return None
+        ip = ip_info.address
     return ip
 
 
@@ -485,36 +805,289 @@ def handle_percentage(percentage):
     return percentage
 
 
+class Timeline(list):
+    """A list of contexts that is always sorted by the timestamp of the contexts.
+
+    Contexts with the same timestamp keep the order in which they were added. Finding the insertion point uses binary
+    search and adding contexts in chronological order is an append. Reading works like with a normal list.
+
+    Attributes:
+        max_size (int): The maximum number of contexts in the timeline (further contexts are dropped)
+
+    Methods:
+        add(context, timestamp=None): Adds a context at the right place of the timeline
+        extend(contexts): Adds multiple contexts and sorts only once
+        between(start, end): Returns all contexts with a timestamp between start and end (inclusive)
+    """
+
+    def __init__(self, contexts: list = None, max_size: int = THRESHOLD_MAX_CONTEXTS):
+        super().__init__()
+        self._timestamps = []  # The timestamps of the contexts (same order as the contexts)
+        self.max_size = max_size
+        if contexts:
+            self.extend(contexts)
+
+    def __reduce__(self):
+        return (self.__class__, (list(self), self.max_size))
+
+    def _log_overflow(self, context):
+        mlog = logging_helper.Log("lib.generic_helper")
+        mlog.debug(
+            "Timeline - [OVERFLOW PROTECTION] Maximum number of contexts reached. No more contexts will be added to the context list of context type '"
+            + str(type(context))
+            + "'."
+        )  # This logs to debug instead of warning, as it can likely spam the log and also there should be a warning on playbook level
+
+    def add(self, context, timestamp: datetime.datetime = None) -> bool:
+        """Adds a context at the right place of the timeline.
+
+        Args:
+            context (any): The context to add
+            timestamp (datetime, optional): The timestamp of the context. Defaults to context.timestamp.
+
+        Returns:
+            bool: True if the context was added, False if the timeline is full
+        """
+        if len(self) >= self.max_size:
+            self._log_overflow(context)
+            return False
+
+        if timestamp is None:
+            timestamp = context.timestamp
+
+        if len(self._timestamps) == 0 or not timestamp < self._timestamps[-1]:
+            self._timestamps.append(timestamp)
+            super().append(context)
+        else:
+            i = bisect.bisect_right(self._timestamps, timestamp)
+            self._timestamps.insert(i, timestamp)
+            super().insert(i, context)
+        return True
+
+    def append(self, context):
+        self.add(context)
+
+    def insert(self, index, context):
+        """Adds the context at the right place of the timeline (the index is ignored, as the timeline is always sorted)."""
+        self.add(context)
+
+    def extend(self, contexts):
+        """Adds multiple contexts to the timeline and sorts it only once.
+
+        Args:
+            contexts (iterable): The contexts to add (each needs a 'timestamp' attribute)
+        """
+        contexts = list(contexts)
+        free = self.max_size - len(self)
+        if len(contexts) > free:
+            self._log_overflow(contexts[free] if free >= 0 else contexts[0])
+            contexts = contexts[: max(free, 0)]
+        if len(contexts) == 0:
+            return
+
+        items = list(zip(self._timestamps, self)) + [(context.timestamp, context) for context in contexts]
+        items.sort(key=lambda item: item[0])  # stable: keeps the insertion order for equal timestamps
+        super().clear()
+        super().extend(item[1] for item in items)
+        self._timestamps = [item[0] for item in items]
+
+    def __iadd__(self, contexts):
+        self.extend(contexts)
+        return self
+
+    def between(self, start: datetime.datetime = None, end: datetime.datetime = None) -> list:
+        """Returns all contexts with a timestamp between start and end.
+
+        Args:
+            start (datetime, optional): The start of the time range (inclusive). Defaults to no limit.
+            end (datetime, optional): The end of the time range (inclusive). Defaults to no limit.
+
+        Returns:
+            list: The contexts in the time range in chronological order
+        """
+        i = 0 if start is None else bisect.bisect_left(self._timestamps, start)
+        j = len(self) if end is None else bisect.bisect_right(self._timestamps, end)
+        return list(self[i:j])
+
+    def remove(self, context):
+        i = self.index(context)
+        del self[i]
+
+    def pop(self, index: int = -1):
+        self._timestamps.pop(index)
+        return super().pop(index)
+
+    def clear(self):
+        self._timestamps.clear()
+        super().clear()
+
+    def __delitem__(self, index):
+        del self._timestamps[index]
+        super().__delitem__(index)
+
+    def __setitem__(self, index, value):
+        raise TypeError("Contexts of a Timeline can not be replaced. Remove the context and add the new one instead.")
+
+    def sort(self, *args, **kwargs):
+        raise TypeError("A Timeline is always sorted by timestamp.")
+
+    def reverse(self):
+        raise TypeError("A Timeline is always sorted by timestamp.")
+
+
+def strip_wildcard(domain):
+    """Removes a leading '*.' from a (certificate or DNS) domain.
+
+    Args:
+        domain (str): The domain
+
+    Returns:
+        str: The domain without wildcard
+    """
+    if type(domain) is str and domain.startswith("*."):
+        return domain[2:]
+    return domain
+
+
+class IndicatorSet(list):
+    """A list of indicators without duplicates.
+
+    Indicators are normalized when they are added and duplicates are ignored (O(1) check). The order of the indicators
+    is the order in which they were added first. Reading works like with a normal list.
+
+    Attributes:
+        normalize (function): The function used to normalize an indicator before it is added (or None)
+
+    Methods:
+        add(indicator): Adds an indicator if it is not already in the set
+        extend(indicators): Adds multiple indicators
+    """
+
+    def __init__(self, indicators=None, normalize=None):
+        super().__init__()
+        self._keys = set()
+        self.normalize = normalize
+        if indicators:
+            self.extend(indicators)
+
+    def __reduce__(self):
+        return (self.__class__, (list(self), self.normalize))
+
+    @staticmethod
+    def _key(indicator):
+        try:
+            hash(indicator)
+            return indicator
+        except TypeError:
+            return str(indicator)
+
+    def add(self, indicator) -> bool:
+        """Adds an indicator if it is not already in the set. None is ignored.
+
+        Args:
+            indicator (any): The indicator
+
+        Returns:
+            bool: True if the indicator was added, False if it was already in the set (or None)
+        """
+        if indicator is None:
+            return False
+        if self.normalize is not None:
+            indicator = self.normalize(indicator)
+        key = self._key(indicator)
+        if key in self._keys:
+            return False
+        self._keys.add(key)
+        super().append(indicator)
+        return True
+
+    def append(self, indicator):
+        self.add(indicator)
+
+    def extend(self, indicators):
+        for indicator in indicators:
+            self.add(indicator)
+
+    def __iadd__(self, indicators):
+        self.extend(indicators)
+        return self
+
+    def __contains__(self, indicator):
+        if self.normalize is not None:
+            indicator = self.normalize(indicator)
+        return self._key(indicator) in self._keys
+
+    def remove(self, indicator):
+        if self.normalize is not None:
+            indicator = self.normalize(indicator)
+        super().remove(indicator)
+        self._keys.discard(self._key(indicator))
+
+    def pop(self, index: int = -1):
+        indicator = super().pop(index)
+        self._keys.discard(self._key(indicator))
+        return indicator
+
+    def clear(self):
+        self._keys.clear()
+        super().clear()
+
+    def __delitem__(self, index):
+        for indicator in self[index] if isinstance(index, slice) else [self[index]]:
+            self._keys.discard(self._key(indicator))
+        super().__delitem__(index)
+
+    def __setitem__(self, index, value):
+        raise TypeError("Indicators of an IndicatorSet can not be replaced. Remove the indicator and add the new one instead.")
+
+    def insert(self, index, indicator):
+        raise TypeError("Indicators of an IndicatorSet are kept in the order they were added. Use add() instead.")
+
+
+def create_indicators() -> dict:
+    """Creates the indicator dictionary used by detections and detection cases.
+
+    Returns:
+        dict: An empty IndicatorSet for every indicator type
+    """
+    return {
+        "ip": IndicatorSet(),
+        "domain": IndicatorSet(normalize=strip_wildcard),
+        "url": IndicatorSet(),
+        "hash": IndicatorSet(),
+        "email": IndicatorSet(),
+        "countries": IndicatorSet(),
+        "registry": IndicatorSet(),
+        "other": IndicatorSet(),
+    }
+
+
 def add_to_timeline(context_list, context, timestamp: datetime):
     """Adds a context to a context list, respecting the timeline.
 
     Args:
-        context_list (list): The context list
+        context_list (list): The context list (a Timeline or a list sorted by timestamp)
         context (dict): The context to add
         timestamp (datetime): The timestamp of the context
 
     Returns:
-        None
+        bool: True if the context was added, False if the context list is full
     """
-    if type(context) == list and len(context) >= THRESHOLD_MAX_CONTEXTS:
+    if isinstance(context_list, Timeline):
+        return context_list.add(context, timestamp)
+
+    if len(context_list) >= THRESHOLD_MAX_CONTEXTS:
         mlog = logging_helper.Log("lib.class_helper")
         mlog.debug(
             "add_to_timeline() - [OVERFLOW PROTECTION] Maximum number of contexts reached. No more contexts will be added to the context list of context type '"
             + str(type(context_list[0]))
             + "'."
         )  # This logs to debug instead of warning, as it can likely spam the log and also there should be a warning on playbook level
-        return
+        return False
 
-    if len(context_list) == 0:
-        context_list.append(context)
-    else:
-        for i in range(len(context_list)):
-            if context_list[i].timestamp > timestamp:
-                context_list.insert(i, context)
-                break
-            elif i == len(context_list) - 1:
-                context_list.append(context)
-                break
+    i = bisect.bisect_right(context_list, timestamp, key=lambda c: c.timestamp)
+    context_list.insert(i, context)
+    return True
 
 
 def remove_duplicates_from_dict(d):
@@ -547,3 +1120,191 @@ def default(obj):
     if isinstance(obj, datetime.datetime):
         return obj.isoformat()
     raise TypeError
+
+
+WHITELIST_INDICATOR_TYPES = {
+    "ip": "global_whitelist_ips",
+    "domain": "global_whitelist_domains",
+    "hash": "global_whitelist_hashes",
+    "url": "global_whitelist_urls",
+    "email": "global_whitelist_emails",
+}  # Indicator type -> cache 'integration' that holds the global whitelist of that type
+
+
+class Whitelist:
+    """A compiled whitelist for matching indicators.
+
+    Hashes, URLs and emails are stored in hash sets. IP entries can be single addresses or CIDR ranges and are stored in
+    one hash set of network addresses per prefix length, so an IP is matched with at most one lookup per prefix length.
+    Domains are stored in a trie of their reversed labels. A plain entry only matches the domain itself, a '*.' wildcard
+    entry matches the domain and all of its subdomains.
+
+    Attributes:
+        size (int): The number of whitelist entries
+
+    Methods:
+        add(indicator_type, entry): Adds an entry to the whitelist
+        match(indicator_type, indicator): Returns the whitelist entry that matches the indicator (or None)
+        match_indicators(indicators): Returns the first whitelisted indicator of an indicator dictionary (or None)
+    """
+
+    _END = ""  # Key that marks the end of a domain in the domain trie (labels can not be empty)
+    _WILDCARD = "*"  # Key that marks a '*.' wildcard domain in the domain trie (matches the domain and its subdomains)
+
+    def __init__(self):
+        self.size = 0
+        self._sets = {"hash": set(), "url": set(), "email": set()}
+        self._networks = {4: {}, 6: {}}  # IP version -> {prefix length -> set of network addresses (as int)}
+        self._domains = {}
+
+    def add(self, indicator_type: str, entry) -> bool:
+        """Adds an entry to the whitelist.
+
+        Args:
+            indicator_type (str): The indicator type (one of WHITELIST_INDICATOR_TYPES)
+            entry (str): The entry (for IPs also a CIDR range, for domains also a '*.' wildcard domain)
+
+        Returns:
+            bool: True if the entry was added, False if it is empty or invalid
+        """
+        if entry is None or str(entry).strip() == "":
+            return False
+        entry = str(entry).strip()
+
+        if indicator_type == "ip":
+            try:
+                network = ipaddress.ip_network(entry, strict=False)
+            except ValueError:
+                mlog.warning("Whitelist.add() - Ignoring invalid IP whitelist entry '" + entry + "'")
+                return False
+            self._networks[network.version].setdefault(network.prefixlen, set()).add(int(network.network_address))
+        elif indicator_type == "domain":
+            node = self._domains
+            for label in reversed(strip_wildcard(entry.lower()).strip(".").split(".")):
+                node = node.setdefault(label, {})
+            node[self._WILDCARD if entry.startswith("*.") else self._END] = entry
+        elif indicator_type in self._sets:
+            self._sets[indicator_type].add(entry if indicator_type == "url" else entry.lower())
+        else:
+            raise ValueError("Unknown whitelist indicator type '" + str(indicator_type) + "'")
+
+        self.size += 1
+        return True
+
+    def match(self, indicator_type: str, indicator):
+        """Returns the whitelist entry that matches an indicator.
+
+        Args:
+            indicator_type (str): The indicator type (one of WHITELIST_INDICATOR_TYPES)
+            indicator (any): The indicator
+
+        Returns:
+            str: The matching whitelist entry (or None)
+        """
+        if indicator is None:
+            return None
+
+        if indicator_type == "ip":
+            try:
+                ip = indicator
+                if not isinstance(ip, (ipaddress.IPv4Address, ipaddress.IPv6Address)):
+                    ip = ipaddress.ip_address(str(indicator))
+            except ValueError:
+                return None
+            ip_int = int(ip)
+            for prefixlen, networks in self._networks[ip.version].items():
+                network_int = ip_int >> (ip.max_prefixlen - prefixlen) << (ip.max_prefixlen - prefixlen)
+                if network_int in networks:
+                    return str(ipaddress.ip_address(network_int)) + "/" + str(prefixlen)
+            return None
+
+        if indicator_type == "domain":
+            node = self._domains
+            for label in reversed(strip_wildcard(str(indicator).lower()).strip(".").split(".")):
+                node = node.get(label)
+                if node is None:
+                    return None
+                if self._WILDCARD in node:
+                    return node[self._WILDCARD]
+            return node.get(self._END)
+
+        entries = self._sets.get(indicator_type)
+        if entries is None:
+            return None
+        indicator = str(indicator) if indicator_type == "url" else str(indicator).lower()
+        return indicator if indicator in entries else None
+
+    def match_indicators(self, indicators: dict):
+        """Returns the first whitelisted indicator of an indicator dictionary (as created by create_indicators()).
+
+        Args:
+            indicators (dict): The indicators (key: indicator type, value: list of indicators)
+
+        Returns:
+            tuple: (indicator type, indicator, whitelist entry) of the first match or None
+        """
+        for indicator_type in WHITELIST_INDICATOR_TYPES:
+            for indicator in indicators.get(indicator_type, []):
+                entry = self.match(indicator_type, indicator)
+                if entry is not None:
+                    return indicator_type, indicator, entry
+        return None
+
+
+_whitelist = {"config_version": None, "cache_path": None, "cache_version": None, "lists": None, "whitelist": Whitelist()}
+_whitelist_lock = threading.Lock()
+
+
+def _file_version(path):
+    try:
+        stat = os.stat(path)
+        return stat.st_mtime_ns, stat.st_size
+    except OSError:
+        return None
+
+
+def get_whitelist() -> Whitelist:
+    """Returns the compiled global whitelist.
+
+    The whitelist is compiled from the 'global_whitelist_*' lists in the cache. The cache file is only read again if it
+    changed, and as other cache entries (like VirusTotal verdicts) change far more often, the whitelist is only
+    recompiled if the whitelist lists themselves changed.
+
+    Returns:
+        Whitelist: The compiled whitelist
+    """
+    with _whitelist_lock:
+        config_version = (config_helper.FILE_PATH, _file_version(config_helper.FILE_PATH))
+        if config_version != _whitelist["config_version"]:
+            config_all = config_helper.Config().cfg
+            _whitelist["cache_path"] = config_all["cache"]["file"]["path"] if config_all["cache"]["file"]["enabled"] else None
+            _whitelist["config_version"] = config_version
+            _whitelist["cache_version"] = None
+
+        cache_path = _whitelist["cache_path"]
+        cache_version = _file_version(cache_path) if cache_path else None
+        if cache_version is not None and cache_version == _whitelist["cache_version"]:
+            return _whitelist["whitelist"]
+
+        lists = {}
+        if cache_version is not None:
+            try:
+                with _cache_lock:
+                    with open(cache_path, "r") as f:
+                        cache = json.load(f)
+                lists = {cache_name: dict_get(cache, cache_name + ".LIST") for cache_name in WHITELIST_INDICATOR_TYPES.values()}
+            except Exception as e:
+                mlog.warning("get_whitelist() - Could not load the global whitelist from cache: " + str(e))
+        _whitelist["cache_version"] = cache_version
+        if lists == _whitelist["lists"]:
+            return _whitelist["whitelist"]
+
+        whitelist = Whitelist()
+        for indicator_type, cache_name in WHITELIST_INDICATOR_TYPES.items():
+            for entry in lists.get(cache_name) or []:
+                whitelist.add(indicator_type, entry)
+
+        mlog.debug("get_whitelist() - Compiled global whitelist with " + str(whitelist.size) + " entries")
+        _whitelist["whitelist"] = whitelist
+        _whitelist["lists"] = lists
+        return whitelist
@@ -94,6 +94,16 @@ class Log:
         for handler in self.logger.handlers:
             handler.setLevel(level.upper())
 
+    def is_debug_enabled(self):
+        """Checks if debug messages are logged. Use it to skip building expensive debug messages.
+
+        Returns:
+            bool: True if debug messages are logged
+        """
+        if not self.logger.isEnabledFor(logging.DEBUG):
+            return False
+        return any(handler.level <= logging.DEBUG for handler in self.logger.handlers)  # The handlers filter by their own level
+
     def debug(self, message):
         """Logs a debug message.
 
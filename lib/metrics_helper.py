@@ -0,0 +1,278 @@
+# Z-SOAR
+# Created by: Martin Offermann
+# This module is a helper module that records how long the stages of the worker pipeline take (so called spans).
+#
+# A span is recorded for every fetch of new detections, playbook call, context request, cache access and ticket note.
+# The spans are buffered and appended as JSON lines to METRICS_FILE, which 'zsoar.py --status' summarizes per stage.
+# When METRICS_FILE grows beyond METRICS_MAX_FILE_SIZE, it is rotated to METRICS_FILE + '.1' (replacing the older one).
+#
+# Usage:
+#   with metrics_helper.span("playbook.handle_detection", playbook=playbook_name):
+#       ...
+#
+#   @metrics_helper.timed("cache.get")
+#   def get_from_cache(...):
+
+import atexit
+import datetime
+import functools
+import json
+import math
+import os
+import threading
+import time
+
+import lib.logging_helper as logging_helper
+
+METRICS_ENABLED = True  # Weither or not to record spans
+METRICS_FILE = "logs/metrics.jsonl"  # The file the spans are appended to (one JSON object per line)
+METRICS_BUFFER_SIZE = 100  # Number of spans that are buffered before they are written to the file
+METRICS_STATUS_MAX_SPANS = 100000  # Number of most recent spans that are summarized by 'zsoar.py --status'
+METRICS_MAX_FILE_SIZE = 20 * 1024 * 1024  # Size in bytes after which METRICS_FILE is rotated (so it can not grow forever)
+METRICS_READ_BLOCK_SIZE = 64 * 1024  # Size in bytes of the blocks the metrics file is read in (from the end)
+
+mlog = logging_helper.Log("lib.metrics_helper")
+
+_buffer = []  # Spans that are not written yet
+_buffer_lock = threading.Lock()
+_listeners = []  # Functions that are called with every recorded span (e.g. by the metrics endpoint of the daemon)
+
+
+def record_span(stage, duration, ok=True, **labels):
+    """Records a span.
+
+    Args:
+        stage (str): The name of the stage (e.g. 'playbook.handle_detection')
+        duration (float): The duration in seconds
+        ok (bool, optional): Whether the stage was successful (did not raise an exception). Defaults to True.
+        **labels: Additional labels of the span (e.g. playbook='PB_010_Generic_Elastic_Alerts')
+
+    Returns:
+        None
+    """
+    if not METRICS_ENABLED:
+        return
+
+    record = {
+        "timestamp": datetime.datetime.now().isoformat(),
+        "stage": stage,
+        "duration_ms": round(duration * 1000, 3),
+        "ok": ok,
+    }
+    record.update(labels)
+
+    for listener in _listeners:
+        try:
+            listener(record)
+        except Exception as e:
+            mlog.warning(f"A metrics listener failed for stage '{stage}': {e}")
+
+    with _buffer_lock:
+        _buffer.append(record)
+        if len(_buffer) < METRICS_BUFFER_SIZE:
+            return
+    flush()
+
+
+class span:
+    """Context manager that records a span for the code in its block.
+
+    Args:
+        stage (str): The name of the stage
+        **labels: Additional labels of the span
+    """
+
+    __slots__ = ("stage", "labels", "start")
+
+    def __init__(self, stage, **labels):
+        self.stage = stage
+        self.labels = labels
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        record_span(self.stage, time.perf_counter() - self.start, exc_type is None, **self.labels)
+        return False
+
+
+def timed(stage, with_module=False, result_labels=None):
+    """Decorator that records a span for every call of a function.
+
+    Args:
+        stage (str): The name of the stage
+        with_module (bool, optional): Whether to label the spans with the module of the function (e.g. the integration).
+                                      Defaults to False.
+        result_labels (function, optional): Function that gets additional labels (as dict) from the return value.
+                                            Defaults to None.
+
+    Returns:
+        function: The decorator
+    """
+
+    def decorator(function):
+        labels = {"module": function.__module__.rsplit(".", 1)[-1]} if with_module else {}
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(stage, **labels) as function_span:
+                result = function(*args, **kwargs)
+                if result_labels is not None:
+                    function_span.labels = {**labels, **result_labels(result)}
+                return result
+
+        return wrapper
+
+    return decorator
+
+
+def add_listener(listener):
+    """Adds a function that is called with every recorded span (as dictionary).
+
+    Args:
+        listener (function): The function
+
+    Returns:
+        None
+    """
+    _listeners.append(listener)
+
+
+def remove_listener(listener):
+    """Removes a function that was added with add_listener().
+
+    Args:
+        listener (function): The function
+
+    Returns:
+        None
+    """
+    if listener in _listeners:
+        _listeners.remove(listener)
+
+
+def flush():
+    """Writes the buffered spans to METRICS_FILE.
+
+    Returns:
+        None
+    """
+    with _buffer_lock:
+        if not _buffer:
+            return
+        lines = "".join(json.dumps(record, default=str) + "\n" for record in _buffer)
+        _buffer.clear()
+
+        try:
+            os.makedirs(os.path.dirname(METRICS_FILE) or ".", exist_ok=True)
+            if os.path.isfile(METRICS_FILE) and os.path.getsize(METRICS_FILE) >= METRICS_MAX_FILE_SIZE:
+                os.replace(METRICS_FILE, METRICS_FILE + ".1")
+            with open(METRICS_FILE, "a") as f:
+                f.write(lines)
+        except OSError as e:
+            mlog.warning("flush() - Could not write metrics to '" + METRICS_FILE + "': " + str(e))
+
+
+atexit.register(flush)
+
+
+def _read_last_lines(path, max_lines):
+    """Reads the last lines of a file, block by block from the end, so that large files are not read completely.
+
+    Args:
+        path (str): The path of the file
+        max_lines (int): The maximum number of lines to read
+
+    Returns:
+        list: The lines (as str, without line breaks), oldest first
+    """
+    if max_lines <= 0:
+        return []
+    try:
+        with open(path, "rb") as f:
+            position = f.seek(0, os.SEEK_END)
+            data = b""
+            while position > 0 and data.count(b"\n") <= max_lines:
+                size = min(METRICS_READ_BLOCK_SIZE, position)
+                position -= size
+                f.seek(position)
+                data = f.read(size) + data
+    except FileNotFoundError:
+        return []
+
+    lines = data.decode("utf-8", errors="replace").splitlines()
+    if position > 0:
+        lines = lines[1:]  # The first line may have been cut off by the block boundary
+    return lines[-max_lines:]
+
+
+def load_spans(path=None, max_spans=METRICS_STATUS_MAX_SPANS):
+    """Loads the most recent spans from the metrics file (and from the rotated file, if it has not enough spans).
+
+    Args:
+        path (str, optional): The path of the metrics file. Defaults to METRICS_FILE.
+        max_spans (int, optional): The maximum number of spans to load. Defaults to METRICS_STATUS_MAX_SPANS.
+
+    Returns:
+        list: The spans (as dictionaries), oldest first
+    """
+    path = path or METRICS_FILE
+    lines = _read_last_lines(path, max_spans)
+    lines = _read_last_lines(path + ".1", max_spans - len(lines)) + lines
+
+    spans = []
+    for line in lines:
+        try:
+            spans.append(json.loads(line))
+        except ValueError:  # E.g. a line that was cut off when the process was killed
+            continue
+    return spans
+
+
+def percentile(values, p):
+    """Gets the p-th percentile of the values (nearest rank).
+
+    Args:
+        values (list): The values, sorted ascending
+        p (float): The percentile (0-100)
+
+    Returns:
+        float: The percentile or None if there are no values
+    """
+    if not values:
+        return None
+    rank = max(1, math.ceil(len(values) * p / 100))
+    return values[rank - 1]
+
+
+def get_stage_stats(spans):
+    """Summarizes spans per stage.
+
+    Args:
+        spans (list): The spans
+
+    Returns:
+        dict: Per stage a dict with 'count', 'errors', 'p50_ms', 'p95_ms', 'max_ms' and 'total_ms', ordered by stage
+    """
+    durations = {}
+    errors = {}
+    for record in spans:
+        stage = record.get("stage")
+        durations.setdefault(stage, []).append(record.get("duration_ms", 0))
+        if not record.get("ok", True):
+            errors[stage] = errors.get(stage, 0) + 1
+
+    stats = {}
+    for stage in sorted(durations, key=str):
+        values = sorted(durations[stage])
+        stats[stage] = {
+            "count": len(values),
+            "errors": errors.get(stage, 0),
+            "p50_ms": percentile(values, 50),
+            "p95_ms": percentile(values, 95),
+            "max_ms": values[-1],
+            "total_ms": round(sum(values), 3),
+        }
+    return stats
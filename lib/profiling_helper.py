@@ -0,0 +1,145 @@
+# Z-SOAR
+# Created by: Martin Offermann
+# This module is a helper module that profiles worker cycles with cProfile and tracemalloc ('zsoar.py --profile').
+#
+# For every profiled cycle, two files are written to PROFILES_DIR:
+#   <label>_<time>_cycle<n>.pstats           The cProfile statistics (e.g. 'python -m pstats <file>' or snakeviz)
+#   <label>_<time>_cycle<n>_allocations.txt  The code lines that allocated the most memory that was still in use at the end
+#
+# Both profilers slow the worker down noticeably, so the daemon can profile only every Nth cycle.
+#
+# Usage:
+#   profiler = profiling_helper.Profiler(every_nth=10)
+#   profiler.run(zsoar_worker.main, cfg, fromDaemon=True)
+
+import cProfile
+import datetime
+import os
+import time
+import tracemalloc
+
+PROFILES_DIR = "logs/profiles"  # The directory the profiles are written to
+TOP_ALLOCATIONS = 30  # Number of code lines listed in the allocations report
+TRACEMALLOC_FRAMES = 1  # Number of frames stored per allocation (more frames make tracing slower)
+IGNORED_ALLOCATION_FILES = (  # Allocations of the import system and the profilers are not listed in the report
+    "<frozen importlib._bootstrap>",
+    "<frozen importlib._bootstrap_external>",
+    tracemalloc.__file__,
+    cProfile.__file__,
+    __file__,
+)
+
+
+class Profiler:
+    """Runs functions (usually zsoar_worker.main) and profiles every Nth call with cProfile and tracemalloc.
+
+    Args:
+        every_nth (int, optional): Profile only every Nth call (the first call is always profiled). Defaults to 1.
+        directory (str, optional): The directory the profiles are written to. Defaults to PROFILES_DIR.
+        label (str, optional): The prefix of the file names. Defaults to "worker".
+        top_allocations (int, optional): Number of code lines listed in the allocations report. Defaults to TOP_ALLOCATIONS.
+    """
+
+    def __init__(self, every_nth=1, directory=PROFILES_DIR, label="worker", top_allocations=TOP_ALLOCATIONS):
+        if every_nth < 1:
+            raise ValueError("every_nth must be at least 1, got " + str(every_nth))
+        self.every_nth = every_nth
+        self.directory = directory
+        self.label = label
+        self.top_allocations = top_allocations
+        self.calls = 0
+        self.last_files = None  # The files written for the last profiled call (pstats, allocations report)
+
+    def run(self, function, *args, **kwargs):
+        """Calls the function and profiles the call if it is sampled. The profile is also written if the function fails.
+
+        Args:
+            function (function): The function
+            *args: The arguments of the function
+            **kwargs: The keyword arguments of the function
+
+        Returns:
+            The return value of the function
+        """
+        self.calls += 1
+        if (self.calls - 1) % self.every_nth != 0:
+            return function(*args, **kwargs)
+
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+        tracemalloc.reset_peak()
+
+        profile = cProfile.Profile()
+        start = time.perf_counter()
+        ok = False
+        try:
+            result = profile.runcall(function, *args, **kwargs)
+            ok = True
+            return result
+        finally:
+            duration = time.perf_counter() - start
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            if started_tracing:
+                tracemalloc.stop()
+            self.last_files = self._write(profile, snapshot, duration, ok, current, peak)
+
+    def _write(self, profile, snapshot, duration, ok, current, peak):
+        """Writes the pstats file and the allocations report of a profiled call.
+
+        Returns:
+            tuple: The paths of the pstats file and the allocations report
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        name = self.label + "_" + datetime.datetime.now().strftime("%Y%m%d_%H%M%S") + "_cycle" + str(self.calls)
+        pstats_path = os.path.join(self.directory, name + ".pstats")
+        report_path = os.path.join(self.directory, name + "_allocations.txt")
+
+        profile.dump_stats(pstats_path)
+        with open(report_path, "w") as f:
+            f.write(format_allocations(snapshot, self.top_allocations, duration, ok, current, peak))
+        return pstats_path, report_path
+
+
+def format_allocations(snapshot, top_allocations=TOP_ALLOCATIONS, duration=None, ok=True, current=None, peak=None):
+    """Formats a report of the code lines that allocated the most memory.
+
+    Args:
+        snapshot (tracemalloc.Snapshot): The snapshot taken at the end of the profiled call
+        top_allocations (int, optional): Number of code lines listed. Defaults to TOP_ALLOCATIONS.
+        duration (float, optional): The duration of the call in seconds
+        ok (bool, optional): Whether the call was successful (did not raise an exception). Defaults to True.
+        current (int, optional): The traced memory at the end of the call in bytes
+        peak (int, optional): The peak of the traced memory during the call in bytes
+
+    Returns:
+        str: The report
+    """
+    snapshot = snapshot.filter_traces([tracemalloc.Filter(False, file) for file in IGNORED_ALLOCATION_FILES])
+    statistics = snapshot.statistics("lineno")
+
+    lines = ["Z-SOAR allocations report (" + datetime.datetime.now().isoformat(timespec="seconds") + ")"]
+    if duration is not None:
+        lines.append("Duration:      " + str(round(duration, 3)) + " s" + ("" if ok else " (failed)"))
+    if current is not None and peak is not None:
+        lines.append("Traced memory: " + _format_size(current) + " at the end, " + _format_size(peak) + " peak")
+    top = min(top_allocations, len(statistics))
+    lines.append("Memory still allocated at the end, by the top " + str(top) + " of " + str(len(statistics)) + " code lines:")
+    lines.append("")
+    lines.append("{:>12s}{:>10s}  {}".format("Size", "Blocks", "Code line"))
+    for statistic in statistics[:top_allocations]:
+        frame = statistic.traceback[0]
+        lines.append(
+            "{:>12s}{:>10d}  {}:{}".format(_format_size(statistic.size), statistic.count, frame.filename, frame.lineno)
+        )
+    return "\n".join(lines) + "\n"
+
+
+def _format_size(size):
+    """Formats a size in bytes to a human readable string (e.g. '1.5 MiB')."""
+    for unit in ("B", "KiB", "MiB"):
+        if abs(size) < 1024:
+            return str(round(size, 1)) + " " + unit
+        size /= 1024
+    return str(round(size, 1)) + " GiB"
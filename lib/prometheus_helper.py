@@ -0,0 +1,219 @@
+# Z-SOAR
+# Created by: Martin Offermann
+# This module is a helper module that provides a Prometheus-compatible metrics endpoint for the daemon.
+#
+# The MetricsRegistry listens to the spans recorded by lib.metrics_helper and aggregates them to counters and histograms.
+# start_server() serves them in the Prometheus text format on a local HTTP port, so slowdowns can be alerted on.
+# Only the standard library is used, so no additional package (like prometheus_client) has to be installed.
+#
+# Usage:
+#   registry = prometheus_helper.MetricsRegistry()
+#   metrics_helper.add_listener(registry.observe_span)
+#   prometheus_helper.start_server(registry, 9464)
+
+import http.server
+import threading
+import time
+
+METRICS_HOST = "127.0.0.1"  # The address the metrics endpoint listens on (only local by default)
+METRICS_PATH = "/metrics"  # The path of the metrics endpoint
+HISTOGRAM_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)  # Upper bounds in seconds
+API_STAGES = {  # Stages that are external API calls and the label of the span that names the integration
+    "worker.provide_new_detections": "integration",
+    "integration.provide_context": "module",
+    "znuny.add_note": "module",
+}
+
+# The exported metrics with their type and help text
+METRICS = {
+    "zsoar_detections_ingested_total": ("counter", "Detections provided by the integrations."),
+    "zsoar_cases_handled_total": ("counter", "Cases handled by the playbooks, by result."),
+    "zsoar_playbook_duration_seconds": ("histogram", "Time the playbooks took to handle a case."),
+    "zsoar_api_call_duration_seconds": ("histogram", "Time the calls to external APIs took."),
+    "zsoar_api_call_errors_total": ("counter", "Calls to external APIs that failed."),
+    "zsoar_cache_requests_total": ("counter", "Cache lookups, by result (hit or miss)."),
+    "zsoar_cache_hit_ratio": ("gauge", "Share of cache lookups that were hits."),
+    "zsoar_daemon_cycle_duration_seconds": ("histogram", "Time a worker cycle of the daemon took."),
+    "zsoar_daemon_cycle_overruns_total": ("counter", "Worker cycles that took longer than the daemon interval."),
+    "zsoar_daemon_last_cycle_timestamp_seconds": ("gauge", "Unix time at which the last worker cycle finished."),
+}
+
+
+class Histogram:
+    """A histogram with cumulative buckets, like it is exported to Prometheus.
+
+    Args:
+        buckets (tuple): The upper bounds of the buckets
+    """
+
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets=HISTOGRAM_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+
+def _escape_label_value(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels, extra=None):
+    items = list(labels) + (extra or [])
+    if not items:
+        return ""
+    return "{" + ",".join(name + '="' + _escape_label_value(value) + '"' for name, value in items) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class MetricsRegistry:
+    """Aggregates the recorded spans to the metrics of METRICS.
+
+    Args:
+        None
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = {}  # (metric name, labels as tuple of (name, value)) -> value or Histogram
+
+    def inc(self, name, labels=(), value=1):
+        """Increments a counter."""
+        with self.lock:
+            key = (name, tuple(labels))
+            self.values[key] = self.values.get(key, 0) + value
+
+    def set(self, name, labels=(), value=0):
+        """Sets a gauge."""
+        with self.lock:
+            self.values[(name, tuple(labels))] = value
+
+    def observe(self, name, labels=(), value=0):
+        """Adds an observation to a histogram."""
+        with self.lock:
+            key = (name, tuple(labels))
+            histogram = self.values.get(key)
+            if histogram is None:
+                histogram = self.values[key] = Histogram()
+            histogram.observe(value)
+
+    def observe_span(self, record):
+        """Updates the metrics with a recorded span. Use it as listener of lib.metrics_helper.
+
+        Args:
+            record (dict): The span, as recorded by metrics_helper.record_span()
+
+        Returns:
+            None
+        """
+        stage = record.get("stage")
+        seconds = record.get("duration_ms", 0) / 1000
+        ok = record.get("ok", True)
+
+        if stage in API_STAGES:
+            labels = (("stage", stage), ("integration", record.get(API_STAGES[stage])))
+            self.observe("zsoar_api_call_duration_seconds", labels, seconds)
+            if not ok:
+                self.inc("zsoar_api_call_errors_total", labels)
+            if stage == "worker.provide_new_detections" and record.get("detections"):
+                self.inc("zsoar_detections_ingested_total", labels[1:], record["detections"])
+        elif stage == "playbook.handle_detection":
+            playbook = ("playbook", record.get("playbook"))
+            self.observe("zsoar_playbook_duration_seconds", (playbook,), seconds)
+            self.inc("zsoar_cases_handled_total", (playbook, ("result", "ok" if ok else "error")))
+        elif stage == "cache.get":
+            self.inc("zsoar_cache_requests_total", (("result", "hit" if record.get("hit") else "miss"),))
+        elif stage == "daemon.cycle":
+            self.observe("zsoar_daemon_cycle_duration_seconds", (), seconds)
+            self.set("zsoar_daemon_last_cycle_timestamp_seconds", (), round(time.time(), 3))
+            if record.get("overrun"):
+                self.inc("zsoar_daemon_cycle_overruns_total")
+
+    def render(self):
+        """Renders the metrics in the Prometheus text format.
+
+        Returns:
+            str: The metrics
+        """
+        with self.lock:
+            values = dict(self.values)
+            histograms = {
+                key: (list(value.counts), value.sum, value.count) for key, value in values.items() if type(value) is Histogram
+            }
+
+        hits = values.get(("zsoar_cache_requests_total", (("result", "hit"),)), 0)
+        misses = values.get(("zsoar_cache_requests_total", (("result", "miss"),)), 0)
+        if hits + misses > 0:
+            values[("zsoar_cache_hit_ratio", ())] = round(hits / (hits + misses), 6)
+
+        lines = []
+        for name, (metric_type, help_text) in METRICS.items():
+            series = [(labels, value) for (metric, labels), value in values.items() if metric == name]
+            series.sort(key=lambda item: str(item[0]))
+            if not series:
+                continue
+            lines.append("# HELP " + name + " " + help_text)
+            lines.append("# TYPE " + name + " " + metric_type)
+
+            for labels, value in series:
+                if metric_type != "histogram":
+                    lines.append(name + _format_labels(labels) + " " + _format_value(value))
+                    continue
+
+                counts, total, count = histograms[(name, labels)]
+                cumulative = 0
+                for bound, bucket_count in zip(HISTOGRAM_BUCKETS, counts):
+                    cumulative += bucket_count
+                    bucket_labels = _format_labels(labels, [("le", _format_value(bound))])
+                    lines.append(name + "_bucket" + bucket_labels + " " + str(cumulative))
+                lines.append(name + "_bucket" + _format_labels(labels, [("le", "+Inf")]) + " " + str(count))
+                lines.append(name + "_sum" + _format_labels(labels) + " " + _format_value(round(total, 6)))
+                lines.append(name + "_count" + _format_labels(labels) + " " + str(count))
+        return "\n".join(lines) + "\n"
+
+
+def start_server(registry, port, host=METRICS_HOST):
+    """Starts the metrics endpoint in a background thread.
+
+    Args:
+        registry (MetricsRegistry): The registry whose metrics are served
+        port (int): The port to listen on (0 to let the OS choose one)
+        host (str, optional): The address to listen on. Defaults to METRICS_HOST.
+
+    Returns:
+        http.server.ThreadingHTTPServer: The server (call shutdown() to stop it)
+    """
+
+    class MetricsHandler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != METRICS_PATH:
+                self.send_error(404)
+                return
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # Scrapes would flood the logs
+
+    server = http.server.ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="zsoar-metrics", daemon=True).start()
+    return server
@@ -0,0 +1,135 @@
+# Z-SOAR
+# Created by: Martin Offermann
+# This module is a helper module that persists CaseFile snapshots, so that the worker can resume a case after a restart.
+#
+# A snapshot is a gzip compressed pickle of a CaseFile, stored in SNAPSHOT_DIR and named by the UUID of the case.
+# The worker writes a snapshot after every playbook that handled a case and deletes it once all playbooks are done.
+# Snapshots that are still present on the next start of the worker belong to interrupted cases and are resumed.
+
+import copyreg
+import datetime
+import gzip
+import io
+import os
+import pickle
+
+import lib.logging_helper as logging_helper
+from lib.generic_helper import get_object_state
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))  # The root directory of Z-SOAR
+SNAPSHOT_DIR = os.path.join(REPO_ROOT, "snapshots")  # The directory where the case snapshots are stored (independent of the CWD)
+SNAPSHOT_SUFFIX = ".pickle.gz"  # The file suffix of a case snapshot
+SNAPSHOT_COMPRESSION_LEVEL = 3  # The gzip compression level (1-9), snapshots are written often so favour speed
+SNAPSHOT_MAX_AGE_HOURS = 24  # Snapshots older than this are considered stale and are not resumed
+
+mlog = logging_helper.Log("lib.snapshot_helper")
+
+
+class _SnapshotPickler(pickle.Pickler):
+    """Pickler for Z-SOAR objects.
+
+    The classes of lib.class_helper override __dict__ with a method, so the default pickle protocol can not restore their
+    attributes. Their state is therefore passed as 'slot state', which pickle restores by calling setattr() for each attribute.
+    """
+
+    def reducer_override(self, obj):
+        if not isinstance(obj, type) and callable(getattr(obj, "__dict__", None)):
+            return copyreg.__newobj__, (type(obj),), (None, get_object_state(obj))
+        return NotImplemented
+
+
+def get_snapshot_path(case_uuid):
+    """Returns the path of the snapshot file of a case.
+
+    Args:
+        case_uuid (uuid.UUID): The UUID of the case
+
+    Returns:
+        str: The path of the snapshot file
+    """
+    return os.path.join(SNAPSHOT_DIR, str(case_uuid) + SNAPSHOT_SUFFIX)
+
+
+def save_snapshot(case_file):
+    """Saves a snapshot of a case file. An existing snapshot of the same case is replaced atomically.
+
+    Args:
+        case_file (CaseFile): The case file to save
+
+    Returns:
+        bool: True if the snapshot was saved, False if not
+    """
+    path = get_snapshot_path(case_file.uuid)
+    try:
+        buffer = io.BytesIO()
+        _SnapshotPickler(buffer, protocol=pickle.HIGHEST_PROTOCOL).dump(case_file)
+
+        os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+        with open(path + ".tmp", "wb") as f:
+            f.write(gzip.compress(buffer.getvalue(), compresslevel=SNAPSHOT_COMPRESSION_LEVEL))
+        os.replace(path + ".tmp", path)
+    except Exception as e:
+        mlog.warning("save_snapshot() - Could not save snapshot of case '" + str(case_file.uuid) + "': " + str(e))
+        return False
+
+    mlog.debug("save_snapshot() - Saved snapshot of case '" + str(case_file.uuid) + "' to '" + path + "'")
+    return True
+
+
+def load_snapshot(path):
+    """Loads a case file from a snapshot file.
+
+    Args:
+        path (str): The path of the snapshot file
+
+    Returns:
+        CaseFile: The case file or None if the snapshot could not be loaded
+    """
+    try:
+        with open(path, "rb") as f:
+            return pickle.loads(gzip.decompress(f.read()))
+    except Exception as e:
+        mlog.warning("load_snapshot() - Could not load snapshot '" + path + "': " + str(e))
+        return None
+
+
+def load_snapshots():
+    """Loads all snapshots of interrupted cases. Stale and unreadable snapshots are deleted.
+
+    Returns:
+        List[CaseFile]: The case files, ordered from oldest to newest snapshot
+    """
+    if not os.path.isdir(SNAPSHOT_DIR):
+        return []
+
+    paths = [os.path.join(SNAPSHOT_DIR, name) for name in os.listdir(SNAPSHOT_DIR) if name.endswith(SNAPSHOT_SUFFIX)]
+    paths.sort(key=os.path.getmtime)
+    min_mtime = (datetime.datetime.now() - datetime.timedelta(hours=SNAPSHOT_MAX_AGE_HOURS)).timestamp()
+
+    case_files = []
+    for path in paths:
+        case_file = load_snapshot(path) if os.path.getmtime(path) >= min_mtime else None
+        if case_file is None:
+            mlog.info("load_snapshots() - Deleting stale or unreadable snapshot '" + path + "'")
+            os.remove(path)
+            continue
+        case_files.append(case_file)
+
+    mlog.debug("load_snapshots() - Loaded " + str(len(case_files)) + " snapshot(s)")
+    return case_files
+
+
+def delete_snapshot(case_uuid):
+    """Deletes the snapshot of a case (if it exists).
+
+    Args:
+        case_uuid (uuid.UUID): The UUID of the case
+
+    Returns:
+        None
+    """
+    try:
+        os.remove(get_snapshot_path(case_uuid))
+        mlog.debug("delete_snapshot() - Deleted snapshot of case '" + str(case_uuid) + "'")
+    except FileNotFoundError:
+        pass
@@ -143,7 +143,7 @@ def zs_handle_detection(case_file: CaseFile, DRY_RUN=False) -> CaseFile:
     parents = bb_get_context_process_parents(PB_NAME, 2, mlog, case_file, detection)
     children = bb_get_context_process_children(PB_NAME, 3, mlog, case_file, detection)
     process_tree = bb_get_context_process_tree_visualisation(
-        PB_NAME, 4, mlog, case_file, detection, parents, children, current_action
+        PB_NAME, 4, mlog, case_file, detection, parents, children, current_action, format="html"
     )
 
     process_names = []
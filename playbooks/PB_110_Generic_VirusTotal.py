@@ -37,9 +37,9 @@ from typing import Union, List
 import lib.logging_helper as logging_helper
 from lib.class_helper import CaseFile, ContextProcess, AuditLog, Detection, ContextThreatIntel, DNSQuery, HTTP
 from lib.config_helper import Config
-from lib.generic_helper import cast_to_ipaddress, format_results, is_local_tld
+from lib.generic_helper import cast_to_ipaddress, get_ip_info, format_results, is_local_tld
 
-from integrations.virus_total import zs_provide_context_for_detections
+from integrations.virus_total import zs_provide_context_for_detections_async, zs_start_cycle
 from integrations.znuny_otrs import zs_add_note_to_ticket, zs_get_ticket_by_number
 
 # Prepare the logger
@@ -71,6 +71,22 @@ def zs_can_handle_detection(case_file: CaseFile) -> bool:
         return False
 
     # Check if any of the detecions of the detection case has an indicator that is searchable in VirusTotal
+    detection = get_searchable_detection(case_file)
+    if detection is not None:
+        mlog.info(f"Playbook '{PB_NAME}' can handle detection '{detection.name}' ({detection.uuid}).")
+        return True
+    return False
+
+
+def get_searchable_detection(case_file: CaseFile):
+    """Returns the first detection of the detection case that has an indicator that is searchable in VirusTotal.
+
+    Args:
+        case_file (CaseFile): The detection case
+
+    Returns:
+        Detection: The detection or None if no detection has a searchable indicator
+    """
     for detection in case_file.detections:
         if (
             len(detection.indicators["ip"]) > 0
@@ -78,9 +94,187 @@ def zs_can_handle_detection(case_file: CaseFile) -> bool:
             or len(detection.indicators["url"]) > 0
             or len(detection.indicators["hash"]) > 0
         ):
-            mlog.info(f"Playbook '{PB_NAME}' can handle detection '{detection.name}' ({detection.uuid}).")
-            return True
-    return False
+            return detection
+    return None
+
+
+def submit_lookup(integration_config, case_file: CaseFile, TEST, search_type, search_value, wait_if_api_quota_exceeded):
+    """Submits a VirusTotal lookup for an indicator without waiting for the result.
+
+    Args:
+        integration_config (dict): The configuration of the VirusTotal integration
+        case_file (CaseFile): The detection case
+        TEST (bool): True if the playbook is run in test mode, False if not
+        search_type (type): The type of the indicator
+        search_value (str): The indicator
+        wait_if_api_quota_exceeded (bool): If the lookup should wait if the API quota is exceeded
+
+    Returns:
+        Future: The future of the lookup or the exception if the lookup could not be submitted
+    """
+    try:
+        return zs_provide_context_for_detections_async(
+            integration_config,
+            case_file,
+            required_type=ContextThreatIntel,
+            TEST=TEST,
+            search_type=search_type,
+            search_value=search_value,
+            maxContext=1,
+            wait_if_api_quota_exceeded=wait_if_api_quota_exceeded,
+        )
+    except Exception as e:
+        return e
+
+
+def submit_lookups(integration_config, case_file: CaseFile, TEST, ips, domains, urls, hashes):
+    """Submits VirusTotal lookups for all searchable indicators (private IPs and local domains are skipped).
+
+    Args:
+        integration_config (dict): The configuration of the VirusTotal integration
+        case_file (CaseFile): The detection case
+        TEST (bool): True if the playbook is run in test mode, False if not
+        ips (list): The IPs
+        domains (list): The domains
+        urls (list): The URLs
+        hashes (list): The file/process hashes
+
+    Returns:
+        tuple: The submitted IP, domain, URL and hash lookups, each as list of tuples (indicator, future)
+    """
+    ip_lookups = []
+    for ip in ips:
+        ip = cast_to_ipaddress(ip)
+        if get_ip_info(ip).is_private:
+            mlog.debug(f"IP '{ip}' is private. Skipping it.")
+            continue
+        ip_lookups.append((ip, submit_lookup(integration_config, case_file, TEST, type(ip), ip, WAIT_FOR_NETWORK)))
+
+    domain_lookups = []
+    for domain in domains:
+        if is_local_tld(domain):
+            mlog.debug(f"Domain '{domain}' is a local domain. Skipping it.")
+            continue
+        domain_lookups.append((domain, submit_lookup(integration_config, case_file, TEST, DNSQuery, domain, WAIT_FOR_NETWORK)))
+
+    url_lookups = []
+    for url in urls:
+        try:
+            if is_local_tld(url.split("/")[2]):
+                mlog.debug(f"URL '{url}' is a local domain. Skipping it.")
+                continue
+        except IndexError:
+            pass
+        url_lookups.append((url, submit_lookup(integration_config, case_file, TEST, HTTP, url, WAIT_FOR_NETWORK)))
+
+    hash_lookups = []
+    for hash in hashes:
+        hash_lookups.append((hash, submit_lookup(integration_config, case_file, TEST, ContextProcess, hash, WAIT_FOR_HASHES)))
+
+    return ip_lookups, domain_lookups, url_lookups, hash_lookups
+
+
+def await_lookups(lookups, indicator_name: str, case_file: CaseFile, current_action: AuditLog) -> List[ContextThreatIntel]:
+    """Awaits the results of submitted VirusTotal lookups.
+
+    Args:
+        lookups (list): The submitted lookups as tuples of (indicator, future)
+        indicator_name (str): The name of the indicator type (used for logging)
+        case_file (CaseFile): The detection case
+        current_action (AuditLog): The current audit log entry (used for errors)
+
+    Returns:
+        List[ContextThreatIntel]: The found threat intel contexts
+    """
+    contexts = []
+    for indicator, lookup in lookups:
+        try:
+            if isinstance(lookup, Exception):
+                raise lookup
+            context = lookup.result()
+            if context:
+                contexts.append(context)
+        except Exception as e:
+            mlog.error(f"Error while getting context for {indicator_name} '{indicator}': {e}")
+            case_file.update_audit(
+                current_action.set_error(message=f"Error while getting context for {indicator_name} '{indicator}': {e}", data=e),
+                mlog,
+            )
+    return contexts
+
+
+def get_case_indicators(case_file: CaseFile):
+    """Returns the indicators of a detection case that are looked up in VirusTotal (without duplicates, keeping the order).
+
+    For EDR and SIEM detections, all indicators of the case file are looked up if configured (see EDR_SEARCH_CASE_FILE and
+    SIEM_SEARCH_CASE_FILE), plus the indicators of every detection.
+
+    Args:
+        case_file (CaseFile): The detection case
+
+    Returns:
+        tuple: The IPs, domains, URLs and hashes (each a list)
+    """
+    indicators = {"ip": [], "domain": [], "url": [], "hash": []}
+
+    vendor_id = case_file.detections[0].vendor_id
+    if (vendor_id in EDR_DETECTION_VENDORS and EDR_SEARCH_CASE_FILE) or (
+        vendor_id in SIEM_DETECTION_VENDORS and SIEM_SEARCH_CASE_FILE
+    ):
+        for indicator_type in indicators:
+            indicators[indicator_type].extend(case_file.indicators[indicator_type])
+
+    for detection in case_file.detections:
+        for indicator_type in indicators:
+            indicators[indicator_type].extend(detection.indicators[indicator_type])
+
+    return tuple(list(dict.fromkeys(indicators[indicator_type])) for indicator_type in ("ip", "domain", "url", "hash"))
+
+
+def zs_prepare_cycle(case_files: List[CaseFile], TEST=False):
+    """Prepares the playbook for a new worker cycle.
+
+    Builds the set of unique indicators of all detection cases of this cycle up front and submits one lookup per
+    indicator. The lookups run in the background, while zs_handle_detection() later joins them for every case.
+    The ticket precondition of zs_can_handle_detection() is not checked, as the tickets of new detections are only created
+    later in this cycle (by a previous playbook). Cases without an indicator that is searchable in VirusTotal are left out,
+    so that no API quota is spent on cases this playbook never handles.
+
+    Args:
+        case_files (List[CaseFile]): All detection cases of this worker cycle
+        TEST (bool): True if the playbook is run in test mode, False if not
+    """
+    if PB_ENABLED == False:
+        return
+
+    cfg = Config().cfg
+    integration_config = cfg["integrations"]["virus_total"]
+    zs_start_cycle()
+
+    # Build the per-cycle indicator set (ordered and without duplicates) and remember the first case of each indicator
+    case_files = [case_file for case_file in case_files if get_searchable_detection(case_file) is not None]
+    cycle_indicators = {"ip": {}, "domain": {}, "url": {}, "hash": {}}
+    for case_file in case_files:
+        for indicator_type, indicators in zip(cycle_indicators, get_case_indicators(case_file)):
+            for indicator in indicators:
+                cycle_indicators[indicator_type].setdefault(indicator, case_file)
+
+    count = sum(len(indicators) for indicators in cycle_indicators.values())
+    if count == 0:
+        return
+    mlog.info(f"Submitting lookups for {str(count)} unique indicators of {str(len(case_files))} detection case(s).")
+
+    for indicator_type, indicators in cycle_indicators.items():
+        for indicator, case_file in indicators.items():
+            submit_lookups(
+                integration_config,
+                case_file,
+                TEST,
+                [indicator] if indicator_type == "ip" else [],
+                [indicator] if indicator_type == "domain" else [],
+                [indicator] if indicator_type == "url" else [],
+                [indicator] if indicator_type == "hash" else [],
+            )
 
 
 def zs_handle_detection(case_file: CaseFile, TEST=False) -> CaseFile:
@@ -124,48 +318,15 @@ def zs_handle_detection(case_file: CaseFile, TEST=False) -> CaseFile:
     ## STEP 1 - Get the threat intel for the indicators of all detections ##
     #                                                                      #
 
-    ips = []
-    domains = []
-    urls = []
-    hashes = []
-
-    if case_file.detections[0].vendor_id in EDR_DETECTION_VENDORS and EDR_SEARCH_CASE_FILE:
+    ips, domains, urls, hashes = get_case_indicators(case_file)
+    if EDR_SEARCH_CASE_FILE and case_file.detections[0].vendor_id in EDR_DETECTION_VENDORS:
         mlog.info(f"Searching for all indicators of detection case '{case_file.uuid}' as it is an EDR detection.")
-        ips = case_file.indicators["ip"]
-        domains = case_file.indicators["domain"]
-        urls = case_file.indicators["url"]
-        hashes = case_file.indicators["hash"]
-
-    if case_file.detections[0].vendor_id in SIEM_DETECTION_VENDORS and SIEM_SEARCH_CASE_FILE:
+    if SIEM_SEARCH_CASE_FILE and case_file.detections[0].vendor_id in SIEM_DETECTION_VENDORS:
         mlog.info(f"Searching for all indicators of detection case '{case_file.uuid}' as it is a SIEM detection.")
-        ips = case_file.indicators["ip"]
-        domains = case_file.indicators["domain"]
-        urls = case_file.indicators["url"]
-        hashes = case_file.indicators["hash"]
 
     for detection in case_file.detections:
         mlog.info(f"Handling detection '{detection.name}' ({detection.uuid})")
-
-        # Get the indicators
         mlog.debug(f"Found indicators of detection: {detection.indicators}")
-        detection: Detection = detection
-
-        for indicator_type in detection.indicators:
-            for indicator in detection.indicators[indicator_type]:
-                if indicator_type == "ip":
-                    ips.append(indicator)
-                elif indicator_type == "domain":
-                    domains.append(indicator)
-                elif indicator_type == "url":
-                    urls.append(indicator)
-                elif indicator_type == "hash":
-                    hashes.append(indicator)
-
-        # Remove duplicates of the lists:
-        ips = list(set(ips))
-        domains = list(set(domains))
-        urls = list(set(urls))
-        hashes = list(set(hashes))
 
         if len(ips) > 0 or len(domains) > 0 or len(urls) > 0 or len(hashes) > 0:
             case_file.update_audit(init_action.set_successful("Got indicators", data=detection.indicators), mlog)
@@ -173,206 +334,117 @@ def zs_handle_detection(case_file: CaseFile, TEST=False) -> CaseFile:
             case_file.update_audit(
                 init_action.set_warning(warning_message=f"No indicators were found for detection {detection.name}."), mlog
             )
-            continue
 
-        if len(ips) > 0:
-            mlog.debug(f"Found IPs: {ips}. Handling them.")
-            current_action = AuditLog(PB_NAME, 1, "Handling IPs", "Started handling IPs")
-            case_file.update_audit(current_action, mlog)
-            for ip in ips:
-                ip = cast_to_ipaddress(ip)
-
-                if ip.is_private:
-                    mlog.debug(f"IP '{ip}' is private. Skipping it.")
-                    continue
-
-                try:
-                    nw_new = zs_provide_context_for_detections(
-                        integration_config,
-                        case_file,
-                        required_type=ContextThreatIntel,
-                        TEST=TEST,
-                        search_type=type(ip),
-                        search_value=ip,
-                        maxContext=1,
-                        wait_if_api_quota_exceeded=WAIT_FOR_NETWORK,
-                    )
-                    if nw_new:
-                        network_contexts.append(nw_new)
-                except Exception as e:
-                    mlog.error(f"Error while getting context for IP '{ip}': {e}")
-                    case_file.update_audit(
-                        current_action.set_error(message=f"Error while getting context for IP '{ip}': {e}", data=e), mlog
-                    )
-
-            if len(network_contexts) != 0:
-                case_file.update_audit(
-                    current_action.set_successful(
-                        message=f"Got threat intel for {str(len(network_contexts))} out of {str(len(ips))} IPs", data=ips
-                    ),
-                    mlog,
-                )
-            else:
-                # Check if all IPs were private
-                had_public_ips = False
-                for ip in ips:
-                    ip = cast_to_ipaddress(ip)
-                    if ip.is_global:
-                        had_public_ips = True
-                        break
-                if had_public_ips:
-                    case_file.update_audit(
-                        current_action.set_warning(
-                            warning_message=f"Could not get threat intel for any of the {str(len(ips))} IPs", data=ips
-                        ),
-                        mlog,
-                    )
-                else:
-                    case_file.update_audit(
-                        current_action.set_successful(
-                            message=f"All {str(len(ips))} IPs were private. No threat intel search possible for them.", data=ips
-                        ),
-                        mlog,
-                    )
-
-        if len(domains) > 0:
-            mlog.debug(f"Found domains: {domains}. Handling them.")
-            current_action = AuditLog(PB_NAME, 2, "Handling domains", "Started handling domains")
-            case_file.update_audit(current_action, mlog)
-            for domain in domains:
-                try:
-                    if is_local_tld(domain):
-                        mlog.debug(f"Domain '{domain}' is a local domain. Skipping it.")
-                        continue
-                    domain_new = zs_provide_context_for_detections(
-                        integration_config,
-                        case_file,
-                        required_type=ContextThreatIntel,
-                        TEST=TEST,
-                        search_type=DNSQuery,
-                        search_value=domain,
-                        maxContext=1,
-                        wait_if_api_quota_exceeded=WAIT_FOR_NETWORK,
-                    )
-                    if domain_new:
-                        network_contexts.append(domain_new)
-                except Exception as e:
-                    mlog.error(f"Error while getting context for domain '{domain}': {e}")
-                    case_file.update_audit(
-                        current_action.set_error(
-                            warning_message=f"Error while getting context for domain '{domain}': {e}", data=e
-                        ),
-                        mlog,
-                    )
-
-            if len(network_contexts) != 0:
-                case_file.update_audit(
-                    current_action.set_successful(
-                        message=f"Got threat intel for {str(len(network_contexts))} out of {str(len(domains))} domains",
-                        data=domains,
-                    ),
-                    mlog,
-                )
-            else:
-                case_file.update_audit(
-                    current_action.set_warning(
-                        warning_message=f"Could not get threat intel for any of the {str(len(domains))} domains", data=domains
-                    ),
-                    mlog,
-                )
-
-        if len(urls) > 0:
-            mlog.debug(f"Found URLs: {urls}. Handling them.")
-            current_action = AuditLog(PB_NAME, 3, "Handling URLs", "Started handling URLs")
-            case_file.update_audit(current_action, mlog)
-            for url in urls:
-                try:
-                    if is_local_tld(url.split("/")[2]):
-                        mlog.debug(f"URL '{url}' is a local domain. Skipping it.")
-                        continue
-                    url_new = zs_provide_context_for_detections(
-                        integration_config,
-                        case_file,
-                        required_type=ContextThreatIntel,
-                        TEST=TEST,
-                        search_type=HTTP,
-                        search_value=url,
-                        maxContext=1,
-                        wait_if_api_quota_exceeded=WAIT_FOR_NETWORK,
-                    )
-                    if url_new:
-                        network_contexts.append(url_new)
-                except Exception as e:
-                    mlog.error(f"Error while getting context for URL '{url}': {e}")
-                    case_file.update_audit(
-                        current_action.set_error(message=f"Error while getting context for URL '{url}': {e}", data=e),
-                        mlog,
-                    )
-
-            if len(network_contexts) != 0:
-                case_file.update_audit(
-                    current_action.set_successful(
-                        message=f"Got threat intel for {str(len(network_contexts))} out of {str(len(urls))} URLs", data=urls
-                    ),
-                    mlog,
-                )
-            else:
-                case_file.update_audit(
-                    current_action.set_warning(
-                        warning_message=f"Could not get threat intel for any of the {str(len(urls))} URLs", data=urls
-                    ),
-                    mlog,
-                )
-
-        if len(hashes) > 0:
-            mlog.debug(f"Found hashes: {hashes}. Handling them.")
-            current_action = AuditLog(PB_NAME, 4, "Handling hashes", "Started handling hashes")
-            case_file.update_audit(current_action, mlog)
-            for hash in hashes:
-                try:
-                    pc_new = zs_provide_context_for_detections(
-                        integration_config,
-                        case_file,
-                        required_type=ContextThreatIntel,
-                        TEST=TEST,
-                        search_type=ContextProcess,
-                        search_value=hash,
-                        maxContext=1,
-                        wait_if_api_quota_exceeded=WAIT_FOR_HASHES,
-                    )
-                    if pc_new:
-                        process_contexts.append(pc_new)
-                except Exception as e:
-                    mlog.error(f"Error while getting context for hash '{hash}': {e}")
-                    case_file.update_audit(
-                        current_action.set_error(message=f"Error while getting context for hash '{hash}': {e}", data=e),
-                        mlog,
-                    )
-
-            if len(process_contexts) != 0:
-                case_file.update_audit(
-                    current_action.set_successful(
-                        message=f"Got threat intel for {str(len(process_contexts))} out of {str(len(hashes))} hashes", data=hashes
-                    ),
-                    mlog,
-                )
-            else:
-                case_file.update_audit(
-                    current_action.set_warning(
-                        warning_message=f"Could not get threat intel for any of the {str(len(hashes))} hashes", data=hashes
-                    ),
-                    mlog,
-                )
-
-        if len(ips) == 0 and len(domains) == 0 and len(urls) == 0 and len(hashes) == 0:
-            mlog.info("No indicators found in this detection.")
-        elif len(network_contexts) == 0 and len(process_contexts) == 0:
-            mlog.info("Found indicators, but no threat intel for this detection.")
+    # Submit the lookups for all indicators of the detection case at once, so that they can run concurrently.
+    # The results are awaited below.
+    ip_lookups, domain_lookups, url_lookups, hash_lookups = submit_lookups(
+        integration_config, case_file, TEST, ips, domains, urls, hashes
+    )
+
+    if len(ips) > 0:
+        mlog.debug(f"Found IPs: {ips}. Handling them.")
+        current_action = AuditLog(PB_NAME, 1, "Handling IPs", "Started handling IPs")
+        case_file.update_audit(current_action, mlog)
+        ip_contexts = await_lookups(ip_lookups, "IP", case_file, current_action)
+        network_contexts += ip_contexts
+
+        if len(ip_contexts) != 0:
+            case_file.update_audit(
+                current_action.set_successful(
+                    message=f"Got threat intel for {str(len(ip_contexts))} out of {str(len(ips))} IPs", data=ips
+                ),
+                mlog,
+            )
+        elif len(ip_lookups) > 0:
+            case_file.update_audit(
+                current_action.set_warning(
+                    warning_message=f"Could not get threat intel for any of the {str(len(ips))} IPs", data=ips
+                ),
+                mlog,
+            )
+        else:
+            case_file.update_audit(
+                current_action.set_successful(
+                    message=f"All {str(len(ips))} IPs were private. No threat intel search possible for them.", data=ips
+                ),
+                mlog,
+            )
+
+    if len(domains) > 0:
+        mlog.debug(f"Found domains: {domains}. Handling them.")
+        current_action = AuditLog(PB_NAME, 2, "Handling domains", "Started handling domains")
+        case_file.update_audit(current_action, mlog)
+        domain_contexts = await_lookups(domain_lookups, "domain", case_file, current_action)
+        network_contexts += domain_contexts
+
+        if len(domain_contexts) != 0:
+            case_file.update_audit(
+                current_action.set_successful(
+                    message=f"Got threat intel for {str(len(domain_contexts))} out of {str(len(domains))} domains",
+                    data=domains,
+                ),
+                mlog,
+            )
+        else:
+            case_file.update_audit(
+                current_action.set_warning(
+                    warning_message=f"Could not get threat intel for any of the {str(len(domains))} domains", data=domains
+                ),
+                mlog,
+            )
+
+    if len(urls) > 0:
+        mlog.debug(f"Found URLs: {urls}. Handling them.")
+        current_action = AuditLog(PB_NAME, 3, "Handling URLs", "Started handling URLs")
+        case_file.update_audit(current_action, mlog)
+        url_contexts = await_lookups(url_lookups, "URL", case_file, current_action)
+        network_contexts += url_contexts
+
+        if len(url_contexts) != 0:
+            case_file.update_audit(
+                current_action.set_successful(
+                    message=f"Got threat intel for {str(len(url_contexts))} out of {str(len(urls))} URLs", data=urls
+                ),
+                mlog,
+            )
+        else:
+            case_file.update_audit(
+                current_action.set_warning(
+                    warning_message=f"Could not get threat intel for any of the {str(len(urls))} URLs", data=urls
+                ),
+                mlog,
+            )
+
+    if len(hashes) > 0:
+        mlog.debug(f"Found hashes: {hashes}. Handling them.")
+        current_action = AuditLog(PB_NAME, 4, "Handling hashes", "Started handling hashes")
+        case_file.update_audit(current_action, mlog)
+        process_contexts += await_lookups(hash_lookups, "hash", case_file, current_action)
+
+        if len(process_contexts) != 0:
+            case_file.update_audit(
+                current_action.set_successful(
+                    message=f"Got threat intel for {str(len(process_contexts))} out of {str(len(hashes))} hashes", data=hashes
+                ),
+                mlog,
+            )
         else:
-            mlog.info(
-                f"Found {str(len(network_contexts))} network indicators and {str(len(process_contexts))} process indicators for this detection."
+            case_file.update_audit(
+                current_action.set_warning(
+                    warning_message=f"Could not get threat intel for any of the {str(len(hashes))} hashes", data=hashes
+                ),
+                mlog,
             )
 
+    if len(ips) == 0 and len(domains) == 0 and len(urls) == 0 and len(hashes) == 0:
+        mlog.info("No indicators found in this detection case.")
+    elif len(network_contexts) == 0 and len(process_contexts) == 0:
+        mlog.info("Found indicators, but no threat intel for this detection case.")
+    else:
+        mlog.info(
+            f"Found {str(len(network_contexts))} network indicators and {str(len(process_contexts))} process indicators for this detection case."
+        )
+
     if not init_action.result_was_successful:
         case_file.update_audit(
             init_action.set_warning(warning_message="Did not find any indicator for any detection. Maybe something is wrong."),
@@ -135,6 +135,7 @@ def bb_get_context_process_tree_visualisation(
     parents: list,
     children: list,
     current_action: AuditLog,
+    format: str = "text",
 ):
     """Create a process tree visualisation.
 
@@ -146,6 +147,7 @@ def bb_get_context_process_tree_visualisation(
         parents {list} -- A list of ContextProcess objects.
         children {list} -- A list of ContextProcess objects.
         current_action {AuditLog} -- The current action AuditLog object.
+        format {str} -- "text" for a text tree or "html" for nested HTML lists (default: "text").
 
     Returns:
         str -- The process tree visualisation.
@@ -154,7 +156,7 @@ def bb_get_context_process_tree_visualisation(
     if len(parents) > 0 or len(children) > 0:
         current_sub_action = AuditLog(playbook_name, playbook_step, "Context - Process Tree", "Gathering Process Tree from BB.")
         try:
-            process_tree = bb_make_process_tree_visualisation(detection.process, parents, children)
+            process_tree = bb_make_process_tree_visualisation(detection.process, parents, children, format)
         except Exception as e:
             mlog.error(
                 f"Failed to create process tree visualisation for detection: '{detection.name}' ({detection.uuid}). Exception: {traceback.format_exc()}"
@@ -20,12 +20,17 @@ BB_LICENSE = "MIT"
 BB_ENABLED = True
 
 THRESHOLD_MAX_PROCESS_CHILDREN = 1000  # Maximum number of children to fetch for each process
+THRESHOLD_MAX_PROCESS_TREE_NODES = 1000  # Maximum number of processes in a process tree (each one is a query to Elastic)
+# Note: The tree is also limited to the free space of the CaseFile's process timeline (see THRESHOLD_MAX_CONTEXTS)
 THRESHOLD_MAX_NETWORK_FLOWS = 500  # Maximum number of network flows to fetch for each process
 THRESHOLD_MAX_FILE_EVENTS = 500  # Maximum number of files to fetch for each process
 THRESHOLD_MAX_REGISTRY_EVENTS = 500  # Maximum number of registry events to fetch for each process
+THRESHOLD_MAX_TREE_DEPTH = 30  # Maximum depth of the rendered process tree (deeper processes are summarised)
+THRESHOLD_MAX_TREE_NODES = 500  # Maximum number of lines of the rendered process tree (further processes are summarised)
 
 import sys
 import os
+import html
 
 import logging
 from typing import Union, List
@@ -48,6 +53,8 @@ log_level_file = cfg["integrations"]["elastic_siem"]["logging"]["log_level_file"
 log_level_stdout = cfg["integrations"]["elastic_siem"]["logging"]["log_level_stdout"]
 mlog = logging_helper.Log("playbooks." + BB_NAME, log_level_file, log_level_stdout)
 
+_WALKED = object()  # Marks that all children of a process in the stack of get_all_children() were walked
+
 
 def bb_get_all_processes_by_uuid(case_file: CaseFile, uuid, children=False) -> ContextProcess:
     """
@@ -92,85 +99,118 @@ def bb_get_all_processes_by_uuid(case_file: CaseFile, uuid, children=False) -> C
         return processes
 
 
-def get_all_children_recursive(
-    case_file, children: List, process: ContextProcess, done_hashes: List = [], all_process_events=False
+def _get_direct_children(case_file: CaseFile, process: ContextProcess) -> List[ContextProcess]:
+    """Returns the direct children of a process as list (empty if there are none)."""
+    new_children = bb_get_all_processes_by_uuid(case_file, process.process_uuid, children=True)
+    if new_children == [] or new_children == None:
+        mlog.debug(
+            "get_all_children - No children found for process name "
+            + str(process.process_name)
+            + " with UUID: "
+            + str(process.process_uuid)
+        )
+        return []
+    if type(new_children) == ContextProcess:
+        return [new_children]
+    return new_children
+
+
+def get_all_children(
+    case_file: CaseFile,
+    process: ContextProcess,
+    all_process_events=False,
+    max_nodes=THRESHOLD_MAX_PROCESS_TREE_NODES,
 ):
     """
-    Returns all children of a process recursively.
+    Returns all children of a process. The process tree is walked depth first with an explicit stack (no recursion).
+
+    Every found child is linked to its parent (process_children) and added to the CaseFile at once at the end.
+    Children with an already seen SHA256 are linked, but not returned and not walked further (unless all_process_events is set).
+    Every process UUID is only walked once, so cycles in the parent/child relations can not lead to endless loops.
+    The tree is cut at max_nodes processes or when the process timeline of the CaseFile is full, as processes that do not
+    fit into the CaseFile anymore would be dropped from it (and from its indicators) after being fetched.
 
     :param case_file: A CaseFile object
-    :param children: A list of children already found (should be empty when first calling the function)
-    :param process: The current process to get the children for
-    :param uuids: A list of UUIDs of processes that have already been processed
+    :param process: The process to get the children for
     :param all_process_events: If True, the function will return all events for the process. If False, only the first found event for every unique process will be returned. Default: False
+    :param max_nodes: The maximum number of children linked into the tree (the rest is not fetched). Default: 1000
+    :return: A tuple of the list of children (in depth first order) and whether max_nodes was reached
     """
     mlog.debug(
-        "get_all_children_recursive - Getting all children for process UUID: "
+        "get_all_children - Getting all children for process UUID: "
         + str(process.process_uuid)
         + " and name: "
         + str(process.process_name)
     )
-    mlog.debug(" Current children in List: " + str(children))
-
-    # Get all children for the current process by searching for all processes with the current process as parent
-    new_children = bb_get_all_processes_by_uuid(case_file, process.process_uuid, children=True)
-
-    if new_children == [] or new_children == None:
-        mlog.debug(
-            "get_all_children_recursive - No children found for process name "
-            + str(process.process_name)
-            + " with UUID: "
-            + str(process.process_uuid)
-        )
-        return children, done_hashes
-    if type(new_children) != list and type(new_children) == ContextProcess:
-        mlog.debug(
-            "get_all_children_recursive - Only one child found for process name "
-            + str(process.process_name)
-            + " with UUID: "
-            + str(process.process_uuid)
-        )
-        new_children = [new_children]
+    children = []  # The children that are returned
+    linked = []  # All children that are linked into the tree (and added to the CaseFile)
+    done_hashes = set()
+    walked_uuids = {process.process_uuid}
+    stack = [(process, iter(_get_direct_children(case_file, process)))]
+    budget_exhausted = False
+    free = case_file.context_processes.max_size - len(case_file.context_processes)
+    if free < max_nodes:
+        mlog.debug("get_all_children - Limiting the process tree to the free space of the CaseFile: " + str(max(free, 0)))
+        max_nodes = max(free, 0)
+
+    while stack:
+        parent, pending = stack[-1]
+        child = next(pending, _WALKED)
+        if child is _WALKED:
+            stack.pop()
+            continue
 
-    for child in new_children:
-        if child.process_uuid == process.process_uuid:
+        if type(child) != ContextProcess:
+            mlog.debug("get_all_children - Skipping a found 'child' because it is empty or not a ContextProcess object.")
+            continue
+        if child.process_uuid == parent.process_uuid:
             mlog.error(
-                "get_all_children_recursive - ! Stopped possible endless loop: Child UUID is the same as current process UUID ! Skipping this child."
+                "get_all_children - ! Stopped possible endless loop: Child UUID is the same as current process UUID ! Skipping this child."
             )
             continue
+        if len(linked) >= max_nodes:
+            mlog.warning(
+                "get_all_children - Reached the maximum of "
+                + str(max_nodes)
+                + " processes in the process tree of process: "
+                + str(process.process_name)
+                + ". Will not fetch further children."
+            )
+            budget_exhausted = True
+            break
 
-        if child == "" or child == None or type(child) != ContextProcess:
+        parent.process_children.append(child)
+        linked.append(child)
+        if not all_process_events and child.process_sha256 in done_hashes:
             mlog.debug(
-                "get_all_children_recursive - Skipping a found 'child' because it is empty or not a ContextProcess object."
+                "get_all_children - Skipping adding child to return list because a process with the same hash is already in it. Child SHA256: "
+                + str(child.process_sha256)
             )
             continue
-        else:
-            mlog.debug(
-                "get_all_children_recursive - Child found for process name "
-                + str(process.process_name)
-                + " with child name: "
-                + str(child.process_name)
-                + ". child UUID: "
+        if child.process_uuid in walked_uuids:
+            mlog.warning(
+                "get_all_children - Process UUID "
                 + str(child.process_uuid)
-                + ". Adding it to current process as child and CaseFile context..."
+                + " is its own ancestor or was already walked. Skipping its children."
             )
-            process.process_children.append(child)
-            case_file.add_context(child)
-            if not all_process_events and (child.process_sha256 in done_hashes):
-                mlog.debug(
-                    "get_all_children_recursive - Skipping adding child to return list because a process with the same hash is already in it. Child SHA256: "
-                    + str(child.process_sha256)
-                )
-                continue
-            mlog.debug(
-                "get_all_children_recursive - Will append "
-                + str(child.process_name)
-                + " to return list and fetch children for this child now..."
-            )
-            children.append(child)
-            done_hashes.append(child.process_sha256)
-            get_all_children_recursive(case_file, children, child)
-    return children, done_hashes
+            continue
+
+        children.append(child)
+        done_hashes.add(child.process_sha256)
+        walked_uuids.add(child.process_uuid)
+        stack.append((child, iter(_get_direct_children(case_file, child))))
+
+    dropped = case_file.add_contexts(linked)
+    if dropped > 0:
+        mlog.warning(
+            "get_all_children - "
+            + str(dropped)
+            + " of "
+            + str(len(linked))
+            + " processes of the process tree could not be added to the CaseFile, as its process timeline is full."
+        )
+    mlog.debug("get_all_children - Found " + str(len(children)) + " children (" + str(len(linked)) + " linked processes).")
+    return children, budget_exhausted
 
 
 def bb_get_all_children(case_file: CaseFile, process: ContextProcess) -> List[ContextProcess]:
@@ -182,16 +222,21 @@ def bb_get_all_children(case_file: CaseFile, process: ContextProcess) -> List[Co
     Be aware that the context is already added to the CaseFile object when calling this function.
     :return: A list of ContextProcess objects
     """
-    children = []
     thrown_process_count = 0
     if process != None:
-        all_children, _ = get_all_children_recursive(case_file, children, process, done_hashes=[], all_process_events=False)
+        all_children, budget_exhausted = get_all_children(case_file, process, all_process_events=False)
     else:
         mlog.warning("bb_get_all_children - Process is None. Returning empty list.")
         return [], 0
 
-    for child in all_children:
-        case_file.add_context(child)
+    if budget_exhausted:
+        mlog.warning(
+            "bb_get_all_children - The process tree of process "
+            + str(process.process_name)
+            + " is incomplete, as it has more processes than the process tree or the CaseFile can hold (at most "
+            + str(THRESHOLD_MAX_PROCESS_TREE_NODES)
+            + ")."
+        )
 
     # Sort the list by start time
     all_children.sort(key=lambda x: x.process_start_time, reverse=False)
@@ -286,125 +331,182 @@ def bb_get_all_parents(case_file: CaseFile, process: ContextProcess) -> List[Con
     return parents
 
 
-def bb_make_process_tree_visualisation(
+class _TreeNode:
+    """A node of a rendered process tree. It stands for one or more sibling processes with the same binary or subtree."""
+
+    __slots__ = ("processes", "children", "count", "total", "signature", "is_focus")
+
+    def __init__(self, processes, is_focus=False):
+        self.processes = processes  # The processes of the node (siblings with the same SHA256 / entity ID)
+        self.children = []
+        self.count = len(processes)  # The number of processes the node stands for
+        self.total = 0  # The number of processes in the subtree of the node
+        self.signature = None  # The shape of the subtree (used to collapse repeated sibling subtrees)
+        self.is_focus = is_focus
+
+    def label(self):
+        process = self.processes[0]
+        label = str(process.process_name) + " (" + str(process.process_id) + ")"
+        return label + " [" + str(self.count) + "x]" if self.count > 1 else label
+
+
+def _process_key(process: ContextProcess):
+    """Returns the key siblings are deduplicated by (SHA256 or, if unknown, the entity ID)."""
+    return process.process_sha256 or process.process_uuid
+
+
+def _build_process_tree(
     focus_process: ContextProcess, parents: List[ContextProcess], children: List[ContextProcess]
+) -> _TreeNode:
+    """Builds the tree that is rendered, walking the linked process_children of the focus process once (without recursion).
+
+    Sibling processes with the same SHA256 (or entity ID) are merged into one node with a count and their children are
+    merged as well. Afterwards, sibling nodes with identical subtrees are collapsed into one node.
+
+    :param focus_process: The detected process
+    :param parents: The parents of the process (direct parent first)
+    :param children: The children of the process (children that are not linked to the tree are added by their parent UUID)
+    :return: The root node of the tree
+    """
+    # The chain of parents (root first), without the focus process itself (Elastic SIEM can return it as its own parent)
+    chain = []
+    for process in reversed(parents):
+        if process is None or process.process_uuid == focus_process.process_uuid:
+            continue
+        if chain and chain[-1].processes[0].process_uuid == process.process_uuid:
+            continue
+        chain.append(_TreeNode([process]))
+    focus_node = _TreeNode([focus_process], is_focus=True)
+    chain.append(focus_node)
+    for node, child in zip(chain, chain[1:]):
+        node.children.append(child)
+
+    # Children that are not linked into the tree are added below their parent (or below the focus process)
+    linked = {id(focus_process)}
+    stack = [focus_process]
+    while stack:
+        for child in stack.pop().process_children:
+            if isinstance(child, ContextProcess) and id(child) not in linked:
+                linked.add(id(child))
+                stack.append(child)
+    linked_uuids = {process.process_uuid for process in children if id(process) in linked} | {focus_process.process_uuid}
+    unlinked_children = {}
+    for process in children:
+        if id(process) not in linked:
+            parent_uuid = process.process_parent if process.process_parent in linked_uuids else focus_process.process_uuid
+            unlinked_children.setdefault(parent_uuid, []).append(process)
+
+    # Walk the processes below the focus process and group the children of every node by their key
+    placed = {id(focus_process)}
+    order = []  # The nodes in the order they were created (parents before their children)
+    stack = [focus_node]
+    while stack:
+        node = stack.pop()
+        order.append(node)
+        groups = {}
+        for process in node.processes:
+            for child in list(process.process_children) + unlinked_children.pop(process.process_uuid, []):
+                if not isinstance(child, ContextProcess) or id(child) in placed:
+                    continue  # Cycles and processes linked more than once are only shown once
+                placed.add(id(child))
+                groups.setdefault(_process_key(child), []).append(child)
+        node.children = [_TreeNode(processes) for processes in groups.values()]
+        stack.extend(node.children)
+
+    # Collapse sibling nodes with identical subtrees, from the leafs upwards
+    signatures = {}  # (name, child signatures) -> small int, so that signatures stay small for deep trees
+    for node in reversed(order):
+        collapsed = {}
+        for child in node.children:
+            if child.signature in collapsed:
+                collapsed[child.signature].count += child.count
+                collapsed[child.signature].total += child.total
+            else:
+                collapsed[child.signature] = child
+        node.children = list(collapsed.values())
+        shape = (node.processes[0].process_name, tuple(sorted((child.signature, child.count) for child in node.children)))
+        node.signature = signatures.setdefault(shape, len(signatures))
+        node.total = node.count + sum(child.total for child in node.children)
+
+    for node in reversed(chain[:-1]):
+        node.total = node.count + sum(child.total for child in node.children)
+    return chain[0]
+
+
+def _render_process_tree(root: _TreeNode, format: str) -> str:
+    """Renders a process tree as text (like the 'tree' command) or as nested HTML lists (without recursion).
+
+    Subtrees deeper than THRESHOLD_MAX_TREE_DEPTH and nodes above THRESHOLD_MAX_TREE_NODES are summarised, so that the
+    ticket note stays readable.
+    """
+    parts = []
+    html_depth = -1  # The depth of the last HTML list item
+
+    def add_line(depth, prefix, text):
+        nonlocal html_depth
+        if format == "text":
+            parts.append(prefix + text)
+            return
+        if depth > html_depth:
+            parts.append("<ul><li>")
+        else:
+            parts.append("</li></ul>" * (html_depth - depth) + "</li><li>")
+        parts.append(text)
+        html_depth = depth
+
+    shown_nodes = 0
+    stack = [(root, "", "", 0)]  # node, prefix of its line, prefix of the lines of its children, depth
+    while stack and shown_nodes < THRESHOLD_MAX_TREE_NODES:
+        node, prefix, child_prefix, depth = stack.pop()
+        shown_nodes += 1
+
+        if format == "html":
+            label = html.escape(node.label())
+            add_line(depth, prefix, "<b>" + label + "</b> (detected process)" if node.is_focus else label)
+        else:
+            add_line(depth, prefix, node.label() + (" <-- detected process" if node.is_focus else ""))
+
+        if node.children and depth + 1 >= THRESHOLD_MAX_TREE_DEPTH:
+            hidden = node.total - node.count
+            add_line(depth + 1, child_prefix + "└── ", "... " + str(hidden) + " more processes (tree too deep)")
+            continue
+
+        for i in reversed(range(len(node.children))):
+            last = i == len(node.children) - 1
+            line_prefix = child_prefix + ("└── " if last else "├── ")
+            stack.append((node.children[i], line_prefix, child_prefix + ("    " if last else "│   "), depth + 1))
+
+    if format == "html":
+        parts.append("</li></ul>" * (html_depth + 1))
+    not_shown = sum(node.total for node, _, _, _ in stack)  # The subtrees that were not reached because of the node limit
+    if not_shown:
+        summary = "... " + str(not_shown) + " more processes not shown"
+        parts.append("<p>" + summary + "</p>" if format == "html" else summary)
+    return "".join(parts) if format == "html" else "\n".join(parts)
+
+
+def bb_make_process_tree_visualisation(
+    focus_process: ContextProcess, parents: List[ContextProcess], children: List[ContextProcess], format: str = "text"
 ) -> str:
     """Returns a visualisation of the process tree
 
+    The tree is built from the parents and the linked children (ContextProcess.process_children) of the process.
+    Sibling processes with the same SHA256 are shown once with a count and repeated sibling subtrees are collapsed.
+
     :param process: The process to create the tree for
     :param parents: The parents of the process
     :param children: The children of the process
+    :param format: "text" for a text tree or "html" for nested HTML lists (<ul>). Default: "text"
 
     :return: A string containing the visualisation of the process tree
     """
     mlog.debug(
         "bb_make_process_tree_visualisation - Creating process tree visualisation for process: " + str(focus_process.process_name)
     )
-    from treelib import Node, Tree, exceptions
-
-    tree = Tree()
-    # Create tree nodes for all parents
-    for j in range(0, len(parents) - 0):
-        try:
-            i = len(parents) - j - 1
-            process = parents[i]
-            if i == len(parents) - 1:
-                mlog.debug(
-                    "bb_make_process_tree_visualisation - Creating root node for process: "
-                    + str(process.process_name)
-                    + " ("
-                    + str(process.process_sha256)
-                    + ")"
-                )
-                root_uid = process.process_sha256
-                if root_uid is None:
-                    root_uid = "0"
-                tree.create_node(process.process_name + " (" + str(process.process_id) + ")", root_uid)
-            else:
-                parent = parents[i + 1]
-                parent_sha = parent.process_sha256
-
-                if parent.process_sha256 is None:
-                    mlog.warning(
-                        f"bb_make_process_tree_visualisation - Duplicate root node found! Process: "
-                        + str(process.process_name)
-                        + " ("
-                        + str(process.process_sha256)
-                        + "). Linking to first root node..."
-                    )
-                    parent_sha = root_uid
-                mlog.debug(
-                    "bb_make_process_tree_visualisation - Creating node for process: "
-                    + str(process.process_name)
-                    + " ("
-                    + str(process.process_sha256)
-                    + ") "
-                    + " with parent: "
-                    + str(parent.process_name)
-                    + " ("
-                    + str(parent_sha)
-                    + ")"
-                )
-                tree.create_node(
-                    process.process_name + " (" + str(process.process_id) + ")", process.process_sha256, parent=parent_sha
-                )
-        except Exception as e:
-            mlog.error("bb_make_process_tree_visualisation - Error in Parent Processes: " + str(e))
-
-    # Create detected process node
-    try:
-        if len(parents) == 0:
-            tree.create_node(
-                focus_process.process_name + " (" + str(focus_process.process_id) + ")", focus_process.process_sha256
-            )
-        else:
-            parent_sha = parents[0].process_sha256
-            if (
-                focus_process.process_sha256 == parent_sha
-            ):  # Weird bug revolving around how Elastic SIEM handles and defines parent/child EntityIDs
-                parent_sha = parents[1].process_sha256
-                if focus_process.process_sha256 == parent_sha or parent_sha == None:  # Sanity check
-                    parent_sha = "0"
-
-            parent_name = parents[0].process_name
-            if parent_name == None:
-                parent_name = "Unknown"
-
-            # mlog.debug("bb_make_process_tree_visualisation - Creating node for detected process: " + str(process.process_name) + " (" + str(process.process_sha256) + ") " + " with parent: " + str(parent_name) + " (" + str(parent_sha) + ")")
-            tree.create_node(
-                focus_process.process_name + " (" + str(focus_process.process_id) + ")",
-                focus_process.process_sha256,
-                parent=parent_sha,
-            )
-    except Exception as e:
-        mlog.error("bb_make_process_tree_visualisation - Error in Detected Process: " + str(e))
-
-    # Create tree nodes for all children
-    for i in range(0, len(children)):
-        try:
-            process = children[i]
-            if i == 0:
-                parent_sha = focus_process.process_sha256
-            else:
-                parent_sha = process.process_parent
-
-            # mlog.debug("bb_make_process_tree_visualisation - Creating node for process: " + str(process.process_name) + " (" + str(process.process_uuid) + ") " + " with parent: "  + " (" + str(parent_sha) + ")")
-            try:
-                tree.create_node(
-                    process.process_name + " (" + str(process.process_id) + ")", process.process_uuid, parent=parent_sha
-                )
-            except exceptions.NodeIDAbsentError:
-                tree.create_node(
-                    process.process_name + " (" + str(process.process_id) + ")",
-                    process.process_uuid,
-                    parent=focus_process.process_sha256,
-                )
-
-        except Exception as e:
-            mlog.error("bb_make_process_tree_visualisation - Error in Child Processes: " + str(e))
-
-    tree_str = tree.show(stdout=False)
-    tree.show()
+    if format not in ("text", "html"):
+        raise ValueError("Unknown format for the process tree visualisation: " + str(format))
+
+    tree_str = _render_process_tree(_build_process_tree(focus_process, parents, children), format)
     mlog.debug("bb_make_process_tree_visualisation - Returning process tree visualisation: \n" + tree_str)
     return tree_str
 
@@ -0,0 +1,31 @@
+# Z-SOAR
+# Created by: Martin Offermann
+# This module provides shared fixtures for the tests.
+
+import json
+
+import pytest
+import yaml
+
+import lib.config_helper as config_helper
+
+
+@pytest.fixture
+def temporary_cache(tmp_path, monkeypatch):
+    """Lets the cache helpers use a copy of the config with an empty cache file in tmp_path (instead of lib/cache.json).
+
+    Yields:
+        str: The path of the cache file
+    """
+    with open(config_helper.FILE_PATH, "r") as f:
+        cfg = yaml.safe_load(f)
+
+    cache_path = tmp_path / "cache.json"
+    cache_path.write_text(json.dumps({}))
+    cfg["cache"]["file"]["enabled"] = True
+    cfg["cache"]["file"]["path"] = str(cache_path)
+    config_path = tmp_path / "zsoar_config.yml"
+    config_path.write_text(yaml.safe_dump(cfg))
+
+    monkeypatch.setattr(config_helper, "FILE_PATH", str(config_path))
+    yield str(cache_path)
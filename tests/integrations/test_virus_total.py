@@ -17,7 +17,11 @@ from lib.class_helper import (
     HTTP,
     DNSQuery,
 )
-from integrations.virus_total import zs_provide_context_for_detections
+from concurrent.futures import Future
+
+import integrations.virus_total as virus_total
+from integrations.virus_total import zs_provide_context_for_detections, TokenBucket, save_verdict, get_verdict, context_from_verdict
+from lib.generic_helper import add_to_cache
 import lib.logging_helper as logging_helper
 import lib.config_helper as config_helper
 import datetime
@@ -96,3 +100,101 @@ def test_zs_provide_context_for_detections():
     print("URL search result:")
     print(result4)
     print("Test finished")
+
+
+def test_token_bucket():
+    bucket = TokenBucket(rate_per_minute=60, capacity=2)
+
+    assert bucket.try_acquire() == 0, "The bucket should start full"
+    assert bucket.try_acquire() == 0, "The bucket should allow a burst up to its capacity"
+    wait = bucket.try_acquire()
+    assert 0 < wait <= 1, "An empty bucket should return the time until the next token is available"
+
+    bucket.drain(30)
+    assert bucket.try_acquire() > 29, "A drained bucket should not provide tokens for the drained time"
+
+    bucket = TokenBucket(rate_per_minute=60, capacity=1)
+    assert bucket.try_acquire(2) == 0, "Requests for more tokens than the capacity should be served by a full bucket"
+    assert 0 < bucket.try_acquire(2) <= 1, "Requests for more tokens than the capacity should wait for a full bucket"
+    with pytest.raises(ValueError):
+        TokenBucket(capacity=0)
+
+
+def test_verdict_cache(temporary_cache):
+    intel = [
+        ThreatIntel(datetime.datetime.now(), "Engine A", True, True, "malicious", "Trojan.Test", 80),
+        ThreatIntel(datetime.datetime.now(), "Engine B", True),
+        ThreatIntel(datetime.datetime.now(), "Engine C", False),
+    ]
+    context = ContextThreatIntel(DNSQuery, "malicious.example.com", "Virus Total API", datetime.datetime.now(), intel, links=[])
+    context.links.append("https://www.virustotal.com/gui/domain/malicious.example.com")
+
+    save_verdict(DNSQuery, "malicious.example.com", context)
+    verdict = get_verdict(DNSQuery, "malicious.example.com")
+    assert verdict["verdict"] == "malicious", "A context with malicious hits should be cached as malicious verdict"
+    assert len(verdict["hits"]) == 1, "Only engines with hits should be stored in the verdict cache"
+
+    cached_context = context_from_verdict(verdict, DNSQuery, "malicious.example.com", "123")
+    assert cached_context.score_total == 3, "The scores of the cached context should match the original context"
+    assert cached_context.score_hit_mal == 1, "The scores of the cached context should match the original context"
+    assert cached_context.score_known == 2, "The scores of the cached context should match the original context"
+    assert cached_context.links == context.links, "The links of the cached context should match the original context"
+    assert cached_context.related_detection_uuid == "123", "The cached context should be related to the given detection"
+
+    save_verdict(DNSQuery, "unknown.example.com", None)
+    verdict = get_verdict(DNSQuery, "unknown.example.com")
+    assert verdict["verdict"] == "unknown", "A lookup without result should be cached as unknown verdict"
+    assert context_from_verdict(verdict, DNSQuery, "unknown.example.com", "123") is None, "An unknown verdict has no context"
+
+    save_verdict(HTTP, "https://example.com/?id=a2V5", None)  # The lookup strips the '=' padding of URLs
+    assert get_verdict(HTTP, "https://example.com/?id=a2V5==") is not None, "URLs ending with '=' should hit the cache"
+
+    add_to_cache("virus_total", "verdicts", "DNSQuery:broken.example.com", {"verdict": "clean"})
+    assert get_verdict(DNSQuery, "broken.example.com") is None, "A verdict without 'cached_at' should be treated as expired"
+
+
+class FakeResponse:
+    def __init__(self, status_code, data=None):
+        self.status_code = status_code
+        self.data = data or {}
+        self.text = str(self.data)
+
+    def json(self):
+        return self.data
+
+
+def test_lookup_resolutions_status(temporary_cache, monkeypatch):
+    config = {"verify_certs": False, "api_key": "test"}
+    mlog = logging_helper.Log("test_virus_total")
+    report = {
+        "data": {
+            "attributes": {
+                "last_analysis_results": {
+                    "Engine A": {"result": "malware", "category": "malicious", "engine_name": "Engine A", "method": "blacklist"}
+                }
+            }
+        }
+    }
+    responses = []
+    monkeypatch.setattr(virus_total.requests, "request", lambda *args, **kwargs: responses.pop(0))
+
+    # An exceeded API quota on the resolutions request should retry the lookup like on the first request
+    lookup = virus_total.Lookup(config, ipaddress.IPv4Address, "8.8.8.8", "123", mlog, True)
+    responses.extend([FakeResponse(200, report), FakeResponse(429)])
+    assert lookup.step(TokenBucket()) == 0, "The lookup should be retried if the API quota is exceeded"
+    assert not lookup.future.done(), "The lookup should not be done before the retry"
+
+    # Other errors of the resolutions request should only skip the additional relationship data
+    lookup = virus_total.Lookup(config, ipaddress.IPv4Address, "8.8.4.4", "123", mlog, True)
+    responses.extend([FakeResponse(200, report), FakeResponse(500)])
+    assert lookup.step(TokenBucket()) is None, "The lookup should be done"
+    assert lookup.future.result().score_hit_mal == 1, "The result of the first request should be used"
+
+
+def test_zs_provide_context_for_detections_timeout(monkeypatch):
+    config = config_helper.Config().cfg["integrations"]["virus_total"]
+    monkeypatch.setattr(virus_total, "zs_provide_context_for_detections_async", lambda *args, **kwargs: Future())
+    monkeypatch.setattr(virus_total, "TIMEOUT_LOOKUP", 0.01)
+
+    context = zs_provide_context_for_detections(config, None, ContextThreatIntel, search_value="8.8.8.8")
+    assert context is None, "A lookup that does not finish in time should return no context"
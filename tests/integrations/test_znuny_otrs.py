@@ -85,3 +85,40 @@ def test_add_note_to_ticket():
 
 
 # test_zs_create_ticket()
+
+
+# Test rendering of long timelines (offline)
+def test_render_timeline():
+    import gzip
+    import base64
+    from integrations.znuny_otrs import render_timeline, cap_note_body, NOTE_MAX_TABLE_ROWS
+
+    # The timelines are built like in the playbooks, as the context lists of a CaseFile are Timelines (not plain lists)
+    detection = Detection("456", "Some Detection", [Rule("123", "Some Rule", 0)], datetime.datetime.now())
+    short_case_file = CaseFile(detection)
+    case_file = CaseFile(detection)
+    for i in range(NOTE_MAX_TABLE_ROWS + 50):
+        flow = ContextFlow(
+            uuid.uuid4(), datetime.datetime.now(), "Test", "10.0.0." + str(i % 10), 50000 + i, "8.8.8.8", 53, "DNS"
+        )
+        case_file.add_context(flow)
+        if i < 10:
+            short_case_file.add_context(flow)
+    flows = case_file.context_flows
+
+    body, attachment = render_timeline(short_case_file.context_flows, "flows")
+    assert attachment is None and body.count("<tr>") == 10, "Short timelines should be rendered completely without attachment"
+    assert body.count("<td>8.8.8.8</td>") == 10 and "max_size" not in body, "Every flow should be a table row"
+
+    body, attachment = render_timeline(flows, "flows")
+    assert body.count("<tr>") < len(flows), "Long timelines should only show the first rows"
+    assert body.count("<td>8.8.8.8</td>") == NOTE_MAX_TABLE_ROWS and "max_size" not in body, "The first flows should be rows"
+    assert "8.8.8.8 (" + str(len(flows)) + ")" in body, "Long timelines should be summarized"
+    csv_lines = gzip.decompress(base64.b64decode(attachment.Content)).decode().splitlines()
+    assert len(csv_lines) == len(flows) + 1, "The attachment should contain all flows (and the CSV header)"
+
+    assert len(cap_note_body("<br>" * 1000, 100).encode()) < 200, "Note bodies should be capped"
+    capped = cap_note_body("<br><table><tr><td>1</td></tr></table>" + "x" * 1000, 100)
+    assert capped.startswith("<br><table><tr><td>1</td></tr></table><br>"), "Capped notes should keep complete tables"
+    capped = cap_note_body("<p>Intro</p><table><tr><td>1<br>2</td></tr></table>" + "x" * 1000, 100)
+    assert capped.count("<table") == capped.count("</table>"), "Capped notes should not contain unclosed tables"
@@ -3,6 +3,7 @@
 # This test module is used to test the PB_010_Generic_VirusTotal playbook.
 # ! Be aware that this has to be an online test
 
+import playbooks.PB_110_Generic_VirusTotal as PB_110_Generic_VirusTotal
 from integrations.znuny_otrs import zs_create_ticket
 from playbooks.PB_110_Generic_VirusTotal import zs_can_handle_detection, zs_handle_detection
 from tests.test_zsoar_lib import test_class_helper
@@ -27,3 +28,30 @@ def test_zs_handle_detection():
 
     zs_handle_detection(case_file, False)
     assert True == True, "zs_handle_detection() should not raise an exception"
+
+
+def test_zs_prepare_cycle_offline(monkeypatch):
+    submitted = []
+
+    def submit_lookups(integration_config, case_file, TEST, ips, domains, urls, hashes):
+        submitted.append((case_file, TEST, ips + domains + urls + hashes))
+
+    monkeypatch.setattr(PB_110_Generic_VirusTotal, "submit_lookups", submit_lookups)
+    monkeypatch.setattr(PB_110_Generic_VirusTotal, "zs_start_cycle", lambda: None)
+
+    with_ticket = test_class_helper()
+    with_ticket.detections[0].indicators["domain"].add("evil.example.net")
+    with_ticket.ticket = {"TicketNumber": "2023061210000017"}
+    without_ticket = test_class_helper()  # New detections get their ticket later in the cycle
+    without_ticket.detections[0].indicators["domain"].add("other.example.net")
+    without_ticket.detections[0].indicators["domain"].add("evil.example.net")
+    without_indicators = test_class_helper()  # Its detection has no searchable indicators, so it is never handled
+
+    PB_110_Generic_VirusTotal.zs_prepare_cycle([with_ticket, without_ticket, without_indicators], TEST=True)
+
+    assert all(TEST for _, TEST, _ in submitted), "The lookups should be submitted in test mode"
+    assert all(case_file is not without_indicators for case_file, _, _ in submitted), "Unhandled cases should not be looked up"
+    indicators = [indicator for _, _, indicators in submitted for indicator in indicators]
+    expected = [indicator for values in PB_110_Generic_VirusTotal.get_case_indicators(with_ticket) for indicator in values]
+    assert set(indicators) == set(expected) | {"other.example.net"}, "The indicators of zs_handle_detection() should be used"
+    assert len(indicators) == len(set(indicators)), "Indicators shared by cases should only be looked up once"
@@ -12,6 +12,7 @@ import json
 import lib.logging_helper as logging_helper
 from lib.class_helper import CaseFile, Detection, Rule, ContextProcess, ContextFlow
 from lib.config_helper import Config
+import playbooks.bb_elastic_process_context as bb_elastic_process_context
 from playbooks.bb_elastic_process_context import (
     bb_get_all_processes_by_uuid,
     bb_get_all_children,
@@ -100,6 +101,111 @@ def test_bb_get_all_children():
         mlog.info(str(child))
 
 
+def test_get_all_children_offline(monkeypatch):
+    import hashlib
+
+    def make_process(name, parent_name, hash_seed):
+        return ContextProcess(
+            "entity-id-of-process-" + name.rjust(16, "0"),
+            datetime.datetime(2023, 6, 1),
+            detection.uuid,
+            name,
+            process_sha256=hashlib.sha256(str(hash_seed).encode()).hexdigest(),
+            process_parent=parent_name and "entity-id-of-process-" + parent_name.rjust(16, "0"),
+        )
+
+    # A chain of processes deeper than the recursion limit, a cycle back to the root and two leafs with the same hash
+    depth = 9996
+    tree = {"p" + str(i): [make_process("p" + str(i + 1), "p" + str(i), i + 1)] for i in range(depth)}
+    last = "p" + str(depth)
+    tree[last] = [make_process("p0", last, 0), make_process("l1", last, "leaf"), make_process("l2", last, "leaf")]
+    fetches = []
+
+    def get_children(case_file, uuid, children=False):
+        fetches.append(uuid)
+        return tree.get(uuid[len("entity-id-of-process-") :].lstrip("0"))
+
+    monkeypatch.setattr(bb_elastic_process_context, "bb_get_all_processes_by_uuid", get_children)
+    offline_case_file = CaseFile([detection])
+    offline_case_file.context_processes.max_size = depth + 3  # Let the whole tree fit into the CaseFile
+    root = make_process("p0", None, 0)
+
+    start = datetime.datetime.now()
+    children, budget_exhausted = bb_elastic_process_context.get_all_children(offline_case_file, root, max_nodes=depth + 3)
+    assert (datetime.datetime.now() - start).total_seconds() < 30, "A tree of 10k processes should be built in bounded time"
+    assert not budget_exhausted and [child.process_name for child in children[-2:]] == [last, "l1"]
+    assert len(fetches) == len(set(fetches)) == depth + 2, "Every process should be fetched once"
+    linked = tree["p" + str(depth - 1)][0].process_children
+    assert [child.process_name for child in linked] == ["p0", "l1", "l2"], "Skipped children should still be linked"
+    assert root.process_children[0].process_name == "p1" and tree["p1"][0].process_children[0].process_name == "p3"
+    assert len(offline_case_file.context_processes) == depth + 3, "All processes should be added to the CaseFile"
+
+    children, budget_exhausted = bb_elastic_process_context.get_all_children(
+        CaseFile([detection]), make_process("p0", None, 0), max_nodes=100
+    )
+    assert budget_exhausted and len(children) == 100, "The tree should be cut at the node budget"
+
+    small_case_file = CaseFile([detection])
+    small_case_file.context_processes.max_size = 50
+    small_case_file.add_context(make_process("other", None, "other"))
+    fetches.clear()
+    children, budget_exhausted = bb_elastic_process_context.get_all_children(small_case_file, make_process("p0", None, 0))
+    assert budget_exhausted and len(children) == 49, "The tree should be cut when the process timeline of the CaseFile is full"
+    assert len(small_case_file.context_processes) == 50 and len(fetches) == 50, "No process should be fetched and dropped"
+
+
+def test_bb_make_process_tree_visualisation_offline():
+    import hashlib
+
+    def make_process(name, pid, children=()):
+        process = ContextProcess(
+            "entity-id-of-process-" + str(pid).rjust(16, "0"),
+            datetime.datetime(2023, 6, 1),
+            detection.uuid,
+            name,
+            pid,
+            process_sha256=hashlib.sha256(name.encode()).hexdigest(),
+        )
+        process.process_children.extend(children)
+        return process
+
+    # Three conhost.exe with the same hash and two different services that both start whoami.exe (a repeated subtree)
+    focus = make_process("powershell.exe", 3, [make_process("conhost.exe", 10 + i) for i in range(3)])
+    focus.process_children.append(make_process("svc.exe", 20, [make_process("whoami.exe", 30)]))
+    focus.process_children.append(make_process("svc.exe", 21, [make_process("whoami.exe", 31)]))
+    focus.process_children[-1].process_sha256 = hashlib.sha256(b"other svc.exe").hexdigest()
+    parents = [make_process("cmd.exe", 2), make_process("explorer.exe", 1)]
+
+    text = bb_make_process_tree_visualisation(focus, parents, [])
+    assert text.splitlines() == [
+        "explorer.exe (1)",
+        "└── cmd.exe (2)",
+        "    └── powershell.exe (3) <-- detected process",
+        "        ├── conhost.exe (10) [3x]",
+        "        └── svc.exe (20) [2x]",
+        "            └── whoami.exe (30)",
+    ], "Siblings with the same hash and repeated sibling subtrees should be shown once with a count"
+
+    tree_html = bb_make_process_tree_visualisation(focus, parents, [], format="html")
+    assert tree_html.startswith("<ul><li>explorer.exe (1)<ul><li>cmd.exe (2)<ul><li><b>powershell.exe (3)</b>")
+    assert tree_html.count("<ul>") == tree_html.count("</ul>") == 5, "The HTML lists should be nested and closed"
+
+    # A deep and wide tree should be summarised and rendered quickly
+    chain = make_process("deep.exe", 100000)
+    process = chain
+    for i in range(5000):
+        process.process_children.append(make_process("chain" + str(i) + ".exe", 100001 + i))
+        process = process.process_children[0]
+    wide = make_process("wide.exe", 200000, [make_process("child" + str(i) + ".exe", 200001 + i) for i in range(5000)])
+    big_focus = make_process("big.exe", 1, [chain, wide])
+
+    start = datetime.datetime.now()
+    text = bb_make_process_tree_visualisation(big_focus, [], [])
+    assert (datetime.datetime.now() - start).total_seconds() < 5, "Big trees should be rendered fast"
+    assert "more processes (tree too deep)" in text and text.endswith("more processes not shown")
+    assert len(text.splitlines()) <= bb_elastic_process_context.THRESHOLD_MAX_TREE_NODES + 2
+
+
 def test_bb_make_process_tree_visualisation():
     # Test the function
     print(process)
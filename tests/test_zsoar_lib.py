@@ -564,4 +564,429 @@ def test_generic_helper():
     # TODO: Add more tests
 
 
+def test_timeline():
+    from lib.generic_helper import Timeline
+    from lib.class_helper import ContextLog
+
+    start = datetime.datetime(2023, 1, 1, 12, 0, 0)
+    logs = [
+        ContextLog("456", start + datetime.timedelta(minutes=i), "Message " + str(i), "Test", log_source_ip="10.0.0.1")
+        for i in (5, 1, 3, 1, 4)
+    ]
+
+    timeline = Timeline()
+    for log in logs:
+        timeline.add(log)
+    assert [log.log_message for log in timeline] == [
+        "Message 1",
+        "Message 1",
+        "Message 3",
+        "Message 4",
+        "Message 5",
+    ], "Timeline is not sorted by timestamp"
+    assert timeline[0] is logs[1], "Contexts with the same timestamp should keep the order in which they were added"
+
+    timeline_bulk = Timeline()
+    timeline_bulk.extend(logs)
+    assert list(timeline_bulk) == list(timeline), "Bulk extend should result in the same order as single adds"
+
+    in_range = timeline.between(start + datetime.timedelta(minutes=2), start + datetime.timedelta(minutes=4))
+    assert [log.log_message for log in in_range] == ["Message 3", "Message 4"], "Time range slicing is not correct"
+
+    small_timeline = Timeline(max_size=2)
+    small_timeline.extend(logs)
+    assert len(small_timeline) == 2, "Timeline should not grow above its maximum size"
+
+
+def test_format_case_file_timeline():
+    import lib.class_helper as class_helper
+    from lib.generic_helper import format_results
+
+    rules = [class_helper.Rule("123", "Some Rule", 0)]
+    detection = class_helper.Detection("456", "Some Detection", rules, datetime.datetime.now())
+    case_file = class_helper.CaseFile(detection)
+    for i in range(3):
+        flow = class_helper.ContextFlow(
+            detection.uuid, datetime.datetime.now(), "Test", "10.0.0." + str(i), 50000, "8.8.8.8", 53, "DNS"
+        )
+        case_file.add_context(flow)
+
+    table = format_results(case_file.context_flows, "html", group_by="")
+    assert table.count("<td>8.8.8.8</td>") == 3, "Every flow of the timeline should be a table row"
+    assert "max_size" not in table, "The timeline should not be rendered as a single object"
+    assert format_results(class_helper.CaseFile(detection).context_flows, "html") == "~ No results found ~"
+
+
+def test_indicator_set():
+    from lib.generic_helper import create_indicators
+
+    indicators = create_indicators()
+    indicators["domain"].append("www.example.com")
+    indicators["domain"].append("*.example.com")
+    indicators["domain"].append("example.com")
+    indicators["domain"].append(None)
+    assert list(indicators["domain"]) == ["www.example.com", "example.com"], "Domains were not normalized or de-doubled"
+    assert "*.example.com" in indicators["domain"], "Membership check should normalize the indicator"
+
+    indicators["ip"].append(ipaddress.ip_address("10.0.0.1"))
+    indicators["ip"].extend([ipaddress.ip_address("10.0.0.2"), ipaddress.ip_address("10.0.0.1")])
+    assert indicators["ip"][1] == ipaddress.ip_address("10.0.0.2"), "Indicators should keep the order they were added"
+    assert len(indicators["ip"]) == 2, "IP indicators were not de-doubled"
+
+
+def test_case_file_context_index():
+    import lib.class_helper as class_helper
+
+    detection = class_helper.Detection("456", "Some Detection", [class_helper.Rule("123", "Some Rule", 0)], datetime.datetime.now())
+    assert detection.get_context_by_uuid(uuid.uuid4()) is None, "Detection without contexts should return None"
+
+    case_file = class_helper.CaseFile(detection)
+    process_uuid = str(uuid.uuid4())
+    process = class_helper.ContextProcess(
+        process_uuid, datetime.datetime.now(), detection.uuid, "virus.exe", 299, "word.exe", 242, "C:\\Tmp\\virus.exe"
+    )
+    file = class_helper.ContextFile(
+        detection.uuid,
+        datetime.datetime.now(),
+        "create",
+        "image.png",
+        "C:\\Tmp\\image.png",
+        512456,
+        process_uuid=process_uuid,
+        uuid=uuid.uuid4(),
+    )
+    case_file.add_context(process)
+    case_file.add_context(file)
+
+    assert case_file.get_context_by_uuid(process_uuid) is process, "Process should be found by its process UUID"
+    assert case_file.get_context_by_uuid(file.uuid, class_helper.ContextFile) is file, "File not found by UUID"
+    assert case_file.get_context_by_uuid(file.uuid, class_helper.ContextFlow) is None, "Type filter was ignored"
+    assert case_file.get_context_by_uuid(uuid.uuid4()) is None, "Unknown UUID should return None"
+    assert case_file.get_contexts_by_process_uuid(process_uuid) == [process, file], "Process index is not correct"
+    assert case_file.get_contexts_by_process_uuid(process_uuid, class_helper.ContextFile) == [file], "Type filter was ignored"
+
+
 test_generic_helper()
+
+
+def test_context_slots():
+    import lib.class_helper as class_helper
+
+    log = class_helper.ContextLog(uuid.uuid4(), datetime.datetime.now(), "Some log message", "Sysmon", "10.0.0.1")
+    for cls in (
+        class_helper.ContextFlow,
+        class_helper.ContextProcess,
+        class_helper.ContextLog,
+        class_helper.ContextFile,
+        class_helper.ContextRegistry,
+    ):
+        assert "__slots__" in vars(cls), cls.__name__ + " should define __slots__"
+
+    assert log.__dict__()["log_message"] == "Some log message", "__dict__() should still return the attributes"
+    with pytest.raises(AttributeError):
+        log.some_unknown_attribute = "value"
+
+
+def test_to_json():
+    import json
+    import lib.class_helper as class_helper
+    from lib.generic_helper import to_dict, to_json
+
+    detection = class_helper.Detection("456", "Some Detection", [class_helper.Rule("123", "Some Rule", 0)], datetime.datetime.now())
+    case_file = class_helper.CaseFile(detection)
+    flow = class_helper.ContextFlow(
+        detection.uuid, datetime.datetime.now(), "Elastic SIEM", "10.0.0.1", 1234, "10.0.0.2", 80, "TCP", process_name=""
+    )
+    flow.dns_query = class_helper.DNSQuery(detection.uuid, "A", "example.com", False, "10.0.0.2")
+    case_file.add_context(flow)
+
+    case_dict = json.loads(to_json(case_file))
+    assert case_dict == to_dict(case_file), "to_json() should encode the output of to_dict()"
+    assert json.loads(str(case_file)) == case_dict, "__str__() should use to_json()"
+
+    flow_dict = case_dict["context_flows"][0]
+    assert flow_dict["source_ip"] == "10.0.0.1", "IP addresses should be serialized as strings"
+    assert flow_dict["dns_query"]["query"] == "example.com", "Nested objects should be serialized as objects, not as strings"
+    assert "process_name" not in flow_dict and "process_id" not in flow_dict, "Empty values should be skipped"
+    assert "_context_index" not in case_dict, "Private attributes should be skipped"
+
+    parent = class_helper.ContextProcess(str(uuid.uuid4()), datetime.datetime.now(), detection.uuid, "parent.exe")
+    child = class_helper.ContextProcess(str(uuid.uuid4()), datetime.datetime.now(), detection.uuid, "child.exe")
+    parent.process_children = [child]
+    child.process_parent = parent
+    assert to_dict(parent)["process_children"][0]["process_parent"] == parent.process_uuid, "Cycles should be resolved"
+
+
+def test_str_keys():
+    import json
+    import lib.class_helper as class_helper
+    from lib.generic_helper import to_dict
+
+    detection = class_helper.Detection(
+        "456", "Some Detection", [class_helper.Rule("123", "Some Rule", 0)], datetime.datetime.now(), raw={"a": 1}
+    )
+    detection_dict = json.loads(str(detection))
+    assert list(detection_dict) == ["id", "name", "timestamp", "raw", "rules", "uuid"], "str() should use the keys of __dict__()"
+    assert detection_dict["id"] == "456", "The vendor ID should be serialized as 'id'"
+
+    audit = class_helper.AuditLog("PB_000_Test", 1, "Some stage")
+    assert list(json.loads(str(audit))) == [
+        "playbook",
+        "stage",
+        "title",
+        "start_time",
+        "playbook_done",
+        "stage_done",
+    ], "The result_* fields should be hidden until the stage is done"
+
+    audit.set_successful("Done", data=[detection])
+    audit_dict = json.loads(str(audit))
+    assert "result_message" in audit_dict and "vendor_id" not in str(audit), "Done stages should show the result_* fields"
+    assert type(audit_dict["result_data"]) is str, "The result data should not embed whole detections"
+
+    class Wrapper:  # A key of __dict__() that differs from the name of its attribute
+        def __init__(self, flow):
+            self._flow = flow
+
+        def __dict__(self, nested=str):
+            return {"flow": nested(self._flow)}
+
+    flow = class_helper.ContextFlow(
+        detection.uuid, datetime.datetime.now(), "Elastic SIEM", "10.0.0.1", 1234, "10.0.0.2", 80, "TCP", process_name=""
+    )
+    assert json.loads(Wrapper(flow).__dict__()["flow"])["source_ip"] == "10.0.0.1", "__dict__() should stringify by default"
+    assert to_dict(Wrapper(flow))["flow"]["source_ip"] == "10.0.0.1", "Nested objects should be serialized as objects"
+
+
+def test_snapshot_helper(tmp_path, monkeypatch):
+    import os
+    import lib.class_helper as class_helper
+    import lib.snapshot_helper as snapshot_helper
+
+    snapshot_dir = os.path.join(os.path.dirname(os.path.abspath(zsoar.__file__)), "snapshots")
+    assert snapshot_helper.SNAPSHOT_DIR == snapshot_dir, "Snapshots should be stored in the repository, not in the CWD"
+    monkeypatch.setattr(snapshot_helper, "SNAPSHOT_DIR", str(tmp_path))
+
+    detection = class_helper.Detection("456", "Some Detection", [class_helper.Rule("123", "Some Rule", 0)], datetime.datetime.now())
+    case_file = class_helper.CaseFile(detection)
+    assert case_file.uuid != class_helper.CaseFile(detection).uuid, "Every CaseFile should get its own UUID"
+
+    process = class_helper.ContextProcess(str(uuid.uuid4()), datetime.datetime.now(), detection.uuid, "virus.exe")
+    case_file.add_context(process)
+    case_file.playbooks.append("PB_010_Generic_Elastic_Alerts")
+
+    assert snapshot_helper.save_snapshot(case_file), "Could not save snapshot"
+    resumed = snapshot_helper.load_snapshots()
+    assert len(resumed) == 1, "The snapshot should be loaded"
+    assert resumed[0].uuid == case_file.uuid, "The resumed case should keep its UUID"
+    assert resumed[0].playbooks == ["PB_010_Generic_Elastic_Alerts"], "The resumed case should keep its playbook progress"
+    assert str(resumed[0]) == str(case_file), "The resumed case should be equal to the saved case"
+    assert resumed[0].get_context_by_uuid(process.process_uuid).process_name == "virus.exe", "Context index was not restored"
+
+    snapshot_helper.delete_snapshot(case_file.uuid)
+    assert snapshot_helper.load_snapshots() == [], "The snapshot should be deleted"
+
+
+def test_whitelist(temporary_cache):
+    import lib.class_helper as class_helper
+    from lib.generic_helper import Whitelist, add_to_cache, get_whitelist
+
+    whitelist = Whitelist()
+    whitelist.add("ip", "10.0.0.0/8")
+    whitelist.add("ip", "192.168.1.1")
+    whitelist.add("ip", "2001:db8::/32")
+    whitelist.add("domain", "*.example.com")
+    whitelist.add("domain", "example.org")
+    whitelist.add("hash", "6F3B9DDA23C69C097372EF91FD09420A")
+    assert whitelist.add("ip", "not an ip") == False, "Invalid IPs should be ignored"
+
+    assert whitelist.match("ip", ipaddress.ip_address("10.1.2.3")) == "10.0.0.0/8", "IP in CIDR range should match"
+    assert whitelist.match("ip", "192.168.1.1") == "192.168.1.1/32", "Single IP should match"
+    assert whitelist.match("ip", "192.168.1.2") is None, "IP outside of the whitelist should not match"
+    assert whitelist.match("ip", "2001:db8::1") == "2001:db8::/32", "IPv6 in CIDR range should match"
+    assert whitelist.match("domain", "www.Example.com") == "*.example.com", "Subdomain should match"
+    assert whitelist.match("domain", "example.com") == "*.example.com", "Domain itself should match"
+    assert whitelist.match("domain", "notexample.com") is None, "Only whole labels should match"
+    assert whitelist.match("domain", "example.org") == "example.org", "Plain domain should match exactly"
+    assert whitelist.match("domain", "evil.example.org") is None, "Plain domain should not match its subdomains"
+    assert whitelist.match("hash", "6f3b9dda23c69c097372ef91fd09420a"), "Hashes should match case-insensitive"
+
+    add_to_cache("global_whitelist_domains", "LIST", "LIST", "*.whitelisted.example.org")
+    detection = class_helper.Detection("456", "Some Detection", [class_helper.Rule("123", "Some Rule", 0)], datetime.datetime.now())
+    detection.indicators["domain"].add("www.whitelisted.example.org")
+    whitelist = get_whitelist()
+    assert whitelist.size == 1, "The global whitelist should be loaded from the cache"
+    assert detection.check_against_whitelist(), "Detection with whitelisted subdomain should be whitelisted"
+
+    add_to_cache("virus_total", "verdicts", "some_indicator", {"verdict": "clean"})
+    assert get_whitelist() is whitelist, "Other cache entries should not recompile the whitelist"
+    add_to_cache("global_whitelist_domains", "LIST", "LIST", "other.example.org")
+    assert get_whitelist().size == 2, "Changed whitelist lists should recompile the whitelist"
+
+
+def test_get_ip_info():
+    from lib.generic_helper import get_ip_info, cast_to_ipaddress
+
+    ip_info = get_ip_info("10.0.0.1")
+    assert ip_info.address == ipaddress.ip_address("10.0.0.1"), "The address should be parsed"
+    assert ip_info.is_private and not ip_info.is_global, "10.0.0.1 should be private"
+    assert get_ip_info("10.0.0.1") is ip_info, "The result should be memoized"
+    assert get_ip_info(ipaddress.ip_address("127.0.0.1")).is_loopback, "127.0.0.1 should be a loopback address"
+    assert get_ip_info("224.0.0.1").is_multicast, "224.0.0.1 should be a multicast address"
+    assert get_ip_info("8.8.8.8").is_global, "8.8.8.8 should be global"
+    assert get_ip_info("not an ip") is None, "Invalid IPs should return None"
+    assert cast_to_ipaddress("not an ip", strict=False) is None, "cast_to_ipaddress() should still allow invalid IPs"
+    with pytest.raises(ValueError):
+        cast_to_ipaddress("not an ip")
+
+
+def test_compile_path():
+    from lib.generic_helper import compile_path, compile_mapping, dict_get
+
+    doc = {"@timestamp": "2023-06-01", "source": {"ip": "10.0.0.1", "geo": {"location": {"lat": 1, "lon": 2}}}, "tags": ["a"]}
+    for path in ("@timestamp", "source.ip", "source.geo.location", "source.geo.city_name", "tags.x", "missing.path"):
+        assert compile_path(path)(doc) == dict_get(doc, path), "Compiled path '" + path + "' should behave like dict_get()"
+    assert compile_path("source.port")(doc, 0) == 0, "The default should be returned for missing keys"
+    assert compile_path("source.geo.location") is compile_path("source.geo.location"), "Compiled paths should be memoized"
+
+    extract = compile_mapping({"ip": "source.ip", "lat": "source.geo.location.lat", "port": "source.port"})
+    assert extract(doc) == {"ip": "10.0.0.1", "lat": 1, "port": None}, "All fields of the mapping should be extracted"
+
+
+def test_format_results():
+    from lib.generic_helper import format_results, Timeline
+    from lib.class_helper import ContextFlow, Location
+
+    flows = [
+        ContextFlow("detection", datetime.datetime.now(), "Test", "10.0.0.1", 50000, "8.8.8.8", 53, "DNS", process_id=1),
+        ContextFlow("detection", datetime.datetime.now(), "Test<&>", "10.0.0.2", 50001, "8.8.4.4", 443, "HTTPS", process_id=1),
+    ]
+
+    flows[0].destination_location = Location("Germany", "Berlin")
+
+    table = format_results(flows, "html", group_by="")
+    assert table.count("<tr>") == 2 and "<th>destination_location_country</th>" in table, "Each flow should be a table row"
+    assert "<td>Berlin</td>" in table, "Nested objects should be expanded into columns"
+    assert "Test&lt;&amp;&gt;" in table and "uuid" not in table, "Cells should be escaped and hidden fields left out"
+    assert format_results(flows, "html") == table, "The default group_by column (uuid) is hidden, so rows should not be merged"
+    assert format_results(Timeline(flows), "html", group_by="") == table, "Timelines should be formatted like lists"
+    grouped = format_results(Timeline(flows), "markdown", group_by="process_id")
+    assert len(grouped.splitlines()) == 3 and "max_size" not in grouped, "Timelines should be grouped like lists"
+
+    table = format_results(flows, "markdown", group_by="process_id")
+    assert table.splitlines()[0].startswith("| process_id |"), "The grouped column should be the first column"
+    assert len(table.splitlines()) == 3 and "| 1 | " in table, "Flows of the same process should be grouped to one row"
+    assert format_results([], "html") == "~ No results found ~", "Empty results should be stated"
+
+
+def test_metrics_helper(tmp_path, monkeypatch):
+    import lib.metrics_helper as metrics_helper
+
+    metrics_helper.flush()  # Do not mix in spans of other tests
+    monkeypatch.setattr(metrics_helper, "METRICS_FILE", str(tmp_path / "metrics.jsonl"))
+
+    for duration in range(1, 101):
+        metrics_helper.record_span("test.stage", duration / 1000, playbook="PB_Test")
+    with pytest.raises(ValueError):
+        with metrics_helper.span("test.failing"):
+            raise ValueError("Failed stage")
+
+    @metrics_helper.timed("test.timed", with_module=True)
+    def timed_function():
+        return 42
+
+    assert timed_function() == 42, "The decorated function should return its result"
+    metrics_helper.flush()
+
+    spans = metrics_helper.load_spans()
+    assert len(spans) == 102 and spans[0]["playbook"] == "PB_Test", "All spans should be written with their labels"
+    assert spans[-1]["module"] == "test_zsoar_lib", "The timed function should be labeled with its module"
+
+    stats = metrics_helper.get_stage_stats(spans)
+    assert stats["test.stage"]["count"] == 100 and stats["test.stage"]["errors"] == 0
+    assert stats["test.stage"]["p50_ms"] == 50 and stats["test.stage"]["p95_ms"] == 95, "Percentiles should be nearest rank"
+    assert stats["test.failing"]["errors"] == 1, "A span that raised an exception should be counted as error"
+
+    # The file is rotated when it is too large and only its end is read
+    monkeypatch.setattr(metrics_helper, "METRICS_MAX_FILE_SIZE", 1)
+    monkeypatch.setattr(metrics_helper, "METRICS_READ_BLOCK_SIZE", 100)
+    metrics_helper.record_span("test.rotated", 0.001)
+    metrics_helper.flush()
+    assert len(metrics_helper.load_spans(max_spans=1000)) == 103, "Spans of the rotated file should be loaded as well"
+    spans = metrics_helper.load_spans(max_spans=5)
+    assert [span["stage"] for span in spans] == ["test.stage"] * 2 + ["test.failing", "test.timed", "test.rotated"]
+    assert (tmp_path / "metrics.jsonl.1").exists(), "The metrics file should be rotated when it is too large"
+
+    # A failing listener must neither break the measured code nor the other listeners
+    def failing_listener(record):
+        raise RuntimeError("Broken listener")
+
+    observed = []
+    monkeypatch.setattr(metrics_helper, "_listeners", [failing_listener, observed.append])
+    with metrics_helper.span("test.listener"):
+        pass
+    assert [record["stage"] for record in observed] == ["test.listener"], "The other listeners should still be called"
+    metrics_helper.flush()
+    assert metrics_helper.load_spans(max_spans=1)[0]["stage"] == "test.listener", "The span should still be recorded"
+
+
+def test_profiling_helper(tmp_path):
+    import pstats
+    import lib.profiling_helper as profiling_helper
+
+    def allocating_function(size):
+        allocating_function.kept = [bytearray(size) for _ in range(10)]
+        return len(allocating_function.kept)
+
+    profiler = profiling_helper.Profiler(every_nth=2, directory=str(tmp_path))
+    assert [profiler.run(allocating_function, 100000) for _ in range(3)] == [10, 10, 10], "The results should be returned"
+    assert len(list(tmp_path.glob("*.pstats"))) == 2, "Only every 2nd call should be profiled"
+
+    pstats_path, report_path = profiler.last_files
+    functions = [function for _, _, function in pstats.Stats(pstats_path).stats]
+    assert "allocating_function" in functions, "The profile should contain the called function"
+    with open(report_path) as f:
+        report = f.read()
+    assert "test_zsoar_lib.py" in report.splitlines()[6], "The biggest allocation should be listed first"
+
+    def failing_function():
+        raise ValueError("Failed cycle")
+
+    profiler = profiling_helper.Profiler(directory=str(tmp_path), label="failing")
+    with pytest.raises(ValueError):
+        profiler.run(failing_function)
+    assert "(failed)" in open(profiler.last_files[1]).read(), "A failed call should still be profiled"
+
+
+def test_prometheus_helper():
+    import urllib.request
+    import lib.metrics_helper as metrics_helper
+    import lib.prometheus_helper as prometheus_helper
+
+    registry = prometheus_helper.MetricsRegistry()
+    metrics_helper.add_listener(registry.observe_span)
+    try:
+        metrics_helper.record_span("worker.provide_new_detections", 0.2, integration="elastic_siem", detections=3)
+        metrics_helper.record_span("playbook.handle_detection", 1.5, playbook="PB_Test")
+        metrics_helper.record_span("integration.provide_context", 0.05, False, module="virus_total")
+        for hit in (True, True, False, True):
+            metrics_helper.record_span("cache.get", 0.001, hit=hit)
+        metrics_helper.record_span("daemon.cycle", 90, overrun=True)
+    finally:
+        metrics_helper.remove_listener(registry.observe_span)
+
+    server = prometheus_helper.start_server(registry, 0)
+    try:
+        url = "http://" + prometheus_helper.METRICS_HOST + ":" + str(server.server_address[1]) + prometheus_helper.METRICS_PATH
+        with urllib.request.urlopen(url) as response:
+            metrics = response.read().decode()
+    finally:
+        server.shutdown()
+
+    assert 'zsoar_detections_ingested_total{integration="elastic_siem"} 3' in metrics
+    assert 'zsoar_cases_handled_total{playbook="PB_Test",result="ok"} 1' in metrics
+    assert 'zsoar_playbook_duration_seconds_bucket{playbook="PB_Test",le="2.5"} 1' in metrics, "Buckets should be cumulative"
+    assert 'zsoar_playbook_duration_seconds_bucket{playbook="PB_Test",le="1"} 0' in metrics
+    assert 'zsoar_api_call_errors_total{stage="integration.provide_context",integration="virus_total"} 1' in metrics
+    assert "zsoar_cache_hit_ratio 0.75" in metrics and "zsoar_daemon_cycle_overruns_total 1" in metrics
+    assert "# TYPE zsoar_daemon_cycle_duration_seconds histogram" in metrics
@@ -12,6 +12,8 @@ import json
 
 import lib.config_helper as config_helper
 import lib.logging_helper as logging_helper
+import lib.metrics_helper as metrics_helper
+import lib.profiling_helper as profiling_helper
 import zsoar_daemon as zsoar_daemon
 import zsoar_worker as zsoar_worker
 
@@ -39,6 +41,20 @@ def add_arguments():
     parser.add_argument("--stop", action="store_true", help="Stop Z-SOAR")
     parser.add_argument("--restart", action="store_true", help="Restart Z-SOAR")
     parser.add_argument("--status", action="store_true", help="Show the status of Z-SOAR")
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Profile the worker cycles with cProfile and tracemalloc (use with --start or --restart). "
+        + "The profiles are written to "
+        + profiling_helper.PROFILES_DIR,
+    )
+    parser.add_argument(
+        "--profile-every",
+        type=int,
+        default=1,
+        metavar="N",
+        help="Only profile every Nth worker cycle of the daemon (default: 1)",
+    )
     parser.add_argument(
         "--allow-multiple-instances",
         action="store_true",
@@ -84,13 +100,52 @@ def get_script_pid(mlog, script):
     return -1
 
 
-def startup(mlog, DEBUG, ALLOW_MULTIPLE_INSTANCES):
+def log_stage_stats(mlog):
+    """Logs the p50/p95 durations per stage of the worker pipeline, as recorded in the metrics file.
+
+    Args:
+        mlog (logging_helper.Log): The logger
+
+    Returns:
+        None
+    """
+    stats = metrics_helper.get_stage_stats(metrics_helper.load_spans())
+    if not stats:
+        mlog.info("No metrics recorded yet (" + metrics_helper.METRICS_FILE + ").")
+        return
+
+    width = max(len("Stage"), max(len(str(stage)) for stage in stats))
+    mlog.info("Stage timings (recorded in " + metrics_helper.METRICS_FILE + "):")
+    mlog.info(
+        "\t"
+        + "Stage".ljust(width)
+        + "Count".rjust(8)
+        + "p50 ms".rjust(12)
+        + "p95 ms".rjust(12)
+        + "Max ms".rjust(12)
+        + "Errors".rjust(8)
+    )
+    for stage, stage_stats in stats.items():
+        mlog.info(
+            "\t"
+            + str(stage).ljust(width)
+            + str(stage_stats["count"]).rjust(8)
+            + str(round(stage_stats["p50_ms"], 1)).rjust(12)
+            + str(round(stage_stats["p95_ms"], 1)).rjust(12)
+            + str(round(stage_stats["max_ms"], 1)).rjust(12)
+            + str(stage_stats["errors"]).rjust(8)
+        )
+
+
+def startup(mlog, DEBUG, ALLOW_MULTIPLE_INSTANCES, PROFILE=False, PROFILE_EVERY=1):
     """Starts the main loop (called 'worker') or the daemon depending on the settings.
 
     Args:
         mlog (logging_helper.Log): The logger
         DEBUG (bool): If debug mode is enabled
         ALLOW_MULTIPLE_INSTANCES (bool): If multiple instances of Z-SOAR should be allowed
+        PROFILE (bool, optional): If the worker cycles should be profiled. Defaults to False.
+        PROFILE_EVERY (int, optional): Only profile every Nth worker cycle of the daemon. Defaults to 1.
 
     Returns:
         None
@@ -115,19 +170,18 @@ def startup(mlog, DEBUG, ALLOW_MULTIPLE_INSTANCES):
             else:
                 mlog.warning("Daemon is already running. Multiple instances are allowed, so this is ignored. Continuing...")
 
-        # Start the daemon with or without debug mode
+        # Start the daemon with or without debug mode and profiling
+        command = [sys.executable, "zsoar_daemon.py"]
         if DEBUG:
-            popen = subprocess.Popen(
-                [sys.executable, "zsoar_daemon.py", "--debug_module"],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-            )
-        else:
-            popen = subprocess.Popen(
-                [sys.executable, "zsoar_daemon.py"],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-            )
+            command.append("--debug_module")
+        if PROFILE:
+            command += ["--profile", "--profile_every", str(PROFILE_EVERY)]
+            mlog.info("Profiling 1 of " + str(PROFILE_EVERY) + " worker cycles to " + profiling_helper.PROFILES_DIR)
+        popen = subprocess.Popen(
+            command,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+        )
 
         if popen.returncode != None:
             mlog.critical("Could not start the daemon: System call failed. Subprocess returned: {}".format(popen.returncode))
@@ -149,7 +203,12 @@ def startup(mlog, DEBUG, ALLOW_MULTIPLE_INSTANCES):
             raise SystemExit(1)
 
         # Start the worker manually
-        return_code = zsoar_worker.main(settings, debug=DEBUG)
+        if PROFILE:
+            profiler = profiling_helper.Profiler()
+            return_code = profiler.run(zsoar_worker.main, settings, debug=DEBUG)
+            mlog.info("Profile of the worker written to: " + ", ".join(profiler.last_files))
+        else:
+            return_code = zsoar_worker.main(settings, debug=DEBUG)
 
         if return_code != None:
             mlog.critical("Could not start the worker: System call failed. Subprocess returned: {}".format(popen.returncode))
@@ -468,10 +527,18 @@ def main():
     else:
         ALLOW_MULTIPLE_INSTANCES = False
 
+    PROFILE = parser.parse_args().profile
+    PROFILE_EVERY = parser.parse_args().profile_every
+    if PROFILE_EVERY < 1:
+        mlog.critical("The value of --profile-every must be at least 1.")
+        if not TEST_CALL:
+            sys.exit(1)
+        PROFILE_EVERY = 1
+
     # Check if the start mode is enabled:
     if parser.parse_args().start:
         mlog.info("Starting Z-SOAR")
-        startup(mlog, DEBUG, ALLOW_MULTIPLE_INSTANCES)
+        startup(mlog, DEBUG, ALLOW_MULTIPLE_INSTANCES, PROFILE, PROFILE_EVERY)
         if not TEST_CALL:
             sys.exit(0)
 
@@ -485,7 +552,7 @@ def main():
     if parser.parse_args().restart:
         mlog.info("Restarting Z-SOAR...")
         stop(mlog)
-        startup(mlog, DEBUG, ALLOW_MULTIPLE_INSTANCES)
+        startup(mlog, DEBUG, ALLOW_MULTIPLE_INSTANCES, PROFILE, PROFILE_EVERY)
         if not TEST_CALL:
             sys.exit(0)
 
@@ -531,6 +598,9 @@ def main():
         if daemon_pid == 0 and worker_pid == 0:
             mlog.info("Z-SOAR is not running.")
 
+        mlog.info("")
+        log_stage_stats(mlog)
+
         if not TEST_CALL:
             sys.exit(0)
 
@@ -2,10 +2,15 @@
 # Created by: Martin Offermann
 # This module is the daemon for the Z-SOAR project. It is used to start the main zsoar_worker.py script on a regular interval.
 # The interval is defined in the config file.
+# If 'metrics_port' is set in the daemon config, a Prometheus-compatible metrics endpoint is served on that local port.
+# With '--profile', the worker cycles are profiled with cProfile and tracemalloc (only every Nth with '--profile_every N').
 
 import time
 import lib.config_helper as config_helper
 import lib.logging_helper as logging_helper
+import lib.metrics_helper as metrics_helper
+import lib.profiling_helper as profiling_helper
+import lib.prometheus_helper as prometheus_helper
 import zsoar_worker as zsoar_worker
 from argparse import ArgumentParser
 import traceback
@@ -46,15 +51,49 @@ def main(TEST_CALL):
     # Get the interval
     interval = cfg["daemon"]["interval_min"]
 
+    # Start the metrics endpoint (optional, older configs do not have the setting)
+    metrics_server = None
+    metrics_port = cfg["daemon"].get("metrics_port", 0)
+    if metrics_port:
+        try:
+            registry = prometheus_helper.MetricsRegistry()
+            metrics_server = prometheus_helper.start_server(registry, metrics_port)
+            metrics_helper.add_listener(registry.observe_span)
+            mlog.info(
+                f"Serving metrics on http://{prometheus_helper.METRICS_HOST}:{metrics_port}{prometheus_helper.METRICS_PATH}"
+            )
+        except (OSError, OverflowError, TypeError) as e:
+            mlog.error("Could not start the metrics endpoint on port " + str(metrics_port) + ". Error: " + str(e))
+
+    # Profile the worker cycles (optional)
+    profiler = None
+    if not TEST_CALL and args.profile:
+        profiler = profiling_helper.Profiler(every_nth=args.profile_every)
+        mlog.info("Profiling 1 of " + str(args.profile_every) + " worker cycles to " + profiling_helper.PROFILES_DIR)
+
     # Start the main loop
     while True:
         mlog.info("Starting zsoar_worker.py")
+        cycle_start = time.perf_counter()
+        cycle_ok = True
         try:
-            zsoar_worker.main(cfg, fromDaemon=True, debug=args.debug_module)
+            if profiler is not None:
+                profiled_files = profiler.last_files
+                profiler.run(zsoar_worker.main, cfg, fromDaemon=True, debug=args.debug_module)
+                if profiler.last_files != profiled_files:
+                    mlog.info("Profile of the worker cycle written to: " + ", ".join(profiler.last_files))
+            else:
+                zsoar_worker.main(cfg, fromDaemon=True, debug=args.debug_module)
             mlog.info("zsoar_worker.py finished. Waiting for next run.")
         except Exception as e:
+            cycle_ok = False
             mlog.error("zsoar_worker.py failed. See the zsoar_worker logs for more information. Error: " + traceback.format_exc())
 
+        # A cycle overruns if it took longer than the interval the daemon waits between the cycles
+        cycle_duration = time.perf_counter() - cycle_start
+        metrics_helper.record_span("daemon.cycle", cycle_duration, cycle_ok, overrun=cycle_duration > interval * 60)
+        metrics_helper.flush()
+
         # Reload config in case it was changed
         try:
             cfg_old = cfg
@@ -69,6 +108,9 @@ def main(TEST_CALL):
             )
 
         if TEST_CALL:
+            if metrics_server is not None:
+                metrics_helper.remove_listener(registry.observe_span)
+                metrics_server.shutdown()
             break
 
         time.sleep(interval * 60)
@@ -81,6 +123,15 @@ if __name__ == "__main__":
         "--debug_module",
         action="store_true",
     )
+    parser_daemon.add_argument(
+        "--profile",
+        action="store_true",
+    )
+    parser_daemon.add_argument(
+        "--profile_every",
+        type=int,
+        default=1,
+    )
     args = parser_daemon.parse_args()
 
     main(TEST_CALL == False)
@@ -17,10 +17,13 @@ import json
 import lib.config_helper as config_helper
 import lib.logging_helper as logging_helper
 import lib.class_helper as class_helper  # TODO: Implement class_helper.py
+import lib.snapshot_helper as snapshot_helper
+import lib.metrics_helper as metrics_helper
 from integrations.znuny_otrs import zs_add_note_to_ticket
 from lib.generic_helper import del_none_from_dict
 
 DEBUG_ADD_AUDIT_LOG_TO_TICKET = True  # Weither or not to add the audit log to the ticket when the worker is finished
+CASE_SNAPSHOTS = True  # Weither or not to save a snapshot of a case after every playbook, to resume interrupted cases after a restart
 
 
 def check_module_exists(module_name, playbook=False):
@@ -67,12 +70,14 @@ def check_module_has_function(module_name, function_name, mlog):
         return False
 
 
-def main(config, fromDaemon=False, debug=False):
+def main(config, fromDaemon=False, debug=False, TEST=False):
     """Main function of the worker script.
 
     Args:
         config (dict): The config dictionary
         fromDaemon (bool): If the script was called from the daemon
+        debug (bool): If debug logging should be enabled
+        TEST (bool): If the playbooks should prepare the cycle (zs_prepare_cycle()) in test mode
 
     Returns:
         None
@@ -88,9 +93,20 @@ def main(config, fromDaemon=False, debug=False):
     integrations = config["integrations"]  # TODO: Implement this in config_helper.py
 
     mlog.info("Started Z-SOAR worker script")
-    mlog.info("Checking for new detections...")
     DetectionList = []
     CaseFileHistory = []
+    resumed_detection_ids = set()
+
+    # Resume cases that were interrupted (e.g. by a restart) from their last snapshot
+    if CASE_SNAPSHOTS:
+        for case_file in snapshot_helper.load_snapshots():
+            mlog.info(
+                f"Resuming case '{case_file.get_title()}' ({str(case_file.uuid)}) after playbook(s): {', '.join(case_file.playbooks)}"
+            )
+            DetectionList.append(case_file)
+            resumed_detection_ids.update(str(detection.vendor_id) for detection in case_file.detections)
+
+    mlog.info("Checking for new detections...")
 
     for integration in integrations:
         module_name = integration
@@ -123,7 +139,9 @@ def main(config, fromDaemon=False, debug=False):
             module_import = __import__("integrations." + module_name)
             module_import = getattr(module_import, module_name)
             integration_config = config["integrations"][module_name]
-            new_detections = module_import.zs_provide_new_detections(integration_config)
+            with metrics_helper.span("worker.provide_new_detections", integration=module_name) as provide_span:
+                new_detections = module_import.zs_provide_new_detections(integration_config)
+                provide_span.labels["detections"] = len(new_detections) if type(new_detections) is list else 0
         except Exception as e:
             mlog.warning(
                 "The module "
@@ -149,6 +167,8 @@ def main(config, fromDaemon=False, debug=False):
         for detection in new_detections:
             if not isinstance(detection, class_helper.Detection):
                 mlog.warning("The module " + module_name + " provided an invalid detection. Skipping.")
+            elif str(detection.vendor_id) in resumed_detection_ids:
+                mlog.info("Detection " + detection.name + " is already part of a resumed case. Skipping.")
             else:
                 mlog.info("Adding new detection " + detection.name + " (" + str(detection.uuid) + ") to the detection array.")
 
@@ -157,6 +177,22 @@ def main(config, fromDaemon=False, debug=False):
 
                 DetectionList.append(case_file_tmp)
 
+    # Let the playbooks prepare for this cycle (e.g. to look up indicators shared by multiple detections only once)
+    if len(DetectionList) > 0:
+        for playbook_name in config["playbooks"]:
+            if not config["playbooks"][playbook_name]["enabled"] or not check_module_exists(playbook_name, playbook=True):
+                continue
+            try:
+                module_import = __import__("playbooks." + playbook_name)
+                playbook_import = getattr(module_import, playbook_name)
+                if hasattr(playbook_import, "zs_prepare_cycle"):
+                    mlog.info(f"Calling playbook {playbook_name} to prepare for {str(len(DetectionList))} detection(s)")
+                    playbook_import.zs_prepare_cycle(DetectionList, TEST=TEST)
+            except Exception as e:
+                mlog.warning(
+                    "The playbook " + playbook_name + " failed to prepare for the current cycle. Error: " + traceback.format_exc()
+                )
+
     # Loop through each detection
     for case_file in DetectionList:
         detection_title = case_file.get_title()
@@ -175,6 +211,12 @@ def main(config, fromDaemon=False, debug=False):
                 mlog.error("The playbook " + playbook_name + " does not exist. Skipping.")
                 continue
 
+            # Check if the playbook already handled the detection before the case was interrupted
+            if playbook_name in case_file.playbooks:
+                mlog.info("The playbook " + playbook_name + " already handled the resumed detection. Skipping.")
+                detectionHandled = True
+                continue
+
             # Ask the playbook if it can handle the detection
             try:
                 mlog.info(
@@ -182,7 +224,8 @@ def main(config, fromDaemon=False, debug=False):
                 )
                 module_import = __import__("playbooks." + playbook_name)
                 playbook_import = getattr(module_import, playbook_name)
-                can_handle = playbook_import.zs_can_handle_detection(case_file)
+                with metrics_helper.span("playbook.can_handle_detection", playbook=playbook_name):
+                    can_handle = playbook_import.zs_can_handle_detection(case_file)
             except Exception as e:
                 mlog.warning(
                     "The playbook "
@@ -198,7 +241,8 @@ def main(config, fromDaemon=False, debug=False):
                     mlog.info(
                         f"Playbook can handle the detection. Calling it to handle: '{detection_title}' ({str(detection_id)})"
                     )
-                    case_file_new = playbook_import.zs_handle_detection(case_file)
+                    with metrics_helper.span("playbook.handle_detection", playbook=playbook_name):
+                        case_file_new = playbook_import.zs_handle_detection(case_file)
                 except Exception as e:
                     mlog.warning(
                         "The playbook " + playbook_name + " failed to handle the detection. Error: " + traceback.format_exc()
@@ -219,9 +263,15 @@ def main(config, fromDaemon=False, debug=False):
                 )
                 case_file_new.playbooks.append(playbook_name)
                 CaseFileHistory.append(case_file_new)
+                if CASE_SNAPSHOTS:
+                    snapshot_helper.save_snapshot(case_file_new)
             else:
                 mlog.info(f"Playbook can not handle the detection. Skipping.")
 
+        # The case is done, so it must not be resumed
+        if CASE_SNAPSHOTS:
+            snapshot_helper.delete_snapshot(case_file.uuid)
+
         # If no playbook was able to handle the detection, log it
         if not detectionHandled:
             mlog.warning("No playbook was able to handle the detection " + detection_title + " (" + str(detection_id) + ").")
@@ -266,6 +316,7 @@ def main(config, fromDaemon=False, debug=False):
                 except Exception as e:
                     mlog.error("Failed to add audit log to ticket " + str(ticket_number) + ". Error: " + traceback.format_exc())
 
+    metrics_helper.flush()
     mlog.info("Finished worker script.")
 
 